@@ -46,728 +46,7 @@ if exist "%~dp0mnemosyne.py" (
 
 REM Extract embedded Python code to temporary file - Simple & Reliable PS version
 set "TEMP_PY=%TEMP%\mnemosyne_runtime_%RANDOM%.py"
-REM#PY# # -*- coding: utf-8 -*-
-REM#PY# """
-REM#PY# Mnemosyne V1.1 - The Keeper of Digital Memory
-REM#PY# Copyright (C) 2026 Mejensi
-REM#PY# Licensed under GNU GPL v3.0
-REM#PY# 
-REM#PY# This software relies on FFmpeg (https://ffmpeg.org) for video processing.
-REM#PY# FFmpeg is licensed under the LGPL/GPL.
-REM#PY# """
-REM#PY# import os, sys, platform, subprocess, shutil, time, datetime, json, argparse, threading, traceback, logging, random
-REM#PY# from pathlib import Path
-REM#PY# from concurrent.futures import ThreadPoolExecutor
-REM#PY# from typing import Tuple, Dict, List
-REM#PY# from logging.handlers import RotatingFileHandler
-REM#PY# 
-REM#PY# if platform.system() == "Windows":
-REM#PY#     try:
-REM#PY#         import ctypes
-REM#PY#         # Enable VT100 support for ANSI colors
-REM#PY#         kernel32 = ctypes.windll.kernel32
-REM#PY#         hStdOut = kernel32.GetStdHandle(-11)
-REM#PY#         mode = ctypes.c_ulong()
-REM#PY#         kernel32.GetConsoleMode(hStdOut, ctypes.byref(mode))
-REM#PY#         mode.value |= 0x0004 # ENABLE_VIRTUAL_TERMINAL_PROCESSING
-REM#PY#         kernel32.SetConsoleMode(hStdOut, mode)
-REM#PY#     except: pass
-REM#PY# 
-REM#PY# VERSION, APP_NAME = "1.1", "Mnemosyne"
-REM#PY# SYSTEM, IS_WINDOWS = platform.system(), platform.system() == "Windows"
-REM#PY# 
-REM#PY# # Setup Paths
-REM#PY# if IS_WINDOWS:
-REM#PY#     APP_DATA = Path(os.environ["APPDATA"]) / APP_NAME
-REM#PY# else:
-REM#PY#     APP_DATA = Path.home() / ".mnemosyne"
-REM#PY# 
-REM#PY# LOG_DIR = APP_DATA / "logs"
-REM#PY# BIN_DIR = Path("bin")
-REM#PY# CONFIG_FILE = Path("config.json")
-REM#PY# 
-REM#PY# # Configuration
-REM#PY# DEFAULT_CONFIG = {
-REM#PY#     "target_height": 480,
-REM#PY#     "video_bitrate": "800k",
-REM#PY#     "audio_bitrate": "128k",
-REM#PY#     "target_fps": 30,
-REM#PY#     "max_workers": max(1, os.cpu_count() // 2) if os.cpu_count() else 2,
-REM#PY#     "recursive": False,
-REM#PY#     "verify_frames": True,
-REM#PY#     "auto_download_ffmpeg": True,
-REM#PY#     "sort": "name_az",
-REM#PY#     "desktop_log": True,
-REM#PY#     "auto_cleanup": True,
-REM#PY#     "show_drive_warnings": True,
-REM#PY#     "preserve_metadata": True
-REM#PY# }
-REM#PY# VIDEO_EXTENSIONS = {'.mp4', '.mkv', '.avi', '.mov', '.flv', '.wmv', '.webm', '.ts', '.m4v'}
-REM#PY# LOCK = threading.Lock()
-REM#PY# 
-REM#PY# class ProcessManager:
-REM#PY#     def __init__(self):
-REM#PY#         self.active_procs = set()
-REM#PY#         self.lock = threading.Lock()
-REM#PY#     def register(self, proc):
-REM#PY#         with self.lock: self.active_procs.add(proc)
-REM#PY#     def unregister(self, proc):
-REM#PY#         with self.lock: self.active_procs.discard(proc)
-REM#PY#     def kill_all(self):
-REM#PY#         with self.lock:
-REM#PY#             for p in self.active_procs:
-REM#PY#                 try:
-REM#PY#                     p.terminate()
-REM#PY#                     try: p.wait(timeout=2)
-REM#PY#                     except subprocess.TimeoutExpired: p.kill()
-REM#PY#                 except: pass
-REM#PY# PROCESS_MGR = ProcessManager()
-REM#PY# 
-REM#PY# if IS_WINDOWS:
-REM#PY#     DRIVE_FIXED = 3
-REM#PY#     DRIVE_REMOVABLE = 2
-REM#PY# 
-REM#PY# # Aesthetics & UI
-REM#PY# class C:
-REM#PY#     RESET = '\033[0m'
-REM#PY#     BOLD = '\033[1m'
-REM#PY#     DIM = '\033[2m'
-REM#PY#     PRIMARY = '\033[38;2;91;155;213m'   # Soft Blue
-REM#PY#     SUCCESS = '\033[38;2;16;185;129m'   # Emerald
-REM#PY#     WARNING = '\033[38;2;245;158;11m'   # Amber
-REM#PY#     ERROR = '\033[38;2;239;68;68m'      # Rose
-REM#PY#     INFO = '\033[38;2;14;165;233m'      # Sky
-REM#PY#     ACCENT = '\033[38;2;168;85;247m'    # Purple
-REM#PY#     MUTED = '\033[38;2;100;116;139m'    # Slate
-REM#PY#     WHITE = '\033[38;2;255;255;255m'
-REM#PY# 
-REM#PY# # Unicode escapes for box characters to prevent source encoding issues
-REM#PY# BOX = {
-REM#PY#     'tl': '\u2554', # ╔
-REM#PY#     'tr': '\u2557', # ╗
-REM#PY#     'bl': '\u255a', # ╚
-REM#PY#     'br': '\u255d', # ╝
-REM#PY#     'h':  '\u2550', # ═
-REM#PY#     'v':  '\u2551', # ║
-REM#PY#     'ml': '\u2560', # ╠
-REM#PY#     'mr': '\u2563'  # ╣
-REM#PY# }
-REM#PY# 
-REM#PY# ASCII_ART = r"""
-REM#PY#  __  __                                                    
-REM#PY# |  \/  |____   ___ ____ ___   ___  ___ _   _ _ __   ___   
-REM#PY# | |\/| | '_ \ / _ \ '_ ` _ \ / _ \/ __| | | | '_ \ / _ \  
-REM#PY# | |  | | | | |  __/ | | | | | (_) \__ \ |_| | | | |  __/  
-REM#PY# |_|  |_|_| |_|\___|_| |_| |_|\___/|___/\__, |_| |_|\___|  
-REM#PY#                                        |___/ v{version}
-REM#PY# """
-REM#PY# 
-REM#PY# INFO_TICKER = [
-REM#PY#     "✦ FFmpeg powers 90% of the world's video streaming.",
-REM#PY#     "➤ Targeting 30 FPS for optimal timeline stability.",
-REM#PY#     "◆ Safety Bridge ensures zero-loss atomic file swaps.",
-REM#PY#     "✦ Mnemosyne preserves file dates to keep your timeline intact.",
-REM#PY#     "✦ Processing is 100% local. No cloud, no tracking.",
-REM#PY#     "◈ GPU acceleration detected - using hardware encoding for speed.",
-REM#PY#     "➤ Frame verification ensures output quality matches input.",
-REM#PY#     "✦ Automatic backup system prevents data loss during conversion.",
-REM#PY#     "◆ Multi-threaded processing maximizes your CPU efficiency.",
-REM#PY#     "◈ Bitrate optimization reduces file size while preserving quality.",
-REM#PY#     "➤ Metadata preservation: Your file timestamps remain unchanged.",
-REM#PY#     "✦ Open source transparency - every line of code is auditable.",
-REM#PY#     "◆ Atomic file operations prevent corruption from interruptions.",
-REM#PY#     "◈ Smart codec detection automatically selects best encoder.",
-REM#PY#     "➤ Removable drive safety: Warnings prevent accidental disconnection."
-REM#PY# ]
-REM#PY# 
-REM#PY# # Logging setup
-REM#PY# def setup_logging(debug=False, desktop_mode=False):
-REM#PY#     if desktop_mode:
-REM#PY#         desktop = Path.home() / "Desktop"
-REM#PY#         if not desktop.exists(): desktop = Path.home()
-REM#PY#         log_file = desktop / "Mnemosyne_Log.txt"
-REM#PY#     else:
-REM#PY#         LOG_DIR.mkdir(parents=True, exist_ok=True)
-REM#PY#         log_file = LOG_DIR / "mnemosyne.log"
-REM#PY#     
-REM#PY#     logger = logging.getLogger()
-REM#PY#     logger.setLevel(logging.DEBUG if debug else logging.INFO)
-REM#PY#     fmt = logging.Formatter('%(asctime)s [%(levelname)s] %(message)s', '%Y-%m-%d %H:%M:%S')
-REM#PY#     logger.handlers.clear()
-REM#PY#     fh = RotatingFileHandler(log_file, maxBytes=10*1024*1024, backupCount=5, encoding='utf-8')
-REM#PY#     fh.setFormatter(fmt); fh.setLevel(logging.DEBUG); logger.addHandler(fh)
-REM#PY#     return log_file
-REM#PY# 
-REM#PY# def enable_ansi():
-REM#PY#     if not IS_WINDOWS: return
-REM#PY#     try:
-REM#PY#         import ctypes
-REM#PY#         kernel32 = ctypes.windll.kernel32
-REM#PY#         h = kernel32.GetStdHandle(-11)
-REM#PY#         m = ctypes.wintypes.DWORD()
-REM#PY#         kernel32.GetConsoleMode(h, ctypes.byref(m))
-REM#PY#         kernel32.SetConsoleMode(h, m.value | 0x0004)
-REM#PY#     except: pass
-REM#PY# 
-REM#PY# def reset_cursor():
-REM#PY#     # Home cursor and clear everything below it to prevent ghosting
-REM#PY#     sys.stdout.write("\033[H")
-REM#PY#     sys.stdout.flush()
-REM#PY# 
-REM#PY# def hide_cursor(): sys.stdout.write("\033[?25l"); sys.stdout.flush()
-REM#PY# def show_cursor(): sys.stdout.write("\033[?25h"); sys.stdout.flush()
-REM#PY# 
-REM#PY# def clear_screen(): os.system('cls' if IS_WINDOWS else 'clear')
-REM#PY# 
-REM#PY# def get_drive_type(path):
-REM#PY#     if not IS_WINDOWS: return 3
-REM#PY#     try:
-REM#PY#         import ctypes
-REM#PY#         root = os.path.splitdrive(path)[0] + "\\"
-REM#PY#         return ctypes.windll.kernel32.GetDriveTypeW(root)
-REM#PY#     except: return 3 
-REM#PY# 
-REM#PY# def cleanup_temp_files(work_dir=None):
-REM#PY#     work_dir = Path(work_dir) if work_dir else Path.cwd()
-REM#PY#     count = 0
-REM#PY#     for p in ["mnemosyne_tmp_*", "temp_*"]:
-REM#PY#         for f in work_dir.glob(p):
-REM#PY#             if p == "temp_*" and f.suffix.lower() not in VIDEO_EXTENSIONS: continue
-REM#PY#             try: f.unlink(); count += 1
-REM#PY#             except: pass
-REM#PY#     return count
-REM#PY# 
-REM#PY# def audit_orphaned_backups():
-REM#PY#     cwd = Path.cwd()
-REM#PY#     t_count = cleanup_temp_files(cwd)
-REM#PY#     if t_count > 0: print(f" {C.INFO}[+] Auto-cleaned {t_count} temporary file(s).{C.RESET}")
-REM#PY#     baks = list(cwd.glob("*.bak"))
-REM#PY#     if not baks:
-REM#PY#         if t_count == 0: print(f" {C.SUCCESS}[+] HEALTH CHECK: System is clean.{C.RESET}")
-REM#PY#         return
-REM#PY#     print(f" {C.WARNING}[!] GLOBAL RESCUE: Found {len(baks)} orphaned backup files.{C.RESET}")
-REM#PY#     ans = input(f" {C.PRIMARY}>> Restore (R) originals or Purge (P) backups? (R/P/Skip): {C.RESET}").lower()
-REM#PY#     if ans == 'p':
-REM#PY#         for b in baks: b.unlink()
-REM#PY#         print(f" {C.SUCCESS}[+] Diagnostic Health Check [OK]{C.RESET}")
-REM#PY#     elif ans == 'r':
-REM#PY#         for b in baks:
-REM#PY#             orig = b.with_suffix('')
-REM#PY#             if orig.exists(): orig.unlink()
-REM#PY#             b.rename(orig)
-REM#PY#         print(f" {C.SUCCESS}[+] Restored {len(baks)} file(s).{C.RESET}")
-REM#PY# 
-REM#PY# def load_config():
-REM#PY#     config = DEFAULT_CONFIG.copy()
-REM#PY#     if CONFIG_FILE.exists():
-REM#PY#         try:
-REM#PY#             with open(CONFIG_FILE, 'r', encoding='utf-8') as f: config.update(json.load(f))
-REM#PY#         except: pass
-REM#PY#     return config
-REM#PY# 
-REM#PY# def save_config(config):
-REM#PY#     try:
-REM#PY#         to_save = {k: v for k, v in config.items() if k in DEFAULT_CONFIG}
-REM#PY#         with open(CONFIG_FILE, 'w', encoding='utf-8') as f:
-REM#PY#             json.dump(to_save, f, indent=4, ensure_ascii=False)
-REM#PY#         return True
-REM#PY#     except: return False
-REM#PY# 
-REM#PY# def draw_box_line(text, width=70, color=C.WHITE, align='center'):
-REM#PY#     # Standard character width calculation (no wide emojis = stable 1:1 width)
-REM#PY#     if align == 'center': stripped = text.center(width)
-REM#PY#     elif align == 'left': stripped = text.ljust(width)
-REM#PY#     else: stripped = text.rjust(width)
-REM#PY#     print(f" {C.PRIMARY}{BOX['v']}{C.RESET} {color}{stripped}{C.RESET} {C.PRIMARY}{BOX['v']}{C.RESET}")
-REM#PY# 
-REM#PY# def draw_separator(width=70, type='mid'):
-REM#PY#     if type == 'top': l, r, m = BOX['tl'], BOX['tr'], BOX['h']
-REM#PY#     elif type == 'bot': l, r, m = BOX['bl'], BOX['br'], BOX['h']
-REM#PY#     else: l, r, m = BOX['ml'], BOX['mr'], BOX['h']
-REM#PY#     print(f" {C.PRIMARY}{l}{m * (width+2)}{r}{C.RESET}")
-REM#PY# 
-REM#PY# def get_ticker_msg():
-REM#PY#     idx = int(time.time() / 15) % len(INFO_TICKER)
-REM#PY#     return INFO_TICKER[idx]
-REM#PY# 
-REM#PY# def draw_header(config, codec_name):
-REM#PY#     output = []
-REM#PY#     # ASCII Art with version
-REM#PY#     ascii_with_version = ASCII_ART.format(version=VERSION)
-REM#PY#     for line in ascii_with_version.strip('\n').split('\n'):
-REM#PY#         if line.strip(): output.append(f"{C.PRIMARY} {line}{C.RESET}")
-REM#PY#     output.append("")
-REM#PY#     
-REM#PY#     width = 70
-REM#PY#     l, r, m = BOX['tl'], BOX['tr'], BOX['h']
-REM#PY#     output.append(f" {C.PRIMARY}{l}{m * (width+2)}{r}{C.RESET}")
-REM#PY#     
-REM#PY#     def box_line(text, color=C.WHITE, align='center'):
-REM#PY#         if align == 'center': stripped = text.center(width)
-REM#PY#         elif align == 'left': stripped = text.ljust(width)
-REM#PY#         else: stripped = text.rjust(width)
-REM#PY#         return f" {C.PRIMARY}{BOX['v']}{C.RESET} {color}{stripped}{C.RESET} {C.PRIMARY}{BOX['v']}{C.RESET}"
-REM#PY# 
-REM#PY#     output.append(box_line(f"The Keeper of Digital Memory v{VERSION}", C.BOLD + C.WHITE))
-REM#PY#     
-REM#PY#     l, r, m = BOX['ml'], BOX['mr'], BOX['h']
-REM#PY#     sep = f" {C.PRIMARY}{l}{m * (width+2)}{r}{C.RESET}"
-REM#PY#     output.append(sep)
-REM#PY#     output.append(box_line("Copyright (C) 2026 Mejensi", C.MUTED))
-REM#PY#     output.append(box_line("Licensed under GNU GPL v3.0", C.MUTED))
-REM#PY#     output.append(sep)
-REM#PY#     
-REM#PY#     c_info = f"RES: {config['target_height']}p  FPS: {config['target_fps']}  BIT: {config['video_bitrate']}"
-REM#PY#     e_info = f"ENC: {codec_name}  WRK: {config['max_workers']}"
-REM#PY#     output.append(box_line(c_info, C.INFO))
-REM#PY#     output.append(box_line(e_info, C.INFO))
-REM#PY#     output.append(sep)
-REM#PY#     output.append(box_line(get_ticker_msg(), C.WARNING))
-REM#PY#     
-REM#PY#     output.append(sep)
-REM#PY#     output.append(box_line("Press CTRL+C anytime to exit safely", C.ERROR))
-REM#PY#     
-REM#PY#     l, r, m = BOX['bl'], BOX['br'], BOX['h']
-REM#PY#     output.append(f" {C.PRIMARY}{l}{m * (width+2)}{r}{C.RESET}")
-REM#PY#     return "\n".join(output)
-REM#PY# 
-REM#PY# def render_progress(label, percent, fps, speed, size_stats, eta=""):
-REM#PY#     w = 30
-REM#PY#     f, e = int(w * percent / 100), w - int(w * percent / 100)
-REM#PY#     bar_char, bg_char = '\u2588', '\u2591'
-REM#PY#     check_icon, arrow_icon, pipe_icon = '\u2713', '\u27a4', '\u2514\u2500'
-REM#PY#     
-REM#PY#     if percent >= 100: bar_color = C.SUCCESS
-REM#PY#     elif percent >= 50: bar_color = C.INFO
-REM#PY#     else: bar_color = C.PRIMARY
-REM#PY#     
-REM#PY#     bar = f"{bar_color}{bar_char*f}{C.RESET}{C.MUTED}{bg_char*e}{C.RESET}"
-REM#PY#     if percent >= 100:
-REM#PY#         return f" {C.SUCCESS}{check_icon}{C.RESET} {C.WHITE}{label:<20}{C.RESET} {bar} {C.SUCCESS}DONE{C.RESET}\n   {C.MUTED}{pipe_icon} {size_stats}{C.RESET}"
-REM#PY#     else:
-REM#PY#         fps_disp = fps if fps != "-" else "..."
-REM#PY#         spd_disp = speed if speed != "0X" else "..."
-REM#PY#         eta_disp = f" | {eta}" if eta else ""
-REM#PY#         return f" {C.PRIMARY}{arrow_icon}{C.RESET} {C.WHITE}{label:<20}{C.RESET} {bar} {C.INFO}{percent:5.1f}%{C.RESET}\n   {C.MUTED}{pipe_icon} {spd_disp} | {fps_disp} fps{eta_disp}{C.RESET}"
-REM#PY# 
-REM#PY# class WorkerStats:
-REM#PY#     def __init__(self):
-REM#PY#         self.stats = {}
-REM#PY#         self.starts = {}
-REM#PY#     def update(self, wid, fn, pct, fps, speed, size_stats=""):
-REM#PY#         with LOCK:
-REM#PY#             if wid not in self.starts: self.starts[wid] = time.time()
-REM#PY#             self.stats[wid] = {'fn': fn, 'pct': pct, 'fps': fps, 'speed': speed, 'size': size_stats, 'start': self.starts[wid]}
-REM#PY#     def get_all(self):
-REM#PY#         with LOCK: return self.stats.copy()
-REM#PY#     def remove_worker(self, wid):
-REM#PY#         with LOCK:
-REM#PY#             self.stats.pop(wid, None)
-REM#PY#             self.starts.pop(wid, None)
-REM#PY# 
-REM#PY# # Helper functions (metadata, ffmpeg)
-REM#PY# def get_file_metadata(path): return (path.stat().st_ctime, path.stat().st_atime, path.stat().st_mtime)
-REM#PY# def restore_file_metadata(path, metadata):
-REM#PY#     ctime, atime, mtime = metadata
-REM#PY#     os.utime(path, (atime, mtime))
-REM#PY#     if platform.system() == "Windows":
-REM#PY#         try:
-REM#PY#             import ctypes
-REM#PY#             from ctypes import wintypes
-REM#PY#             ts = int((ctime + 11644473600) * 10000000)
-REM#PY#             ft = wintypes.FILETIME(ts & 0xFFFFFFFF, ts >> 32)
-REM#PY#             h = ctypes.windll.kernel32.CreateFileW(str(path), 0x40000000 | 0x0100, 0, None, 3, 0, None)
-REM#PY#             if h != -1:
-REM#PY#                 ctypes.windll.kernel32.SetFileTime(h, ctypes.byref(ft), None, None)
-REM#PY#                 ctypes.windll.kernel32.CloseHandle(h)
-REM#PY#         except: pass
-REM#PY# 
-REM#PY# FFMPEG_URLS = {"Windows": "https://www.gyan.dev/ffmpeg/builds/ffmpeg-release-essentials.zip", "Linux": "https://johnvansickle.com/ffmpeg/releases/ffmpeg-release-amd64-static.tar.xz", "Darwin": "https://evermeet.cx/ffmpeg/getrelease/zip"}
-REM#PY# 
-REM#PY# def check_ffmpeg():
-REM#PY#     if shutil.which("ffmpeg") and shutil.which("ffprobe"): return True
-REM#PY#     ffmpeg_bin = BIN_DIR / ("ffmpeg.exe" if platform.system() == "Windows" else "ffmpeg")
-REM#PY#     ffprobe_bin = BIN_DIR / ("ffprobe.exe" if platform.system() == "Windows" else "ffprobe")
-REM#PY#     if ffmpeg_bin.exists() and ffprobe_bin.exists():
-REM#PY#         os.environ["PATH"] = str(BIN_DIR.absolute()) + os.pathsep + os.environ["PATH"]
-REM#PY#         return True
-REM#PY#     return False
-REM#PY# 
-REM#PY# def download_ffmpeg():
-REM#PY#     url = FFMPEG_URLS.get(platform.system())
-REM#PY#     if not url: return False
-REM#PY#     BIN_DIR.mkdir(exist_ok=True)
-REM#PY#     archive_ext = ".zip" if platform.system() in ["Windows", "Darwin"] else ".tar.xz"
-REM#PY#     archive_path = BIN_DIR / f"ffmpeg{archive_ext}"
-REM#PY#     print(f"\n{C.INFO}[DOWNLOAD] Fetching FFmpeg...{C.RESET}")
-REM#PY#     try:
-REM#PY#         import urllib.request
-REM#PY#         def reporthook(b, b_size, total):
-REM#PY#             if total > 0:
-REM#PY#                 pct = min(100, (b * b_size / total) * 100)
-REM#PY#                 bar = '█' * int(40 * pct / 100) + '░' * (40 - int(40 * pct / 100))
-REM#PY#                 print(f"\r{C.INFO}[PROGRESS]{C.RESET} {bar} {pct:5.1f}%", end='', flush=True)
-REM#PY#         urllib.request.urlretrieve(url, archive_path, reporthook=reporthook)
-REM#PY#         print(f"\n{C.INFO}[EXTRACT] Extracting binaries...{C.RESET}")
-REM#PY#         if archive_ext == ".zip":
-REM#PY#             import zipfile
-REM#PY#             with zipfile.ZipFile(archive_path, 'r') as z:
-REM#PY#                 for m in z.namelist():
-REM#PY#                     fn = os.path.basename(m)
-REM#PY#                     if fn.lower() in ["ffmpeg.exe", "ffprobe.exe", "ffmpeg", "ffprobe"]:
-REM#PY#                         with z.open(m) as src, open(BIN_DIR / fn, 'wb') as tgt:
-REM#PY#                             shutil.copyfileobj(src, tgt)
-REM#PY#                         if platform.system() != "Windows": (BIN_DIR / fn).chmod(0o755)
-REM#PY#         else:
-REM#PY#             import tarfile
-REM#PY#             with tarfile.open(archive_path, 'r:xz') as tar:
-REM#PY#                 for m in tar.getmembers():
-REM#PY#                     if m.name.endswith(("ffmpeg", "ffprobe")):
-REM#PY#                         m.name = os.path.basename(m.name)
-REM#PY#                         tar.extract(m, path=BIN_DIR)
-REM#PY#                         (BIN_DIR / m.name).chmod(0o755)
-REM#PY#         archive_path.unlink()
-REM#PY#         os.environ["PATH"] = str(BIN_DIR.absolute()) + os.pathsep + os.environ["PATH"]
-REM#PY#         return True
-REM#PY#     except: return False
-REM#PY# 
-REM#PY# def ensure_ffmpeg(auto_download=True):
-REM#PY#     if check_ffmpeg(): return True
-REM#PY#     print(f"\n{C.WARNING} \u26a0  FFmpeg Not Found{C.RESET}\n")
-REM#PY#     if not auto_download:
-REM#PY#         if input(f"{C.PRIMARY}>> Download FFmpeg automatically? (Y/N): {C.RESET}").lower() != 'y': return False
-REM#PY#     return download_ffmpeg()
-REM#PY# 
-REM#PY# def detect_gpu_codec(force_codec=None):
-REM#PY#     if force_codec and force_codec != 'auto':
-REM#PY#         try:
-REM#PY#             r = subprocess.run(["ffmpeg", "-encoders"], capture_output=True, text=True, timeout=5)
-REM#PY#             if force_codec in r.stdout: return (force_codec, f"{force_codec.upper()} [FORCED]")
-REM#PY#         except: pass
-REM#PY#     try:
-REM#PY#         r = subprocess.run(["ffmpeg", "-encoders"], capture_output=True, text=True, timeout=5)
-REM#PY#         e = r.stdout
-REM#PY#         if "h264_nvenc" in e: return ("h264_nvenc", "NVIDIA (NVENC)")
-REM#PY#         elif "h264_qsv" in e: return ("h264_qsv", "Intel QuickSync")
-REM#PY#         elif "h264_videotoolbox" in e: return ("h264_videotoolbox", "Apple VideoToolbox")
-REM#PY#         elif "h264_vaapi" in e: return ("h264_vaapi", "VAAPI")
-REM#PY#         else: return ("libx264", "CPU (x264)")
-REM#PY#     except: return ("libx264", "CPU (x264)")
-REM#PY# 
-REM#PY# worker_stats = WorkerStats()
-REM#PY# 
-REM#PY# def verify_output(inp, outp):
-REM#PY#     if not outp.exists() or outp.stat().st_size < 10240: return False
-REM#PY#     try:
-REM#PY#         def get_meta(p):
-REM#PY#             cmd = ["ffprobe", "-v", "error", "-show_entries", "format=duration:stream=nb_frames,width,height", "-of", "csv=p=0", str(p)]
-REM#PY#             r = subprocess.run(cmd, capture_output=True, text=True, timeout=15)
-REM#PY#             parts = r.stdout.strip().split(',')
-REM#PY#             return float(parts[0] if parts[0] else 0), int(parts[1] if len(parts) > 1 and parts[1] else -1)
-REM#PY#         in_d, in_f = get_meta(inp)
-REM#PY#         out_d, out_f = get_meta(outp)
-REM#PY#         dur_ok = abs(in_d - out_d) < 2.0
-REM#PY#         frm_ok = (in_f == -1 or out_f == -1 or abs(in_f - out_f) < 150)
-REM#PY#         return dur_ok and frm_ok
-REM#PY#     except: return False
-REM#PY# 
-REM#PY# def process_video(wid, vpath, codec, config):
-REM#PY#     fn = vpath.name
-REM#PY#     s_fps, s_speed, pct = "-", "0X", 0.0
-REM#PY#     worker_stats.update(wid, fn, 0.0, s_fps, s_speed, "")
-REM#PY#     logging.info(f"[Worker {wid}] Started processing: {fn}")
-REM#PY#     try:
-REM#PY#         meta = get_file_metadata(vpath)
-REM#PY#         start_size = vpath.stat().st_size
-REM#PY#         tmp = vpath.parent / f"mnemosyne_tmp_{wid}_{fn}"
-REM#PY#         try:
-REM#PY#             dur = float(subprocess.run(["ffprobe", "-v", "error", "-show_entries", "format=duration", "-of", "csv=p=0", str(vpath)], capture_output=True, text=True).stdout.strip() or 1.0)
-REM#PY#         except: dur = 1.0
-REM#PY#         # Build command with Conditional Logic for Hardware vs Software Encoders
-REM#PY#         cmd = ["ffmpeg", "-nostdin", "-y", "-i", str(vpath), "-c:v", codec]
-REM#PY#         
-REM#PY#         # 1. NVENC (NVIDIA): Use Constant Quality (CQ) mode
-REM#PY#         if "nvenc" in codec:
-REM#PY#             cmd.extend(["-rc", "vbr", "-cq", "24", "-preset", "p4"])
-REM#PY#         # 2. CPU (libx264): Use Target Bitrate + Medium Preset
-REM#PY#         elif "libx264" in codec:
-REM#PY#             cmd.extend(["-b:v", config['video_bitrate'], "-preset", "medium"])
-REM#PY#         # 3. Universal Safety Mode (Intel QSV, AMD, Apple, etc.): Use Bitrate Only
-REM#PY#         # avoid specific presets that might crash other hardware encoders
-REM#PY#         else:
-REM#PY#             cmd.extend(["-b:v", config['video_bitrate']])
-REM#PY# 
-REM#PY#         # Common parameters (FPS, Audio, Resize, Metadata)
-REM#PY#         cmd.extend([
-REM#PY#             "-r", str(config['target_fps']),
-REM#PY#             "-vf", f"scale=-2:{config['target_height']}",
-REM#PY#             "-c:a", "aac", "-b:a", config['audio_bitrate'],
-REM#PY#             "-metadata", f"encoder={APP_NAME} v{VERSION}",
-REM#PY#             "-progress", "-", "-nostats", str(tmp)
-REM#PY#         ])
-REM#PY#         
-REM#PY#         if IS_WINDOWS:
-REM#PY#             # CREATE_NEW_PROCESS_GROUP = 0x00000200
-REM#PY#             proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True, encoding='utf-8', errors='replace', creationflags=0x00000200)
-REM#PY#         else:
-REM#PY#             proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True, encoding='utf-8', errors='replace')
-REM#PY#         PROCESS_MGR.register(proc)
-REM#PY#         while True:
-REM#PY#             line = proc.stdout.readline()
-REM#PY#             if not line and proc.poll() is not None: break
-REM#PY#             if "out_time=" in line:
-REM#PY#                 try:
-REM#PY#                     ts = line.split("out_time=")[1].split()[0]
-REM#PY#                     h, m, s = map(float, ts.split(':'))
-REM#PY#                     new_pct = min(99.9, ((h*3600 + m*60 + s) / dur) * 100); pct = new_pct
-REM#PY#                     worker_stats.update(wid, fn, pct, s_fps, s_speed)
-REM#PY#                 except: pass
-REM#PY#             elif "fps=" in line:
-REM#PY#                 try:
-REM#PY#                     s_fps = line.split("fps=")[1].split()[0]
-REM#PY#                     s_speed = line.split("speed=")[1].split()[0]
-REM#PY#                     worker_stats.update(wid, fn, pct, s_fps, s_speed)
-REM#PY#                 except: pass
-REM#PY#         PROCESS_MGR.unregister(proc)
-REM#PY#         if proc.returncode != 0:
-REM#PY#             if codec != "libx264":
-REM#PY#                 logging.warning(f"Hardware encoding failed for {fn}, falling back to CPU")
-REM#PY#                 worker_stats.update(wid, fn, 0.0, "-", "0X", "Retrying with CPU...")
-REM#PY#                 return process_video(wid, vpath, "libx264", config)
-REM#PY#             return False
-REM#PY# 
-REM#PY#         if config['verify_frames'] and not verify_output(vpath, tmp): return False
-REM#PY#         
-REM#PY#         end_size = tmp.stat().st_size
-REM#PY#         size_diff = (1 - (end_size / start_size)) * 100
-REM#PY#         size_stats = f"{start_size/1024/1024:.1f}MB -> {end_size/1024/1024:.1f}MB ({size_diff:.0f}% saved)"
-REM#PY#         
-REM#PY#         bak = vpath.with_suffix(vpath.suffix + '.bak')
-REM#PY#         if bak.exists(): bak.unlink()
-REM#PY#         try:
-REM#PY#             vpath.rename(bak)
-REM#PY#             tmp.rename(vpath)
-REM#PY#             restore_file_metadata(vpath, meta)
-REM#PY#             if vpath.exists() and vpath.stat().st_size > 10240: bak.unlink()
-REM#PY#             else: raise Exception("Output verification fail after swap")
-REM#PY#         except Exception as e:
-REM#PY#             logging.error(f"File swap error: {e}")
-REM#PY#             if bak.exists() and not vpath.exists(): bak.rename(vpath)
-REM#PY#             return False
-REM#PY#             
-REM#PY#         worker_stats.update(wid, fn, 100.0, "0", "0", size_stats)
-REM#PY#         return True
-REM#PY#     except Exception as e:
-REM#PY#         logging.error(f"Process error for {fn}: {e}")
-REM#PY#         if 'tmp' in locals() and tmp.exists(): tmp.unlink()
-REM#PY#         return False
-REM#PY# 
-REM#PY# def update_display(total, codec_name, config):
-REM#PY#     header = draw_header(config, codec_name)
-REM#PY#     buffer = [""] # Leading newline to separate from logo
-REM#PY#     stats = worker_stats.get_all()
-REM#PY#     completed = sum(1 for s in stats.values() if s['pct'] >= 100)
-REM#PY#     in_progress = len([s for s in stats.values() if 0 < s['pct'] < 100])
-REM#PY#     
-REM#PY#     for wid in sorted(stats.keys()):
-REM#PY#         s = stats[wid]
-REM#PY#         fn_short = s['fn'][:25] + "..." if len(s['fn']) > 28 else s['fn']
-REM#PY#         eta_str = ""
-REM#PY#         if 0 < s['pct'] < 100 and 'start' in s:
-REM#PY#             elapsed = time.time() - s['start']
-REM#PY#             if s['pct'] > 1:
-REM#PY#                 rem = (elapsed / (s['pct'] / 100)) - elapsed
-REM#PY#                 m, s_v = divmod(int(rem), 60); eta_str = f"ETA: {m}m {s_v}s"
-REM#PY#         buffer.append(render_progress(fn_short, s['pct'], s['fps'], s['speed'], s['size'], eta_str))
-REM#PY#         buffer.append("")
-REM#PY#         
-REM#PY#     buffer.append(f" {C.WHITE}{'='*70}{C.RESET}")
-REM#PY#     o_pct = (completed / total * 100) if total > 0 else 0
-REM#PY#     buffer.append(f" {C.WHITE}Total: {total} | {C.SUCCESS}Done: {completed} | {C.INFO}Active: {in_progress} | {o_pct:.1f}%{C.RESET}")
-REM#PY#     
-REM#PY#     # Send as one atomic write to terminal
-REM#PY#     sys.stdout.write("\033[H" + header + "\n".join(buffer) + "\033[J")
-REM#PY#     sys.stdout.flush()
-REM#PY# 
-REM#PY# def show_security_notice(log_msg, drive_type=None):
-REM#PY#     clear_screen(); w = 70
-REM#PY#     draw_separator(w, 'top')
-REM#PY#     draw_box_line("SECURITY & TRANSPARENCY", w, C.BOLD + C.PRIMARY)
-REM#PY#     draw_separator(w, 'mid')
-REM#PY#     if drive_type == 2: # REMOVABLE
-REM#PY#         draw_box_line("\u26a0  REMOVABLE MEDIA DETECTED", w, C.BOLD + C.WARNING)
-REM#PY#         draw_box_line("IMPORTANT: Keep the device connected to prevent data loss.", w, C.WARNING)
-REM#PY#         draw_separator(w, 'mid')
-REM#PY#     draw_box_line("1. Local Processing: No data ever leaves your computer.", w, C.WHITE)
-REM#PY#     draw_box_line(f"2. Logs: {log_msg}", w, C.WHITE)
-REM#PY#     draw_box_line("3. Open Source: Full code transparency (GNU GPL v3.0)", w, C.WHITE)
-REM#PY#     draw_box_line("4. Atomic Safety: Temporary files used to prevent data loss.", w, C.WHITE)
-REM#PY#     draw_separator(w, 'mid')
-REM#PY#     draw_box_line("Mnemosyne protects your privacy and your digital memory.", w, C.SUCCESS)
-REM#PY#     draw_separator(w, 'bot')
-REM#PY#     print(""); input(f" {C.PRIMARY}>> Press ENTER to continue...{C.RESET}")
-REM#PY# 
-REM#PY# def main():
-REM#PY#     enable_ansi()
-REM#PY#     # Signal Handling for Ctrl+C
-REM#PY#     import signal
-REM#PY#     def signal_handler(sig, frame):
-REM#PY#         PROCESS_MGR.kill_all()
-REM#PY#         show_cursor()
-REM#PY#         print(f"\n\n {C.WARNING}[!] EMERGENCY STOP: Interrupted by user (Signal {sig}).{C.RESET}")
-REM#PY#         print(f" {C.SUCCESS}[+] Cleanup complete. You may now exit.{C.RESET}")
-REM#PY#         cleanup_temp_files(); sys.exit(130)
-REM#PY#     signal.signal(signal.SIGINT, signal_handler)
-REM#PY# 
-REM#PY#     parser = argparse.ArgumentParser(description=f"{APP_NAME} v{VERSION}", formatter_class=argparse.RawDescriptionHelpFormatter)
-REM#PY#     parser.add_argument('-r', '--recursive', action='store_true', help='Search subfolders')
-REM#PY#     parser.add_argument('-w', '--workers', type=int, help='Parallel threads')
-REM#PY#     parser.add_argument('--height', type=int, help='Target height')
-REM#PY#     parser.add_argument('--desktop-log', action='store_true', help='Log to Desktop')
-REM#PY#     parser.add_argument('--codec', choices=['auto', 'h264_nvenc', 'h264_qsv', 'h264_vaapi', 'libx264'], default='auto')
-REM#PY#     args = parser.parse_args()
-REM#PY# 
-REM#PY#     config = load_config()
-REM#PY#     if args.recursive: config['recursive'] = True
-REM#PY#     if args.workers: config['max_workers'] = args.workers
-REM#PY#     if args.height: config['target_height'] = args.height
-REM#PY#     
-REM#PY#     desktop_log_mode = args.desktop_log
-REM#PY#     if not args.desktop_log:
-REM#PY#         clear_screen(); w = 70
-REM#PY#         draw_separator(w, 'top'); draw_box_line("LOG PREFERENCE", w, C.BOLD + C.PRIMARY); draw_separator(w, 'mid')
-REM#PY#         draw_box_line("Where should Mnemosyne save log files?", w)
-REM#PY#         draw_box_line("[1] Desktop", w, C.INFO)
-REM#PY#         draw_box_line("[2] AppData", w, C.INFO)
-REM#PY#         draw_separator(w, 'bot')
-REM#PY#         choice = input(f" {C.PRIMARY}>> Choice [Default=1]: {C.RESET}").strip()
-REM#PY#         desktop_log_mode = (choice != '2')
-REM#PY# 
-REM#PY#     log_file = setup_logging(desktop_mode=desktop_log_mode)
-REM#PY#     log_msg = "Desktop/Mnemosyne_Log.txt" if desktop_log_mode else "AppData/Mnemosyne/logs"
-REM#PY#     
-REM#PY#     drive_type = get_drive_type(str(Path.cwd()))
-REM#PY#     show_security_notice(log_msg, drive_type)
-REM#PY#     audit_orphaned_backups()
-REM#PY#     
-REM#PY#     if not ensure_ffmpeg(config['auto_download_ffmpeg']): return 1
-REM#PY#     codec, codec_name = detect_gpu_codec(args.codec)
-REM#PY# 
-REM#PY#     def get_input(prompt, default_val, valid_choices=None):
-REM#PY#         suffix = f" [Default={default_val}]: "
-REM#PY#         while True:
-REM#PY#             user_in = input(f" {C.PRIMARY}>> {prompt}{suffix}{C.RESET}").strip()
-REM#PY#             val = user_in if user_in else default_val
-REM#PY#             if not valid_choices or val in valid_choices:
-REM#PY#                 return val
-REM#PY#             print(f" {C.ERROR}[!] Invalid choice '{val}'. Please select from {', '.join(valid_choices)}.{C.RESET}")
-REM#PY# 
-REM#PY#     while True:
-REM#PY#         clear_screen(); print(draw_header(config, codec_name))
-REM#PY#         
-REM#PY#         # 1. Strategy
-REM#PY#         print(f" {C.PRIMARY}[BOOT] Strategy:{C.RESET}")
-REM#PY#         print(f"    [1] Local Folder  [2] Deep Scan (Recursive)")
-REM#PY#         curr_rec = '2' if config['recursive'] else '1'
-REM#PY#         strat = get_input("Choice", curr_rec, ['1', '2'])
-REM#PY#         config['recursive'] = (strat == '2')
-REM#PY#         
-REM#PY#         # 2. Priority
-REM#PY#         print(f"\n {C.PRIMARY}[BOOT] Priority:{C.RESET}")
-REM#PY#         print(f"    [1] Name A-Z  [2] Name Z-A  [3] Largest  [4] Smallest")
-REM#PY#         curr_sort = '1'
-REM#PY#         if config['sort'] == 'name_za': curr_sort = '2'
-REM#PY#         elif config['sort'] == 'size_desc': curr_sort = '3'
-REM#PY#         elif config['sort'] == 'size_asc': curr_sort = '4'
-REM#PY#         
-REM#PY#         sort_opt = get_input("Choice", curr_sort, ['1', '2', '3', '4'])
-REM#PY#         if sort_opt == '2': config['sort'] = 'name_za'
-REM#PY#         elif sort_opt == '3': config['sort'] = 'size_desc'
-REM#PY#         elif sort_opt == '4': config['sort'] = 'size_asc'
-REM#PY#         else: config['sort'] = 'name_az'
-REM#PY# 
-REM#PY#         # 3. Engine Mode
-REM#PY#         print(f"\n {C.PRIMARY}[BOOT] Engine Mode:{C.RESET}")
-REM#PY#         print(f"    [1] Sequential  [2] Parallel  [3] Custom Workers")
-REM#PY#         curr_mode = '2'
-REM#PY#         if config['max_workers'] == 1: curr_mode = '1'
-REM#PY#         
-REM#PY#         mode_opt = get_input("Choice", curr_mode, ['1', '2', '3'])
-REM#PY#         if mode_opt == '1': config['max_workers'] = 1
-REM#PY#         elif mode_opt == '3':
-REM#PY#             try: 
-REM#PY#                 w_in = input(f" {C.PRIMARY}>> Workers (1-{os.cpu_count()}) [Current={config['max_workers']}]: {C.RESET}")
-REM#PY#                 config['max_workers'] = int(w_in) if w_in else config['max_workers']
-REM#PY#             except: pass # Keep existing on error
-REM#PY#         elif mode_opt == '2':
-REM#PY#              # Restore default parallel limit if switching back to parallel from sequential
-REM#PY#              if config['max_workers'] == 1:
-REM#PY#                  config['max_workers'] = DEFAULT_CONFIG['max_workers']
-REM#PY# 
-REM#PY#         print(f"\n {C.INFO}[SCAN] Scanning for videos...{C.RESET}")
-REM#PY#         videos = []; cwd = Path.cwd()
-REM#PY#         pattern = cwd.rglob if config['recursive'] else cwd.glob
-REM#PY#         for ext in VIDEO_EXTENSIONS: videos.extend(list(pattern(f"*{ext}")))
-REM#PY#         videos = [v for v in videos if not any(x in v.parts for x in ["bin", "logs"])]
-REM#PY#         if not videos:
-REM#PY#             input(f" {C.WARNING}No videos found. Press ENTER to retry...{C.RESET}"); continue
-REM#PY#         
-REM#PY#         if config['sort'] == 'name_az': videos.sort()
-REM#PY#         elif config['sort'] == 'name_za': videos.sort(reverse=True)
-REM#PY#         elif config['sort'] == 'size_desc': videos.sort(key=lambda x: x.stat().st_size, reverse=True)
-REM#PY#         elif config['sort'] == 'size_asc': videos.sort(key=lambda x: x.stat().st_size)
-REM#PY# 
-REM#PY#         clear_screen(); print(draw_header(config, codec_name)); w = 70
-REM#PY#         total_in = sum(v.stat().st_size for v in videos)
-REM#PY#         draw_separator(w, 'top'); draw_box_line("MISSION BRIEFING", w, C.BOLD + C.PRIMARY); draw_separator(w, 'mid')
-REM#PY#         draw_box_line(f"Queue: {len(videos)} videos | Size: {total_in/1024/1024:.1f} MB", w)
-REM#PY#         if drive_type == 2: draw_box_line("Drive: REMOVABLE MEDIA (Caution)", w, C.WARNING)
-REM#PY#         draw_box_line(f"Codec: {codec_name} | Mode: {'Parallel' if config['max_workers']>1 else 'Sequential'}", w)
-REM#PY#         draw_separator(w, 'bot')
-REM#PY#         
-REM#PY#         ans = input(f"\n {C.SUCCESS}READY TO ENGAGE.{C.RESET} Press ENTER to start, 'N' to re-config, 'S' to save: ").lower().strip()
-REM#PY#         if ans == 'n': continue
-REM#PY#         if ans == 's': save_config(config); print(f" {C.SUCCESS}[+] Settings saved.{C.RESET}"); time.sleep(1); continue
-REM#PY#         if ans == 'q': return 0
-REM#PY#         break
-REM#PY# 
-REM#PY#     start_t = time.time(); success = 0; failed = 0
-REM#PY#     clear_screen(); hide_cursor()
-REM#PY#     try:
-REM#PY#         with ThreadPoolExecutor(max_workers=config['max_workers']) as executor:
-REM#PY#             futures = {executor.submit(process_video, (i % config['max_workers']) + 1, v, codec, config): v for i, v in enumerate(videos)}
-REM#PY#             while any(not f.done() for f in futures):
-REM#PY#                 update_display(len(videos), codec_name, config); time.sleep(0.5)
-REM#PY#             for f in futures:
-REM#PY#                 if f.result(): success += 1
-REM#PY#                 else: failed += 1
-REM#PY#     finally:
-REM#PY#         show_cursor()
-REM#PY# 
-REM#PY#     end_t = time.time(); total_t = end_t - start_t
-REM#PY#     total_out = sum(v.stat().st_size for v in videos if v.exists())
-REM#PY#     saved = total_in - total_out
-REM#PY#     
-REM#PY#     clear_screen(); print(draw_header(config, codec_name)); w = 70
-REM#PY#     draw_separator(w, 'top'); draw_box_line("FINAL MISSION REPORT", w, C.BOLD + C.SUCCESS); draw_separator(w, 'mid')
-REM#PY#     draw_box_line(f"Status: {success} Success | {failed} Failed", w)
-REM#PY#     draw_box_line(f"Time: {int(total_t//60)}m {int(total_t%60)}s | Space Saved: {saved/1024/1024:.1f} MB", w)
-REM#PY#     draw_separator(w, 'bot')
-REM#PY#     cleanup_temp_files()
-REM#PY#     print(f"\n {C.SUCCESS}All operations completed successfully.{C.RESET}")
-REM#PY#     return 0
-REM#PY# 
-REM#PY# if __name__ == "__main__":
-REM#PY#     try: sys.exit(main())
-REM#PY#     except KeyboardInterrupt:
-REM#PY#         PROCESS_MGR.kill_all()
-REM#PY#         show_cursor()
-REM#PY#         print(f"\n\n {C.WARNING}[!] EMERGENCY STOP: Interrupted by user.{C.RESET}")
-REM#PY#         print(f" {C.SUCCESS}[+] Operations terminated. Original videos are safe, you may now exit.{C.RESET}")
-REM#PY#         cleanup_temp_files(); sys.exit(130)
-REM#PY#     except Exception as e:
-REM#PY#         logging.critical(f"FATAL: {e}"); logging.debug(traceback.format_exc())
-REM#PY#         print(f"\n\n {C.ERROR}[X] Fatal error. Check logs.{C.RESET}"); sys.exit(1)
+powershell -NoProfile -Command "Get-Content -LiteralPath '%~f0' -Encoding UTF8 | Where-Object { $_ -like 'REM#PY#*' } | ForEach-Object { $_ -replace '^REM#PY# ?', '' } | Set-Content -LiteralPath '%TEMP_PY%' -Encoding UTF8"
 
 REM Run Python in Strict Mode
 python -X utf8 "%TEMP_PY%" %*
@@ -795,24 +74,12 @@ REM#PY#
 REM#PY# This software relies on FFmpeg (https://ffmpeg.org) for video processing.
 REM#PY# FFmpeg is licensed under the LGPL/GPL.
 REM#PY# """
-REM#PY# import os, sys, platform, subprocess, shutil, time, datetime, json, argparse, threading, traceback, logging, random
+REM#PY# import os, sys, platform, subprocess, shutil, time, datetime, json, argparse, threading, traceback, logging, random, selectors, collections, fnmatch, queue, bisect, hashlib, heapq, zlib, contextlib, weakref
 REM#PY# from pathlib import Path
-REM#PY# from concurrent.futures import ThreadPoolExecutor
+REM#PY# from concurrent.futures import ThreadPoolExecutor, Future, CancelledError, wait, FIRST_COMPLETED
 REM#PY# from typing import Tuple, Dict, List
 REM#PY# from logging.handlers import RotatingFileHandler
 REM#PY# 
-REM#PY# if platform.system() == "Windows":
-REM#PY#     try:
-REM#PY#         import ctypes
-REM#PY#         # Enable VT100 support for ANSI colors
-REM#PY#         kernel32 = ctypes.windll.kernel32
-REM#PY#         hStdOut = kernel32.GetStdHandle(-11)
-REM#PY#         mode = ctypes.c_ulong()
-REM#PY#         kernel32.GetConsoleMode(hStdOut, ctypes.byref(mode))
-REM#PY#         mode.value |= 0x0004 # ENABLE_VIRTUAL_TERMINAL_PROCESSING
-REM#PY#         kernel32.SetConsoleMode(hStdOut, mode)
-REM#PY#     except: pass
-REM#PY# 
 REM#PY# VERSION, APP_NAME = "1.1", "Mnemosyne"
 REM#PY# SYSTEM, IS_WINDOWS = platform.system(), platform.system() == "Windows"
 REM#PY# 
@@ -823,6 +90,12 @@ REM#PY# else:
 REM#PY#     APP_DATA = Path.home() / ".mnemosyne"
 REM#PY# 
 REM#PY# LOG_DIR = APP_DATA / "logs"
+REM#PY# PROBE_CACHE_FILE = APP_DATA / "probe_cache.json"
+REM#PY# JOURNAL_FILE = APP_DATA / "journal.jsonl"
+REM#PY# METRICS_FILE = APP_DATA / "metrics.jsonl"
+REM#PY# WATCH_STATE_FILE = APP_DATA / "watch_state.json"
+REM#PY# ENCODER_CACHE_FILE = APP_DATA / "encoders.json"
+REM#PY# PROBE_SCHEMA = 2 # Bump when run_ffprobe() starts collecting new fields
 REM#PY# BIN_DIR = Path("bin")
 REM#PY# CONFIG_FILE = Path("config.json")
 REM#PY# 
@@ -835,20 +108,102 @@ REM#PY#     "target_fps": 30,
 REM#PY#     "max_workers": max(1, os.cpu_count() // 2) if os.cpu_count() else 2,
 REM#PY#     "recursive": False,
 REM#PY#     "verify_frames": True,
+REM#PY#     "verify_level": "sampled",
+REM#PY#     "verify_samples": 5,
+REM#PY#     "stall_timeout": 300,
 REM#PY#     "auto_download_ffmpeg": True,
-REM#PY#     "sort": "name_az",
+REM#PY#     "sort": "cost_desc",
 REM#PY#     "desktop_log": True,
 REM#PY#     "auto_cleanup": True,
 REM#PY#     "show_drive_warnings": True,
-REM#PY#     "preserve_metadata": True
+REM#PY#     "preserve_metadata": True,
+REM#PY#     "skip_compliant": True,
+REM#PY#     "cpu_budget": 0,
+REM#PY#     "encoder_lanes": [],
+REM#PY#     "hw_failure_limit": 3,
+REM#PY#     "container_remux": [],
+REM#PY#     "exclude_dirs": ["bin", "logs"],
+REM#PY#     "include": [],
+REM#PY#     "exclude": [],
+REM#PY#     "prescan": True,
+REM#PY#     "pipeline_depth": 64,
+REM#PY#     "watch_settle": 10,
+REM#PY#     "watch_interval": 30,
+REM#PY#     "watch_inotify": True,
+REM#PY#     "segment_min_duration": 1800,
+REM#PY#     "segment_seconds": 300,
+REM#PY#     "renditions": [],
+REM#PY#     "batch_max_duration": 15,
+REM#PY#     "batch_size": 8,
+REM#PY#     "scratch_dir": "",
+REM#PY#     "scratch_quota_gb": 0,
+REM#PY#     "device_workers": 0,
+REM#PY#     "device_limits": {},
+REM#PY#     "min_savings": 5,
+REM#PY#     "dedup": "copy",
+REM#PY#     "x264_preset": "medium",
+REM#PY#     "metrics_log": True,
+REM#PY#     "metrics_port": 0,
+REM#PY#     "benchmark": {"workers": [], "cpu_budget": [0], "presets": ["medium", "veryfast"], "verify": [True, False], "tolerance": 10}
 REM#PY# }
 REM#PY# VIDEO_EXTENSIONS = {'.mp4', '.mkv', '.avi', '.mov', '.flv', '.wmv', '.webm', '.ts', '.m4v'}
-REM#PY# LOCK = threading.Lock()
+REM#PY# # Written into every output; ffmpeg muxers overwrite 'encoder', so 'comment' carries the marker
+REM#PY# ENCODER_TAG = f"{APP_NAME} v{VERSION}"
 REM#PY# 
-REM#PY# class ProcessManager:
+REM#PY# def marker_comment(info):
+REM#PY#     # Setting 'comment' replaces the one copied from the source, so the marker is appended to it
+REM#PY#     prev = ((info or {}).get('comment') or '').strip()
+REM#PY#     return f"{prev} | {ENCODER_TAG}" if prev else ENCODER_TAG
+REM#PY# 
+REM#PY# class ProgressParser:
+REM#PY#     # Incremental parser for ffmpeg '-progress' output: key=value lines, each block closed by progress=continue|end
 REM#PY#     def __init__(self):
+REM#PY#         self.buf = b''
+REM#PY#         self.block = {}
+REM#PY#     def feed(self, data):
+REM#PY#         self.buf += data
+REM#PY#         *lines, self.buf = self.buf.split(b'\n')
+REM#PY#         blocks = []
+REM#PY#         for raw in lines:
+REM#PY#             key, sep, value = raw.decode('utf-8', 'replace').strip().partition('=')
+REM#PY#             if not sep: continue
+REM#PY#             self.block[key] = value
+REM#PY#             if key == 'progress':
+REM#PY#                 blocks.append(self.block); self.block = {}
+REM#PY#         return blocks
+REM#PY# 
+REM#PY# class FFmpegHandle:
+REM#PY#     def __init__(self, proc, on_progress=None, stall_timeout=None, metrics=None):
+REM#PY#         self.proc, self.on_progress, self.stall_timeout = proc, on_progress, stall_timeout
+REM#PY#         self.parser = ProgressParser()
+REM#PY#         self.stderr_tail = collections.deque(maxlen=20)
+REM#PY#         self.err_buf = b''
+REM#PY#         self.open_pipes = 2
+REM#PY#         self.last_activity = time.time()
+REM#PY#         self.cancel_at = self.exited_at = None
+REM#PY#         self.returncode = None
+REM#PY#         self.done = threading.Event()
+REM#PY#         self.metrics = metrics # Stage record of the job that spawned it, if any
+REM#PY#         self.started, self.cpu = time.time(), None
+REM#PY#         self.speed_sum, self.speed_n = 0.0, 0
+REM#PY#     def wait(self, timeout=None):
+REM#PY#         self.done.wait(timeout)
+REM#PY#         return self.returncode
+REM#PY#     def error_text(self): return " | ".join(self.stderr_tail)
+REM#PY# 
+REM#PY# class ProcessManager:
+REM#PY#     # Supervises every ffmpeg child from a single selector loop: progress parsing, stall timeouts, cancellation.
+REM#PY#     # On Windows, where pipes can't be selected, each child gets reader threads and a watchdog thread instead.
+REM#PY#     def __init__(self, metrics=None):
 REM#PY#         self.active_procs = set()
 REM#PY#         self.lock = threading.Lock()
+REM#PY#         self.handles = {}
+REM#PY#         self.sel = None
+REM#PY#         self.thread = None
+REM#PY#         self.wake_r = self.wake_w = None
+REM#PY#         self.peak_rss = 0 # Largest ffmpeg high-water mark seen (bytes, Linux only)
+REM#PY#         self.metrics = metrics # JobMetrics whose per-thread job record each child is credited to
+REM#PY#         self.on_spawn = None # Called with every new handle, from the spawning thread
 REM#PY#     def register(self, proc):
 REM#PY#         with self.lock: self.active_procs.add(proc)
 REM#PY#     def unregister(self, proc):
@@ -861,7 +216,126 @@ REM#PY#                     p.terminate()
 REM#PY#                     try: p.wait(timeout=2)
 REM#PY#                     except subprocess.TimeoutExpired: p.kill()
 REM#PY#                 except: pass
-REM#PY# PROCESS_MGR = ProcessManager()
+REM#PY#     def _handle(self, proc, on_progress, stall_timeout):
+REM#PY#         h = FFmpegHandle(proc, on_progress, stall_timeout, self.metrics.current() if self.metrics else None)
+REM#PY#         self.register(proc)
+REM#PY#         if self.on_spawn: self.on_spawn(h)
+REM#PY#         return h
+REM#PY#     def spawn(self, cmd, on_progress=None, stall_timeout=None):
+REM#PY#         kw = {'creationflags': 0x00000200} if IS_WINDOWS else {} # CREATE_NEW_PROCESS_GROUP
+REM#PY#         proc = subprocess.Popen(cmd, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.PIPE, **kw)
+REM#PY#         h = self._handle(proc, on_progress, stall_timeout)
+REM#PY#         if IS_WINDOWS:
+REM#PY#             # Windows select() only works on sockets, so pipes get a blocking reader thread each
+REM#PY#             for pipe in (proc.stdout, proc.stderr):
+REM#PY#                 threading.Thread(target=self._pump, args=(h, pipe), daemon=True).start()
+REM#PY#             threading.Thread(target=self._reap_blocking, args=(h,), daemon=True).start()
+REM#PY#             return h
+REM#PY#         with self.lock:
+REM#PY#             if self.thread is None:
+REM#PY#                 self.sel = selectors.DefaultSelector()
+REM#PY#                 self.wake_r, self.wake_w = os.pipe()
+REM#PY#                 os.set_blocking(self.wake_r, False)
+REM#PY#                 self.sel.register(self.wake_r, selectors.EVENT_READ, None)
+REM#PY#                 self.thread = threading.Thread(target=self._loop, name="ffmpeg-supervisor", daemon=True)
+REM#PY#                 self.thread.start()
+REM#PY#             self.handles[proc.pid] = h
+REM#PY#             for pipe in (proc.stdout, proc.stderr):
+REM#PY#                 os.set_blocking(pipe.fileno(), False)
+REM#PY#                 self.sel.register(pipe, selectors.EVENT_READ, h)
+REM#PY#         os.write(self.wake_w, b'x')
+REM#PY#         return h
+REM#PY#     def cancel(self, h):
+REM#PY#         if h.cancel_at is None:
+REM#PY#             h.cancel_at = time.time()
+REM#PY#             try: h.proc.terminate()
+REM#PY#             except: pass
+REM#PY#     def _on_data(self, h, pipe, data):
+REM#PY#         h.last_activity = time.time()
+REM#PY#         if pipe is h.proc.stdout:
+REM#PY#             for block in h.parser.feed(data):
+REM#PY#                 if SYSTEM == "Linux": self._sample_rss(h)
+REM#PY#                 try: h.speed_sum += float(block.get('speed', '').strip().rstrip('x')); h.speed_n += 1
+REM#PY#                 except ValueError: pass
+REM#PY#                 if h.on_progress:
+REM#PY#                     try: h.on_progress(block)
+REM#PY#                     except: pass
+REM#PY#         else:
+REM#PY#             h.err_buf += data
+REM#PY#             *lines, h.err_buf = h.err_buf.split(b'\n')
+REM#PY#             for l in lines:
+REM#PY#                 if l.strip(): h.stderr_tail.append(l.decode('utf-8', 'replace').strip())
+REM#PY#     def _sample_rss(self, h):
+REM#PY#         # VmHWM is the kernel's own peak, so sampling once per progress block catches the maximum
+REM#PY#         try:
+REM#PY#             with open(f"/proc/{h.proc.pid}/status", 'rb') as f:
+REM#PY#                 for line in f:
+REM#PY#                     if line.startswith(b'VmHWM:'):
+REM#PY#                         self.peak_rss = max(self.peak_rss, int(line.split()[1]) * 1024); break
+REM#PY#         except (OSError, ValueError): pass
+REM#PY#     def _poll(self, h):
+REM#PY#         # Reap with wait4() so each child's own CPU time is known; Popen.poll() only reports the exit code
+REM#PY#         if h.proc.returncode is not None or not hasattr(os, 'wait4'): return h.proc.poll()
+REM#PY#         try: pid, status, ru = os.wait4(h.proc.pid, os.WNOHANG)
+REM#PY#         except ChildProcessError: return h.proc.poll() # Already reaped by Popen (e.g. inside terminate())
+REM#PY#         if not pid: return None
+REM#PY#         h.cpu = ru.ru_utime + ru.ru_stime
+REM#PY#         h.proc.returncode = os.waitstatus_to_exitcode(status)
+REM#PY#         return h.proc.returncode
+REM#PY#     def _finish(self, h, rc):
+REM#PY#         h.returncode = rc
+REM#PY#         self.unregister(h.proc)
+REM#PY#         if h.metrics is not None: JobMetrics.child_done(h)
+REM#PY#         h.done.set()
+REM#PY#     def _pump(self, h, pipe):
+REM#PY#         for data in iter(lambda: pipe.read1(65536), b''): self._on_data(h, pipe, data)
+REM#PY#     def _reap_blocking(self, h):
+REM#PY#         # Windows: no selector loop, so the thread waiting on the child also enforces its stall timeout
+REM#PY#         while True:
+REM#PY#             try: rc = h.proc.wait(timeout=0.5); break
+REM#PY#             except subprocess.TimeoutExpired: self._watchdog(h, time.time())
+REM#PY#         self._finish(h, rc)
+REM#PY#     def _watchdog(self, h, now):
+REM#PY#         # Terminate a child that stopped producing output; kill one that ignored terminate() for 2s
+REM#PY#         if h.stall_timeout and h.cancel_at is None and now - h.last_activity > h.stall_timeout:
+REM#PY#             logging.warning(f"ffmpeg (pid {h.proc.pid}) stalled for {h.stall_timeout}s, terminating")
+REM#PY#             self.cancel(h)
+REM#PY#         if h.cancel_at and now - h.cancel_at > 2 and self._poll(h) is None:
+REM#PY#             try: h.proc.kill()
+REM#PY#             except: pass
+REM#PY#     def _loop(self):
+REM#PY#         while True:
+REM#PY#             # Pipes usually hit EOF just before the process exits: poll those children again right away
+REM#PY#             with self.lock: exiting = any(h.open_pipes == 0 for h in self.handles.values())
+REM#PY#             for key, _ in self.sel.select(timeout=0.002 if exiting else 0.5):
+REM#PY#                 h = key.data
+REM#PY#                 if h is None:
+REM#PY#                     try: os.read(self.wake_r, 4096)
+REM#PY#                     except BlockingIOError: pass
+REM#PY#                     continue
+REM#PY#                 try: data = os.read(key.fd, 65536)
+REM#PY#                 except BlockingIOError: continue
+REM#PY#                 except OSError: data = b''
+REM#PY#                 if data: self._on_data(h, key.fileobj, data)
+REM#PY#                 else:
+REM#PY#                     with self.lock: self.sel.unregister(key.fileobj)
+REM#PY#                     key.fileobj.close(); h.open_pipes -= 1
+REM#PY#             now = time.time()
+REM#PY#             with self.lock: handles = list(self.handles.values())
+REM#PY#             for h in handles:
+REM#PY#                 self._watchdog(h, now)
+REM#PY#                 if self._poll(h) is None: continue
+REM#PY#                 h.exited_at = h.exited_at or now
+REM#PY#                 # Normally both pipes hit EOF first; a leaked grandchild may hold them open past exit
+REM#PY#                 if h.open_pipes == 0 or now - h.exited_at > 2:
+REM#PY#                     with self.lock:
+REM#PY#                         self.handles.pop(h.proc.pid, None)
+REM#PY#                         for pipe in (h.proc.stdout, h.proc.stderr):
+REM#PY#                             if pipe.closed: continue
+REM#PY#                             try: self.sel.unregister(pipe)
+REM#PY#                             except: pass
+REM#PY#                             pipe.close()
+REM#PY#                     self._finish(h, h.proc.returncode)
 REM#PY# 
 REM#PY# if IS_WINDOWS:
 REM#PY#     DRIVE_FIXED = 3
@@ -957,7 +431,24 @@ REM#PY#
 REM#PY# def hide_cursor(): sys.stdout.write("\033[?25l"); sys.stdout.flush()
 REM#PY# def show_cursor(): sys.stdout.write("\033[?25h"); sys.stdout.flush()
 REM#PY# 
-REM#PY# def clear_screen(): os.system('cls' if IS_WINDOWS else 'clear')
+REM#PY# def clear_screen():
+REM#PY#     screen.reset()
+REM#PY#     # Plain escape codes where the terminal understands them; spawning a shell per clear is slow
+REM#PY#     if IS_WINDOWS: os.system('cls')
+REM#PY#     else: sys.stdout.write("\033[2J\033[H"); sys.stdout.flush()
+REM#PY# 
+REM#PY# class ScreenDiff:
+REM#PY#     # Keeps the last frame and rewrites only the lines that changed since it
+REM#PY#     def __init__(self):
+REM#PY#         self.lines = []
+REM#PY#     def reset(self): self.lines = []
+REM#PY#     def draw(self, text):
+REM#PY#         lines = text.split("\n")
+REM#PY#         out = [f"\033[{i + 1};1H{line}\033[K" for i, line in enumerate(lines) if i >= len(self.lines) or self.lines[i] != line]
+REM#PY#         if len(lines) < len(self.lines): out.append(f"\033[{len(lines) + 1};1H\033[J")
+REM#PY#         self.lines = lines
+REM#PY#         if out: sys.stdout.write("".join(out)); sys.stdout.flush()
+REM#PY# screen = ScreenDiff()
 REM#PY# 
 REM#PY# def get_drive_type(path):
 REM#PY#     if not IS_WINDOWS: return 3
@@ -967,21 +458,20 @@ REM#PY#         root = os.path.splitdrive(path)[0] + "\\"
 REM#PY#         return ctypes.windll.kernel32.GetDriveTypeW(root)
 REM#PY#     except: return 3 
 REM#PY# 
-REM#PY# def cleanup_temp_files(work_dir=None):
+REM#PY# def cleanup_temp_files(work_dir=None, recursive=False):
 REM#PY#     work_dir = Path(work_dir) if work_dir else Path.cwd()
 REM#PY#     count = 0
-REM#PY#     for p in ["mnemosyne_tmp_*", "temp_*"]:
-REM#PY#         for f in work_dir.glob(p):
-REM#PY#             if p == "temp_*" and f.suffix.lower() not in VIDEO_EXTENSIONS: continue
-REM#PY#             try: f.unlink(); count += 1
-REM#PY#             except: pass
+REM#PY#     # Only names Mnemosyne itself writes; anything else in a library may be a user's own video
+REM#PY#     for f in (work_dir.rglob("mnemosyne_tmp_*") if recursive else work_dir.glob("mnemosyne_tmp_*")):
+REM#PY#         try: f.unlink(); count += 1
+REM#PY#         except: pass
 REM#PY#     return count
 REM#PY# 
-REM#PY# def audit_orphaned_backups():
+REM#PY# def audit_orphaned_backups(recursive=False):
 REM#PY#     cwd = Path.cwd()
-REM#PY#     t_count = cleanup_temp_files(cwd)
+REM#PY#     t_count = cleanup_temp_files(cwd, recursive)
 REM#PY#     if t_count > 0: print(f" {C.INFO}[+] Auto-cleaned {t_count} temporary file(s).{C.RESET}")
-REM#PY#     baks = list(cwd.glob("*.bak"))
+REM#PY#     baks = list(cwd.rglob("*.bak") if recursive else cwd.glob("*.bak"))
 REM#PY#     if not baks:
 REM#PY#         if t_count == 0: print(f" {C.SUCCESS}[+] HEALTH CHECK: System is clean.{C.RESET}")
 REM#PY#         return
@@ -1058,7 +548,7 @@ REM#PY#     output.append(box_line("Licensed under GNU GPL v3.0", C.MUTED))
 REM#PY#     output.append(sep)
 REM#PY#     
 REM#PY#     c_info = f"RES: {config['target_height']}p  FPS: {config['target_fps']}  BIT: {config['video_bitrate']}"
-REM#PY#     e_info = f"ENC: {codec_name}  WRK: {config['max_workers']}"
+REM#PY#     e_info = f"ENC: {codec_name}  WRK: {config['max_workers']}  CPU: {cpu_budget(config)}"
 REM#PY#     output.append(box_line(c_info, C.INFO))
 REM#PY#     output.append(box_line(e_info, C.INFO))
 REM#PY#     output.append(sep)
@@ -1091,22 +581,23 @@ REM#PY#         eta_disp = f" | {eta}" if eta else ""
 REM#PY#         return f" {C.PRIMARY}{arrow_icon}{C.RESET} {C.WHITE}{label:<20}{C.RESET} {bar} {C.INFO}{percent:5.1f}%{C.RESET}\n   {C.MUTED}{pipe_icon} {spd_disp} | {fps_disp} fps{eta_disp}{C.RESET}"
 REM#PY# 
 REM#PY# class WorkerStats:
-REM#PY#     def __init__(self):
+REM#PY#     # Each update publishes a fresh snapshot dict; a single item assignment is atomic, so readers need no lock
+REM#PY#     def __init__(self, listener=None):
 REM#PY#         self.stats = {}
-REM#PY#         self.starts = {}
+REM#PY#         self.listener = listener # Called with (slot, snapshot) on every update
 REM#PY#     def update(self, wid, fn, pct, fps, speed, size_stats=""):
-REM#PY#         with LOCK:
-REM#PY#             if wid not in self.starts: self.starts[wid] = time.time()
-REM#PY#             self.stats[wid] = {'fn': fn, 'pct': pct, 'fps': fps, 'speed': speed, 'size': size_stats, 'start': self.starts[wid]}
-REM#PY#     def get_all(self):
-REM#PY#         with LOCK: return self.stats.copy()
-REM#PY#     def remove_worker(self, wid):
-REM#PY#         with LOCK:
-REM#PY#             self.stats.pop(wid, None)
-REM#PY#             self.starts.pop(wid, None)
+REM#PY#         prev = self.stats.get(wid)
+REM#PY#         # Slots are reused across jobs, so a new file on the slot restarts its clock
+REM#PY#         start = prev['start'] if prev and prev['fn'] == fn else time.time()
+REM#PY#         self.stats[wid] = s = {'fn': fn, 'pct': pct, 'fps': fps, 'speed': speed, 'size': size_stats, 'start': start}
+REM#PY#         if self.listener: self.listener(wid, s)
+REM#PY#     def get_all(self): return dict(self.stats)
+REM#PY#     def remove_worker(self, wid): self.stats.pop(wid, None)
 REM#PY# 
 REM#PY# # Helper functions (metadata, ffmpeg)
-REM#PY# def get_file_metadata(path): return (path.stat().st_ctime, path.stat().st_atime, path.stat().st_mtime)
+REM#PY# def get_file_metadata(path, st=None):
+REM#PY#     st = st or path.stat()
+REM#PY#     return (st.st_ctime, st.st_atime, st.st_mtime)
 REM#PY# def restore_file_metadata(path, metadata):
 REM#PY#     ctime, atime, mtime = metadata
 REM#PY#     os.utime(path, (atime, mtime))
@@ -1178,135 +669,1680 @@ REM#PY#     if not auto_download:
 REM#PY#         if input(f"{C.PRIMARY}>> Download FFmpeg automatically? (Y/N): {C.RESET}").lower() != 'y': return False
 REM#PY#     return download_ffmpeg()
 REM#PY# 
+REM#PY# # Concurrent sessions per hardware encoder (consumer NVENC drivers cap sessions)
+REM#PY# HW_LANE_SLOTS = {"h264_nvenc": 3, "h264_qsv": 2, "h264_vaapi": 2, "h264_videotoolbox": 2}
+REM#PY# CODEC_LABELS = {"h264_nvenc": "NVIDIA (NVENC)", "h264_qsv": "Intel QuickSync", "h264_videotoolbox": "Apple VideoToolbox", "h264_vaapi": "VAAPI", "libx264": "CPU (x264)"}
+REM#PY# HW_CODECS = ["h264_nvenc", "h264_qsv", "h264_videotoolbox", "h264_vaapi"]
+REM#PY# 
+REM#PY# def ffmpeg_version(ffmpeg="ffmpeg"):
+REM#PY#     try: return subprocess.run([ffmpeg, "-version"], capture_output=True, text=True, timeout=5).stdout.split('\n')[0].strip()
+REM#PY#     except: return ""
+REM#PY# 
+REM#PY# def trial_encode(codec, ffmpeg="ffmpeg"):
+REM#PY#     # Half a second of synthetic video proves the encoder actually opens on this machine
+REM#PY#     cmd = [ffmpeg, "-nostdin", "-v", "error", "-f", "lavfi", "-i", "testsrc2=size=320x240:rate=30", "-t", "0.5", "-c:v", codec, "-f", "null", "-"]
+REM#PY#     try: return subprocess.run(cmd, capture_output=True, timeout=30).returncode == 0
+REM#PY#     except: return False
+REM#PY# 
+REM#PY# def encoder_works(codec, ffmpeg="ffmpeg"):
+REM#PY#     # Trial results cached per host, binary and ffmpeg version
+REM#PY#     key = f"{platform.node()}|{ffmpeg}|{ffmpeg_version(ffmpeg)}"
+REM#PY#     try:
+REM#PY#         with open(ENCODER_CACHE_FILE, 'r', encoding='utf-8') as f: cache = json.load(f)
+REM#PY#     except: cache = {}
+REM#PY#     results = cache.setdefault(key, {})
+REM#PY#     if codec not in results:
+REM#PY#         results[codec] = trial_encode(codec, ffmpeg)
+REM#PY#         logging.info(f"Encoder trial {codec} ({ffmpeg}): {'OK' if results[codec] else 'UNUSABLE'}")
+REM#PY#         try:
+REM#PY#             ENCODER_CACHE_FILE.parent.mkdir(parents=True, exist_ok=True)
+REM#PY#             with open(ENCODER_CACHE_FILE, 'w', encoding='utf-8') as f: json.dump(cache, f, indent=2)
+REM#PY#         except: pass
+REM#PY#     return results[codec]
+REM#PY# 
 REM#PY# def detect_gpu_codec(force_codec=None):
+REM#PY#     try: listed = subprocess.run(["ffmpeg", "-encoders"], capture_output=True, text=True, timeout=5).stdout
+REM#PY#     except: return ("libx264", "CPU (x264)")
 REM#PY#     if force_codec and force_codec != 'auto':
-REM#PY#         try:
-REM#PY#             r = subprocess.run(["ffmpeg", "-encoders"], capture_output=True, text=True, timeout=5)
-REM#PY#             if force_codec in r.stdout: return (force_codec, f"{force_codec.upper()} [FORCED]")
+REM#PY#         if force_codec in listed and (force_codec == "libx264" or encoder_works(force_codec)):
+REM#PY#             return (force_codec, f"{force_codec.upper()} [FORCED]")
+REM#PY#     for c in HW_CODECS:
+REM#PY#         # Compiled in is not enough: NVENC/QSV builds often fail without the driver or device
+REM#PY#         if c in listed and encoder_works(c): return (c, CODEC_LABELS[c])
+REM#PY#     return ("libx264", "CPU (x264)")
+REM#PY# 
+REM#PY# def parse_rate(rate):
+REM#PY#     try:
+REM#PY#         n, _, d = str(rate).partition('/')
+REM#PY#         return float(n) / float(d) if d else float(n)
+REM#PY#     except: return 0.0
+REM#PY# 
+REM#PY# def run_ffprobe(path, timeout=30):
+REM#PY#     # One structured probe per file: container, streams, codecs, tags
+REM#PY#     cmd = ["ffprobe", "-v", "error", "-show_entries",
+REM#PY#            "format=duration,start_time,bit_rate,format_name:format_tags=encoder,comment:stream=index,codec_type,codec_name,width,height,avg_frame_rate,r_frame_rate,nb_frames,bit_rate,duration,channels",
+REM#PY#            "-of", "json", str(path)]
+REM#PY#     r = subprocess.run(cmd, capture_output=True, text=True, encoding='utf-8', errors='replace', timeout=timeout)
+REM#PY#     # A failed probe raises instead of returning an empty result, so it is never cached and can be retried
+REM#PY#     if r.returncode != 0: raise Exception(f"ffprobe exited with code {r.returncode}: {r.stderr.strip()[-200:]}")
+REM#PY#     try: data = json.loads(r.stdout or "{}")
+REM#PY#     except ValueError: data = {}
+REM#PY#     if 'format' not in data or 'streams' not in data: raise Exception("ffprobe returned no format or stream data")
+REM#PY#     fmt, streams = data['format'], data['streams']
+REM#PY#     tags = {k.lower(): v for k, v in (fmt.get('tags') or {}).items()}
+REM#PY#     info = {'duration': 0.0, 'start': 0.0, 'bitrate': 0, 'format': fmt.get('format_name', ''), 'encoder': tags.get('encoder', ''), 'comment': tags.get('comment', ''),
+REM#PY#             'vcodec': None, 'width': 0, 'height': 0, 'fps': 0.0, 'nb_frames': -1, 'vbitrate': 0,
+REM#PY#             'acodec': None, 'abitrate': 0, 'streams': []}
+REM#PY#     try: info['duration'] = float(fmt.get('duration') or 0)
+REM#PY#     except: pass
+REM#PY#     try: info['bitrate'] = int(fmt.get('bit_rate') or 0)
+REM#PY#     except: pass
+REM#PY#     try: info['start'] = float(fmt.get('start_time') or 0)
+REM#PY#     except: pass
+REM#PY#     for s in streams:
+REM#PY#         entry = {k: s[k] for k in ('index', 'codec_type', 'codec_name', 'width', 'height', 'avg_frame_rate', 'nb_frames', 'bit_rate', 'duration', 'channels') if k in s}
+REM#PY#         info['streams'].append(entry)
+REM#PY#         if s.get('codec_type') == 'video' and info['vcodec'] is None:
+REM#PY#             info['vcodec'] = s.get('codec_name')
+REM#PY#             info['width'], info['height'] = int(s.get('width') or 0), int(s.get('height') or 0)
+REM#PY#             info['fps'] = parse_rate(s.get('avg_frame_rate')) or parse_rate(s.get('r_frame_rate'))
+REM#PY#             try: info['nb_frames'] = int(s.get('nb_frames') or -1)
+REM#PY#             except: pass
+REM#PY#             try: info['vbitrate'] = int(s.get('bit_rate') or 0)
+REM#PY#             except: pass
+REM#PY#         elif s.get('codec_type') == 'audio' and info['acodec'] is None:
+REM#PY#             info['acodec'] = s.get('codec_name')
+REM#PY#             try: info['abitrate'] = int(s.get('bit_rate') or 0)
+REM#PY#             except: pass
+REM#PY#     if not info['duration']:
+REM#PY#         try: info['duration'] = max(float(s.get('duration') or 0) for s in streams)
 REM#PY#         except: pass
+REM#PY#     return info
+REM#PY# 
+REM#PY# class ProbeCache:
+REM#PY#     # Persistent ffprobe results keyed by path, validated by (size, mtime, inode)
+REM#PY#     def __init__(self, path=PROBE_CACHE_FILE, runner=run_ffprobe):
+REM#PY#         self.path = path
+REM#PY#         self.runner = runner # path -> probe info; the engine swaps in its simulator here
+REM#PY#         self.entries = None
+REM#PY#         self.dirty = False
+REM#PY#         self.lock = threading.Lock()
+REM#PY#     def load(self):
+REM#PY#         with self.lock:
+REM#PY#             if self.entries is not None: return
+REM#PY#             self.entries = {}
+REM#PY#             try:
+REM#PY#                 with open(self.path, 'r', encoding='utf-8') as f: self.entries = json.load(f)
+REM#PY#             except: pass
+REM#PY#             # probe_s only describes probes run by this process; a cached entry costs this run nothing
+REM#PY#             for e in self.entries.values(): e.pop('probe_s', None)
+REM#PY#     def save(self):
+REM#PY#         if self.entries is None or not self.dirty: return False
+REM#PY#         try:
+REM#PY#             self.path.parent.mkdir(parents=True, exist_ok=True)
+REM#PY#             tmp = self.path.with_suffix('.tmp')
+REM#PY#             with self.lock:
+REM#PY#                 with open(tmp, 'w', encoding='utf-8') as f: json.dump(self.entries, f, separators=(',', ':'))
+REM#PY#                 self.dirty = False
+REM#PY#             os.replace(tmp, self.path)
+REM#PY#             return True
+REM#PY#         except: return False
+REM#PY#     @staticmethod
+REM#PY#     def signature(st): return [st.st_size, st.st_mtime_ns, st.st_ino]
+REM#PY#     def get(self, path, st=None):
+REM#PY#         self.load()
+REM#PY#         st = st or os.stat(path)
+REM#PY#         with self.lock: entry = self.entries.get(str(path))
+REM#PY#         if entry and entry.get('sig') == self.signature(st) and entry.get('schema') == PROBE_SCHEMA: return entry
+REM#PY#         return None
+REM#PY#     def probe(self, path, st=None):
+REM#PY#         st = st or os.stat(path)
+REM#PY#         entry = self.get(path, st)
+REM#PY#         if entry: return entry
+REM#PY#         t0 = time.time()
+REM#PY#         info = self.runner(path)
+REM#PY#         info['probe_s'] = time.time() - t0
+REM#PY#         self.store(path, info, st)
+REM#PY#         return info
+REM#PY#     def store(self, path, info, st=None):
+REM#PY#         self.load()
+REM#PY#         st = st or os.stat(path)
+REM#PY#         info.update({'schema': PROBE_SCHEMA, 'sig': self.signature(st), 'size': st.st_size, 'mtime': st.st_mtime, 'dev': st.st_dev})
+REM#PY#         with self.lock:
+REM#PY#             self.entries[str(path)] = info
+REM#PY#             self.dirty = True
+REM#PY#         return info
+REM#PY#     def mark(self, path, key, value):
+REM#PY#         # Attach a verdict to a still-valid entry; it disappears with the entry when the file changes
+REM#PY#         entry = self.get(path)
+REM#PY#         if not entry: return
+REM#PY#         with self.lock:
+REM#PY#             entry[key] = value
+REM#PY#             self.dirty = True
+REM#PY#     def forget(self, path):
+REM#PY#         self.load()
+REM#PY#         with self.lock:
+REM#PY#             if self.entries.pop(str(path), None) is not None: self.dirty = True
+REM#PY# 
+REM#PY# def path_filters(root, config):
+REM#PY#     # (wanted_file, wanted_dir) predicates taking (path, name): the video/temp name rules, exclude_dirs
+REM#PY#     # and the include/exclude globs, which match the path relative to root or the bare name
+REM#PY#     root = Path(root)
+REM#PY#     skip_dirs = {d.lower() for d in config.get('exclude_dirs', [])}
+REM#PY#     include, exclude = config.get('include', []), config.get('exclude', [])
+REM#PY#     def rel(path): return os.path.relpath(path, root).replace(os.sep, '/')
+REM#PY#     def matches(path, name, patterns):
+REM#PY#         r, name = rel(path).lower(), name.lower()
+REM#PY#         return any(fnmatch.fnmatchcase(r, p.lower()) or fnmatch.fnmatchcase(name, p.lower()) for p in patterns)
+REM#PY#     def wanted_dir(path, name):
+REM#PY#         return name.lower() not in skip_dirs and not matches(path, name, exclude)
+REM#PY#     def wanted_file(path, name):
+REM#PY#         if os.path.splitext(name)[1].lower() not in VIDEO_EXTENSIONS or name.startswith("mnemosyne_tmp_"): return False
+REM#PY#         if include and not matches(path, name, include): return False
+REM#PY#         return not (exclude and matches(path, name, exclude))
+REM#PY#     return wanted_file, wanted_dir
+REM#PY# 
+REM#PY# def iter_videos(root, recursive=False, config=None, max_workers=8, filters=None):
+REM#PY#     # One scandir walk for all extensions; excluded folders are pruned before descending
+REM#PY#     # and each file's stat result is kept. Subfolders are scanned in parallel and
+REM#PY#     # (path, stat) pairs are yielded as soon as their folder is read.
+REM#PY#     # filters: path_filters() of an enclosing root when scanning one of its subfolders.
+REM#PY#     config = config or DEFAULT_CONFIG
+REM#PY#     root = Path(root)
+REM#PY#     wanted_file, wanted_dir = filters or path_filters(root, config)
+REM#PY#     def scan_dir(d):
+REM#PY#         files, subdirs = [], []
+REM#PY#         try:
+REM#PY#             with os.scandir(d) as it:
+REM#PY#                 for e in it:
+REM#PY#                     try:
+REM#PY#                         if e.is_dir(follow_symlinks=False):
+REM#PY#                             if recursive and wanted_dir(e.path, e.name): subdirs.append(e.path)
+REM#PY#                         elif wanted_file(e.path, e.name):
+REM#PY#                             files.append((Path(e.path), e.stat()))
+REM#PY#                     except OSError: pass
+REM#PY#         except OSError as ex: logging.warning(f"Scan skipped {d}: {ex}")
+REM#PY#         return files, subdirs
+REM#PY#     with ThreadPoolExecutor(max_workers=max_workers) as ex:
+REM#PY#         pending = {ex.submit(scan_dir, str(root))}
+REM#PY#         while pending:
+REM#PY#             done, pending = wait(pending, return_when=FIRST_COMPLETED)
+REM#PY#             for f in done:
+REM#PY#                 files, subdirs = f.result()
+REM#PY#                 pending |= {ex.submit(scan_dir, d) for d in subdirs}
+REM#PY#                 yield from files
+REM#PY# 
+REM#PY# def scan_videos(root, recursive=False, config=None, max_workers=8):
+REM#PY#     return dict(iter_videos(root, recursive, config, max_workers))
+REM#PY# 
+REM#PY# def probe_all(eng, paths, max_workers=8, stats=None):
+REM#PY#     # Fill the cache in parallel; cached entries cost one stat() and no ffprobe spawn
+REM#PY#     stats = stats or {}
+REM#PY#     def safe_probe(p):
+REM#PY#         try: return p, eng.probes.probe(p, stats.get(p))
+REM#PY#         except Exception as e:
+REM#PY#             logging.warning(f"Probe failed for {p.name}: {e}")
+REM#PY#             return p, None
+REM#PY#     with ThreadPoolExecutor(max_workers=max_workers) as ex: results = dict(ex.map(safe_probe, paths))
+REM#PY#     eng.probes.save()
+REM#PY#     return results
+REM#PY# 
+REM#PY# def parse_bitrate(value):
+REM#PY#     # "800k" -> 800000, "1.5M" -> 1500000
+REM#PY#     v = str(value).strip().lower()
+REM#PY#     mult = {'k': 1000, 'm': 1000000}.get(v[-1:], 1)
+REM#PY#     try: return int(float(v.rstrip('km')) * mult)
+REM#PY#     except: return 0
+REM#PY# 
+REM#PY# PLAN_SLACK = 1.1 # Container overhead and VBR peaks
+REM#PY# 
+REM#PY# def video_compatible(info, config):
+REM#PY#     # H.264 already at or below the target height, fps and bitrate: the stream can be copied
+REM#PY#     vbr = info.get('vbitrate') or max(0, info.get('bitrate', 0) - info.get('abitrate', 0))
+REM#PY#     return (info.get('vcodec') == 'h264' and 0 < info.get('height', 0) <= config['target_height']
+REM#PY#             and info.get('fps', 0) <= config['target_fps'] + 0.5
+REM#PY#             and 0 < vbr <= parse_bitrate(config['video_bitrate']) * PLAN_SLACK)
+REM#PY# 
+REM#PY# def audio_compatible(info, config):
+REM#PY#     return (not info.get('acodec') or (info['acodec'] == 'aac'
+REM#PY#             and 0 < info.get('abitrate', 0) <= parse_bitrate(config['audio_bitrate']) * PLAN_SLACK))
+REM#PY# 
+REM#PY# def output_path(vpath, action, config):
+REM#PY#     # Remuxes may rewrap allowed containers (e.g. .avi, .mkv) as .mp4, never over an existing file
+REM#PY#     if action == 'remux' and vpath.suffix.lower() in [e.lower() for e in config.get('container_remux', [])]:
+REM#PY#         dest = vpath.with_suffix('.mp4')
+REM#PY#         if not dest.exists(): return dest
+REM#PY#     return vpath
+REM#PY# 
+REM#PY# GAIN_CHECK_FRACTION = 0.2 # Share of the file encoded before the output size is projected
+REM#PY# GAIN_CHECK_SECS = 5.0      # ...and at least this much output, so the stream headers don't skew it
+REM#PY# 
+REM#PY# def gain_signature(config):
+REM#PY#     # A low-gain verdict only holds for the settings it was measured with
+REM#PY#     return [config['target_height'], config['video_bitrate'], config['target_fps'], config.get('min_savings', 0)]
+REM#PY# 
+REM#PY# def keep_original(eng, wid, vpath, tmp, saved_pct, stage, renditions=()):
+REM#PY#     # Encode isn't worth it: drop the output, leave the source untouched and remember the verdict.
+REM#PY#     # Verified renditions are still placed: the ladder is wanted even when the main output isn't.
+REM#PY#     if tmp.exists(): tmp.unlink()
+REM#PY#     placed = place_renditions(renditions)
+REM#PY#     eng.probes.mark(vpath, 'low_gain', gain_signature(eng.config))
+REM#PY#     eng.journal.record(vpath, 'skipped', reason=f"saves {saved_pct:.0f}%", **({'renditions': placed} if placed else {}))
+REM#PY#     with eng.lock: eng.gain_aborts[stage] += 1
+REM#PY#     logging.info(f"[Worker {wid}] Keeping original {vpath.name}: {'projected ' if stage == 'early' else ''}savings {saved_pct:.0f}% < {eng.config['min_savings']}%")
+REM#PY#     eng.stats.update(wid, vpath.name, 100.0, "0", "0", f"Kept original ({saved_pct:.0f}% saving)")
+REM#PY#     return True
+REM#PY# 
+REM#PY# def plan_video(info, config, path=None):
+REM#PY#     # Classify a probed file as ('skip' | 'remux' | 'encode', reason)
+REM#PY#     if not info: return ('encode', "probe failed")
+REM#PY#     if APP_NAME in (info.get('comment') or '') or APP_NAME in (info.get('encoder') or ''):
+REM#PY#         return ('skip', "already processed")
+REM#PY#     if not info.get('vcodec'): return ('skip', "no video stream")
+REM#PY#     if info.get('low_gain') and info['low_gain'] == gain_signature(config): return ('skip', "re-encode saves too little")
+REM#PY#     if not config.get('skip_compliant', True): return ('encode', "forced")
+REM#PY#     video_ok, audio_ok = video_compatible(info, config), audio_compatible(info, config)
+REM#PY#     if video_ok and audio_ok:
+REM#PY#         if path and output_path(path, 'remux', config) != path: return ('remux', "container only")
+REM#PY#         return ('skip', "within targets")
+REM#PY#     if video_ok: return ('remux', "video within targets")
+REM#PY#     return ('encode', "above targets")
+REM#PY# 
+REM#PY# def build_plan(videos, probes, config):
+REM#PY#     plan = {v: plan_video(probes.get(v), config, v) for v in videos}
+REM#PY#     counts = {a: sum(1 for p in plan.values() if p[0] == a) for a in ('encode', 'remux', 'skip')}
+REM#PY#     work = {a: sum((probes.get(v) or {}).get('duration', 0) for v, p in plan.items() if p[0] == a) for a in ('encode', 'remux')}
+REM#PY#     return plan, counts, work
+REM#PY# 
+REM#PY# def fmt_duration(secs):
+REM#PY#     h, rem = divmod(int(secs), 3600)
+REM#PY#     return f"{h}h {rem // 60}m" if h else f"{rem // 60}m {rem % 60}s"
+REM#PY# 
+REM#PY# class JobJournal:
+REM#PY#     # Append-only JSONL log of job state transitions, fsync'd so it survives power loss
+REM#PY#     # States: queued -> encoding -> verified -> swapped -> done | failed
+REM#PY#     TERMINAL = ('done', 'failed', 'skipped')
+REM#PY#     def __init__(self, path=JOURNAL_FILE):
+REM#PY#         self.path = path
+REM#PY#         self.fh = None
+REM#PY#         self.lock = threading.Lock()
+REM#PY#     def _write(self, records, sync=True):
+REM#PY#         with self.lock:
+REM#PY#             if self.fh is None:
+REM#PY#                 self.path.parent.mkdir(parents=True, exist_ok=True)
+REM#PY#                 self.fh = open(self.path, 'a', encoding='utf-8')
+REM#PY#             for r in records: self.fh.write(json.dumps(r, ensure_ascii=False) + "\n")
+REM#PY#             self.fh.flush()
+REM#PY#             if sync:
+REM#PY#                 try: os.fsync(self.fh.fileno())
+REM#PY#                 except: pass
+REM#PY#     def record(self, path, state, **extra):
+REM#PY#         self._write([dict(t=time.time(), path=str(path), state=state, **extra)])
+REM#PY#     def begin_run(self, videos, actions=None):
+REM#PY#         # A new batch supersedes the previous journal; recovery has already run by now
+REM#PY#         with self.lock:
+REM#PY#             if self.fh: self.fh.close()
+REM#PY#             self.path.parent.mkdir(parents=True, exist_ok=True)
+REM#PY#             self.fh = open(self.path, 'w', encoding='utf-8')
+REM#PY#         now = time.time()
+REM#PY#         recs = [dict(t=now, state='run_start', root=str(Path.cwd()), count=len(videos))]
+REM#PY#         recs += [dict(t=now, path=str(v), state='queued', action=(actions or {}).get(v, 'encode')) for v in videos]
+REM#PY#         self._write(recs)
+REM#PY#     def end_run(self):
+REM#PY#         self._write([dict(t=time.time(), state='run_end')])
+REM#PY#     def close(self):
+REM#PY#         with self.lock:
+REM#PY#             if self.fh: self.fh.close(); self.fh = None
+REM#PY#     def replay(self):
+REM#PY#         # Returns {path: merged job record} for an unfinished run, or None if the last run completed
+REM#PY#         jobs, finished = {}, True
+REM#PY#         try:
+REM#PY#             with open(self.path, 'r', encoding='utf-8') as f:
+REM#PY#                 for line in f:
+REM#PY#                     try: r = json.loads(line)
+REM#PY#                     except: continue # Torn final line from a crash
+REM#PY#                     if r.get('state') == 'run_start': jobs, finished = {}, False
+REM#PY#                     elif r.get('state') == 'run_end': finished = True
+REM#PY#                     elif 'path' in r: jobs.setdefault(r['path'], {}).update(r)
+REM#PY#         except FileNotFoundError: return None
+REM#PY#         return None if finished else jobs
+REM#PY# 
+REM#PY# class JobMetrics:
+REM#PY#     # Per-job stage timings: one JSONL record per scheduled job, plus running totals served as Prometheus text
+REM#PY#     STAGES = ('queue', 'probe', 'encode', 'verify', 'swap')
+REM#PY#     BUCKETS = (0.05, 0.25, 1, 5, 15, 60, 300, 1800) # Seconds; +Inf is implied
+REM#PY#     ROTATE_BYTES = 50 * 1024 * 1024
+REM#PY#     def __init__(self, path=METRICS_FILE):
+REM#PY#         self.path = path
+REM#PY#         self.fh = None
+REM#PY#         self.enabled = True # Write JSONL records; counters are kept either way
+REM#PY#         self.lock = threading.Lock()
+REM#PY#         self.local = threading.local() # The record of the job running on this worker thread
+REM#PY#         self.counters = collections.Counter() # (metric, labels) -> value
+REM#PY#         self.hist = {s: [0] * (len(self.BUCKETS) + 1) + [0.0] for s in self.STAGES} # bucket counts, +Inf, sum
+REM#PY#         self.running = 0
+REM#PY#     def current(self): return getattr(self.local, 'rec', None)
+REM#PY#     def begin(self, job, lane, slot):
+REM#PY#         now = time.time()
+REM#PY#         jobs = job.members or [job]
+REM#PY#         rec = {'t0': now, 'path': str(job.path), 'files': len(job.files), 'action': job.action, 'lane': lane.name, 'slot': slot,
+REM#PY#                'queue_s': now - job.queued_at if job.queued_at else 0.0, 'probe_s': sum(j.probe_s for j in jobs),
+REM#PY#                'encode_s': 0.0, 'verify_s': 0.0, 'swap_s': 0.0, 'cpu_s': None, 'speed_sum': 0.0, 'speed_n': 0,
+REM#PY#                'bytes_in': job.size, 'bytes_out': 0, 'media_s': sum((j.info or {}).get('duration') or 0.0 for j in jobs)}
+REM#PY#         self.local.rec = rec
+REM#PY#         with self.lock: self.running += 1
+REM#PY#         return rec
+REM#PY#     def add(self, key, value):
+REM#PY#         rec = self.current()
+REM#PY#         if rec is not None: rec[key] += value
+REM#PY#     @staticmethod
+REM#PY#     def child_done(h):
+REM#PY#         # Called by the supervisor as each ffmpeg exits; segments and joins add up on the same record
+REM#PY#         rec = h.metrics
+REM#PY#         rec['encode_s'] += time.time() - h.started
+REM#PY#         if h.cpu is not None: rec['cpu_s'] = (rec['cpu_s'] or 0.0) + h.cpu
+REM#PY#         rec['speed_sum'] += h.speed_sum; rec['speed_n'] += h.speed_n
+REM#PY#     def end(self, rec, job, requeued=False):
+REM#PY#         self.local.rec = None
+REM#PY#         now = time.time()
+REM#PY#         ok = sum(1 for j in job.files if j.ok)
+REM#PY#         speed_sum, speed_n = rec.pop('speed_sum'), rec.pop('speed_n')
+REM#PY#         rec['wall_s'] = now - rec.pop('t0')
+REM#PY#         rec['speed'] = speed_sum / speed_n if speed_n else None
+REM#PY#         rec.update(t=now, ok=ok, failed=0 if requeued else rec['files'] - ok, requeued=requeued)
+REM#PY#         line = json.dumps({k: round(v, 3) if isinstance(v, float) else v for k, v in rec.items()}, ensure_ascii=False)
+REM#PY#         with self.lock:
+REM#PY#             self.running -= 1
+REM#PY#             lane = rec['lane']
+REM#PY#             if requeued: self.counters['files_total', ('requeued', lane)] += rec['files']
+REM#PY#             else:
+REM#PY#                 self.counters['files_total', ('ok', lane)] += ok
+REM#PY#                 self.counters['files_total', ('failed', lane)] += rec['files'] - ok
+REM#PY#             for key in ('bytes_in', 'bytes_out', 'media_s', 'cpu_s'): self.counters[key, ()] += rec[key] or 0
+REM#PY#             for stage in self.STAGES:
+REM#PY#                 secs = rec[f'{stage}_s']
+REM#PY#                 if secs <= 0: continue # Cached probes, verification off, nothing swapped
+REM#PY#                 h = self.hist[stage]
+REM#PY#                 h[bisect.bisect_left(self.BUCKETS, secs)] += 1; h[-1] += secs
+REM#PY#             if not self.enabled: return
+REM#PY#             try:
+REM#PY#                 if self.fh is None:
+REM#PY#                     self.path.parent.mkdir(parents=True, exist_ok=True)
+REM#PY#                     if self.path.exists() and self.path.stat().st_size > self.ROTATE_BYTES: os.replace(self.path, self.path.with_name(self.path.name + '.1'))
+REM#PY#                     self.fh = open(self.path, 'a', encoding='utf-8')
+REM#PY#                 self.fh.write(line + "\n"); self.fh.flush()
+REM#PY#             except OSError as e:
+REM#PY#                 logging.warning(f"Metrics log disabled: {e}"); self.enabled = False
+REM#PY#     def stage_totals(self):
+REM#PY#         # {stage: (observations, seconds)} for the final report
+REM#PY#         with self.lock: return {s: (sum(h[:-1]), h[-1]) for s, h in self.hist.items()}
+REM#PY#     def render(self):
+REM#PY#         with self.lock:
+REM#PY#             counters, hist, running = dict(self.counters), {s: list(h) for s, h in self.hist.items()}, self.running
+REM#PY#         out = ["# HELP mnemosyne_files_total Files finished, by result and encoder lane", "# TYPE mnemosyne_files_total counter"]
+REM#PY#         for (name, labels), v in sorted(counters.items()):
+REM#PY#             if name == 'files_total': out.append(f'mnemosyne_files_total{{result="{labels[0]}",lane="{labels[1]}"}} {v}')
+REM#PY#         for key, name, text in (('bytes_in', 'bytes_read_total', "Source bytes of finished jobs"), ('bytes_out', 'bytes_written_total', "Output bytes swapped into place"),
+REM#PY#                                 ('media_s', 'media_seconds_total', "Source media duration of finished jobs"), ('cpu_s', 'child_cpu_seconds_total', "CPU time of ffmpeg children")):
+REM#PY#             out += [f"# HELP mnemosyne_{name} {text}", f"# TYPE mnemosyne_{name} counter", f"mnemosyne_{name} {counters.get((key, ()), 0):g}"]
+REM#PY#         out += ["# HELP mnemosyne_jobs_running Jobs currently on a worker slot", "# TYPE mnemosyne_jobs_running gauge", f"mnemosyne_jobs_running {running}"]
+REM#PY#         out += ["# HELP mnemosyne_stage_seconds Time per job spent in each stage", "# TYPE mnemosyne_stage_seconds histogram"]
+REM#PY#         for stage, h in hist.items():
+REM#PY#             cum = 0
+REM#PY#             for le, n in zip([f"{b:g}" for b in self.BUCKETS] + ["+Inf"], h[:-1]):
+REM#PY#                 cum += n; out.append(f'mnemosyne_stage_seconds_bucket{{stage="{stage}",le="{le}"}} {cum}')
+REM#PY#             out += [f'mnemosyne_stage_seconds_sum{{stage="{stage}"}} {h[-1]:.3f}', f'mnemosyne_stage_seconds_count{{stage="{stage}"}} {cum}']
+REM#PY#         return "\n".join(out) + "\n"
+REM#PY#     def serve(self, port, host="127.0.0.1"):
+REM#PY#         # Localhost only: the endpoint has no authentication
+REM#PY#         from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+REM#PY#         metrics = self
+REM#PY#         class Handler(BaseHTTPRequestHandler):
+REM#PY#             def do_GET(self):
+REM#PY#                 if self.path.split('?')[0] not in ('/', '/metrics'): return self.send_error(404)
+REM#PY#                 body = metrics.render().encode()
+REM#PY#                 self.send_response(200)
+REM#PY#                 self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+REM#PY#                 self.send_header('Content-Length', str(len(body)))
+REM#PY#                 self.end_headers(); self.wfile.write(body)
+REM#PY#             def log_message(self, *args): pass
+REM#PY#         server = ThreadingHTTPServer((host, port), Handler)
+REM#PY#         threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+REM#PY#         return server
+REM#PY#     def close(self):
+REM#PY#         with self.lock:
+REM#PY#             if self.fh: self.fh.close(); self.fh = None
+REM#PY# 
+REM#PY# def swap_into_place(eng, vpath, tmp, meta, dest=None):
+REM#PY#     # Atomic Safety Bridge: original -> .bak, verified temp -> original (or its new container), then drop .bak
+REM#PY#     dest = dest or vpath
+REM#PY#     bak = vpath.with_suffix(vpath.suffix + '.bak')
+REM#PY#     if bak.exists(): bak.unlink()
+REM#PY#     vpath.rename(bak)
+REM#PY#     tmp.rename(dest)
+REM#PY#     eng.journal.record(vpath, 'swapped', tmp=str(tmp), bak=str(bak), dest=str(dest))
+REM#PY#     if meta: restore_file_metadata(dest, meta)
+REM#PY#     if dest.exists() and dest.stat().st_size > 10240: bak.unlink()
+REM#PY#     else: raise Exception("Output verification fail after swap")
+REM#PY# 
+REM#PY# def recover_interrupted_jobs(eng):
+REM#PY#     # Roll back or finish half-done swaps from an interrupted run; returns paths still to process
+REM#PY#     jobs = eng.journal.replay()
+REM#PY#     if not jobs: return [], 0
+REM#PY#     remaining, fixed = [], 0
+REM#PY#     for p, job in jobs.items():
+REM#PY#         state = job.get('state')
+REM#PY#         if state in JobJournal.TERMINAL: continue
+REM#PY#         vpath = Path(p)
+REM#PY#         dest = Path(job.get('dest') or p)
+REM#PY#         tmp = Path(job['tmp']) if job.get('tmp') else None
+REM#PY#         bak = Path(job['bak']) if job.get('bak') else vpath.with_suffix(vpath.suffix + '.bak')
+REM#PY#         meta = tuple(job['meta']) if job.get('meta') else None
+REM#PY#         try:
+REM#PY#             if state == 'swapped' and dest.exists() and dest.stat().st_size > 10240:
+REM#PY#                 # New file is in place; only metadata restore and backup removal were pending
+REM#PY#                 if meta: restore_file_metadata(dest, meta)
+REM#PY#                 if bak.exists(): bak.unlink()
+REM#PY#                 eng.journal.record(vpath, 'done', recovered=True); fixed += 1
+REM#PY#                 continue
+REM#PY#             if state in ('verified', 'swapped') and tmp and tmp.exists() and meta:
+REM#PY#                 # Verified output survived: finish the swap instead of re-encoding
+REM#PY#                 if not vpath.exists() and bak.exists(): bak.rename(vpath)
+REM#PY#                 swap_into_place(eng, vpath, tmp, meta, dest)
+REM#PY#                 eng.journal.record(vpath, 'done', recovered=True); fixed += 1
+REM#PY#                 continue
+REM#PY#             # Anything earlier is rolled back to the original and re-queued
+REM#PY#             if bak.exists():
+REM#PY#                 if vpath.exists() and vpath.stat().st_size <= 10240: vpath.unlink()
+REM#PY#                 if not vpath.exists(): bak.rename(vpath); fixed += 1
+REM#PY#                 else: bak.unlink()
+REM#PY#             if tmp and tmp.exists(): tmp.unlink()
+REM#PY#             if vpath.exists(): remaining.append(vpath)
+REM#PY#         except Exception as e:
+REM#PY#             logging.error(f"Recovery failed for {vpath.name}: {e}")
+REM#PY#     logging.info(f"Journal recovery: {fixed} swap(s) repaired, {len(remaining)} job(s) remaining")
+REM#PY#     return remaining, fixed
+REM#PY# 
+REM#PY# # Rough per-worker throughput used to turn probe data into comparable cost estimates (seconds)
+REM#PY# ENCODE_PIXEL_RATE = 60e6   # Source pixels/s, ~1080p30 realtime on a medium x264 preset
+REM#PY# REMUX_BYTE_RATE = 100e6    # Bytes/s when the video stream is copied
+REM#PY# 
+REM#PY# def estimate_cost(info, action='encode'):
+REM#PY#     if not info: return 0.0
+REM#PY#     dur = info.get('duration') or 0.0
+REM#PY#     if action == 'remux': return info.get('size', 0) / REMUX_BYTE_RATE + dur * 0.01
+REM#PY#     return dur * (info.get('width') or 640) * (info.get('height') or 480) * (info.get('fps') or 30.0) / ENCODE_PIXEL_RATE
+REM#PY# 
+REM#PY# def cpu_budget(config):
+REM#PY#     # Cores Mnemosyne may use in total; 0 means every core on the host
+REM#PY#     cores = os.cpu_count() or 2
+REM#PY#     b = int(config.get('cpu_budget') or 0)
+REM#PY#     return max(1, min(b, cores) if b > 0 else cores)
+REM#PY# 
+REM#PY# class ThreadBudget:
+REM#PY#     # Splits the CPU budget between running ffmpeg jobs instead of letting each spread over every core
+REM#PY#     def __init__(self, total, slots):
+REM#PY#         self.total, self.slots = total, slots
+REM#PY#         self.used = 0
+REM#PY#         self.lock = threading.Lock()
+REM#PY#     def free(self):
+REM#PY#         with self.lock: return self.total - self.used
+REM#PY#     def acquire(self, outstanding):
+REM#PY#         # Share is based on how many jobs can still run together, so it grows as the queue drains.
+REM#PY#         # The budget is a hard cap: callers only start a job while free() > 0, so with fewer cores
+REM#PY#         # than slots fewer jobs run at once, and a job may get less while an earlier one holds more.
+REM#PY#         with self.lock:
+REM#PY#             share = max(1, self.total // max(1, min(self.slots, outstanding)))
+REM#PY#             n = min(share, self.total - self.used)
+REM#PY#             self.used += n
+REM#PY#             return n
+REM#PY#     def release(self, n):
+REM#PY#         with self.lock: self.used = max(0, self.used - n)
+REM#PY# 
+REM#PY# class HardwareEncodeError(Exception): pass
+REM#PY# 
+REM#PY# 
+REM#PY# class EncoderLane:
+REM#PY#     # One encoder with its own concurrency limit; 'ffmpeg' may point at any compatible binary
+REM#PY#     def __init__(self, codec, capacity, ffmpeg="ffmpeg", label=None):
+REM#PY#         self.codec, self.capacity, self.ffmpeg = codec, max(1, int(capacity)), ffmpeg
+REM#PY#         self.label = label or CODEC_LABELS.get(codec, codec.upper())
+REM#PY#         self.hardware = codec != "libx264"
+REM#PY#         self.disabled = False
+REM#PY#         self.active = 0
+REM#PY#         self.name = f"{codec}@{ffmpeg}" if ffmpeg != "ffmpeg" else codec
+REM#PY# 
+REM#PY# def build_lanes(config, codec):
+REM#PY#     # Explicit lanes from config, else the detected hardware encoder beside a CPU lane
+REM#PY#     if config.get('encoder_lanes'):
+REM#PY#         lanes = [EncoderLane(l['codec'], l.get('slots', 1), l.get('ffmpeg', 'ffmpeg'), l.get('label')) for l in config['encoder_lanes']]
+REM#PY#         usable = [l for l in lanes if not l.hardware or encoder_works(l.codec, l.ffmpeg)]
+REM#PY#         for l in lanes:
+REM#PY#             if l not in usable: logging.warning(f"Encoder lane {l.label} ({l.ffmpeg}) failed its trial encode, disabled")
+REM#PY#         return usable or [EncoderLane("libx264", config['max_workers'])]
+REM#PY#     lanes = []
+REM#PY#     if codec != "libx264": lanes.append(EncoderLane(codec, min(HW_LANE_SLOTS.get(codec, 2), config['max_workers'])))
+REM#PY#     lanes.append(EncoderLane("libx264", config['max_workers']))
+REM#PY#     return lanes
+REM#PY# 
+REM#PY# def describe_lanes(lanes):
+REM#PY#     return " + ".join(f"{l.label} x{l.capacity}" for l in lanes)
+REM#PY# 
+REM#PY# COPY_BLOCK = 8 * 1024 * 1024 # Copy-back from scratch in large sequential blocks
+REM#PY# 
+REM#PY# def lock_dir(path):
+REM#PY#     # Exclusive lock on a folder, held until the returned file is closed; None if another engine has it
+REM#PY#     path = Path(path)
+REM#PY#     path.mkdir(parents=True, exist_ok=True)
+REM#PY#     fh = open(path / "engine.lock", 'a+')
 REM#PY#     try:
-REM#PY#         r = subprocess.run(["ffmpeg", "-encoders"], capture_output=True, text=True, timeout=5)
-REM#PY#         e = r.stdout
-REM#PY#         if "h264_nvenc" in e: return ("h264_nvenc", "NVIDIA (NVENC)")
-REM#PY#         elif "h264_qsv" in e: return ("h264_qsv", "Intel QuickSync")
-REM#PY#         elif "h264_videotoolbox" in e: return ("h264_videotoolbox", "Apple VideoToolbox")
-REM#PY#         elif "h264_vaapi" in e: return ("h264_vaapi", "VAAPI")
-REM#PY#         else: return ("libx264", "CPU (x264)")
-REM#PY#     except: return ("libx264", "CPU (x264)")
+REM#PY#         if IS_WINDOWS:
+REM#PY#             import msvcrt
+REM#PY#             fh.seek(0); msvcrt.locking(fh.fileno(), msvcrt.LK_NBLCK, 1)
+REM#PY#         else:
+REM#PY#             import fcntl
+REM#PY#             fcntl.flock(fh.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+REM#PY#     except OSError:
+REM#PY#         fh.close(); return None
+REM#PY#     return fh
+REM#PY# 
+REM#PY# class ScratchSpace:
+REM#PY#     # Local staging folder (SSD, tmpfs) for temp outputs. Jobs reserve their expected output size
+REM#PY#     # at admission; when the quota is used up the scheduler holds further jobs back.
+REM#PY#     def __init__(self, path, config):
+REM#PY#         self.path = Path(path).expanduser()
+REM#PY#         # Startup cleanup would delete another engine's in-flight temp files, so the folder is held exclusively
+REM#PY#         self.owner = lock_dir(self.path)
+REM#PY#         if self.owner is None: raise OSError(f"{self.path} is in use by another engine")
+REM#PY#         cleanup_temp_files(self.path)
+REM#PY#         free = shutil.disk_usage(self.path).free * 0.9
+REM#PY#         quota = float(config.get('scratch_quota_gb') or 0) * 1024 ** 3
+REM#PY#         self.capacity = min(free, quota) if quota > 0 else free
+REM#PY#         self.used = 0
+REM#PY#         self.rate = (parse_bitrate(config['video_bitrate']) + parse_bitrate(config['audio_bitrate'])) / 8
+REM#PY#         self.seg_min = config.get('segment_min_duration', 0)
+REM#PY#     def need(self, job):
+REM#PY#         total = 0
+REM#PY#         for j in job.files:
+REM#PY#             dur = (j.info or {}).get('duration') or 0.0
+REM#PY#             n = j.size if j.action == 'remux' or not dur else min(j.size, self.rate * dur) if j.size else self.rate * dur
+REM#PY#             # Segmented encodes hold their parts and the joined file at the same time
+REM#PY#             if j.action == 'encode' and self.seg_min and dur >= self.seg_min: n *= 2
+REM#PY#             total += n * PLAN_SLACK
+REM#PY#         return total
+REM#PY#     def fits(self, job):
+REM#PY#         need = self.need(job)
+REM#PY#         return need > self.capacity or self.used + need <= self.capacity
+REM#PY#     def reserve(self, job):
+REM#PY#         need = self.need(job)
+REM#PY#         # Larger than the whole scratch area: encode beside the source as before
+REM#PY#         if need > self.capacity: job.staging, job.reserved = None, 0
+REM#PY#         else: job.staging, job.reserved = self.path, need
+REM#PY#         self.used += job.reserved
+REM#PY#     def release(self, job):
+REM#PY#         self.used = max(0, self.used - job.reserved)
+REM#PY#         job.reserved = 0
+REM#PY#     def close(self): self.owner.close()
+REM#PY# 
+REM#PY# def open_scratch(config):
+REM#PY#     if not config.get('scratch_dir'): return None
+REM#PY#     try:
+REM#PY#         scratch = ScratchSpace(config['scratch_dir'], config)
+REM#PY#         logging.info(f"Scratch staging: {scratch.path} ({scratch.capacity / 1024 ** 3:.1f} GB usable)")
+REM#PY#         return scratch
+REM#PY#     except OSError as e:
+REM#PY#         logging.warning(f"Scratch dir unusable ({e}), writing temp files beside the sources")
+REM#PY#         return None
+REM#PY# 
+REM#PY# def copy_back(src, dst):
+REM#PY#     # One sequential pass scratch -> source drive, hashed on the way; the copy is read back and compared
+REM#PY#     h = hashlib.blake2b()
+REM#PY#     try:
+REM#PY#         with open(src, 'rb') as fi, open(dst, 'wb') as fo:
+REM#PY#             while chunk := fi.read(COPY_BLOCK):
+REM#PY#                 h.update(chunk); fo.write(chunk)
+REM#PY#             fo.flush(); os.fsync(fo.fileno())
+REM#PY#             # Drop the cached pages so the read-back really comes from the target device
+REM#PY#             if hasattr(os, 'posix_fadvise'): os.posix_fadvise(fo.fileno(), 0, 0, os.POSIX_FADV_DONTNEED)
+REM#PY#         check = hashlib.blake2b()
+REM#PY#         with open(dst, 'rb') as f:
+REM#PY#             while chunk := f.read(COPY_BLOCK): check.update(chunk)
+REM#PY#         if check.digest() != h.digest(): raise Exception(f"Checksum mismatch copying {src.name} back from scratch")
+REM#PY#     except:
+REM#PY#         if dst.exists(): dst.unlink()
+REM#PY#         raise
+REM#PY#     src.unlink()
+REM#PY#     return dst
+REM#PY# 
+REM#PY# class Job:
+REM#PY#     def __init__(self, path, action='encode', info=None):
+REM#PY#         self.path, self.action, self.info = path, action, info
+REM#PY#         self.cost = estimate_cost(info, action)
+REM#PY#         self.size = (info or {}).get('size', 0)
+REM#PY#         self.elapsed = 0.0
+REM#PY#         self.threads = 0
+REM#PY#         self.dest = path
+REM#PY#         self.excluded = set() # Lanes this job already failed on
+REM#PY#         self.lane = None
+REM#PY#         self.ok = None
+REM#PY#         self.members = None # Set on a batch of short clips run as one job
+REM#PY#         self.staging, self.reserved = None, 0 # Scratch folder and bytes held there while running
+REM#PY#         self.device = None # st_dev of the source, for per-device limits
+REM#PY#         self.duplicates = [] # Byte-identical sources that reuse this job's output
+REM#PY#         self.future = self.on_progress = None # Set for jobs queued through Engine.submit()
+REM#PY#         self.handles, self.cancelled = None, False # ffmpeg processes of the running job, for cancellation
+REM#PY#         self.probe_s = (info or {}).get('probe_s', 0.0) # ffprobe time this run, 0 when the probe was cached
+REM#PY#         self.queued_at = None
+REM#PY#     @property
+REM#PY#     def files(self):
+REM#PY#         jobs = self.members or [self]
+REM#PY#         return jobs + [d for j in jobs for d in j.duplicates]
+REM#PY#     @classmethod
+REM#PY#     def batch(cls, jobs):
+REM#PY#         b = cls(jobs[0].path, 'batch')
+REM#PY#         b.members = jobs
+REM#PY#         b.cost, b.size = sum(j.cost for j in jobs), sum(j.size for j in jobs)
+REM#PY#         b.device = jobs[0].device
+REM#PY#         return b
+REM#PY# 
+REM#PY# def batchable(job, config):
+REM#PY#     limit = config.get('batch_max_duration', 0)
+REM#PY#     d = (job.info or {}).get('duration') or 0.0
+REM#PY#     return limit > 0 and job.action == 'encode' and 0 < d <= limit and not config.get('renditions')
+REM#PY# 
+REM#PY# HASH_BLOCK = 64 * 1024
+REM#PY# DEDUP_POLICIES = ('off', 'copy', 'reflink', 'hardlink')
+REM#PY# 
+REM#PY# def sample_hash(path, size):
+REM#PY#     # Head, middle and tail blocks plus the size: cheap and almost always decisive
+REM#PY#     h = hashlib.blake2b(str(size).encode())
+REM#PY#     with open(path, 'rb') as f:
+REM#PY#         for off in sorted({0, max(0, size // 2 - HASH_BLOCK // 2), max(0, size - HASH_BLOCK)}):
+REM#PY#             f.seek(off); h.update(f.read(HASH_BLOCK))
+REM#PY#     return h.digest()
+REM#PY# 
+REM#PY# def full_hash(path):
+REM#PY#     h = hashlib.blake2b()
+REM#PY#     with open(path, 'rb') as f:
+REM#PY#         while chunk := f.read(COPY_BLOCK): h.update(chunk)
+REM#PY#     return h.digest()
+REM#PY# 
+REM#PY# def find_duplicates(jobs, config, max_workers=8):
+REM#PY#     # size -> sampled hash -> full hash; each identical group keeps its first job, the rest ride along
+REM#PY#     if config.get('dedup', 'copy') not in DEDUP_POLICIES[1:]: return jobs
+REM#PY#     # A reused output comes without the primary's renditions, so with a ladder every copy is encoded itself
+REM#PY#     if config.get('renditions'): return jobs
+REM#PY#     def refine(groups, key_fn):
+REM#PY#         out = []
+REM#PY#         with ThreadPoolExecutor(max_workers=max_workers) as ex:
+REM#PY#             for group in groups:
+REM#PY#                 keys = {}
+REM#PY#                 for j, k in zip(group, ex.map(lambda j: _safe(key_fn, j), group)):
+REM#PY#                     if k is not None: keys.setdefault(k, []).append(j)
+REM#PY#                 out.extend(g for g in keys.values() if len(g) > 1)
+REM#PY#         return out
+REM#PY#     def _safe(fn, j):
+REM#PY#         try: return fn(j)
+REM#PY#         except OSError as e: logging.warning(f"Dedup: can't read {j.path.name}: {e}"); return None
+REM#PY#     by_size = {}
+REM#PY#     for j in jobs:
+REM#PY#         if j.size and not j.members: by_size.setdefault((j.size, j.action), []).append(j)
+REM#PY#     groups = [g for g in by_size.values() if len(g) > 1]
+REM#PY#     # Files small enough that the samples cover them entirely need no full pass
+REM#PY#     groups = refine(groups, lambda j: sample_hash(j.path, j.size))
+REM#PY#     groups = [g for g in groups if g[0].size <= 3 * HASH_BLOCK] + refine([g for g in groups if g[0].size > 3 * HASH_BLOCK], lambda j: full_hash(j.path))
+REM#PY#     dropped = set()
+REM#PY#     for g in groups:
+REM#PY#         g.sort(key=jobs.index)
+REM#PY#         g[0].duplicates = g[1:]
+REM#PY#         dropped.update(id(j) for j in g[1:])
+REM#PY#         logging.info(f"Dedup: {g[0].path} has {len(g) - 1} identical cop{'y' if len(g) == 2 else 'ies'}")
+REM#PY#     return [j for j in jobs if id(j) not in dropped]
+REM#PY# 
+REM#PY# def clone_file(src, dst, policy):
+REM#PY#     # reflink (copy-on-write clone) falls back to a plain copy where the filesystem can't do it
+REM#PY#     if policy == 'hardlink': return os.link(src, dst)
+REM#PY#     if policy == 'reflink' and SYSTEM == "Linux":
+REM#PY#         import fcntl
+REM#PY#         try:
+REM#PY#             with open(src, 'rb') as fi, open(dst, 'wb') as fo:
+REM#PY#                 fcntl.ioctl(fo.fileno(), 0x40049409, fi.fileno()) # FICLONE
+REM#PY#             return
+REM#PY#         except OSError:
+REM#PY#             if os.path.exists(dst): os.unlink(dst)
+REM#PY#     shutil.copyfile(src, dst)
+REM#PY# 
+REM#PY# def reuse_output(eng, wid, primary, dup):
+REM#PY#     # Give an identical source the primary's finished output, through the same journal and atomic swap
+REM#PY#     policy = eng.config.get('dedup', 'copy')
+REM#PY#     vpath, t0 = dup.path, time.time()
+REM#PY#     eng.stats.update(wid, vpath.name, 99.9, "-", "-", f"Reusing output ({policy})")
+REM#PY#     try:
+REM#PY#         st = vpath.stat()
+REM#PY#         meta = get_file_metadata(vpath, st)
+REM#PY#         tmp = vpath.parent / f"mnemosyne_tmp_{wid}_{dup.dest.name}"
+REM#PY#         eng.journal.record(vpath, 'encoding', tmp=str(tmp), dest=str(dup.dest), action='dedup', meta=list(meta))
+REM#PY#         clone_file(primary.dest, tmp, policy)
+REM#PY#         eng.journal.record(vpath, 'verified', tmp=str(tmp))
+REM#PY#         # Hard links share one inode, so per-file timestamps can't differ; the primary's are kept
+REM#PY#         swap_into_place(eng, vpath, tmp, None if policy == 'hardlink' else meta, dup.dest)
+REM#PY#         if dup.dest != vpath: eng.probes.forget(vpath)
+REM#PY#         out_info = eng.probes.get(primary.dest)
+REM#PY#         if out_info: eng.probes.store(dup.dest, {k: v for k, v in out_info.items() if k not in ('sig', 'size', 'mtime', 'dev')})
+REM#PY#         eng.journal.record(vpath, 'done', size=dup.dest.stat().st_size, dedup_of=str(primary.path))
+REM#PY#         dup.ok = True
+REM#PY#     except Exception as e:
+REM#PY#         logging.error(f"Dedup reuse failed for {vpath.name}: {e}")
+REM#PY#         if 'tmp' in locals() and tmp.exists(): tmp.unlink()
+REM#PY#         eng.journal.record(vpath, 'failed', error=f"dedup: {e}")
+REM#PY#         dup.ok = False
+REM#PY#     dup.elapsed = time.time() - t0
+REM#PY# 
+REM#PY# def apply_duplicates(eng, wid, job):
+REM#PY#     config = eng.config
+REM#PY#     for j in job.files:
+REM#PY#         if not j.duplicates: continue
+REM#PY#         if not j.ok:
+REM#PY#             # Same bytes, same outcome: copies of a failed source are left untouched and counted as failed
+REM#PY#             for d in j.duplicates:
+REM#PY#                 eng.journal.record(d.path, 'failed', error=f"duplicate of failed {j.path.name}"); d.ok = False
+REM#PY#             continue
+REM#PY#         kept = j.path.exists() and (eng.probes.get(j.path) or {}).get('low_gain') == gain_signature(config)
+REM#PY#         for d in j.duplicates:
+REM#PY#             if kept:
+REM#PY#                 # The primary was kept as is; an identical copy would be too
+REM#PY#                 eng.probes.mark(d.path, 'low_gain', gain_signature(config))
+REM#PY#                 eng.journal.record(d.path, 'skipped', reason="duplicate kept original"); d.ok = True
+REM#PY#             else: reuse_output(eng, wid, j, d)
+REM#PY# 
+REM#PY# def make_batches(jobs, config):
+REM#PY#     # Group short encodes into batch jobs of up to batch_size; everything else passes through unchanged.
+REM#PY#     # Each batch takes the place of its first member, so the order the jobs came in (the sort) is kept.
+REM#PY#     size = max(1, config.get('batch_size', 8))
+REM#PY#     small = [j for j in jobs if batchable(j, config)]
+REM#PY#     if size < 2 or len(small) < 2: return jobs
+REM#PY#     by_device, first = {}, {}
+REM#PY#     for j in small: by_device.setdefault(j.device, []).append(j)
+REM#PY#     for group in by_device.values():
+REM#PY#         for i in range(0, len(group), size):
+REM#PY#             chunk = group[i:i + size]
+REM#PY#             first[chunk[0]] = Job.batch(chunk) if len(chunk) > 1 else chunk[0]
+REM#PY#     small = set(small)
+REM#PY#     return [first.get(j, j) for j in jobs if j in first or j not in small]
+REM#PY# 
+REM#PY# DEVICE_LOOKAHEAD = 256 # Queue entries scanned for a job on an idle device
+REM#PY# 
+REM#PY# def device_limits(config):
+REM#PY#     # {st_dev: max concurrent jobs}; the None key is the default for every other device (0 = no limit)
+REM#PY#     limits = {None: int(config.get('device_workers') or 0)}
+REM#PY#     for path, n in (config.get('device_limits') or {}).items():
+REM#PY#         try: limits[os.stat(path).st_dev] = int(n)
+REM#PY#         except OSError as e: logging.warning(f"device_limits: {path} skipped ({e})")
+REM#PY#     return limits
+REM#PY# 
+REM#PY# def mount_point(path):
+REM#PY#     # Top-most folder of the path that is still on the same device
+REM#PY#     path = Path(path).absolute()
+REM#PY#     try:
+REM#PY#         dev = path.stat().st_dev
+REM#PY#         while path.parent != path and path.parent.stat().st_dev == dev: path = path.parent
+REM#PY#     except OSError: pass
+REM#PY#     return str(path)
+REM#PY# 
+REM#PY# class Scheduler:
+REM#PY#     # Fixed pool of worker slots handed out when a job starts; jobs leave the queue in the given order
+REM#PY#     # and go to the first encoder lane with spare capacity that they haven't already failed on
+REM#PY#     def __init__(self, jobs, slots, budget=None, lanes=None, hw_failure_limit=0, closed=True, max_pending=0, lpt=False, scratch=None, device_limits=None, lock=None):
+REM#PY#         # closed=False keeps workers waiting for add() until close(); add() blocks beyond max_pending
+REM#PY#         self.closed, self.max_pending, self.lpt = closed, max_pending, lpt
+REM#PY#         self.scratch = scratch
+REM#PY#         self.dev_limits = device_limits or {}
+REM#PY#         self.dev_active = collections.Counter()
+REM#PY#         self.dev_stats = {} # st_dev -> [files, bytes, first start, last end, sample path]
+REM#PY#         for j in jobs: self._register(j)
+REM#PY#         self.added = sum(len(j.files) for j in jobs) # Counted in files, a batch counts each clip
+REM#PY#         self.budget = budget
+REM#PY#         self.lanes = lanes or [EncoderLane("libx264", slots)]
+REM#PY#         self.hw_failure_limit, self.hw_failures = hw_failure_limit, 0
+REM#PY#         self.pending = list(jobs)
+REM#PY#         self.pending.reverse() # pop() from the end is O(1)
+REM#PY#         self.slots = slots
+REM#PY#         self.free_slots = list(range(slots, 0, -1))
+REM#PY#         self.cond = threading.Condition(lock)
+REM#PY#         self.finished = []
+REM#PY#         self.completed = 0
+REM#PY#         self.keep_finished = True # Long-running watch mode only needs the counters
+REM#PY#         self.on_finish = None
+REM#PY#         self.running = 0
+REM#PY#         self.start_t = self.end_t = None
+REM#PY#     def _register(self, job):
+REM#PY#         job.queued_at = job.queued_at or time.time()
+REM#PY#         if job.device is None:
+REM#PY#             try: job.device = job.path.stat().st_dev
+REM#PY#             except OSError: job.device = 0
+REM#PY#         if job.device not in self.dev_stats: self.dev_stats[job.device] = [0, 0, None, None, job.path]
+REM#PY#     def _device_free(self, job):
+REM#PY#         limit = self.dev_limits.get(job.device, self.dev_limits.get(None, 0))
+REM#PY#         return not limit or self.dev_active[job.device] < limit
+REM#PY#     @staticmethod
+REM#PY#     def order_lpt(jobs):
+REM#PY#         # Longest Processing Time first: big files start early instead of finishing the batch alone
+REM#PY#         return sorted(jobs, key=lambda j: j.cost, reverse=True)
+REM#PY#     def _pick(self):
+REM#PY#         balance = len(self.dev_stats) > 1
+REM#PY#         for lane in self.lanes:
+REM#PY#             if lane.disabled or lane.active >= lane.capacity: continue
+REM#PY#             best = None
+REM#PY#             for n, i in enumerate(range(len(self.pending) - 1, -1, -1)):
+REM#PY#                 job = self.pending[i]
+REM#PY#                 if lane.name in job.excluded or not self._device_free(job): continue
+REM#PY#                 # Scratch admission: a job whose output won't fit yet waits while smaller ones go ahead
+REM#PY#                 if self.scratch and not self.scratch.fits(job): continue
+REM#PY#                 if not balance: return i, lane
+REM#PY#                 # Several disks: take the next job from the least busy device so every disk keeps working
+REM#PY#                 busy = self.dev_active[job.device]
+REM#PY#                 if best is None or busy < best[0]: best = (busy, i)
+REM#PY#                 if busy == 0 or n >= DEVICE_LOOKAHEAD: break
+REM#PY#             if best: return best[1], lane
+REM#PY#         return None
+REM#PY#     def add(self, job):
+REM#PY#         with self.cond:
+REM#PY#             while self.max_pending and len(self.pending) >= self.max_pending: self.cond.wait()
+REM#PY#             # pending is consumed from the end: LPT keeps it sorted by ascending cost, otherwise FIFO
+REM#PY#             if self.lpt: bisect.insort(self.pending, job, key=lambda j: j.cost)
+REM#PY#             else: self.pending.insert(0, job)
+REM#PY#             self._register(job)
+REM#PY#             self.added += len(job.files)
+REM#PY#             self.cond.notify_all()
+REM#PY#     def close(self):
+REM#PY#         with self.cond:
+REM#PY#             self.closed = True
+REM#PY#             if not self.pending and not self.running and self.start_t: self.end_t = time.time()
+REM#PY#             self.cond.notify_all()
+REM#PY#     def next(self):
+REM#PY#         with self.cond:
+REM#PY#             while True:
+REM#PY#                 if not self.pending and self.closed: return None
+REM#PY#                 pick = self._pick() if self.free_slots and self.pending and (not self.budget or self.budget.free() > 0) else None
+REM#PY#                 if pick: break
+REM#PY#                 self.cond.wait()
+REM#PY#             if self.start_t is None: self.start_t = time.time()
+REM#PY#             i, lane = pick
+REM#PY#             job = self.pending.pop(i)
+REM#PY#             self.cond.notify_all() # Room for a blocked add()
+REM#PY#             # An open queue can fill every slot at any moment, so it is always shared as if full
+REM#PY#             if self.budget: job.threads = self.budget.acquire(len(self.pending) + self.running + 1 if self.closed else self.slots)
+REM#PY#             if self.scratch: self.scratch.reserve(job)
+REM#PY#             self.dev_active[job.device] += 1
+REM#PY#             ds = self.dev_stats[job.device]
+REM#PY#             if ds[2] is None: ds[2] = time.time()
+REM#PY#             job.lane = lane
+REM#PY#             lane.active += 1
+REM#PY#             self.running += 1
+REM#PY#             return job, self.free_slots.pop(), lane
+REM#PY#     def finish(self, job, slot, requeue=False):
+REM#PY#         with self.cond:
+REM#PY#             if self.budget and job.threads: self.budget.release(job.threads)
+REM#PY#             if self.scratch: self.scratch.release(job)
+REM#PY#             self.dev_active[job.device] -= 1
+REM#PY#             job.lane.active -= 1
+REM#PY#             self.running -= 1
+REM#PY#             # A cancelled job says nothing about the encoder either way
+REM#PY#             if not requeue and job.lane.hardware and not job.cancelled: self.hw_failures = 0
+REM#PY#             if requeue and job.lane.hardware:
+REM#PY#                 self.hw_failures += 1
+REM#PY#                 # Circuit breaker: after N hardware failures in a row the rest of the queue goes to the CPU
+REM#PY#                 if self.hw_failure_limit and self.hw_failures >= self.hw_failure_limit and any(not l.hardware for l in self.lanes):
+REM#PY#                     for l in self.lanes:
+REM#PY#                         if l.hardware and not l.disabled:
+REM#PY#                             l.disabled = True
+REM#PY#                             logging.warning(f"{self.hw_failures} hardware failures in a row, disabling lane {l.label}")
+REM#PY#             if requeue and any(l.name not in job.excluded and not l.disabled for l in self.lanes):
+REM#PY#                 self.pending.append(job) # Front of the queue, for the next free compatible lane
+REM#PY#                 job.queued_at = time.time()
+REM#PY#             else:
+REM#PY#                 if requeue: job.ok = False
+REM#PY#                 # Duplicates keep their own reuse time; only the encode itself is shared out
+REM#PY#                 members = job.members or [job]
+REM#PY#                 work = max(0.0, job.elapsed - sum(d.elapsed for j in members for d in j.duplicates))
+REM#PY#                 for j in job.files:
+REM#PY#                     if j.ok is None: j.ok = job.ok
+REM#PY#                     # A batch's wall time is shared out by cost so the makespan stays comparable
+REM#PY#                     if j is job: j.elapsed = work
+REM#PY#                     elif job.members and j in members: j.elapsed = work * (j.cost / job.cost if job.cost else 1 / len(members))
+REM#PY#                     j.info = None # Probe data is no longer needed; keeps memory flat on huge batches
+REM#PY#                 self.completed += len(job.files)
+REM#PY#                 ds = self.dev_stats[job.device]
+REM#PY#                 ds[0] += len(job.files); ds[1] += job.size; ds[3] = time.time()
+REM#PY#                 if self.keep_finished: self.finished.extend(job.files)
+REM#PY#                 requeue = False
+REM#PY#             self.free_slots.append(slot)
+REM#PY#             if self.closed and not self.pending and not self.running: self.end_t = time.time()
+REM#PY#             self.cond.notify_all()
+REM#PY#         return not requeue
+REM#PY#     def worker(self, fn):
+REM#PY#         while True:
+REM#PY#             task = self.next()
+REM#PY#             if not task: return
+REM#PY#             job, slot, lane = task
+REM#PY#             t0 = time.time(); requeue = False
+REM#PY#             try: job.ok = bool(fn(slot, job, lane))
+REM#PY#             except HardwareEncodeError:
+REM#PY#                 logging.warning(f"[Worker {slot}] {lane.label} failed for {job.path.name}, requeueing for another lane")
+REM#PY#                 job.excluded.add(lane.name); requeue = True
+REM#PY#             except Exception as e:
+REM#PY#                 logging.error(f"[Worker {slot}] Unhandled error for {job.path.name}: {e}"); job.ok = False
+REM#PY#             job.elapsed += time.time() - t0
+REM#PY#             if self.finish(job, slot, requeue) and self.on_finish:
+REM#PY#                 for j in job.files:
+REM#PY#                     try: self.on_finish(j)
+REM#PY#                     except Exception as e: logging.error(f"on_finish failed for {j.path.name}: {e}")
+REM#PY#     def borrow(self, lane, job):
+REM#PY#         # Lend an idle slot to a running job (segmented encode) when nothing is waiting for it
+REM#PY#         with self.cond:
+REM#PY#             if self.pending or not self.free_slots or lane.disabled or lane.active >= lane.capacity: return None
+REM#PY#             if self.budget and self.budget.free() <= 0: return None
+REM#PY#             if not self._device_free(job): return None
+REM#PY#             self.dev_active[job.device] += 1
+REM#PY#             lane.active += 1
+REM#PY#             self.running += 1
+REM#PY#             threads = self.budget.acquire(self.running) if self.budget else 0
+REM#PY#             slot = self.free_slots.pop()
+REM#PY#         def release():
+REM#PY#             with self.cond:
+REM#PY#                 if self.budget and threads: self.budget.release(threads)
+REM#PY#                 self.dev_active[job.device] -= 1
+REM#PY#                 lane.active -= 1
+REM#PY#                 self.running -= 1
+REM#PY#                 self.free_slots.append(slot)
+REM#PY#                 self.cond.notify_all()
+REM#PY#         return slot, threads, release
+REM#PY#     def done_count(self):
+REM#PY#         with self.cond: return self.completed
+REM#PY#     def wait(self, timeout):
+REM#PY#         # Returns True once every job has finished; wakes early on each completion
+REM#PY#         with self.cond:
+REM#PY#             if self.pending or self.running or not self.closed: self.cond.wait(timeout)
+REM#PY#             return self.closed and not self.pending and not self.running
+REM#PY#     def device_report(self):
+REM#PY#         # [(mount point, files, bytes, bytes/s over the device's busy span)]
+REM#PY#         with self.cond: stats = list(self.dev_stats.values())
+REM#PY#         return [(mount_point(p), n, b, b / (end - start) if start and end and end > start else 0.0) for n, b, start, end, p in stats if n]
+REM#PY#     def makespan(self):
+REM#PY#         # Actual wall time vs. the lower bound max(total work / slots, longest job)
+REM#PY#         actual = ((self.end_t or time.time()) - self.start_t) if self.start_t else 0.0
+REM#PY#         times = [j.elapsed for j in self.finished]
+REM#PY#         ideal = max(sum(times) / self.slots, max(times)) if times else 0.0
+REM#PY#         return actual, ideal, (ideal / actual * 100) if actual > 0 else 100.0
+REM#PY# 
+REM#PY# class Pipeline:
+REM#PY#     # scan -> bounded probe queue -> probe pool -> scheduler: encoding starts as soon as the first file is planned
+REM#PY#     def __init__(self, eng, source, probe_workers=4):
+REM#PY#         self.eng, self.source, self.sched, self.config = eng, source, eng.sched, eng.config
+REM#PY#         config = self.config
+REM#PY#         self.probe_workers = probe_workers
+REM#PY#         self.probe_q = queue.Queue(maxsize=config.get('pipeline_depth', 64))
+REM#PY#         self.counts = {'encode': 0, 'remux': 0, 'skip': 0}
+REM#PY#         self.live = probe_workers
+REM#PY#         self.small = {} # st_dev -> short clips gathering into the next batch
+REM#PY#         self.lock = threading.Lock()
+REM#PY#     def start(self):
+REM#PY#         threading.Thread(target=self._feed, name="scan", daemon=True).start()
+REM#PY#         for i in range(self.probe_workers): threading.Thread(target=self._probe, name=f"probe-{i}", daemon=True).start()
+REM#PY#         return self
+REM#PY#     def _feed(self):
+REM#PY#         try:
+REM#PY#             for item in self.source: self.probe_q.put(item) # Blocks while the probe stage is behind
+REM#PY#         except Exception as e: logging.error(f"Scan failed: {e}")
+REM#PY#         for _ in range(self.probe_workers): self.probe_q.put(None)
+REM#PY#     def _probe(self):
+REM#PY#         try:
+REM#PY#             while (item := self.probe_q.get()) is not None:
+REM#PY#                 try: self._plan(*item)
+REM#PY#                 except Exception as e: logging.error(f"Queueing failed for {item[0].name}: {e}")
+REM#PY#         finally:
+REM#PY#             # However this thread ends, the last one out must close the queue or the workers wait forever
+REM#PY#             with self.lock:
+REM#PY#                 self.live -= 1
+REM#PY#                 last = self.live == 0
+REM#PY#             if last:
+REM#PY#                 try:
+REM#PY#                     for group in self.small.values(): self.sched.add(Job.batch(group) if len(group) > 1 else group[0])
+REM#PY#                     self.eng.probes.save()
+REM#PY#                 except Exception as e: logging.error(f"Queueing failed: {e}")
+REM#PY#                 finally: self.sched.close()
+REM#PY#     def _plan(self, path, st):
+REM#PY#         try: info = self.eng.probes.probe(path, st)
+REM#PY#         except Exception as e:
+REM#PY#             logging.warning(f"Probe failed for {path.name}: {e}"); info = None
+REM#PY#         action, reason = plan_video(info, self.config, path)
+REM#PY#         with self.lock: self.counts[action] += 1
+REM#PY#         if action == 'skip': return
+REM#PY#         job = Job(path, action, info)
+REM#PY#         job.dest = output_path(path, action, self.config)
+REM#PY#         job.device = st.st_dev
+REM#PY#         if not job.size: job.size = st.st_size
+REM#PY#         self.eng.journal.record(path, 'queued', action=action)
+REM#PY#         if batchable(job, self.config):
+REM#PY#             # Short clips wait here until a full batch from the same device has gathered
+REM#PY#             with self.lock:
+REM#PY#                 group = self.small.setdefault(job.device, [])
+REM#PY#                 group.append(job)
+REM#PY#                 if len(group) >= max(1, self.config.get('batch_size', 8)): del self.small[job.device]
+REM#PY#                 else: group = None
+REM#PY#             if group: self.sched.add(Job.batch(group) if len(group) > 1 else group[0])
+REM#PY#             return
+REM#PY#         self.sched.add(job) # Blocks while the encoders are behind
+REM#PY# 
+REM#PY# VERIFY_LEVELS = ('fast', 'sampled', 'full')
+REM#PY# VERIFY_WINDOW = 1.0 # Seconds decoded per sample window
+REM#PY# 
+REM#PY# def decode_sampled(path, duration, fps, k, start=0.0):
+REM#PY#     # Decode k short windows spread over the file in one ffmpeg run and check their timestamps land where asked.
+REM#PY#     # -copyts keeps the container's start offset (about 1.4s for MPEG-TS), so it is taken off every frame time.
+REM#PY#     k = max(1, min(k, int(duration // VERIFY_WINDOW) or 1))
+REM#PY#     starts = [max(0.0, duration * (i + 0.5) / k - VERIFY_WINDOW / 2) for i in range(k)]
+REM#PY#     cmd = ["ffmpeg", "-nostdin", "-v", "error", "-xerror", "-copyts"]
+REM#PY#     for t in starts: cmd.extend(["-ss", f"{t:.3f}", "-t", f"{VERIFY_WINDOW}", "-i", str(path)])
+REM#PY#     for i in range(k): cmd.extend(["-map", f"{i}:v:0"])
+REM#PY#     cmd.extend(["-f", "framecrc", "-"])
+REM#PY#     r = subprocess.run(cmd, capture_output=True, text=True, errors='replace', timeout=60 + 10 * k)
+REM#PY#     if r.returncode != 0 or r.stderr.strip(): return False
+REM#PY#     tb, frames = {}, {}
+REM#PY#     for line in r.stdout.splitlines():
+REM#PY#         if line.startswith('#tb '):
+REM#PY#             idx, _, rate = line[4:].partition(':')
+REM#PY#             tb[int(idx)] = parse_rate(rate.strip())
+REM#PY#         elif line and not line.startswith('#'):
+REM#PY#             parts = [x.strip() for x in line.split(',')]
+REM#PY#             frames.setdefault(int(parts[0]), []).append(int(parts[2]) * tb.get(int(parts[0]), 0) - start)
+REM#PY#     slack = 3.0 / (fps or 30.0)
+REM#PY#     for i, t in enumerate(starts):
+REM#PY#         ts = frames.get(i)
+REM#PY#         if not ts: return False
+REM#PY#         end = min(t + VERIFY_WINDOW, duration)
+REM#PY#         if ts[0] > t + slack or ts[-1] < end - VERIFY_WINDOW / 2 or ts[0] < t - slack: return False
+REM#PY#         if any(b <= a or b - a > slack for a, b in zip(ts, ts[1:])): return False
+REM#PY#     return True
+REM#PY# 
+REM#PY# def decode_full(path):
+REM#PY#     # Decode every frame with error detection; returns the decoded video frame count or -1 on error
+REM#PY#     cmd = ["ffmpeg", "-nostdin", "-v", "error", "-xerror", "-i", str(path), "-map", "0:v:0", "-map", "0:a?", "-f", "null", "-", "-progress", "pipe:1"]
+REM#PY#     r = subprocess.run(cmd, capture_output=True, text=True, errors='replace')
+REM#PY#     if r.returncode != 0 or r.stderr.strip(): return -1
+REM#PY#     frames = [l for l in r.stdout.splitlines() if l.startswith('frame=')]
+REM#PY#     try: return int(frames[-1].split('=')[1])
+REM#PY#     except: return -1
+REM#PY# 
+REM#PY# def verify_output(eng, inp, outp, in_info=None, level='fast', samples=5):
+REM#PY#     # fast: headers and duration | sampled: + decode K windows | full: + decode everything
+REM#PY#     if not outp.exists() or outp.stat().st_size < 10240: return None
+REM#PY#     t0 = time.time()
+REM#PY#     try:
+REM#PY#         in_info = in_info or eng.probes.probe(inp)
+REM#PY#         out_info = eng.ffprobe(outp, timeout=15)
+REM#PY#         if not out_info.get('vcodec') or not out_info.get('height'): return None
+REM#PY#         in_d, out_d = in_info['duration'], out_info['duration']
+REM#PY#         if abs(in_d - out_d) >= 2.0: return None
+REM#PY#         out_fps = out_info.get('fps') or in_info.get('fps') or 30.0
+REM#PY#         out_f = out_info['nb_frames']
+REM#PY#         # Short files: one full decode is cheaper than seeking into k windows
+REM#PY#         if level == 'sampled' and out_d < 4 * samples * VERIFY_WINDOW: level = 'full'
+REM#PY#         if level == 'sampled' and not decode_sampled(outp, out_d, out_fps, samples, out_info.get('start', 0.0)): return None
+REM#PY#         if level == 'full':
+REM#PY#             out_f = decode_full(outp)
+REM#PY#             if out_f < 0: return None
+REM#PY#         # Compare against the frames the input duration implies at the output rate (nb_frames is often absent)
+REM#PY#         if out_f > 0 and in_d > 0 and abs(in_d * out_fps - out_f) > max(2.0 * out_fps, in_d * out_fps * 0.01): return None
+REM#PY#         return out_info
+REM#PY#     except: return None
+REM#PY#     finally:
+REM#PY#         secs = time.time() - t0
+REM#PY#         with eng.lock:
+REM#PY#             tot = eng.verify_totals.setdefault(level, [0, 0.0])
+REM#PY#             tot[0] += 1; tot[1] += secs
+REM#PY#         eng.metrics.add('verify_s', secs)
+REM#PY#         logging.debug(f"Verify ({level}) {outp.name}: {secs:.2f}s")
+REM#PY# 
+REM#PY# def video_encode_args(codec, config, scale=True):
+REM#PY#     args = ["-c:v", codec]
+REM#PY#     # 1. NVENC (NVIDIA): Use Constant Quality (CQ) mode
+REM#PY#     if "nvenc" in codec:
+REM#PY#         args.extend(["-rc", "vbr", "-cq", "24", "-preset", "p4"])
+REM#PY#     # 2. CPU (libx264): Use Target Bitrate + Medium Preset
+REM#PY#     elif "libx264" in codec:
+REM#PY#         args.extend(["-b:v", config['video_bitrate'], "-preset", config.get('x264_preset', "medium")])
+REM#PY#     # 3. Universal Safety Mode (Intel QSV, AMD, Apple, etc.): Use Bitrate Only
+REM#PY#     # avoid specific presets that might crash other hardware encoders
+REM#PY#     else:
+REM#PY#         args.extend(["-b:v", config['video_bitrate']])
+REM#PY#     # Common parameters (FPS, Resize); a ladder does its scaling in the shared filter graph instead
+REM#PY#     args.extend(["-r", str(config['target_fps'])])
+REM#PY#     if scale: args.extend(["-vf", f"scale=-2:{config['target_height']}"])
+REM#PY#     return args
+REM#PY# 
+REM#PY# def rendition_targets(vpath, config, wid):
+REM#PY#     # Extra outputs from config 'renditions': [(spec, tmp, final)], written beside the source or in spec['dir'].
+REM#PY#     # A target that already exists is left alone: it may be a user's file that happens to share the name.
+REM#PY#     out = []
+REM#PY#     for i, r in enumerate(config.get('renditions') or []):
+REM#PY#         name = r.get('name') or f"r{i}"
+REM#PY#         thumb = r.get('type') == 'thumbnail'
+REM#PY#         folder = vpath.parent / r.get('dir', '')
+REM#PY#         final = folder / f"{vpath.stem}{r.get('suffix', '_' + name)}{r.get('ext', '.jpg' if thumb else '.mp4')}"
+REM#PY#         if final.exists():
+REM#PY#             logging.warning(f"Rendition '{name}' skipped for {vpath.name}: {final.name} already exists")
+REM#PY#             continue
+REM#PY#         out.append((r, folder / f"mnemosyne_tmp_{wid}_{final.name}", final))
+REM#PY#     return out
+REM#PY# 
+REM#PY# def place_renditions(renditions):
+REM#PY#     # Move verified rendition temps to their final names; returns the paths placed
+REM#PY#     placed = []
+REM#PY#     for r, r_tmp, final in renditions:
+REM#PY#         if final.exists():
+REM#PY#             # Appeared while encoding: never overwrite it
+REM#PY#             logging.warning(f"Rendition '{r.get('name', final.name)}' not placed: {final} already exists")
+REM#PY#             r_tmp.unlink(); continue
+REM#PY#         os.replace(r_tmp, final); placed.append(str(final))
+REM#PY#     return placed
+REM#PY# 
+REM#PY# def ladder_args(renditions, config, action, dur, comment=ENCODER_TAG):
+REM#PY#     # One decode feeds every output: split the video once, scale each branch, map each to its own output.
+REM#PY#     # Renditions encode on the CPU unless they name a codec, so a hardware lane's session limit still holds.
+REM#PY#     branches = [] if action == 'remux' else [("main", f"scale=-2:{config['target_height']}")]
+REM#PY#     for i, (r, _, _) in enumerate(renditions):
+REM#PY#         flt = f"scale=-2:{r.get('height', config['target_height'])}"
+REM#PY#         if r.get('type') == 'thumbnail':
+REM#PY#             at = float(r.get('at', 0.1))
+REM#PY#             at = at * dur if at < 1 else min(at, max(0.0, dur - 1.0))
+REM#PY#             flt = f"select='gte(t,{at:.3f})',{flt}"
+REM#PY#         branches.append((f"r{i}", flt))
+REM#PY#     graph = f"[0:v:0]split={len(branches)}" + "".join(f"[s{j}]" for j in range(len(branches)))
+REM#PY#     graph += "".join(f";[s{j}]{flt}[{label}]" for j, (label, flt) in enumerate(branches))
+REM#PY#     outputs = []
+REM#PY#     for i, (r, tmp, _) in enumerate(renditions):
+REM#PY#         outputs.extend(["-map", f"[r{i}]"])
+REM#PY#         if r.get('type') == 'thumbnail':
+REM#PY#             outputs.extend(["-frames:v", "1", "-update", "1"])
+REM#PY#         else:
+REM#PY#             rc = {**config, 'video_bitrate': r.get('video_bitrate', config['video_bitrate']), 'target_fps': r.get('fps', config['target_fps'])}
+REM#PY#             outputs.extend(video_encode_args(r.get('codec', "libx264"), rc, scale=False))
+REM#PY#             outputs.extend(["-map", "0:a:0?", "-c:a", "aac", "-b:a", r.get('audio_bitrate', config['audio_bitrate'])])
+REM#PY#             outputs.extend(["-metadata", f"comment={comment}"])
+REM#PY#         outputs.append(str(tmp))
+REM#PY#     main_map = ["-filter_complex", graph, "-map", "0:v:0" if action == 'remux' else "[main]", "-map", "0:a:0?"]
+REM#PY#     return main_map, outputs
+REM#PY# 
+REM#PY# def keyframe_cuts(path, duration, seg_len):
+REM#PY#     # Segment start offsets (seconds from file start) snapped to the keyframe at or before each target time
+REM#PY#     targets = [seg_len * i for i in range(1, int(duration // seg_len) + 1) if seg_len * i < duration - seg_len / 4]
+REM#PY#     if not targets: return [0.0]
+REM#PY#     cmd = ["ffprobe", "-v", "error", "-select_streams", "v:0", "-read_intervals", ",".join(f"{t:.3f}%+#1" for t in targets),
+REM#PY#            "-show_entries", "packet=pts_time,flags:format=start_time", "-of", "json", str(path)]
+REM#PY#     try: data = json.loads(subprocess.run(cmd, capture_output=True, text=True, errors='replace', timeout=60).stdout or '{}')
+REM#PY#     except (subprocess.SubprocessError, ValueError): return [0.0] # Unseekable source: one part, same as a plain encode
+REM#PY#     start = float(data.get('format', {}).get('start_time') or 0.0)
+REM#PY#     cuts = {0.0}
+REM#PY#     for pkt in data.get('packets', []):
+REM#PY#         if 'K' in pkt.get('flags', '') and pkt.get('pts_time') not in (None, 'N/A'):
+REM#PY#             t = float(pkt['pts_time']) - start
+REM#PY#             if 1.0 < t < duration - 1.0: cuts.add(round(t, 6))
+REM#PY#     return sorted(cuts)
+REM#PY# 
+REM#PY# def encode_segmented(eng, wid, vpath, tmp, codec, info, threads, ffmpeg, borrow, audio_args, on_progress):
+REM#PY#     # Video is encoded in keyframe-aligned pieces (each decode starts on a keyframe, nothing is wasted),
+REM#PY#     # joined with the concat demuxer and muxed once with the untouched source audio, so A/V sync is kept.
+REM#PY#     # The concat list pins each piece to its exact source length so rounding can't accumulate.
+REM#PY#     config = eng.config
+REM#PY#     fn, dur = vpath.name, info['duration']
+REM#PY#     cuts = keyframe_cuts(vpath, dur, max(10, config.get('segment_seconds', 300)))
+REM#PY#     bounds = list(zip(cuts, cuts[1:] + [None]))
+REM#PY#     parts = [tmp.parent / f"mnemosyne_tmp_{wid}_seg{k:04d}_{vpath.stem}.mkv" for k in range(len(bounds))]
+REM#PY#     listing = tmp.parent / f"mnemosyne_tmp_{wid}_{vpath.stem}.concat.txt"
+REM#PY#     queue, running, done_secs, live = list(range(len(bounds))), {}, 0.0, {}
+REM#PY#     failed = None
+REM#PY#     logging.info(f"[Worker {wid}] Segmented encode: {fn} in {len(bounds)} parts")
+REM#PY#     def report():
+REM#PY#         on_progress({'out_time_us': str(int((done_secs + sum(live.values())) * 0.95e6)), 'fps': '-', 'speed': f"{len(running)} seg"})
+REM#PY#     def spawn(k, slot, n):
+REM#PY#         a, b = bounds[k]
+REM#PY#         cmd = [ffmpeg, "-nostdin", "-y", "-loglevel", "error"]
+REM#PY#         if n: cmd.extend(["-filter_threads", str(n), "-threads", str(n)])
+REM#PY#         if a: cmd.extend(["-ss", f"{a:.6f}"])
+REM#PY#         if b is not None: cmd.extend(["-t", f"{b - a:.6f}"])
+REM#PY#         cmd.extend(["-i", str(vpath), "-map", "0:v:0", "-an", "-sn", "-dn"])
+REM#PY#         if n: cmd.extend(["-threads", str(n)])
+REM#PY#         cmd.extend(video_encode_args(codec, config))
+REM#PY#         cmd.extend(["-progress", "pipe:1", "-nostats", str(parts[k])])
+REM#PY#         def seg_progress(p):
+REM#PY#             try: live[k] = max(0.0, min((b or dur) - a, int(p.get('out_time_us', '')) / 1e6))
+REM#PY#             except ValueError: pass
+REM#PY#             if slot != wid: eng.stats.update(slot, f"{fn} [{k + 1}/{len(bounds)}]", live.get(k, 0) / max(0.001, (b or dur) - a) * 100, p.get('fps', '-'), p.get('speed', '-').strip())
+REM#PY#             report()
+REM#PY#         return eng.procs.spawn(cmd, seg_progress, config.get('stall_timeout'))
+REM#PY#     try:
+REM#PY#         while (queue and not failed) or running:
+REM#PY#             # The job's own slot runs one part; idle slots are borrowed for the rest while the queue is empty
+REM#PY#             while queue and not failed:
+REM#PY#                 if not any(slot == wid for slot, _, _ in running.values()): lease = (wid, threads, None)
+REM#PY#                 else: lease = borrow()
+REM#PY#                 if not lease: break
+REM#PY#                 k = queue.pop(0)
+REM#PY#                 running[spawn(k, lease[0], lease[1])] = (lease[0], lease[2], k)
+REM#PY#             h = next((h for h in running if h.done.is_set()), None)
+REM#PY#             if h is None:
+REM#PY#                 next(iter(running)).wait(0.5); continue
+REM#PY#             slot, release, k = running.pop(h)
+REM#PY#             if release:
+REM#PY#                 eng.stats.update(slot, f"{fn} [{k + 1}/{len(bounds)}]", 100.0, "0", "0", "segment done")
+REM#PY#                 release()
+REM#PY#             live.pop(k, None)
+REM#PY#             if h.returncode != 0: failed = (h.returncode, h.error_text()); continue
+REM#PY#             a, b = bounds[k]
+REM#PY#             done_secs += (b or dur) - a
+REM#PY#             report()
+REM#PY#         if failed: return failed
+REM#PY#         with open(listing, 'w', encoding='utf-8') as f:
+REM#PY#             f.write("ffconcat version 1.0\n")
+REM#PY#             for part, (a, b) in zip(parts, bounds):
+REM#PY#                 f.write("file '" + part.name.replace("'", "'\\''") + "'\n")
+REM#PY#                 if b is not None: f.write(f"duration {b - a:.6f}\n")
+REM#PY#         cmd = [ffmpeg, "-nostdin", "-y", "-loglevel", "error", "-f", "concat", "-safe", "0", "-i", str(listing), "-i", str(vpath),
+REM#PY#                "-map", "0:v:0", "-map", "1:a?", "-map_metadata", "1", "-c:v", "copy"] + audio_args
+REM#PY#         def join_progress(p):
+REM#PY#             try: on_progress({'out_time_us': str(int(dur * 0.95e6 + max(0, int(p.get('out_time_us', ''))) * 0.05)), 'fps': '-', 'speed': 'join'})
+REM#PY#             except ValueError: pass
+REM#PY#         proc = eng.procs.spawn(cmd, join_progress, config.get('stall_timeout'))
+REM#PY#         return proc.wait(), proc.error_text()
+REM#PY#     finally:
+REM#PY#         for h, (slot, release, k) in running.items():
+REM#PY#             eng.procs.cancel(h); h.wait()
+REM#PY#             if release: release()
+REM#PY#         for f in parts + [listing]:
+REM#PY#             try: f.unlink()
+REM#PY#             except OSError: pass
+REM#PY# 
+REM#PY# def finalize_output(eng, wid, vpath, tmp, dest, meta, start_size, info, renditions=(), check_gain=False):
+REM#PY#     # Verify a finished temp output, then swap it into place; raises if verification fails
+REM#PY#     config = eng.config
+REM#PY#     saved_pct = None
+REM#PY#     if check_gain and config.get('min_savings', 0) and start_size:
+REM#PY#         saved_pct = (1 - tmp.stat().st_size / start_size) * 100
+REM#PY#         if saved_pct >= config['min_savings']: saved_pct = None
+REM#PY#         elif not renditions: return keep_original(eng, wid, vpath, tmp, saved_pct, 'final')
+REM#PY#     out_info = None
+REM#PY#     if config['verify_frames']:
+REM#PY#         if saved_pct is None:
+REM#PY#             level = config.get('verify_level', 'sampled')
+REM#PY#             out_info = verify_output(eng, vpath, tmp, info, level if level in VERIFY_LEVELS else 'fast', config.get('verify_samples', 5))
+REM#PY#             if not out_info: raise Exception("Output verification failed")
+REM#PY#         for r, r_tmp, _ in renditions:
+REM#PY#             ok = r_tmp.exists() and r_tmp.stat().st_size > 0 if r.get('type') == 'thumbnail' else verify_output(eng, vpath, r_tmp, info, 'fast')
+REM#PY#             if not ok: raise Exception(f"Rendition '{r.get('name', r_tmp.name)}' failed verification")
+REM#PY#     if saved_pct is not None: return keep_original(eng, wid, vpath, tmp, saved_pct, 'final', renditions)
+REM#PY#     job = getattr(eng.local, 'job', None)
+REM#PY#     if job is not None and job.cancelled:
+REM#PY#         # Cancelled after ffmpeg finished: the source is still untouched, so the cancel can still be honoured
+REM#PY#         for p in [tmp] + [r_tmp for _, r_tmp, _ in renditions]:
+REM#PY#             if p.exists(): p.unlink()
+REM#PY#         eng.journal.record(vpath, 'failed', error="cancelled")
+REM#PY#         return False
+REM#PY#     t0 = time.time()
+REM#PY#     if tmp.parent != vpath.parent:
+REM#PY#         eng.stats.update(wid, vpath.name, 99.9, "-", "-", "Copying back from scratch...")
+REM#PY#         tmp = copy_back(tmp, vpath.parent / tmp.name)
+REM#PY#     eng.journal.record(vpath, 'verified', tmp=str(tmp))
 REM#PY# 
-REM#PY# worker_stats = WorkerStats()
+REM#PY#     end_size = tmp.stat().st_size
+REM#PY#     size_diff = (1 - (end_size / start_size)) * 100
+REM#PY#     size_stats = f"{start_size/1024/1024:.1f}MB -> {end_size/1024/1024:.1f}MB ({size_diff:.0f}% saved)"
 REM#PY# 
-REM#PY# def verify_output(inp, outp):
-REM#PY#     if not outp.exists() or outp.stat().st_size < 10240: return False
+REM#PY#     bak = vpath.with_suffix(vpath.suffix + '.bak')
 REM#PY#     try:
-REM#PY#         def get_meta(p):
-REM#PY#             cmd = ["ffprobe", "-v", "error", "-show_entries", "format=duration:stream=nb_frames,width,height", "-of", "csv=p=0", str(p)]
-REM#PY#             r = subprocess.run(cmd, capture_output=True, text=True, timeout=15)
-REM#PY#             parts = r.stdout.strip().split(',')
-REM#PY#             return float(parts[0] if parts[0] else 0), int(parts[1] if len(parts) > 1 and parts[1] else -1)
-REM#PY#         in_d, in_f = get_meta(inp)
-REM#PY#         out_d, out_f = get_meta(outp)
-REM#PY#         dur_ok = abs(in_d - out_d) < 2.0
-REM#PY#         frm_ok = (in_f == -1 or out_f == -1 or abs(in_f - out_f) < 150)
-REM#PY#         return dur_ok and frm_ok
-REM#PY#     except: return False
+REM#PY#         swap_into_place(eng, vpath, tmp, meta, dest)
+REM#PY#         eng.metrics.add('swap_s', time.time() - t0); eng.metrics.add('bytes_out', end_size)
+REM#PY#         # Cache the output's probe so the next run doesn't spawn ffprobe for it
+REM#PY#         if dest != vpath: eng.probes.forget(vpath)
+REM#PY#         if out_info: eng.probes.store(dest, out_info)
+REM#PY#         else: eng.probes.forget(dest)
+REM#PY#     except Exception as e:
+REM#PY#         logging.error(f"File swap error: {e}")
+REM#PY#         if bak.exists() and not vpath.exists(): bak.rename(vpath)
+REM#PY#         for _, r_tmp, _ in renditions:
+REM#PY#             if r_tmp.exists(): r_tmp.unlink()
+REM#PY#         eng.journal.record(vpath, 'failed', error=f"swap: {e}")
+REM#PY#         return False
 REM#PY# 
-REM#PY# def process_video(wid, vpath, codec, config):
+REM#PY#     placed = place_renditions(renditions)
+REM#PY#     eng.journal.record(vpath, 'done', size=end_size, renditions=placed)
+REM#PY#     eng.stats.update(wid, vpath.name, 100.0, "0", "0", size_stats)
+REM#PY#     return True
+REM#PY# 
+REM#PY# def process_batch(eng, wid, jobs, codec, threads=0, ffmpeg="ffmpeg", scratch=None):
+REM#PY#     # Short clips share one ffmpeg: N inputs mapped to N outputs, so process start and encoder init
+REM#PY#     # are paid once. Each output is still verified and swapped on its own; returns the number that succeeded.
+REM#PY#     config = eng.config
+REM#PY#     label = f"{len(jobs)} clips ({jobs[0].path.name}...)"
+REM#PY#     eng.stats.update(wid, label, 0.0, "-", "0X", "")
+REM#PY#     logging.info(f"[Worker {wid}] Started batch of {len(jobs)}: {', '.join(j.path.name for j in jobs)}")
+REM#PY#     cmd = [ffmpeg, "-nostdin", "-y", "-loglevel", "error"]
+REM#PY#     if threads: cmd.extend(["-filter_threads", str(threads), "-threads", str(threads)])
+REM#PY#     items = []
+REM#PY#     for j in jobs:
+REM#PY#         try:
+REM#PY#             st = j.path.stat()
+REM#PY#             info = eng.probes.probe(j.path, st)
+REM#PY#         except Exception as e:
+REM#PY#             logging.error(f"Process error for {j.path.name}: {e}"); j.ok = False
+REM#PY#             continue
+REM#PY#         tmp = (scratch or j.path.parent) / f"mnemosyne_tmp_{wid}_{j.dest.name}"
+REM#PY#         items.append((j, tmp, get_file_metadata(j.path, st), st.st_size, info))
+REM#PY#         cmd.extend(["-i", str(j.path)])
+REM#PY#     if not items: return 0
+REM#PY#     for i, (j, tmp, meta, _, info) in enumerate(items):
+REM#PY#         cmd.extend(["-map", f"{i}:v:0", "-map", f"{i}:a:0?"])
+REM#PY#         if threads: cmd.extend(["-threads", str(threads)])
+REM#PY#         cmd.extend(video_encode_args(codec, config))
+REM#PY#         if info.get('acodec') and audio_compatible(info, config): cmd.extend(["-c:a", "copy"])
+REM#PY#         else: cmd.extend(["-c:a", "aac", "-b:a", config['audio_bitrate']])
+REM#PY#         cmd.extend(["-metadata", f"encoder={ENCODER_TAG}", "-metadata", f"comment={marker_comment(info)}", str(tmp)])
+REM#PY#         eng.journal.record(j.path, 'encoding', tmp=str(tmp), dest=str(j.dest), codec=codec, action=j.action, meta=list(meta))
+REM#PY#     cmd[-1:-1] = ["-progress", "pipe:1", "-nostats"]
+REM#PY#     longest = max(info['duration'] for *_, info in items) or 1.0
+REM#PY#     def on_progress(p):
+REM#PY#         try: pct = max(0.0, min(99.9, int(p.get('out_time_us', '')) / 1e6 / longest * 100))
+REM#PY#         except ValueError: return
+REM#PY#         eng.stats.update(wid, label, pct, p.get('fps', '-'), p.get('speed', '-').strip())
+REM#PY#     proc = eng.procs.spawn(cmd, on_progress, config.get('stall_timeout'))
+REM#PY#     if proc.wait() != 0:
+REM#PY#         for _, tmp, *_ in items:
+REM#PY#             if tmp.exists(): tmp.unlink()
+REM#PY#         if codec != "libx264":
+REM#PY#             for j, *_ in items: eng.journal.record(j.path, 'queued', retry=codec)
+REM#PY#             raise HardwareEncodeError(f"{codec} exited with code {proc.returncode}")
+REM#PY#         # One bad input fails the shared process: fall back to one ffmpeg per clip to keep per-file results
+REM#PY#         logging.warning(f"[Worker {wid}] Batch failed ({proc.error_text()}), processing clips one by one")
+REM#PY#         for j, *_ in items: j.ok = process_video(eng, wid, j.path, codec, j.action, threads, ffmpeg, fallback=False, dest=j.dest, scratch=scratch)
+REM#PY#         return sum(1 for j in jobs if j.ok)
+REM#PY#     for j, tmp, meta, start_size, info in items:
+REM#PY#         try: j.ok = finalize_output(eng, wid, j.path, tmp, j.dest, meta, start_size, info, check_gain=True)
+REM#PY#         except Exception as e:
+REM#PY#             logging.error(f"Process error for {j.path.name}: {e}")
+REM#PY#             if tmp.exists(): tmp.unlink()
+REM#PY#             eng.journal.record(j.path, 'failed', error=str(e)); j.ok = False
+REM#PY#     done = sum(1 for j in jobs if j.ok)
+REM#PY#     eng.stats.update(wid, label, 100.0, "0", "0", f"{done}/{len(jobs)} clips done")
+REM#PY#     return done
+REM#PY# 
+REM#PY# def process_video(eng, wid, vpath, codec, action='encode', threads=0, ffmpeg="ffmpeg", fallback=True, dest=None, borrow=None, scratch=None):
+REM#PY#     config = eng.config
 REM#PY#     fn = vpath.name
 REM#PY#     s_fps, s_speed, pct = "-", "0X", 0.0
-REM#PY#     worker_stats.update(wid, fn, 0.0, s_fps, s_speed, "")
+REM#PY#     eng.stats.update(wid, fn, 0.0, s_fps, s_speed, "")
 REM#PY#     logging.info(f"[Worker {wid}] Started processing: {fn}")
 REM#PY#     try:
-REM#PY#         meta = get_file_metadata(vpath)
-REM#PY#         start_size = vpath.stat().st_size
-REM#PY#         tmp = vpath.parent / f"mnemosyne_tmp_{wid}_{fn}"
-REM#PY#         try:
-REM#PY#             dur = float(subprocess.run(["ffprobe", "-v", "error", "-show_entries", "format=duration", "-of", "csv=p=0", str(vpath)], capture_output=True, text=True).stdout.strip() or 1.0)
-REM#PY#         except: dur = 1.0
+REM#PY#         st = vpath.stat()
+REM#PY#         meta = get_file_metadata(vpath, st)
+REM#PY#         start_size = st.st_size
+REM#PY#         dest = dest or output_path(vpath, action, config)
+REM#PY#         # Encode and verify on the scratch drive when staging; finalize_output copies the result back
+REM#PY#         tmp = (scratch or vpath.parent) / f"mnemosyne_tmp_{wid}_{dest.name}"
+REM#PY#         try: info = eng.probes.probe(vpath, st)
+REM#PY#         except: info = {'duration': 0.0, 'nb_frames': -1}
+REM#PY#         dur = info['duration'] or 1.0
+REM#PY#         # Per-stream decisions: compatible streams are copied instead of re-encoded
+REM#PY#         copy_audio = bool(info.get('acodec')) and audio_compatible(info, config)
+REM#PY#         eng.journal.record(vpath, 'encoding', tmp=str(tmp), dest=str(dest), codec=codec, action=action, meta=list(meta))
 REM#PY#         # Build command with Conditional Logic for Hardware vs Software Encoders
-REM#PY#         cmd = ["ffmpeg", "-nostdin", "-y", "-i", str(vpath), "-c:v", codec]
+REM#PY#         cmd = [ffmpeg, "-nostdin", "-y", "-loglevel", "error"]
+REM#PY#         # Thread budget: cap decoder, filter graph and encoder threads to this job's share of the CPU
+REM#PY#         if threads: cmd.extend(["-filter_threads", str(threads), "-threads", str(threads)])
+REM#PY#         cmd.extend(["-i", str(vpath)])
+REM#PY#         if threads: cmd.extend(["-threads", str(threads)])
+REM#PY#         
+REM#PY#         # Ladder: extra renditions are cut from the same decode via a split filter graph
+REM#PY#         renditions = rendition_targets(vpath, config, wid)
+REM#PY#         extra_outputs = []
+REM#PY#         if renditions:
+REM#PY#             main_map, extra_outputs = ladder_args(renditions, config, action, info['duration'], marker_comment(info))
+REM#PY#             cmd.extend(main_map)
+REM#PY#             for _, r_tmp, _ in renditions: r_tmp.parent.mkdir(parents=True, exist_ok=True)
 REM#PY#         
-REM#PY#         # 1. NVENC (NVIDIA): Use Constant Quality (CQ) mode
-REM#PY#         if "nvenc" in codec:
-REM#PY#             cmd.extend(["-rc", "vbr", "-cq", "24", "-preset", "p4"])
-REM#PY#         # 2. CPU (libx264): Use Target Bitrate + Medium Preset
-REM#PY#         elif "libx264" in codec:
-REM#PY#             cmd.extend(["-b:v", config['video_bitrate'], "-preset", "medium"])
-REM#PY#         # 3. Universal Safety Mode (Intel QSV, AMD, Apple, etc.): Use Bitrate Only
-REM#PY#         # avoid specific presets that might crash other hardware encoders
+REM#PY#         # 0. Remux: video already within targets, stream-copied into the (new) container
+REM#PY#         if action == 'remux':
+REM#PY#             cmd.extend(["-c:v", "copy"])
 REM#PY#         else:
-REM#PY#             cmd.extend(["-b:v", config['video_bitrate']])
+REM#PY#             cmd.extend(video_encode_args(codec, config, scale=not renditions))
 REM#PY# 
-REM#PY#         # Common parameters (FPS, Audio, Resize, Metadata)
+REM#PY#         # Common parameters (Audio, Metadata)
+REM#PY#         if copy_audio: cmd.extend(["-c:a", "copy"])
+REM#PY#         else: cmd.extend(["-c:a", "aac", "-b:a", config['audio_bitrate']])
 REM#PY#         cmd.extend([
-REM#PY#             "-r", str(config['target_fps']),
-REM#PY#             "-vf", f"scale=-2:{config['target_height']}",
-REM#PY#             "-c:a", "aac", "-b:a", config['audio_bitrate'],
-REM#PY#             "-metadata", f"encoder={APP_NAME} v{VERSION}",
-REM#PY#             "-progress", "-", "-nostats", str(tmp)
-REM#PY#         ])
+REM#PY#             "-metadata", f"encoder={ENCODER_TAG}", "-metadata", f"comment={marker_comment(info)}",
+REM#PY#             "-progress", "pipe:1", "-nostats", str(tmp)
+REM#PY#         ] + extra_outputs)
 REM#PY#         
-REM#PY#         if IS_WINDOWS:
-REM#PY#             # CREATE_NEW_PROCESS_GROUP = 0x00000200
-REM#PY#             proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True, encoding='utf-8', errors='replace', creationflags=0x00000200)
+REM#PY#         # Savings gate: project the final size from total_size / share encoded and stop early if it's not worth it.
+REM#PY#         # A ladder can't stop early (its renditions are wanted regardless); its main output is still gated at the end.
+REM#PY#         check_gain = action == 'encode' and bool(config.get('min_savings', 0))
+REM#PY#         proc, projected = None, None
+REM#PY#         def on_progress(p):
+REM#PY#             nonlocal pct, s_fps, s_speed, projected
+REM#PY#             try: pct = max(0.0, min(99.9, int(p.get('out_time_us', '')) / 1e6 / dur * 100))
+REM#PY#             except ValueError: pass
+REM#PY#             s_fps, s_speed = p.get('fps', s_fps), p.get('speed', s_speed).strip()
+REM#PY#             eng.stats.update(wid, fn, pct, s_fps, s_speed)
+REM#PY#             if check_gain and not renditions and proc and projected is None and pct >= GAIN_CHECK_FRACTION * 100 and pct * dur / 100 >= GAIN_CHECK_SECS:
+REM#PY#                 try: size = int(p.get('total_size', ''))
+REM#PY#                 except ValueError: return
+REM#PY#                 est = size / (pct / 100)
+REM#PY#                 if (1 - est / start_size) * 100 < config['min_savings']:
+REM#PY#                     projected = est
+REM#PY#                     eng.procs.cancel(proc)
+REM#PY#         seg_min = config.get('segment_min_duration', 0)
+REM#PY#         if action == 'encode' and borrow and seg_min and info['duration'] >= seg_min and not renditions:
+REM#PY#             # Long file: encode keyframe-aligned segments on this slot plus any idle ones, then join
+REM#PY#             rc, err = encode_segmented(eng, wid, vpath, tmp, codec, info, threads, ffmpeg, borrow, cmd[cmd.index("-c:a"):], on_progress)
 REM#PY#         else:
-REM#PY#             proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True, encoding='utf-8', errors='replace')
-REM#PY#         PROCESS_MGR.register(proc)
-REM#PY#         while True:
-REM#PY#             line = proc.stdout.readline()
-REM#PY#             if not line and proc.poll() is not None: break
-REM#PY#             if "out_time=" in line:
-REM#PY#                 try:
-REM#PY#                     ts = line.split("out_time=")[1].split()[0]
-REM#PY#                     h, m, s = map(float, ts.split(':'))
-REM#PY#                     new_pct = min(99.9, ((h*3600 + m*60 + s) / dur) * 100); pct = new_pct
-REM#PY#                     worker_stats.update(wid, fn, pct, s_fps, s_speed)
-REM#PY#                 except: pass
-REM#PY#             elif "fps=" in line:
-REM#PY#                 try:
-REM#PY#                     s_fps = line.split("fps=")[1].split()[0]
-REM#PY#                     s_speed = line.split("speed=")[1].split()[0]
-REM#PY#                     worker_stats.update(wid, fn, pct, s_fps, s_speed)
-REM#PY#                 except: pass
-REM#PY#         PROCESS_MGR.unregister(proc)
-REM#PY#         if proc.returncode != 0:
+REM#PY#             proc = eng.procs.spawn(cmd, on_progress, config.get('stall_timeout'))
+REM#PY#             rc = proc.wait()
+REM#PY#             err = proc.error_text()
+REM#PY#             if projected is not None:
+REM#PY#                 return keep_original(eng, wid, vpath, tmp, (1 - projected / start_size) * 100, 'early')
+REM#PY#         if rc != 0:
 REM#PY#             if codec != "libx264":
+REM#PY#                 if tmp.exists(): tmp.unlink()
+REM#PY#                 for _, r_tmp, _ in renditions:
+REM#PY#                     if r_tmp.exists(): r_tmp.unlink()
+REM#PY#                 # Under the scheduler the job moves to a CPU lane instead of re-encoding on this worker
+REM#PY#                 if not fallback: raise HardwareEncodeError(f"{codec} exited with code {rc}")
 REM#PY#                 logging.warning(f"Hardware encoding failed for {fn}, falling back to CPU")
-REM#PY#                 worker_stats.update(wid, fn, 0.0, "-", "0X", "Retrying with CPU...")
-REM#PY#                 return process_video(wid, vpath, "libx264", config)
-REM#PY#             return False
-REM#PY# 
-REM#PY#         if config['verify_frames'] and not verify_output(vpath, tmp): return False
-REM#PY#         
-REM#PY#         end_size = tmp.stat().st_size
-REM#PY#         size_diff = (1 - (end_size / start_size)) * 100
-REM#PY#         size_stats = f"{start_size/1024/1024:.1f}MB -> {end_size/1024/1024:.1f}MB ({size_diff:.0f}% saved)"
-REM#PY#         
-REM#PY#         bak = vpath.with_suffix(vpath.suffix + '.bak')
-REM#PY#         if bak.exists(): bak.unlink()
-REM#PY#         try:
-REM#PY#             vpath.rename(bak)
-REM#PY#             tmp.rename(vpath)
-REM#PY#             restore_file_metadata(vpath, meta)
-REM#PY#             if vpath.exists() and vpath.stat().st_size > 10240: bak.unlink()
-REM#PY#             else: raise Exception("Output verification fail after swap")
-REM#PY#         except Exception as e:
-REM#PY#             logging.error(f"File swap error: {e}")
-REM#PY#             if bak.exists() and not vpath.exists(): bak.rename(vpath)
-REM#PY#             return False
-REM#PY#             
-REM#PY#         worker_stats.update(wid, fn, 100.0, "0", "0", size_stats)
-REM#PY#         return True
+REM#PY#                 eng.stats.update(wid, fn, 0.0, "-", "0X", "Retrying with CPU...")
+REM#PY#                 return process_video(eng, wid, vpath, "libx264", action, threads, dest=dest, borrow=borrow, scratch=scratch)
+REM#PY#             raise Exception(f"ffmpeg exited with code {rc}: {err}")
+REM#PY# 
+REM#PY#         return finalize_output(eng, wid, vpath, tmp, dest, meta, start_size, info, renditions, check_gain)
+REM#PY#     except HardwareEncodeError:
+REM#PY#         eng.journal.record(vpath, 'queued', retry=codec)
+REM#PY#         raise
 REM#PY#     except Exception as e:
 REM#PY#         logging.error(f"Process error for {fn}: {e}")
 REM#PY#         if 'tmp' in locals() and tmp.exists(): tmp.unlink()
+REM#PY#         for _, r_tmp, _ in locals().get('renditions', []):
+REM#PY#             if r_tmp.exists(): r_tmp.unlink()
+REM#PY#         eng.journal.record(vpath, 'failed', error=str(e))
 REM#PY#         return False
 REM#PY# 
-REM#PY# def update_display(total, codec_name, config):
-REM#PY#     header = draw_header(config, codec_name)
+REM#PY# def make_runner(eng):
+REM#PY#     # The function Scheduler.worker calls for each job: batch, single file, then any identical copies
+REM#PY#     sched = eng.sched
+REM#PY#     def run_job(slot, job, lane):
+REM#PY#         fut = job.future
+REM#PY#         if fut and not fut.running() and not fut.set_running_or_notify_cancel():
+REM#PY#             eng.journal.record(job.path, 'skipped', reason="cancelled")
+REM#PY#             return False
+REM#PY#         eng.local.job, eng.slot_jobs[slot] = job, job
+REM#PY#         rec, requeued = eng.metrics.begin(job, lane, slot), False
+REM#PY#         try:
+REM#PY#             if job.members: ok = process_batch(eng, slot, job.members, lane.codec, job.threads, lane.ffmpeg, job.staging)
+REM#PY#             else: ok = job.ok = process_video(eng, slot, job.path, lane.codec, job.action, job.threads, lane.ffmpeg, fallback=False, dest=job.dest, borrow=lambda: sched.borrow(lane, job), scratch=job.staging)
+REM#PY#             apply_duplicates(eng, slot, job)
+REM#PY#             return ok
+REM#PY#         except HardwareEncodeError:
+REM#PY#             if job.cancelled:
+REM#PY#                 # Killed on request, not a hardware fault: no retry on another lane, no strike against the GPU
+REM#PY#                 for j in job.files: eng.journal.record(j.path, 'failed', error="cancelled")
+REM#PY#                 return False
+REM#PY#             requeued = True; raise
+REM#PY#         finally:
+REM#PY#             eng.metrics.end(rec, job, requeued)
+REM#PY#             eng.local.job = job.handles = None
+REM#PY#             eng.slot_jobs.pop(slot, None)
+REM#PY#     return run_job
+REM#PY# 
+REM#PY# class Engine:
+REM#PY#     # One self-contained encoder: its own ffmpeg supervisor, progress table, probe cache, journal and metrics.
+REM#PY#     # Engines share nothing, so several can run in one process with different configs and data folders.
+REM#PY#     # A data folder (and a scratch_dir) belongs to one engine at a time; a second engine on it fails fast.
+REM#PY#     live = weakref.WeakSet() # For the CLI's emergency stop only
+REM#PY#     def __init__(self, config=None, data_dir=APP_DATA, on_progress=None):
+REM#PY#         self.config = dict(DEFAULT_CONFIG, **(config or {}))
+REM#PY#         self.data_dir = Path(data_dir)
+REM#PY#         self.owner = lock_dir(self.data_dir)
+REM#PY#         if self.owner is None: raise RuntimeError(f"{self.data_dir} is in use by another engine; give each engine its own data_dir")
+REM#PY#         self.metrics = JobMetrics(self.data_dir / "metrics.jsonl")
+REM#PY#         self.metrics.enabled = self.config.get('metrics_log', True)
+REM#PY#         self.procs = ProcessManager(self.metrics)
+REM#PY#         self.procs.on_spawn = self._track
+REM#PY#         self.stats = WorkerStats(self._progress)
+REM#PY#         self.probes = ProbeCache(self.data_dir / "probe_cache.json", self.ffprobe)
+REM#PY#         self.journal = JobJournal(self.data_dir / "journal.jsonl")
+REM#PY#         self.on_progress = on_progress # (slot, snapshot) for every progress update
+REM#PY#         self.lock = threading.Lock() # Guards the run counters below
+REM#PY#         self.verify_totals = {} # level -> [files, seconds]
+REM#PY#         self.gain_aborts = {'early': 0, 'final': 0}
+REM#PY#         self.sim = None # FakeFFmpeg answering probes instead of ffprobe (--simulate)
+REM#PY#         self.local = threading.local() # The job running on this worker thread
+REM#PY#         self.slot_jobs = {} # slot -> running job, to route progress to per-job callbacks
+REM#PY#         self.sched = self.pool = self.lanes = None
+REM#PY#         self.sched_lock = None # Lock behind the scheduler's condition; --simulate swaps in a ContentionLock
+REM#PY#         self.on_finish = None
+REM#PY#         Engine.live.add(self)
+REM#PY#     def ffprobe(self, path, timeout=30):
+REM#PY#         return self.sim.probe(path) if self.sim else run_ffprobe(path, timeout)
+REM#PY#     def _progress(self, slot, snapshot):
+REM#PY#         if self.on_progress: self.on_progress(slot, snapshot)
+REM#PY#         job = self.slot_jobs.get(slot)
+REM#PY#         if job and job.on_progress:
+REM#PY#             try: job.on_progress(snapshot)
+REM#PY#             except Exception as e: logging.debug(f"Progress callback failed for {job.path.name}: {e}")
+REM#PY#     def _track(self, h):
+REM#PY#         # Runs on the worker thread that spawned h, so the thread's current job owns it
+REM#PY#         job = getattr(self.local, 'job', None)
+REM#PY#         if job is None: return
+REM#PY#         job.handles = (job.handles or []) + [h]
+REM#PY#         if job.cancelled: self.procs.cancel(h)
+REM#PY#     def _finished(self, job):
+REM#PY#         if job.future and not job.future.done():
+REM#PY#             # A cancel that lands after the swap committed came too late: report what actually happened
+REM#PY#             if job.cancelled and not job.ok: job.future.set_exception(CancelledError())
+REM#PY#             else: job.future.set_result(bool(job.ok))
+REM#PY#         if self.on_finish: self.on_finish(job)
+REM#PY#     def recover(self):
+REM#PY#         # (paths left to encode, swaps repaired) from an interrupted run of this engine's journal
+REM#PY#         return recover_interrupted_jobs(self)
+REM#PY#     def serve_metrics(self, port=None):
+REM#PY#         port = port or self.config.get('metrics_port', 0)
+REM#PY#         if not port: return None
+REM#PY#         try:
+REM#PY#             server = self.metrics.serve(port)
+REM#PY#             logging.info(f"Metrics endpoint: http://127.0.0.1:{port}/metrics")
+REM#PY#             return server
+REM#PY#         except OSError as e: logging.warning(f"Metrics endpoint on port {port} unavailable: {e}")
+REM#PY#     def start(self, jobs=None, lanes=None, codec=None, on_finish=None, max_pending=None):
+REM#PY#         # Start the workers. A job list runs as one fixed batch; without one the queue stays open for submit()
+REM#PY#         # until close(), holding at most max_pending (default pipeline_depth) waiting jobs. Without lanes,
+REM#PY#         # codec picks the hardware lane beside the CPU one; None detects it like --codec auto.
+REM#PY#         config = self.config
+REM#PY#         self.lanes = lanes or build_lanes(config, codec or detect_gpu_codec()[0])
+REM#PY#         slots = 1 if config['max_workers'] == 1 else sum(l.capacity for l in self.lanes)
+REM#PY#         closed = jobs is not None
+REM#PY#         self.sched = Scheduler(make_batches(jobs, config) if closed else [], slots, ThreadBudget(cpu_budget(config), slots), self.lanes,
+REM#PY#                                config.get('hw_failure_limit', 3), closed=closed,
+REM#PY#                                max_pending=0 if closed else config.get('pipeline_depth', 64) if max_pending is None else max_pending,
+REM#PY#                                lpt=config['sort'] == 'cost_desc', scratch=open_scratch(config), device_limits=device_limits(config), lock=self.sched_lock)
+REM#PY#         self.sched.on_finish, self.on_finish = self._finished, on_finish
+REM#PY#         everything = [f for j in jobs for f in j.files] if closed else []
+REM#PY#         self.journal.begin_run([f.path for f in everything], {f.path: f.action for f in everything})
+REM#PY#         self.pool = ThreadPoolExecutor(max_workers=slots, thread_name_prefix="worker")
+REM#PY#         run_job = make_runner(self)
+REM#PY#         for _ in range(slots): self.pool.submit(self.sched.worker, run_job)
+REM#PY#         return self.sched
+REM#PY#     def submit(self, path, on_progress=None):
+REM#PY#         # Probe, plan and queue one file, starting the workers with detected lanes on first use. The future
+REM#PY#         # resolves to True/False once it is done, None when the file needs no work; future.cancel() drops it
+REM#PY#         # while queued, cancel(future) also stops a running encode
+REM#PY#         if self.sched is None: self.start()
+REM#PY#         path, fut = Path(path), Future()
+REM#PY#         st = path.stat()
+REM#PY#         try: info = self.probes.probe(path, st)
+REM#PY#         except Exception as e:
+REM#PY#             logging.warning(f"Probe failed for {path.name}: {e}"); info = None
+REM#PY#         action, reason = plan_video(info, self.config, path)
+REM#PY#         if action == 'skip':
+REM#PY#             fut.set_result(None); return fut
+REM#PY#         job = Job(path, action, info)
+REM#PY#         job.dest, job.device, job.size = output_path(path, action, self.config), st.st_dev, job.size or st.st_size
+REM#PY#         job.future, job.on_progress, fut.job = fut, on_progress, job
+REM#PY#         self.journal.record(path, 'queued', action=action)
+REM#PY#         logging.info(f"Queued {path} ({action}: {reason})")
+REM#PY#         self.sched.add(job) # Blocks while pipeline_depth jobs are already waiting
+REM#PY#         return fut
+REM#PY#     def cancel(self, fut):
+REM#PY#         # Queued jobs never start; a running one has its ffmpeg processes terminated and fails.
+REM#PY#         # Once its output has replaced the source it is too late, and the future still resolves to True.
+REM#PY#         if fut.cancel(): return True
+REM#PY#         job = getattr(fut, 'job', None)
+REM#PY#         if job is None or fut.done(): return False
+REM#PY#         job.cancelled = True
+REM#PY#         for h in job.handles or []: self.procs.cancel(h)
+REM#PY#         return True
+REM#PY#     def wait(self, timeout=None):
+REM#PY#         # True once every queued job has finished (only after close() for an open queue); None blocks until then
+REM#PY#         end = None if timeout is None else time.time() + timeout
+REM#PY#         while not self.sched.wait(1.0 if end is None else max(0.0, min(1.0, end - time.time()))):
+REM#PY#             if end is not None and time.time() >= end: return False
+REM#PY#         return True
+REM#PY#     def close(self, wait=True):
+REM#PY#         # No more submissions; finish what is queued (wait=True) and write out the caches.
+REM#PY#         # Without waiting the run stays open in the journal, so the next start recovers it.
+REM#PY#         if self.sched:
+REM#PY#             self.sched.close()
+REM#PY#             self.pool.shutdown(wait=wait)
+REM#PY#             if wait: self.journal.end_run()
+REM#PY#         self.probes.save()
+REM#PY#         self.journal.close(); self.metrics.close()
+REM#PY#         if wait or not self.sched:
+REM#PY#             # Workers left running keep the folders until the process exits
+REM#PY#             if self.sched and self.sched.scratch: self.sched.scratch.close()
+REM#PY#             self.owner.close()
+REM#PY#     def kill(self): self.procs.kill_all()
+REM#PY#     @classmethod
+REM#PY#     def kill_all(cls):
+REM#PY#         for eng in list(cls.live): eng.kill()
+REM#PY# 
+REM#PY# header_cache = {}
+REM#PY# def update_display(eng, total, codec_name, completed=None):
+REM#PY#     # The header only changes with the ticker, so it is built once per message
+REM#PY#     config = eng.config
+REM#PY#     key = (get_ticker_msg(), codec_name, config['target_height'], config['target_fps'], config['video_bitrate'], config['max_workers'], cpu_budget(config))
+REM#PY#     header = header_cache.get(key)
+REM#PY#     if header is None:
+REM#PY#         header_cache.clear(); header = header_cache[key] = draw_header(config, codec_name)
 REM#PY#     buffer = [""] # Leading newline to separate from logo
-REM#PY#     stats = worker_stats.get_all()
-REM#PY#     completed = sum(1 for s in stats.values() if s['pct'] >= 100)
+REM#PY#     stats = eng.stats.get_all()
+REM#PY#     if completed is None: completed = sum(1 for s in stats.values() if s['pct'] >= 100)
 REM#PY#     in_progress = len([s for s in stats.values() if 0 < s['pct'] < 100])
 REM#PY#     
 REM#PY#     for wid in sorted(stats.keys()):
@@ -1325,9 +2361,568 @@ REM#PY#     buffer.append(f" {C.WHITE}{'='*70}{C.RESET}")
 REM#PY#     o_pct = (completed / total * 100) if total > 0 else 0
 REM#PY#     buffer.append(f" {C.WHITE}Total: {total} | {C.SUCCESS}Done: {completed} | {C.INFO}Active: {in_progress} | {o_pct:.1f}%{C.RESET}")
 REM#PY#     
-REM#PY#     # Send as one atomic write to terminal
-REM#PY#     sys.stdout.write("\033[H" + header + "\n".join(buffer) + "\033[J")
-REM#PY#     sys.stdout.flush()
+REM#PY#     # Only changed lines are written, as one write to the terminal
+REM#PY#     screen.draw(header + "\n".join(buffer))
+REM#PY# 
+REM#PY# class InotifyWatcher:
+REM#PY#     # Minimal inotify binding via ctypes (Linux only); yields paths of files that finished writing or moved in
+REM#PY#     IN_CLOSE_WRITE, IN_MOVED_TO, IN_CREATE, IN_Q_OVERFLOW, IN_ISDIR = 0x8, 0x80, 0x100, 0x4000, 0x40000000
+REM#PY#     def __init__(self):
+REM#PY#         import ctypes, struct
+REM#PY#         self.struct = struct
+REM#PY#         self.libc = ctypes.CDLL(None, use_errno=True)
+REM#PY#         self.fd = self.libc.inotify_init1(os.O_NONBLOCK | getattr(os, 'O_CLOEXEC', 0))
+REM#PY#         if self.fd < 0: raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+REM#PY#         self.wds = {}
+REM#PY#         self.overflowed = False
+REM#PY#     def add(self, path):
+REM#PY#         mask = self.IN_CLOSE_WRITE | self.IN_MOVED_TO | self.IN_CREATE
+REM#PY#         wd = self.libc.inotify_add_watch(self.fd, os.fsencode(str(path)), mask)
+REM#PY#         if wd < 0: raise OSError(f"inotify_add_watch failed for {path} (max_user_watches?)")
+REM#PY#         self.wds[wd] = Path(path)
+REM#PY#     def read(self, timeout):
+REM#PY#         import select
+REM#PY#         if not select.select([self.fd], [], [], timeout)[0]: return []
+REM#PY#         try: buf = os.read(self.fd, 65536)
+REM#PY#         except BlockingIOError: return []
+REM#PY#         events, off = [], 0
+REM#PY#         while off + 16 <= len(buf):
+REM#PY#             wd, mask, _, n = self.struct.unpack_from('iIII', buf, off)
+REM#PY#             name = buf[off + 16:off + 16 + n].rstrip(b'\0').decode('utf-8', 'surrogateescape')
+REM#PY#             off += 16 + n
+REM#PY#             if mask & self.IN_Q_OVERFLOW: self.overflowed = True
+REM#PY#             elif wd in self.wds and name: events.append((self.wds[wd] / name, bool(mask & self.IN_ISDIR)))
+REM#PY#         return events
+REM#PY#     def close(self): os.close(self.fd)
+REM#PY# 
+REM#PY# class WatchState:
+REM#PY#     # Signatures of files already handled, persisted so a restart doesn't re-probe the whole tree
+REM#PY#     def __init__(self, path=WATCH_STATE_FILE):
+REM#PY#         self.path = path
+REM#PY#         try:
+REM#PY#             with open(path, 'r', encoding='utf-8') as f: self.seen = json.load(f)
+REM#PY#         except: self.seen = {}
+REM#PY#         self.dirty, self.saved_at = False, time.time()
+REM#PY#     def handled(self, path, st): return self.seen.get(str(path)) == [st.st_size, st.st_mtime_ns]
+REM#PY#     def mark(self, path, st=None):
+REM#PY#         try: st = st or os.stat(path)
+REM#PY#         except OSError: self.seen.pop(str(path), None); return
+REM#PY#         self.seen[str(path)] = [st.st_size, st.st_mtime_ns]; self.dirty = True
+REM#PY#     def save(self, force=False):
+REM#PY#         if not self.dirty or (not force and time.time() - self.saved_at < 30): return
+REM#PY#         try:
+REM#PY#             self.path.parent.mkdir(parents=True, exist_ok=True)
+REM#PY#             tmp = self.path.with_suffix('.tmp')
+REM#PY#             with open(tmp, 'w', encoding='utf-8') as f: json.dump(self.seen, f, separators=(',', ':'))
+REM#PY#             os.replace(tmp, self.path)
+REM#PY#             self.dirty, self.saved_at = False, time.time()
+REM#PY#         except Exception as e: logging.warning(f"Watch state not saved: {e}")
+REM#PY# 
+REM#PY# def watch_folder(eng, root, lanes):
+REM#PY#     # Headless daemon: queue new or changed videos once their size has settled, forever
+REM#PY#     root, config = Path(root), eng.config
+REM#PY#     state = WatchState(eng.data_dir / "watch_state.json")
+REM#PY#     settle, interval = config.get('watch_settle', 10), config.get('watch_interval', 30)
+REM#PY#     candidates, inflight, lock = {}, set(), threading.Lock() # path -> (size, mtime_ns, first_seen)
+REM#PY#     failures = {} # path -> failed attempts in a row
+REM#PY#     def retry_later(path):
+REM#PY#         # Failures are often transient (NAS blip, stalled ffmpeg): come back later instead of marking the file
+REM#PY#         # handled. Backdating first_seen into the future holds the candidate back for the delay.
+REM#PY#         n = failures[path] = failures.get(path, 0) + 1
+REM#PY#         delay = min(3600, settle * 2 ** n)
+REM#PY#         try: st = path.stat()
+REM#PY#         except OSError: return 0
+REM#PY#         candidates[path] = (st.st_size, st.st_mtime_ns, time.time() + delay)
+REM#PY#         return delay
+REM#PY#     def on_finish(job):
+REM#PY#         with lock:
+REM#PY#             inflight.discard(job.path)
+REM#PY#             if job.ok:
+REM#PY#                 failures.pop(job.path, None)
+REM#PY#                 state.mark(job.dest if job.dest.exists() else job.path)
+REM#PY#             else: delay = retry_later(job.path)
+REM#PY#         if job.ok: print(f" {C.SUCCESS}[WATCH] OK: {job.path}{C.RESET}", flush=True)
+REM#PY#         else: print(f" {C.ERROR}[WATCH] FAILED: {job.path} (retry in {delay}s){C.RESET}", flush=True)
+REM#PY#     # Unbounded queue: the event loop must never block on a busy encoder
+REM#PY#     sched = eng.start(lanes=lanes, on_finish=on_finish, max_pending=0)
+REM#PY#     sched.keep_finished = False
+REM#PY# 
+REM#PY#     # Events go through the same name and pattern rules as a scan of root
+REM#PY#     filters = wanted_file, wanted_dir = path_filters(root, config)
+REM#PY#     def consider(path, st=None):
+REM#PY#         if not wanted_file(path, path.name): return
+REM#PY#         try: st = st or path.stat()
+REM#PY#         except OSError: return
+REM#PY#         with lock:
+REM#PY#             if path in inflight or state.handled(path, st): return
+REM#PY#             prev = candidates.get(path)
+REM#PY#             if not prev or prev[:2] != (st.st_size, st.st_mtime_ns): candidates[path] = (st.st_size, st.st_mtime_ns, time.time())
+REM#PY#     def full_scan():
+REM#PY#         for path, st in iter_videos(root, config['recursive'], config): consider(path, st)
+REM#PY# 
+REM#PY#     watcher = None
+REM#PY#     if config.get('watch_inotify', True) and SYSTEM == "Linux":
+REM#PY#         try:
+REM#PY#             watcher = InotifyWatcher()
+REM#PY#             watcher.add(root)
+REM#PY#             if config['recursive']:
+REM#PY#                 for d, subdirs, _ in os.walk(root):
+REM#PY#                     subdirs[:] = [x for x in subdirs if wanted_dir(os.path.join(d, x), x)]
+REM#PY#                     for x in subdirs: watcher.add(Path(d) / x)
+REM#PY#             logging.info(f"Watch: inotify on {len(watcher.wds)} folder(s)")
+REM#PY#         except Exception as e:
+REM#PY#             logging.warning(f"Watch: inotify unavailable ({e}), polling every {interval}s")
+REM#PY#             if watcher: watcher.close()
+REM#PY#             watcher = None
+REM#PY#     print(f" {C.INFO}[WATCH] Watching {root} ({'inotify' if watcher else f'polling every {interval}s'}), settle {settle}s. CTRL+C to stop.{C.RESET}", flush=True)
+REM#PY#     full_scan(); last_scan = time.time()
+REM#PY#     try:
+REM#PY#         while True:
+REM#PY#             if watcher:
+REM#PY#                 for path, is_dir in watcher.read(1.0):
+REM#PY#                     if is_dir:
+REM#PY#                         if config['recursive'] and wanted_dir(path, path.name):
+REM#PY#                             try: watcher.add(path)
+REM#PY#                             except OSError as e: logging.warning(f"Watch: {e}")
+REM#PY#                             for p, st in iter_videos(path, True, config, filters=filters): consider(p, st)
+REM#PY#                     else: consider(path)
+REM#PY#                 if watcher.overflowed:
+REM#PY#                     watcher.overflowed = False; full_scan(); last_scan = time.time()
+REM#PY#             else:
+REM#PY#                 time.sleep(1.0)
+REM#PY#                 if time.time() - last_scan >= interval: full_scan(); last_scan = time.time()
+REM#PY#             # Re-stat candidates: only files unchanged for 'settle' seconds are queued
+REM#PY#             now = time.time()
+REM#PY#             with lock: pending = list(candidates.items())
+REM#PY#             for path, (size, mtime_ns, since) in pending:
+REM#PY#                 try: st = path.stat()
+REM#PY#                 except OSError:
+REM#PY#                     with lock: candidates.pop(path, None)
+REM#PY#                     continue
+REM#PY#                 if (st.st_size, st.st_mtime_ns) != (size, mtime_ns):
+REM#PY#                     with lock: candidates[path] = (st.st_size, st.st_mtime_ns, now)
+REM#PY#                     continue
+REM#PY#                 if now - since < settle or now - st.st_mtime < settle: continue
+REM#PY#                 with lock: candidates.pop(path, None)
+REM#PY#                 try: info = eng.probes.probe(path, st)
+REM#PY#                 except Exception as e:
+REM#PY#                     logging.warning(f"Probe failed for {path.name}: {e}"); info = None
+REM#PY#                 if not info:
+REM#PY#                     with lock: retry_later(path)
+REM#PY#                     continue
+REM#PY#                 action, reason = plan_video(info, config, path)
+REM#PY#                 if action == 'skip':
+REM#PY#                     with lock: state.mark(path, st)
+REM#PY#                     continue
+REM#PY#                 job = Job(path, action, info); job.dest = output_path(path, action, config); job.device = st.st_dev
+REM#PY#                 with lock: inflight.add(path)
+REM#PY#                 eng.journal.record(path, 'queued', action=action)
+REM#PY#                 logging.info(f"[WATCH] Queued {path} ({action}: {reason})")
+REM#PY#                 sched.add(job)
+REM#PY#             with lock: state.save()
+REM#PY#             eng.probes.save()
+REM#PY#     finally:
+REM#PY#         sched.close()
+REM#PY#         with lock: state.save(force=True)
+REM#PY#         eng.probes.save()
+REM#PY#         if watcher: watcher.close()
+REM#PY# 
+REM#PY# class ProgressStream:
+REM#PY#     # --batch progress: one JSON object per line, and a slot is only reported when its values changed
+REM#PY#     def __init__(self, target='-'):
+REM#PY#         self.fh = sys.stdout if target in (None, '-') else open(target, 'a', encoding='utf-8')
+REM#PY#         self.last = {}
+REM#PY#         self.lock = threading.Lock()
+REM#PY#     def emit(self, event, **fields):
+REM#PY#         line = json.dumps(dict(t=round(time.time(), 3), event=event, **fields), ensure_ascii=False)
+REM#PY#         with self.lock:
+REM#PY#             self.fh.write(line + "\n"); self.fh.flush()
+REM#PY#     def poll(self, eng):
+REM#PY#         sched = eng.sched
+REM#PY#         for wid, s in sorted(eng.stats.get_all().items()):
+REM#PY#             cur = (s['fn'], round(s['pct'], 1), s['fps'], s['speed'], s['size'])
+REM#PY#             if self.last.get(wid) == cur: continue
+REM#PY#             self.last[wid] = cur
+REM#PY#             self.emit('progress', slot=wid, file=cur[0], pct=cur[1], fps=cur[2], speed=cur[3], note=cur[4])
+REM#PY#         totals = (sched.done_count(), sched.added)
+REM#PY#         if self.last.get('totals') != totals:
+REM#PY#             self.last['totals'] = totals
+REM#PY#             self.emit('totals', done=totals[0], total=totals[1])
+REM#PY#     def close(self):
+REM#PY#         if self.fh is not sys.stdout: self.fh.close()
+REM#PY# 
+REM#PY# def queue_jobs(stats, probes, config):
+REM#PY#     # Plan, order and dedupe scanned files into scheduler jobs; returns (jobs, counts, work, files queued)
+REM#PY#     videos = list(stats)
+REM#PY#     plan, counts, work = build_plan(videos, probes, config)
+REM#PY#     videos = [v for v in videos if plan[v][0] != 'skip']
+REM#PY#     if config['sort'] == 'name_az': videos.sort()
+REM#PY#     elif config['sort'] == 'name_za': videos.sort(reverse=True)
+REM#PY#     elif config['sort'] == 'size_desc': videos.sort(key=lambda x: stats[x].st_size, reverse=True)
+REM#PY#     elif config['sort'] == 'size_asc': videos.sort(key=lambda x: stats[x].st_size)
+REM#PY#     jobs = [Job(v, plan[v][0], probes.get(v)) for v in videos]
+REM#PY#     for j in jobs: j.dest, j.device = output_path(j.path, j.action, config), stats[j.path].st_dev
+REM#PY#     if config['sort'] == 'cost_desc': jobs = Scheduler.order_lpt(jobs)
+REM#PY#     return find_duplicates(jobs, config, max(4, config['max_workers'] * 2)), counts, work, len(jobs)
+REM#PY# 
+REM#PY# def run_batch(eng, lanes, progress='-'):
+REM#PY#     # Headless one-shot run for cron and wrappers: no prompts, no terminal UI, JSON-lines progress
+REM#PY#     config = eng.config
+REM#PY#     out = ProgressStream(progress)
+REM#PY#     cwd = Path.cwd()
+REM#PY#     resume, repaired = eng.recover()
+REM#PY#     cleaned = cleanup_temp_files(cwd, config['recursive'])
+REM#PY#     baks = len(list(cwd.rglob("*.bak") if config['recursive'] else cwd.glob("*.bak")))
+REM#PY#     # Orphaned backups need a human decision (restore or purge), so batch mode only reports them
+REM#PY#     if baks: logging.warning(f"{baks} orphaned .bak file(s) left untouched; run interactively to restore or purge")
+REM#PY#     out.emit('start', version=VERSION, root=str(cwd), lanes=describe_lanes(lanes), repaired=repaired, resumed=len(resume), temp_cleaned=cleaned, orphaned_backups=baks)
+REM#PY#     on_finish = lambda j: out.emit('file', path=str(j.path), dest=str(j.dest), action=j.action, ok=bool(j.ok), elapsed=round(j.elapsed, 3))
+REM#PY#     pipeline = None
+REM#PY#     start_t = time.time()
+REM#PY#     try:
+REM#PY#         if not config.get('prescan', True) and not resume:
+REM#PY#             sched = eng.start(lanes=lanes, on_finish=on_finish)
+REM#PY#             pipeline = Pipeline(eng, iter_videos(cwd, config['recursive'], config), max(2, config['max_workers'])).start()
+REM#PY#         else:
+REM#PY#             stats = {v: v.stat() for v in resume if v.exists()} if resume else scan_videos(cwd, config['recursive'], config)
+REM#PY#             probes = probe_all(eng, list(stats), max(4, config['max_workers'] * 2), stats)
+REM#PY#             jobs, counts, work, queued = queue_jobs(stats, probes, config)
+REM#PY#             out.emit('plan', files=len(stats), **counts, encode_s=round(work['encode'], 1), remux_s=round(work['remux'], 1), duplicates=queued - len(jobs))
+REM#PY#             sched = eng.start(jobs, lanes, on_finish=on_finish)
+REM#PY#         logging.info(f"Batch mode: {cwd} | lanes {describe_lanes(lanes)} | {sched.slots} slot(s)")
+REM#PY#         while not eng.wait(0.5): out.poll(eng)
+REM#PY#         out.poll(eng)
+REM#PY#     finally:
+REM#PY#         eng.close()
+REM#PY#     success = sum(1 for j in sched.finished if j.ok)
+REM#PY#     span, ideal, eff = sched.makespan()
+REM#PY#     summary = dict(success=success, failed=len(sched.finished) - success, elapsed=round(time.time() - start_t, 3),
+REM#PY#                    makespan=round(span, 3), efficiency=round(eff, 1), bytes_in=sum(j.size for j in sched.finished),
+REM#PY#                    bytes_out=sum(j.dest.stat().st_size if j.dest.exists() else (j.path.stat().st_size if j.path.exists() else 0) for j in sched.finished),
+REM#PY#                    kept_originals=sum(eng.gain_aborts.values()))
+REM#PY#     if pipeline: summary.update(pipeline.counts)
+REM#PY#     out.emit('end', **summary)
+REM#PY#     logging.info(f"Batch finished: {summary}")
+REM#PY#     out.close()
+REM#PY#     return 2 if summary['failed'] else 0
+REM#PY# 
+REM#PY# BENCH_DIR = APP_DATA / "bench"
+REM#PY# # Synthetic corpus: (name, width, height, fps, seconds, container); testsrc2 + sine are deterministic
+REM#PY# BENCH_CORPUS = [
+REM#PY#     ("hd720_30", 1280, 720, 30, 10, ".mp4"),
+REM#PY#     ("hd1080_30", 1920, 1080, 30, 6, ".mkv"),
+REM#PY#     ("sd480_25", 640, 480, 25, 8, ".avi"),
+REM#PY#     ("wide480_60", 854, 480, 60, 5, ".mov"),
+REM#PY#     ("clip720_24", 1280, 720, 24, 3, ".mp4"),
+REM#PY#     ("qhd_30", 2560, 1440, 30, 3, ".mp4"),
+REM#PY# ]
+REM#PY# 
+REM#PY# def build_bench_corpus(folder):
+REM#PY#     # Generated once and reused, so every benchmark run encodes the same bytes
+REM#PY#     folder.mkdir(parents=True, exist_ok=True)
+REM#PY#     for name, w, h, fps, secs, ext in BENCH_CORPUS:
+REM#PY#         out = folder / f"{name}{ext}"
+REM#PY#         if out.exists(): continue
+REM#PY#         print(f" {C.INFO}[BENCH] Generating {out.name}...{C.RESET}")
+REM#PY#         tmp = folder / f"mnemosyne_tmp_{out.name}"
+REM#PY#         cmd = ["ffmpeg", "-nostdin", "-y", "-v", "error", "-f", "lavfi", "-i", f"testsrc2=size={w}x{h}:rate={fps}",
+REM#PY#                "-f", "lavfi", "-i", "sine=frequency=440:sample_rate=48000", "-t", str(secs), "-map", "0:v", "-map", "1:a",
+REM#PY#                "-c:v", "libx264", "-preset", "ultrafast", "-crf", "18", "-pix_fmt", "yuv420p", "-c:a", "aac", "-b:a", "192k", str(tmp)]
+REM#PY#         subprocess.run(cmd, check=True, timeout=300)
+REM#PY#         tmp.rename(out)
+REM#PY# 
+REM#PY# def bench_matrix(config):
+REM#PY#     b = config.get('benchmark') or {}
+REM#PY#     workers = b.get('workers') or sorted({1, config['max_workers']})
+REM#PY#     cells = []
+REM#PY#     for w in workers:
+REM#PY#         for budget in b.get('cpu_budget') or [0]:
+REM#PY#             for preset in b.get('presets') or [config.get('x264_preset', 'medium')]:
+REM#PY#                 for verify in b.get('verify') or [config['verify_frames']]:
+REM#PY#                     cells.append((f"w{w}_cpu{budget}_{preset}_{'verify' if verify else 'noverify'}",
+REM#PY#                                   dict(config, max_workers=w, cpu_budget=budget, x264_preset=preset, verify_frames=verify)))
+REM#PY#     return cells
+REM#PY# 
+REM#PY# def cpu_times():
+REM#PY#     # (self + children) CPU seconds; children are only counted once reaped, which process_video always does
+REM#PY#     try: import resource
+REM#PY#     except ImportError: return None
+REM#PY#     own, kids = resource.getrusage(resource.RUSAGE_SELF), resource.getrusage(resource.RUSAGE_CHILDREN)
+REM#PY#     return own.ru_utime + own.ru_stime + kids.ru_utime + kids.ru_stime
+REM#PY# 
+REM#PY# def reset_peak_rss():
+REM#PY#     # Linux resets this process's high-water mark (VmHWM) on request; ru_maxrss elsewhere only ever grows
+REM#PY#     try:
+REM#PY#         with open("/proc/self/clear_refs", 'w') as f: f.write("5")
+REM#PY#         return True
+REM#PY#     except OSError: return False
+REM#PY# 
+REM#PY# def peak_rss():
+REM#PY#     # Bytes: VmHWM since the last reset_peak_rss()
+REM#PY#     try:
+REM#PY#         with open("/proc/self/status") as f:
+REM#PY#             for line in f:
+REM#PY#                 if line.startswith("VmHWM:"): return int(line.split()[1]) * 1024
+REM#PY#     except OSError: pass
+REM#PY#     return 0
+REM#PY# 
+REM#PY# def bench_run(corpus, cfg):
+REM#PY#     # One matrix cell through the real path: scan, probe, plan, schedule, process_video, verify, swap
+REM#PY#     work = BENCH_DIR / "run"
+REM#PY#     shutil.rmtree(work, ignore_errors=True)
+REM#PY#     shutil.copytree(corpus, work)
+REM#PY#     # A fresh engine per cell: cold probe cache and zeroed counters, with its state kept under BENCH_DIR
+REM#PY#     eng = Engine(cfg, BENCH_DIR)
+REM#PY#     eng.probes.entries = {}
+REM#PY#     # Without a per-cell reset only ffmpeg's peak is comparable between cells
+REM#PY#     own_peak = reset_peak_rss()
+REM#PY#     cpu0, t0 = cpu_times(), time.time()
+REM#PY#     stats = scan_videos(work, False, cfg)
+REM#PY#     probes = probe_all(eng, list(stats), max(4, cfg['max_workers'] * 2), stats)
+REM#PY#     plan, _, _ = build_plan(list(stats), probes, cfg)
+REM#PY#     jobs = [Job(v, plan[v][0], probes.get(v)) for v in stats if plan[v][0] != 'skip']
+REM#PY#     for j in jobs: j.dest, j.device = output_path(j.path, j.action, cfg), stats[j.path].st_dev
+REM#PY#     slots = cfg['max_workers']
+REM#PY#     sched = eng.start(Scheduler.order_lpt(jobs), [EncoderLane("libx264", slots)])
+REM#PY#     eng.wait()
+REM#PY#     wall = time.time() - t0
+REM#PY#     cpu = cpu_times() - cpu0 if cpu0 is not None else None
+REM#PY#     eng.close()
+REM#PY#     done = [j for j in sched.finished if j.ok]
+REM#PY#     src_secs = sum((probes.get(j.path) or {}).get('duration', 0) for j in done)
+REM#PY#     own_rss = peak_rss() if own_peak else 0
+REM#PY#     shutil.rmtree(work, ignore_errors=True)
+REM#PY#     return {
+REM#PY#         'files': len(sched.finished), 'failed': len(sched.finished) - len(done), 'wall_s': round(wall, 3),
+REM#PY#         'files_per_s': round(len(done) / wall, 4) if wall else 0.0,
+REM#PY#         'source_s_per_wall_s': round(src_secs / wall, 4) if wall else 0.0,
+REM#PY#         'cpu_s_per_output_min': round(cpu / (src_secs / 60), 3) if cpu is not None and src_secs else None,
+REM#PY#         'peak_rss_mb': round(max(eng.procs.peak_rss, own_rss) / 1024 / 1024, 1) or None,
+REM#PY#     }
+REM#PY# 
+REM#PY# def bench_compare(results, baseline, tolerance):
+REM#PY#     # Higher is better for throughput, lower is better for CPU and memory
+REM#PY#     regressions = []
+REM#PY#     for cell, cur in results['runs'].items():
+REM#PY#         base = baseline.get('runs', {}).get(cell)
+REM#PY#         if not base: continue
+REM#PY#         for key, better in (('files_per_s', 1), ('source_s_per_wall_s', 1), ('cpu_s_per_output_min', -1), ('peak_rss_mb', -1)):
+REM#PY#             a, b = base.get(key), cur.get(key)
+REM#PY#             if not a or b is None: continue
+REM#PY#             change = (b - a) / a * 100
+REM#PY#             if change * better < -tolerance: regressions.append((cell, key, a, b, change))
+REM#PY#     return regressions
+REM#PY# 
+REM#PY# def run_benchmark(config, save_baseline=False):
+REM#PY#     # Each cell runs its own Engine in BENCH_DIR, so the user's probe cache and journal are left alone
+REM#PY#     corpus = BENCH_DIR / "corpus"
+REM#PY#     build_bench_corpus(corpus)
+REM#PY#     # Every corpus clip is short enough to batch; batching off keeps each file on its own process_video
+REM#PY#     # run so the worker axis has something to spread
+REM#PY#     config = dict(config, dedup='off', batch_max_duration=0, scratch_dir=config.get('scratch_dir', ''))
+REM#PY#     results = {'version': VERSION, 'time': datetime.datetime.now().isoformat(timespec='seconds'),
+REM#PY#                'host': {'system': SYSTEM, 'cpus': os.cpu_count(), 'ffmpeg': ffmpeg_version()}, 'runs': {}}
+REM#PY#     for name, cfg in bench_matrix(config):
+REM#PY#         print(f" {C.INFO}[BENCH] {name}...{C.RESET}", end=" ", flush=True)
+REM#PY#         r = results['runs'][name] = bench_run(corpus, cfg)
+REM#PY#         print(f"{r['files_per_s']:.2f} files/s | {r['source_s_per_wall_s']:.2f}x realtime | "
+REM#PY#               f"{r['cpu_s_per_output_min'] or '-'} cpu-s/min | {r['peak_rss_mb'] or '-'} MB{' | FAILED ' + str(r['failed']) if r['failed'] else ''}")
+REM#PY#         logging.info(f"Benchmark {name}: {r}")
+REM#PY#     out = BENCH_DIR / f"results-{time.strftime('%Y%m%d-%H%M%S')}.json"
+REM#PY#     with open(out, 'w', encoding='utf-8') as f: json.dump(results, f, indent=2)
+REM#PY#     print(f" {C.SUCCESS}[+] Results: {out}{C.RESET}")
+REM#PY#     base_file = BENCH_DIR / "baseline.json"
+REM#PY#     status = 0
+REM#PY#     if base_file.exists():
+REM#PY#         with open(base_file, 'r', encoding='utf-8') as f: baseline = json.load(f)
+REM#PY#         if baseline.get('host') != results['host']: print(f" {C.WARNING}[!] Baseline was recorded on a different host or ffmpeg build.{C.RESET}")
+REM#PY#         tol = (config.get('benchmark') or {}).get('tolerance', 10)
+REM#PY#         regressions = bench_compare(results, baseline, tol)
+REM#PY#         for cell, key, a, b, change in regressions:
+REM#PY#             print(f" {C.ERROR}[REGRESSION] {cell}: {key} {a} -> {b} ({change:+.0f}%){C.RESET}")
+REM#PY#         if not regressions: print(f" {C.SUCCESS}[+] No regressions beyond {tol}% against {base_file.name}.{C.RESET}")
+REM#PY#         status = 2 if regressions else 0
+REM#PY#     if save_baseline or not base_file.exists():
+REM#PY#         shutil.copyfile(out, base_file)
+REM#PY#         print(f" {C.SUCCESS}[+] Saved as baseline.{C.RESET}")
+REM#PY#     return status
+REM#PY# 
+REM#PY# SIM_DIR = APP_DATA / "sim"
+REM#PY# 
+REM#PY# class ContentionLock:
+REM#PY#     # Drop-in Lock that counts acquisitions and the time spent waiting on contended ones
+REM#PY#     def __init__(self, name):
+REM#PY#         self.name, self.lock = name, threading.Lock()
+REM#PY#         self.acquired = self.contended = 0
+REM#PY#         self.wait_s = 0.0
+REM#PY#     def acquire(self, blocking=True, timeout=-1):
+REM#PY#         if self.lock.acquire(False):
+REM#PY#             self.acquired += 1; return True
+REM#PY#         if not blocking: return False
+REM#PY#         t0 = time.perf_counter()
+REM#PY#         ok = self.lock.acquire(True, timeout)
+REM#PY#         if ok:
+REM#PY#             self.acquired += 1; self.contended += 1
+REM#PY#             self.wait_s += time.perf_counter() - t0
+REM#PY#         return ok
+REM#PY#     def release(self): self.lock.release()
+REM#PY#     def locked(self): return self.lock.locked()
+REM#PY#     __enter__ = acquire
+REM#PY#     def __exit__(self, *exc): self.release()
+REM#PY# 
+REM#PY# class SimProcess:
+REM#PY#     # Enough of Popen for the supervisor: a pid, terminate/kill and poll
+REM#PY#     def __init__(self, pid):
+REM#PY#         self.pid, self.killed, self.rc = pid, False, None
+REM#PY#         self.stdout, self.stderr = object(), object() # Only compared by identity in _on_data
+REM#PY#     def terminate(self): self.killed = True
+REM#PY#     kill = terminate
+REM#PY#     def poll(self): return self.rc
+REM#PY#     def wait(self, timeout=None): return self.rc
+REM#PY# 
+REM#PY# class FakeFFmpeg(ProcessManager):
+REM#PY#     # In-process stand-in for ffmpeg/ffprobe: jobs "encode" at 'speed' x realtime, emit real -progress
+REM#PY#     # text every 'period' seconds through the normal parser, and fail at 'fail_rate'. Outputs are sparse
+REM#PY#     # files, so renames, verification and swaps run for real without using disk space.
+REM#PY#     def __init__(self, config, speed=2000.0, fail_rate=0.0, period=0.5, seed=1, metrics=None):
+REM#PY#         super().__init__(metrics)
+REM#PY#         self.config, self.speed, self.fail_rate, self.period = config, speed, fail_rate, period
+REM#PY#         self.rng = random.Random(seed)
+REM#PY#         self.events, self.seq = [], 0
+REM#PY#         self.outputs = {} # output path -> probe info it will report
+REM#PY#         self.busy_s = 0.0 # Simulated encoder wall time handed out
+REM#PY#         self.cv = threading.Condition()
+REM#PY#         threading.Thread(target=self._run, name="fake-ffmpeg", daemon=True).start()
+REM#PY#     def _sample_rss(self, h): pass # No child process; the orchestrator's own RSS is what gets reported
+REM#PY#     def source_info(self, path):
+REM#PY#         # Deterministic per name: mostly 1080p sources to encode, some already compliant
+REM#PY#         r = random.Random(zlib.crc32(path.name.encode()))
+REM#PY#         dur = round(r.uniform(2, 120), 3)
+REM#PY#         small = r.random() < 0.1
+REM#PY#         h, vbr = (480, 700000) if small else (1080, 6000000)
+REM#PY#         return {'duration': dur, 'bitrate': vbr + 128000, 'format': 'mov,mp4,m4a,3gp,3g2,mj2', 'encoder': '', 'comment': '',
+REM#PY#                 'vcodec': 'h264', 'width': h * 16 // 9, 'height': h, 'fps': 30.0, 'nb_frames': int(dur * 30), 'vbitrate': vbr,
+REM#PY#                 'acodec': 'aac', 'abitrate': 128000, 'streams': []}
+REM#PY#     def probe(self, path):
+REM#PY#         path = Path(path)
+REM#PY#         return dict(self.outputs.get(str(path)) or self.source_info(path))
+REM#PY#     def spawn(self, cmd, on_progress=None, stall_timeout=None):
+REM#PY#         inputs = [Path(cmd[i + 1]) for i, a in enumerate(cmd) if a == '-i']
+REM#PY#         outs = [Path(a) for i, a in enumerate(cmd) if Path(a).name.startswith("mnemosyne_tmp_") and cmd[i - 1] != '-i']
+REM#PY#         durs = [self.source_info(p)['duration'] for p in inputs] or [1.0]
+REM#PY#         dur = max(durs)
+REM#PY#         # A batch maps input k to output k, so each output reports its own source's duration
+REM#PY#         outs = list(zip(outs, durs if len(durs) == len(outs) else [dur] * len(outs)))
+REM#PY#         with self.cv:
+REM#PY#             self.seq += 1
+REM#PY#             h = self._handle(SimProcess(self.seq), on_progress, stall_timeout)
+REM#PY#             h.sim = {'dur': dur, 'outs': outs, 'start': time.time(), 'fail': self.rng.random() < self.fail_rate}
+REM#PY#             self.busy_s += dur / self.speed
+REM#PY#             heapq.heappush(self.events, (time.time(), self.seq, h))
+REM#PY#             self.cv.notify()
+REM#PY#         return h
+REM#PY#     def _block(self, h, t, dur, end):
+REM#PY#         rate = parse_bitrate(self.config['video_bitrate']) + parse_bitrate(self.config['audio_bitrate'])
+REM#PY#         frame = int(t * self.config['target_fps'])
+REM#PY#         return (f"frame={frame}\nfps={self.config['target_fps'] * self.speed:.0f}\nbitrate={rate / 1000:.1f}kbits/s\n"
+REM#PY#                 f"total_size={int(rate / 8 * t)}\nout_time_us={int(t * 1e6)}\nspeed={self.speed:.0f}x\n"
+REM#PY#                 f"progress={'end' if end else 'continue'}\n").encode()
+REM#PY#     def _run(self):
+REM#PY#         while True:
+REM#PY#             with self.cv:
+REM#PY#                 while not self.events or self.events[0][0] > time.time():
+REM#PY#                     self.cv.wait(self.events[0][0] - time.time() if self.events else None)
+REM#PY#                 _, _, h = heapq.heappop(self.events)
+REM#PY#             sim, now = h.sim, time.time()
+REM#PY#             t = min(sim['dur'], (now - sim['start']) * self.speed)
+REM#PY#             end = t >= sim['dur'] or h.proc.killed or (sim['fail'] and t >= sim['dur'] / 2)
+REM#PY#             self._on_data(h, h.proc.stdout, self._block(h, t, sim['dur'], end))
+REM#PY#             if not end:
+REM#PY#                 with self.cv:
+REM#PY#                     heapq.heappush(self.events, (min(now + self.period, sim['start'] + sim['dur'] / self.speed), h.proc.pid, h))
+REM#PY#                 continue
+REM#PY#             rc = 255 if h.proc.killed else 1 if sim['fail'] else 0
+REM#PY#             if rc == 1: self._on_data(h, h.proc.stderr, b"Error while decoding stream #0:0: Invalid data found (simulated)\n")
+REM#PY#             elif rc == 0:
+REM#PY#                 for out, dur in sim['outs']:
+REM#PY#                     with open(out, 'wb') as f: f.truncate(max(20480, int(parse_bitrate(self.config['video_bitrate']) / 8 * dur)))
+REM#PY#                     info = self.source_info(out)
+REM#PY#                     info.update(duration=dur, height=self.config['target_height'], width=self.config['target_height'] * 16 // 9,
+REM#PY#                                 fps=float(self.config['target_fps']), nb_frames=int(dur * self.config['target_fps']), comment=ENCODER_TAG)
+REM#PY#                     self.outputs[str(out)] = info
+REM#PY#             h.proc.rc = rc
+REM#PY#             self._finish(h, rc)
+REM#PY# 
+REM#PY# def run_simulation(config, count, speed=2000.0, fail_rate=0.01):
+REM#PY#     # Orchestrator-only load test: the real scan/probe/plan/scheduler/verify/swap path, ffmpeg faked in-process
+REM#PY#     try: import resource
+REM#PY#     except ImportError: resource = None
+REM#PY#     root = SIM_DIR / "run"
+REM#PY#     shutil.rmtree(root, ignore_errors=True)
+REM#PY#     # Keep to the stages that only need ffprobe; decode checks and keyframe probes are ffmpeg work, not orchestration
+REM#PY#     config = dict(config, verify_level='fast', segment_min_duration=0, renditions=[], dedup='off', scratch_dir='', min_savings=0)
+REM#PY#     phases = {}
+REM#PY#     t0 = time.time()
+REM#PY#     for i in range(count):
+REM#PY#         d = root / f"d{i // 1000:04d}"
+REM#PY#         if i % 1000 == 0: d.mkdir(parents=True, exist_ok=True)
+REM#PY#         p = d / f"sim_{i:07d}.mp4"
+REM#PY#         with open(p, 'wb') as f: f.truncate(max(20480, int(random.Random(i).uniform(2, 120) * 6128000 / 8)))
+REM#PY#     phases['generate'] = time.time() - t0
+REM#PY#     # A throwaway engine in SIM_DIR whose process manager is the fake ffmpeg
+REM#PY#     eng = Engine(config, SIM_DIR)
+REM#PY#     eng.probes.entries = {}
+REM#PY#     eng.sim = eng.procs = sim = FakeFFmpeg(eng.config, speed, fail_rate, metrics=eng.metrics)
+REM#PY#     sim.on_spawn = eng._track
+REM#PY#     locks = [ContentionLock(n) for n in ('scheduler', 'journal', 'probe_cache', 'metrics', 'stats')]
+REM#PY#     eng.sched_lock, (eng.journal.lock, eng.probes.lock, eng.metrics.lock, eng.lock) = locks[0], locks[1:]
+REM#PY#     cpu0 = resource.getrusage(resource.RUSAGE_SELF) if resource else None
+REM#PY#     t0 = time.time()
+REM#PY#     stats = scan_videos(root, True, config)
+REM#PY#     phases['scan'] = time.time() - t0; t0 = time.time()
+REM#PY#     probes = probe_all(eng, list(stats), max(4, config['max_workers'] * 2), stats)
+REM#PY#     plan, counts, _ = build_plan(list(stats), probes, config)
+REM#PY#     jobs = [Job(v, plan[v][0], probes.get(v)) for v in stats if plan[v][0] != 'skip']
+REM#PY#     for j in jobs: j.dest, j.device = output_path(j.path, j.action, config), stats[j.path].st_dev
+REM#PY#     jobs = Scheduler.order_lpt(jobs)
+REM#PY#     phases['probe_plan'] = time.time() - t0; t0 = time.time()
+REM#PY#     slots = config['max_workers']
+REM#PY#     display_s, display_n = 0.0, 0
+REM#PY#     real_stdout, sys.stdout = sys.stdout, open(os.devnull, 'w', encoding='utf-8')
+REM#PY#     try:
+REM#PY#         sched = eng.start(jobs, [EncoderLane("libx264", slots)])
+REM#PY#         while not eng.wait(0.5):
+REM#PY#             d0 = time.perf_counter()
+REM#PY#             update_display(eng, sched.added, "SIMULATED", sched.done_count())
+REM#PY#             display_s += time.perf_counter() - d0; display_n += 1
+REM#PY#         phases['run'] = run_wall = time.time() - t0
+REM#PY#     finally:
+REM#PY#         sys.stdout.close(); sys.stdout = real_stdout
+REM#PY#         eng.close()
+REM#PY#     cpu1 = resource.getrusage(resource.RUSAGE_SELF) if resource else None
+REM#PY#     n = len(sched.finished)
+REM#PY#     report = {
+REM#PY#         'files': count, 'jobs': n, 'skipped': counts['skip'], 'failed': sum(1 for j in sched.finished if not j.ok),
+REM#PY#         'slots': slots, 'speed': speed, 'fail_rate': fail_rate, 'phases_s': {k: round(v, 3) for k, v in phases.items()},
+REM#PY#         'jobs_per_s': round(n / run_wall, 1) if run_wall else 0.0,
+REM#PY#         'overhead_ms_per_job': round((run_wall * slots - sim.busy_s) / n * 1000, 3) if n else 0.0,
+REM#PY#         'cpu_s': round(cpu1.ru_utime + cpu1.ru_stime - cpu0.ru_utime - cpu0.ru_stime, 2) if cpu0 else None,
+REM#PY#         'peak_rss_mb': round(cpu1.ru_maxrss / (1024 * 1024 if SYSTEM == "Darwin" else 1024), 1) if cpu1 else None,
+REM#PY#         'display': {'calls': display_n, 'avg_ms': round(display_s / display_n * 1000, 3) if display_n else 0.0},
+REM#PY#         'locks': {l.name: {'acquired': l.acquired, 'contended': l.contended, 'wait_ms': round(l.wait_s * 1000, 1)}
+REM#PY#                   for l in locks},
+REM#PY#     }
+REM#PY#     if report['cpu_s'] is not None: report['cpu_ms_per_job'] = round(report['cpu_s'] / max(1, n) * 1000, 3)
+REM#PY#     t0 = time.time()
+REM#PY#     shutil.rmtree(root, ignore_errors=True)
+REM#PY#     for f in (eng.journal.path, eng.probes.path, eng.metrics.path):
+REM#PY#         if f.exists(): f.unlink()
+REM#PY#     report['phases_s']['cleanup'] = round(time.time() - t0, 3)
+REM#PY#     out = SIM_DIR / f"sim-{time.strftime('%Y%m%d-%H%M%S')}.json"
+REM#PY#     with open(out, 'w', encoding='utf-8') as f: json.dump(report, f, indent=2)
+REM#PY#     print(json.dumps(report, indent=2))
+REM#PY#     print(f" {C.SUCCESS}[+] Report: {out}{C.RESET}")
+REM#PY#     return 0
 REM#PY# 
 REM#PY# def show_security_notice(log_msg, drive_type=None):
 REM#PY#     clear_screen(); w = 70
@@ -1352,12 +2947,13 @@ REM#PY#     enable_ansi()
 REM#PY#     # Signal Handling for Ctrl+C
 REM#PY#     import signal
 REM#PY#     def signal_handler(sig, frame):
-REM#PY#         PROCESS_MGR.kill_all()
+REM#PY#         Engine.kill_all()
 REM#PY#         show_cursor()
 REM#PY#         print(f"\n\n {C.WARNING}[!] EMERGENCY STOP: Interrupted by user (Signal {sig}).{C.RESET}")
 REM#PY#         print(f" {C.SUCCESS}[+] Cleanup complete. You may now exit.{C.RESET}")
-REM#PY#         cleanup_temp_files(); sys.exit(130)
+REM#PY#         cleanup_temp_files(recursive=config.get('recursive', False)); sys.exit(130)
 REM#PY#     signal.signal(signal.SIGINT, signal_handler)
+REM#PY#     config = {}
 REM#PY# 
 REM#PY#     parser = argparse.ArgumentParser(description=f"{APP_NAME} v{VERSION}", formatter_class=argparse.RawDescriptionHelpFormatter)
 REM#PY#     parser.add_argument('-r', '--recursive', action='store_true', help='Search subfolders')
@@ -1365,12 +2961,67 @@ REM#PY#     parser.add_argument('-w', '--workers', type=int, help='Parallel thre
 REM#PY#     parser.add_argument('--height', type=int, help='Target height')
 REM#PY#     parser.add_argument('--desktop-log', action='store_true', help='Log to Desktop')
 REM#PY#     parser.add_argument('--codec', choices=['auto', 'h264_nvenc', 'h264_qsv', 'h264_vaapi', 'libx264'], default='auto')
+REM#PY#     parser.add_argument('--cpu-budget', type=int, help='Cores to use in total (leave the rest free)')
+REM#PY#     parser.add_argument('--stream', action='store_true', help='Start encoding while the scan is still running')
+REM#PY#     parser.add_argument('--watch', action='store_true', help='Headless daemon: keep watching the folder and process new files')
+REM#PY#     parser.add_argument('--benchmark', action='store_true', help='Encode a synthetic corpus across a config matrix and compare with the baseline')
+REM#PY#     parser.add_argument('--save-baseline', action='store_true', help='With --benchmark: store this run as the new baseline')
+REM#PY#     parser.add_argument('--batch', action='store_true', help='Headless one-shot run: no prompts, settings from flags and config.json')
+REM#PY#     parser.add_argument('--progress', default='-', metavar='FILE', help="With --batch: write JSON-lines progress to FILE instead of stdout ('-')")
+REM#PY#     parser.add_argument('--metrics-port', type=int, help='Serve Prometheus metrics on 127.0.0.1:PORT/metrics')
+REM#PY#     parser.add_argument('--simulate', type=int, metavar='N', help='Load-test the orchestrator on N synthetic files with an in-process fake ffmpeg')
+REM#PY#     parser.add_argument('--sim-speed', type=float, default=2000.0, help='With --simulate: media seconds encoded per wall second')
+REM#PY#     parser.add_argument('--sim-fail', type=float, default=0.01, help='With --simulate: share of encodes that fail')
 REM#PY#     args = parser.parse_args()
 REM#PY# 
 REM#PY#     config = load_config()
 REM#PY#     if args.recursive: config['recursive'] = True
 REM#PY#     if args.workers: config['max_workers'] = args.workers
 REM#PY#     if args.height: config['target_height'] = args.height
+REM#PY#     if args.cpu_budget: config['cpu_budget'] = args.cpu_budget
+REM#PY#     if args.stream: config['prescan'] = False
+REM#PY#     if args.metrics_port: config['metrics_port'] = args.metrics_port
+REM#PY#     def open_engine():
+REM#PY#         # One run per data folder: a second instance would overwrite the first one's journal
+REM#PY#         try: return Engine(config)
+REM#PY#         except RuntimeError as e:
+REM#PY#             logging.error(str(e))
+REM#PY#             print(f" {C.ERROR}[X] Another {APP_NAME} run is using {APP_DATA}. Wait for it to finish.{C.RESET}", file=sys.stderr)
+REM#PY# 
+REM#PY#     if args.benchmark:
+REM#PY#         setup_logging(desktop_mode=args.desktop_log)
+REM#PY#         if not check_ffmpeg() and not (config['auto_download_ffmpeg'] and download_ffmpeg()): return 1
+REM#PY#         return run_benchmark(config, args.save_baseline)
+REM#PY#     if args.simulate:
+REM#PY#         setup_logging(desktop_mode=args.desktop_log)
+REM#PY#         return run_simulation(config, args.simulate, args.sim_speed, args.sim_fail)
+REM#PY#     if args.batch:
+REM#PY#         signal.signal(signal.SIGTERM, signal_handler)
+REM#PY#         setup_logging(desktop_mode=args.desktop_log)
+REM#PY#         # stdout may be the progress stream; keep download chatter off it
+REM#PY#         with contextlib.redirect_stdout(sys.stderr):
+REM#PY#             if not check_ffmpeg() and not (config['auto_download_ffmpeg'] and download_ffmpeg()): return 1
+REM#PY#         codec, _ = detect_gpu_codec(args.codec)
+REM#PY#         eng = open_engine()
+REM#PY#         if not eng: return 1
+REM#PY#         eng.serve_metrics()
+REM#PY#         return run_batch(eng, build_lanes(config, codec), args.progress)
+REM#PY# 
+REM#PY#     if args.watch:
+REM#PY#         signal.signal(signal.SIGTERM, signal_handler)
+REM#PY#         setup_logging(desktop_mode=args.desktop_log)
+REM#PY#         eng = open_engine()
+REM#PY#         if not eng: return 1
+REM#PY#         eng.recover() # Remaining jobs are picked up again by the initial scan
+REM#PY#         if not check_ffmpeg() and not (config['auto_download_ffmpeg'] and download_ffmpeg()): return 1
+REM#PY#         codec, _ = detect_gpu_codec(args.codec)
+REM#PY#         lanes = build_lanes(config, codec)
+REM#PY#         logging.info(f"Watch mode: {Path.cwd()} | lanes {describe_lanes(lanes)}")
+REM#PY#         eng.serve_metrics()
+REM#PY#         # Jobs cut short by a stop stay open in the journal and are recovered on the next start
+REM#PY#         try: watch_folder(eng, Path.cwd(), lanes)
+REM#PY#         finally: eng.close(wait=False)
+REM#PY#         return 0
 REM#PY#     
 REM#PY#     desktop_log_mode = args.desktop_log
 REM#PY#     if not args.desktop_log:
@@ -1388,7 +3039,16 @@ REM#PY#     log_msg = "Desktop/Mnemosyne_Log.txt" if desktop_log_mode else "AppD
 REM#PY#     
 REM#PY#     drive_type = get_drive_type(str(Path.cwd()))
 REM#PY#     show_security_notice(log_msg, drive_type)
-REM#PY#     audit_orphaned_backups()
+REM#PY#     # The menus below edit the engine's own config
+REM#PY#     eng = open_engine()
+REM#PY#     if not eng: return 1
+REM#PY#     config = eng.config
+REM#PY#     resume, repaired = eng.recover()
+REM#PY#     if repaired: print(f" {C.SUCCESS}[+] JOURNAL: Repaired {repaired} interrupted file swap(s).{C.RESET}")
+REM#PY#     if resume:
+REM#PY#         ans = input(f" {C.PRIMARY}>> Resume interrupted batch ({len(resume)} remaining)? (Y/N): {C.RESET}").lower().strip()
+REM#PY#         if ans == 'n': resume = []; eng.journal.end_run()
+REM#PY#     audit_orphaned_backups(config['recursive'])
 REM#PY#     
 REM#PY#     if not ensure_ffmpeg(config['auto_download_ffmpeg']): return 1
 REM#PY#     codec, codec_name = detect_gpu_codec(args.codec)
@@ -1414,17 +3074,19 @@ REM#PY#         config['recursive'] = (strat == '2')
 REM#PY#         
 REM#PY#         # 2. Priority
 REM#PY#         print(f"\n {C.PRIMARY}[BOOT] Priority:{C.RESET}")
-REM#PY#         print(f"    [1] Name A-Z  [2] Name Z-A  [3] Largest  [4] Smallest")
-REM#PY#         curr_sort = '1'
-REM#PY#         if config['sort'] == 'name_za': curr_sort = '2'
+REM#PY#         print(f"    [1] Name A-Z  [2] Name Z-A  [3] Largest  [4] Smallest  [5] Heaviest Encode")
+REM#PY#         curr_sort = '5'
+REM#PY#         if config['sort'] == 'name_az': curr_sort = '1'
+REM#PY#         elif config['sort'] == 'name_za': curr_sort = '2'
 REM#PY#         elif config['sort'] == 'size_desc': curr_sort = '3'
 REM#PY#         elif config['sort'] == 'size_asc': curr_sort = '4'
 REM#PY#         
-REM#PY#         sort_opt = get_input("Choice", curr_sort, ['1', '2', '3', '4'])
-REM#PY#         if sort_opt == '2': config['sort'] = 'name_za'
+REM#PY#         sort_opt = get_input("Choice", curr_sort, ['1', '2', '3', '4', '5'])
+REM#PY#         if sort_opt == '1': config['sort'] = 'name_az'
+REM#PY#         elif sort_opt == '2': config['sort'] = 'name_za'
 REM#PY#         elif sort_opt == '3': config['sort'] = 'size_desc'
 REM#PY#         elif sort_opt == '4': config['sort'] = 'size_asc'
-REM#PY#         else: config['sort'] = 'name_az'
+REM#PY#         else: config['sort'] = 'cost_desc'
 REM#PY# 
 REM#PY#         # 3. Engine Mode
 REM#PY#         print(f"\n {C.PRIMARY}[BOOT] Engine Mode:{C.RESET}")
@@ -1444,54 +3106,96 @@ REM#PY#              # Restore default parallel limit if switching back to paral
 REM#PY#              if config['max_workers'] == 1:
 REM#PY#                  config['max_workers'] = DEFAULT_CONFIG['max_workers']
 REM#PY# 
-REM#PY#         print(f"\n {C.INFO}[SCAN] Scanning for videos...{C.RESET}")
-REM#PY#         videos = []; cwd = Path.cwd()
-REM#PY#         pattern = cwd.rglob if config['recursive'] else cwd.glob
-REM#PY#         for ext in VIDEO_EXTENSIONS: videos.extend(list(pattern(f"*{ext}")))
-REM#PY#         videos = [v for v in videos if not any(x in v.parts for x in ["bin", "logs"])]
-REM#PY#         if not videos:
-REM#PY#             input(f" {C.WARNING}No videos found. Press ENTER to retry...{C.RESET}"); continue
-REM#PY#         
-REM#PY#         if config['sort'] == 'name_az': videos.sort()
-REM#PY#         elif config['sort'] == 'name_za': videos.sort(reverse=True)
-REM#PY#         elif config['sort'] == 'size_desc': videos.sort(key=lambda x: x.stat().st_size, reverse=True)
-REM#PY#         elif config['sort'] == 'size_asc': videos.sort(key=lambda x: x.stat().st_size)
-REM#PY# 
-REM#PY#         clear_screen(); print(draw_header(config, codec_name)); w = 70
-REM#PY#         total_in = sum(v.stat().st_size for v in videos)
-REM#PY#         draw_separator(w, 'top'); draw_box_line("MISSION BRIEFING", w, C.BOLD + C.PRIMARY); draw_separator(w, 'mid')
-REM#PY#         draw_box_line(f"Queue: {len(videos)} videos | Size: {total_in/1024/1024:.1f} MB", w)
+REM#PY#         cwd = Path.cwd(); w = 70
+REM#PY#         lanes = build_lanes(config, codec); codec_name = describe_lanes(lanes)
+REM#PY#         streaming = not config.get('prescan', True) and not resume
+REM#PY#         if streaming:
+REM#PY#             # Nothing is scanned up front: the pipeline feeds the encoders as files are found
+REM#PY#             clear_screen(); print(draw_header(config, codec_name))
+REM#PY#             draw_separator(w, 'top'); draw_box_line("MISSION BRIEFING", w, C.BOLD + C.PRIMARY); draw_separator(w, 'mid')
+REM#PY#             draw_box_line(f"Queue: streaming from {cwd.name or cwd} ({'recursive' if config['recursive'] else 'top level'})", w)
+REM#PY#             draw_box_line("Plan: decided per file while scanning, probing and encoding overlap", w, C.INFO)
+REM#PY#         else:
+REM#PY#             if resume:
+REM#PY#                 print(f"\n {C.INFO}[RESUME] Continuing {len(resume)} videos from the interrupted batch...{C.RESET}")
+REM#PY#                 stats = {v: v.stat() for v in resume if v.exists()}
+REM#PY#             else:
+REM#PY#                 print(f"\n {C.INFO}[SCAN] Scanning for videos...{C.RESET}")
+REM#PY#                 stats = scan_videos(cwd, config['recursive'], config)
+REM#PY#             videos = list(stats)
+REM#PY#             if not videos:
+REM#PY#                 input(f" {C.WARNING}No videos found. Press ENTER to retry...{C.RESET}"); continue
+REM#PY#             print(f" {C.INFO}[PROBE] Reading metadata for {len(videos)} videos...{C.RESET}")
+REM#PY#             probes = probe_all(eng, videos, max(4, config['max_workers'] * 2), stats)
+REM#PY#             jobs, counts, work, queued = queue_jobs(stats, probes, config)
+REM#PY#             if not jobs:
+REM#PY#                 input(f" {C.SUCCESS}All {counts['skip']} videos already meet the targets. Press ENTER to rescan...{C.RESET}"); continue
+REM#PY# 
+REM#PY#             clear_screen(); print(draw_header(config, codec_name))
+REM#PY#             total_in = sum(f.size for j in jobs for f in j.files)
+REM#PY#             draw_separator(w, 'top'); draw_box_line("MISSION BRIEFING", w, C.BOLD + C.PRIMARY); draw_separator(w, 'mid')
+REM#PY#             draw_box_line(f"Queue: {queued} videos | Size: {total_in/1024/1024:.1f} MB", w)
+REM#PY#             draw_box_line(f"Plan: {counts['encode']} encode | {counts['remux']} remux | {counts['skip']} skip", w, C.INFO)
+REM#PY#             draw_box_line(f"Work: {fmt_duration(work['encode'])} to encode | {fmt_duration(work['remux'])} to remux", w, C.INFO)
+REM#PY#             if len(jobs) < queued: draw_box_line(f"Dedup: {queued - len(jobs)} identical copies reuse another file's output ({config['dedup']})", w, C.INFO)
 REM#PY#         if drive_type == 2: draw_box_line("Drive: REMOVABLE MEDIA (Caution)", w, C.WARNING)
-REM#PY#         draw_box_line(f"Codec: {codec_name} | Mode: {'Parallel' if config['max_workers']>1 else 'Sequential'}", w)
+REM#PY#         draw_box_line(f"Codec: {codec_name} | Mode: {'Parallel' if config['max_workers']>1 else 'Sequential'} | CPU Budget: {cpu_budget(config)} cores", w)
 REM#PY#         draw_separator(w, 'bot')
 REM#PY#         
 REM#PY#         ans = input(f"\n {C.SUCCESS}READY TO ENGAGE.{C.RESET} Press ENTER to start, 'N' to re-config, 'S' to save: ").lower().strip()
-REM#PY#         if ans == 'n': continue
+REM#PY#         if ans == 'n': resume = []; continue
 REM#PY#         if ans == 's': save_config(config); print(f" {C.SUCCESS}[+] Settings saved.{C.RESET}"); time.sleep(1); continue
 REM#PY#         if ans == 'q': return 0
 REM#PY#         break
 REM#PY# 
-REM#PY#     start_t = time.time(); success = 0; failed = 0
+REM#PY#     start_t = time.time()
+REM#PY#     eng.serve_metrics()
+REM#PY#     if streaming:
+REM#PY#         sched = eng.start(lanes=lanes)
+REM#PY#         pipeline = Pipeline(eng, iter_videos(cwd, config['recursive'], config), max(2, config['max_workers'])).start()
+REM#PY#     else:
+REM#PY#         sched = eng.start(jobs, lanes)
 REM#PY#     clear_screen(); hide_cursor()
+REM#PY#     logging.info(f"Encoder lanes: {describe_lanes(lanes)} | {sched.slots} slot(s)")
 REM#PY#     try:
-REM#PY#         with ThreadPoolExecutor(max_workers=config['max_workers']) as executor:
-REM#PY#             futures = {executor.submit(process_video, (i % config['max_workers']) + 1, v, codec, config): v for i, v in enumerate(videos)}
-REM#PY#             while any(not f.done() for f in futures):
-REM#PY#                 update_display(len(videos), codec_name, config); time.sleep(0.5)
-REM#PY#             for f in futures:
-REM#PY#                 if f.result(): success += 1
-REM#PY#                 else: failed += 1
+REM#PY#         while not eng.wait(0.5):
+REM#PY#             update_display(eng, sched.added, codec_name, sched.done_count())
+REM#PY#         success = sum(1 for j in sched.finished if j.ok)
+REM#PY#         failed = len(sched.finished) - success
 REM#PY#     finally:
 REM#PY#         show_cursor()
+REM#PY#         eng.probes.save()
+REM#PY#     eng.close()
 REM#PY# 
 REM#PY#     end_t = time.time(); total_t = end_t - start_t
-REM#PY#     total_out = sum(v.stat().st_size for v in videos if v.exists())
+REM#PY#     total_in = sum(j.size for j in sched.finished)
+REM#PY#     total_out = sum(j.dest.stat().st_size if j.dest.exists() else (j.path.stat().st_size if j.path.exists() else 0) for j in sched.finished)
 REM#PY#     saved = total_in - total_out
+REM#PY#     span, ideal, eff = sched.makespan()
+REM#PY#     logging.info(f"Makespan {span:.1f}s vs ideal {ideal:.1f}s ({eff:.0f}% efficiency) over {sched.slots} slot(s), {len(sched.finished) / span if span > 0 else 0:.2f} files/s")
 REM#PY#     
 REM#PY#     clear_screen(); print(draw_header(config, codec_name)); w = 70
 REM#PY#     draw_separator(w, 'top'); draw_box_line("FINAL MISSION REPORT", w, C.BOLD + C.SUCCESS); draw_separator(w, 'mid')
 REM#PY#     draw_box_line(f"Status: {success} Success | {failed} Failed", w)
+REM#PY#     if streaming:
+REM#PY#         c = pipeline.counts
+REM#PY#         draw_box_line(f"Plan: {c['encode']} encode | {c['remux']} remux | {c['skip']} skip", w, C.INFO)
 REM#PY#     draw_box_line(f"Time: {int(total_t//60)}m {int(total_t%60)}s | Space Saved: {saved/1024/1024:.1f} MB", w)
+REM#PY#     draw_box_line(f"Makespan: {fmt_duration(span)} | Ideal: {fmt_duration(ideal)} | Efficiency: {eff:.0f}%", w)
+REM#PY#     draw_box_line(f"Throughput: {len(sched.finished) / span if span > 0 else 0:.2f} files/s", w, C.MUTED)
+REM#PY#     devices = sched.device_report()
+REM#PY#     if len(devices) > 1:
+REM#PY#         for mount, n, b, rate in devices:
+REM#PY#             draw_box_line(f"Disk {mount[-24:]}: {n} file(s) | {b/1024/1024:.0f} MB | {rate/1024/1024:.1f} MB/s", w, C.MUTED)
+REM#PY#     for mount, n, b, rate in devices: logging.info(f"Device {mount}: {n} file(s), {b/1024/1024:.1f} MB in, {rate/1024/1024:.2f} MB/s")
+REM#PY#     if sum(eng.gain_aborts.values()):
+REM#PY#         draw_box_line(f"Kept originals: {sum(eng.gain_aborts.values())} (< {config['min_savings']}% saving, {eng.gain_aborts['early']} stopped early)", w, C.MUTED)
+REM#PY#     for level, (n, secs) in eng.verify_totals.items():
+REM#PY#         draw_box_line(f"Verify ({level}): {n} file(s) | avg {secs / n:.2f}s | total {fmt_duration(secs)}", w, C.MUTED)
+REM#PY#     stages = eng.metrics.stage_totals()
+REM#PY#     if any(n for n, _ in stages.values()):
+REM#PY#         draw_box_line("Avg: " + " | ".join(f"{s} {secs / n:.1f}s" for s, (n, secs) in stages.items() if n), w, C.MUTED)
+REM#PY#         logging.info("Stage totals: " + ", ".join(f"{s} {n} job(s) {secs:.1f}s" for s, (n, secs) in stages.items()))
 REM#PY#     draw_separator(w, 'bot')
 REM#PY#     cleanup_temp_files()
 REM#PY#     print(f"\n {C.SUCCESS}All operations completed successfully.{C.RESET}")
@@ -1500,7 +3204,7 @@ REM#PY#
 REM#PY# if __name__ == "__main__":
 REM#PY#     try: sys.exit(main())
 REM#PY#     except KeyboardInterrupt:
-REM#PY#         PROCESS_MGR.kill_all()
+REM#PY#         Engine.kill_all()
 REM#PY#         show_cursor()
 REM#PY#         print(f"\n\n {C.WARNING}[!] EMERGENCY STOP: Interrupted by user.{C.RESET}")
 REM#PY#         print(f" {C.SUCCESS}[+] Operations terminated. Original videos are safe, you may now exit.{C.RESET}")
@@ -24,8 +24,11 @@ if [ -f "$SCRIPT_DIR/mnemosyne.py" ]; then
     exit $?
 fi
 
-# Multi-line string embedding for the Python core
-python3 - << 'PY_EOF' "$@"
+# Embedded Python core, written to a temp file so the terminal stays on stdin for the prompts
+TMP_DIR="$(mktemp -d "${TMPDIR:-/tmp}/mnemosyne_runtime_XXXXXX")"
+trap 'rm -rf "$TMP_DIR"' EXIT
+TMP_PY="$TMP_DIR/mnemosyne.py"
+cat > "$TMP_PY" << 'PY_EOF'
 # -*- coding: utf-8 -*-
 """
 Mnemosyne V1.1 - The Keeper of Digital Memory
@@ -35,24 +38,12 @@ Licensed under GNU GPL v3.0
 This software relies on FFmpeg (https://ffmpeg.org) for video processing.
 FFmpeg is licensed under the LGPL/GPL.
 """
-import os, sys, platform, subprocess, shutil, time, datetime, json, argparse, threading, traceback, logging, random
+import os, sys, platform, subprocess, shutil, time, datetime, json, argparse, threading, traceback, logging, random, selectors, collections, fnmatch, queue, bisect, hashlib, heapq, zlib, contextlib, weakref
 from pathlib import Path
-from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import ThreadPoolExecutor, Future, CancelledError, wait, FIRST_COMPLETED
 from typing import Tuple, Dict, List
 from logging.handlers import RotatingFileHandler
 
-if platform.system() == "Windows":
-    try:
-        import ctypes
-        # Enable VT100 support for ANSI colors
-        kernel32 = ctypes.windll.kernel32
-        hStdOut = kernel32.GetStdHandle(-11)
-        mode = ctypes.c_ulong()
-        kernel32.GetConsoleMode(hStdOut, ctypes.byref(mode))
-        mode.value |= 0x0004 # ENABLE_VIRTUAL_TERMINAL_PROCESSING
-        kernel32.SetConsoleMode(hStdOut, mode)
-    except: pass
-
 VERSION, APP_NAME = "1.1", "Mnemosyne"
 SYSTEM, IS_WINDOWS = platform.system(), platform.system() == "Windows"
 
@@ -63,6 +54,12 @@ else:
     APP_DATA = Path.home() / ".mnemosyne"
 
 LOG_DIR = APP_DATA / "logs"
+PROBE_CACHE_FILE = APP_DATA / "probe_cache.json"
+JOURNAL_FILE = APP_DATA / "journal.jsonl"
+METRICS_FILE = APP_DATA / "metrics.jsonl"
+WATCH_STATE_FILE = APP_DATA / "watch_state.json"
+ENCODER_CACHE_FILE = APP_DATA / "encoders.json"
+PROBE_SCHEMA = 2 # Bump when run_ffprobe() starts collecting new fields
 BIN_DIR = Path("bin")
 CONFIG_FILE = Path("config.json")
 
@@ -75,20 +72,102 @@ DEFAULT_CONFIG = {
     "max_workers": max(1, os.cpu_count() // 2) if os.cpu_count() else 2,
     "recursive": False,
     "verify_frames": True,
+    "verify_level": "sampled",
+    "verify_samples": 5,
+    "stall_timeout": 300,
     "auto_download_ffmpeg": True,
-    "sort": "name_az",
+    "sort": "cost_desc",
     "desktop_log": True,
     "auto_cleanup": True,
     "show_drive_warnings": True,
-    "preserve_metadata": True
+    "preserve_metadata": True,
+    "skip_compliant": True,
+    "cpu_budget": 0,
+    "encoder_lanes": [],
+    "hw_failure_limit": 3,
+    "container_remux": [],
+    "exclude_dirs": ["bin", "logs"],
+    "include": [],
+    "exclude": [],
+    "prescan": True,
+    "pipeline_depth": 64,
+    "watch_settle": 10,
+    "watch_interval": 30,
+    "watch_inotify": True,
+    "segment_min_duration": 1800,
+    "segment_seconds": 300,
+    "renditions": [],
+    "batch_max_duration": 15,
+    "batch_size": 8,
+    "scratch_dir": "",
+    "scratch_quota_gb": 0,
+    "device_workers": 0,
+    "device_limits": {},
+    "min_savings": 5,
+    "dedup": "copy",
+    "x264_preset": "medium",
+    "metrics_log": True,
+    "metrics_port": 0,
+    "benchmark": {"workers": [], "cpu_budget": [0], "presets": ["medium", "veryfast"], "verify": [True, False], "tolerance": 10}
 }
 VIDEO_EXTENSIONS = {'.mp4', '.mkv', '.avi', '.mov', '.flv', '.wmv', '.webm', '.ts', '.m4v'}
-LOCK = threading.Lock()
+# Written into every output; ffmpeg muxers overwrite 'encoder', so 'comment' carries the marker
+ENCODER_TAG = f"{APP_NAME} v{VERSION}"
 
-class ProcessManager:
+def marker_comment(info):
+    # Setting 'comment' replaces the one copied from the source, so the marker is appended to it
+    prev = ((info or {}).get('comment') or '').strip()
+    return f"{prev} | {ENCODER_TAG}" if prev else ENCODER_TAG
+
+class ProgressParser:
+    # Incremental parser for ffmpeg '-progress' output: key=value lines, each block closed by progress=continue|end
     def __init__(self):
+        self.buf = b''
+        self.block = {}
+    def feed(self, data):
+        self.buf += data
+        *lines, self.buf = self.buf.split(b'\n')
+        blocks = []
+        for raw in lines:
+            key, sep, value = raw.decode('utf-8', 'replace').strip().partition('=')
+            if not sep: continue
+            self.block[key] = value
+            if key == 'progress':
+                blocks.append(self.block); self.block = {}
+        return blocks
+
+class FFmpegHandle:
+    def __init__(self, proc, on_progress=None, stall_timeout=None, metrics=None):
+        self.proc, self.on_progress, self.stall_timeout = proc, on_progress, stall_timeout
+        self.parser = ProgressParser()
+        self.stderr_tail = collections.deque(maxlen=20)
+        self.err_buf = b''
+        self.open_pipes = 2
+        self.last_activity = time.time()
+        self.cancel_at = self.exited_at = None
+        self.returncode = None
+        self.done = threading.Event()
+        self.metrics = metrics # Stage record of the job that spawned it, if any
+        self.started, self.cpu = time.time(), None
+        self.speed_sum, self.speed_n = 0.0, 0
+    def wait(self, timeout=None):
+        self.done.wait(timeout)
+        return self.returncode
+    def error_text(self): return " | ".join(self.stderr_tail)
+
+class ProcessManager:
+    # Supervises every ffmpeg child from a single selector loop: progress parsing, stall timeouts, cancellation.
+    # On Windows, where pipes can't be selected, each child gets reader threads and a watchdog thread instead.
+    def __init__(self, metrics=None):
         self.active_procs = set()
         self.lock = threading.Lock()
+        self.handles = {}
+        self.sel = None
+        self.thread = None
+        self.wake_r = self.wake_w = None
+        self.peak_rss = 0 # Largest ffmpeg high-water mark seen (bytes, Linux only)
+        self.metrics = metrics # JobMetrics whose per-thread job record each child is credited to
+        self.on_spawn = None # Called with every new handle, from the spawning thread
     def register(self, proc):
         with self.lock: self.active_procs.add(proc)
     def unregister(self, proc):
@@ -101,7 +180,126 @@ class ProcessManager:
                     try: p.wait(timeout=2)
                     except subprocess.TimeoutExpired: p.kill()
                 except: pass
-PROCESS_MGR = ProcessManager()
+    def _handle(self, proc, on_progress, stall_timeout):
+        h = FFmpegHandle(proc, on_progress, stall_timeout, self.metrics.current() if self.metrics else None)
+        self.register(proc)
+        if self.on_spawn: self.on_spawn(h)
+        return h
+    def spawn(self, cmd, on_progress=None, stall_timeout=None):
+        kw = {'creationflags': 0x00000200} if IS_WINDOWS else {} # CREATE_NEW_PROCESS_GROUP
+        proc = subprocess.Popen(cmd, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.PIPE, **kw)
+        h = self._handle(proc, on_progress, stall_timeout)
+        if IS_WINDOWS:
+            # Windows select() only works on sockets, so pipes get a blocking reader thread each
+            for pipe in (proc.stdout, proc.stderr):
+                threading.Thread(target=self._pump, args=(h, pipe), daemon=True).start()
+            threading.Thread(target=self._reap_blocking, args=(h,), daemon=True).start()
+            return h
+        with self.lock:
+            if self.thread is None:
+                self.sel = selectors.DefaultSelector()
+                self.wake_r, self.wake_w = os.pipe()
+                os.set_blocking(self.wake_r, False)
+                self.sel.register(self.wake_r, selectors.EVENT_READ, None)
+                self.thread = threading.Thread(target=self._loop, name="ffmpeg-supervisor", daemon=True)
+                self.thread.start()
+            self.handles[proc.pid] = h
+            for pipe in (proc.stdout, proc.stderr):
+                os.set_blocking(pipe.fileno(), False)
+                self.sel.register(pipe, selectors.EVENT_READ, h)
+        os.write(self.wake_w, b'x')
+        return h
+    def cancel(self, h):
+        if h.cancel_at is None:
+            h.cancel_at = time.time()
+            try: h.proc.terminate()
+            except: pass
+    def _on_data(self, h, pipe, data):
+        h.last_activity = time.time()
+        if pipe is h.proc.stdout:
+            for block in h.parser.feed(data):
+                if SYSTEM == "Linux": self._sample_rss(h)
+                try: h.speed_sum += float(block.get('speed', '').strip().rstrip('x')); h.speed_n += 1
+                except ValueError: pass
+                if h.on_progress:
+                    try: h.on_progress(block)
+                    except: pass
+        else:
+            h.err_buf += data
+            *lines, h.err_buf = h.err_buf.split(b'\n')
+            for l in lines:
+                if l.strip(): h.stderr_tail.append(l.decode('utf-8', 'replace').strip())
+    def _sample_rss(self, h):
+        # VmHWM is the kernel's own peak, so sampling once per progress block catches the maximum
+        try:
+            with open(f"/proc/{h.proc.pid}/status", 'rb') as f:
+                for line in f:
+                    if line.startswith(b'VmHWM:'):
+                        self.peak_rss = max(self.peak_rss, int(line.split()[1]) * 1024); break
+        except (OSError, ValueError): pass
+    def _poll(self, h):
+        # Reap with wait4() so each child's own CPU time is known; Popen.poll() only reports the exit code
+        if h.proc.returncode is not None or not hasattr(os, 'wait4'): return h.proc.poll()
+        try: pid, status, ru = os.wait4(h.proc.pid, os.WNOHANG)
+        except ChildProcessError: return h.proc.poll() # Already reaped by Popen (e.g. inside terminate())
+        if not pid: return None
+        h.cpu = ru.ru_utime + ru.ru_stime
+        h.proc.returncode = os.waitstatus_to_exitcode(status)
+        return h.proc.returncode
+    def _finish(self, h, rc):
+        h.returncode = rc
+        self.unregister(h.proc)
+        if h.metrics is not None: JobMetrics.child_done(h)
+        h.done.set()
+    def _pump(self, h, pipe):
+        for data in iter(lambda: pipe.read1(65536), b''): self._on_data(h, pipe, data)
+    def _reap_blocking(self, h):
+        # Windows: no selector loop, so the thread waiting on the child also enforces its stall timeout
+        while True:
+            try: rc = h.proc.wait(timeout=0.5); break
+            except subprocess.TimeoutExpired: self._watchdog(h, time.time())
+        self._finish(h, rc)
+    def _watchdog(self, h, now):
+        # Terminate a child that stopped producing output; kill one that ignored terminate() for 2s
+        if h.stall_timeout and h.cancel_at is None and now - h.last_activity > h.stall_timeout:
+            logging.warning(f"ffmpeg (pid {h.proc.pid}) stalled for {h.stall_timeout}s, terminating")
+            self.cancel(h)
+        if h.cancel_at and now - h.cancel_at > 2 and self._poll(h) is None:
+            try: h.proc.kill()
+            except: pass
+    def _loop(self):
+        while True:
+            # Pipes usually hit EOF just before the process exits: poll those children again right away
+            with self.lock: exiting = any(h.open_pipes == 0 for h in self.handles.values())
+            for key, _ in self.sel.select(timeout=0.002 if exiting else 0.5):
+                h = key.data
+                if h is None:
+                    try: os.read(self.wake_r, 4096)
+                    except BlockingIOError: pass
+                    continue
+                try: data = os.read(key.fd, 65536)
+                except BlockingIOError: continue
+                except OSError: data = b''
+                if data: self._on_data(h, key.fileobj, data)
+                else:
+                    with self.lock: self.sel.unregister(key.fileobj)
+                    key.fileobj.close(); h.open_pipes -= 1
+            now = time.time()
+            with self.lock: handles = list(self.handles.values())
+            for h in handles:
+                self._watchdog(h, now)
+                if self._poll(h) is None: continue
+                h.exited_at = h.exited_at or now
+                # Normally both pipes hit EOF first; a leaked grandchild may hold them open past exit
+                if h.open_pipes == 0 or now - h.exited_at > 2:
+                    with self.lock:
+                        self.handles.pop(h.proc.pid, None)
+                        for pipe in (h.proc.stdout, h.proc.stderr):
+                            if pipe.closed: continue
+                            try: self.sel.unregister(pipe)
+                            except: pass
+                            pipe.close()
+                    self._finish(h, h.proc.returncode)
 
 if IS_WINDOWS:
     DRIVE_FIXED = 3
@@ -157,6 +355,7 @@ INFO_TICKER = [
     "✦ Open source transparency - every line of code is auditable.",
     "◆ Atomic file operations prevent corruption from interruptions.",
     "◈ Smart codec detection automatically selects best encoder.",
+    "➤ Removable drive safety: Warnings prevent accidental disconnection."
 ]
 
 # Logging setup
@@ -196,7 +395,24 @@ def reset_cursor():
 def hide_cursor(): sys.stdout.write("\033[?25l"); sys.stdout.flush()
 def show_cursor(): sys.stdout.write("\033[?25h"); sys.stdout.flush()
 
-def clear_screen(): os.system('cls' if IS_WINDOWS else 'clear')
+def clear_screen():
+    screen.reset()
+    # Plain escape codes where the terminal understands them; spawning a shell per clear is slow
+    if IS_WINDOWS: os.system('cls')
+    else: sys.stdout.write("\033[2J\033[H"); sys.stdout.flush()
+
+class ScreenDiff:
+    # Keeps the last frame and rewrites only the lines that changed since it
+    def __init__(self):
+        self.lines = []
+    def reset(self): self.lines = []
+    def draw(self, text):
+        lines = text.split("\n")
+        out = [f"\033[{i + 1};1H{line}\033[K" for i, line in enumerate(lines) if i >= len(self.lines) or self.lines[i] != line]
+        if len(lines) < len(self.lines): out.append(f"\033[{len(lines) + 1};1H\033[J")
+        self.lines = lines
+        if out: sys.stdout.write("".join(out)); sys.stdout.flush()
+screen = ScreenDiff()
 
 def get_drive_type(path):
     if not IS_WINDOWS: return 3
@@ -206,21 +422,20 @@ def get_drive_type(path):
         return ctypes.windll.kernel32.GetDriveTypeW(root)
     except: return 3 
 
-def cleanup_temp_files(work_dir=None):
+def cleanup_temp_files(work_dir=None, recursive=False):
     work_dir = Path(work_dir) if work_dir else Path.cwd()
     count = 0
-    for p in ["mnemosyne_tmp_*", "temp_*"]:
-        for f in work_dir.glob(p):
-            if p == "temp_*" and f.suffix.lower() not in VIDEO_EXTENSIONS: continue
-            try: f.unlink(); count += 1
-            except: pass
+    # Only names Mnemosyne itself writes; anything else in a library may be a user's own video
+    for f in (work_dir.rglob("mnemosyne_tmp_*") if recursive else work_dir.glob("mnemosyne_tmp_*")):
+        try: f.unlink(); count += 1
+        except: pass
     return count
 
-def audit_orphaned_backups():
+def audit_orphaned_backups(recursive=False):
     cwd = Path.cwd()
-    t_count = cleanup_temp_files(cwd)
+    t_count = cleanup_temp_files(cwd, recursive)
     if t_count > 0: print(f" {C.INFO}[+] Auto-cleaned {t_count} temporary file(s).{C.RESET}")
-    baks = list(cwd.glob("*.bak"))
+    baks = list(cwd.rglob("*.bak") if recursive else cwd.glob("*.bak"))
     if not baks:
         if t_count == 0: print(f" {C.SUCCESS}[+] HEALTH CHECK: System is clean.{C.RESET}")
         return
@@ -297,7 +512,7 @@ def draw_header(config, codec_name):
     output.append(sep)
     
     c_info = f"RES: {config['target_height']}p  FPS: {config['target_fps']}  BIT: {config['video_bitrate']}"
-    e_info = f"ENC: {codec_name}  WRK: {config['max_workers']}"
+    e_info = f"ENC: {codec_name}  WRK: {config['max_workers']}  CPU: {cpu_budget(config)}"
     output.append(box_line(c_info, C.INFO))
     output.append(box_line(e_info, C.INFO))
     output.append(sep)
@@ -330,22 +545,23 @@ def render_progress(label, percent, fps, speed, size_stats, eta=""):
         return f" {C.PRIMARY}{arrow_icon}{C.RESET} {C.WHITE}{label:<20}{C.RESET} {bar} {C.INFO}{percent:5.1f}%{C.RESET}\n   {C.MUTED}{pipe_icon} {spd_disp} | {fps_disp} fps{eta_disp}{C.RESET}"
 
 class WorkerStats:
-    def __init__(self):
+    # Each update publishes a fresh snapshot dict; a single item assignment is atomic, so readers need no lock
+    def __init__(self, listener=None):
         self.stats = {}
-        self.starts = {}
+        self.listener = listener # Called with (slot, snapshot) on every update
     def update(self, wid, fn, pct, fps, speed, size_stats=""):
-        with LOCK:
-            if wid not in self.starts: self.starts[wid] = time.time()
-            self.stats[wid] = {'fn': fn, 'pct': pct, 'fps': fps, 'speed': speed, 'size': size_stats, 'start': self.starts[wid]}
-    def get_all(self):
-        with LOCK: return self.stats.copy()
-    def remove_worker(self, wid):
-        with LOCK:
-            self.stats.pop(wid, None)
-            self.starts.pop(wid, None)
+        prev = self.stats.get(wid)
+        # Slots are reused across jobs, so a new file on the slot restarts its clock
+        start = prev['start'] if prev and prev['fn'] == fn else time.time()
+        self.stats[wid] = s = {'fn': fn, 'pct': pct, 'fps': fps, 'speed': speed, 'size': size_stats, 'start': start}
+        if self.listener: self.listener(wid, s)
+    def get_all(self): return dict(self.stats)
+    def remove_worker(self, wid): self.stats.pop(wid, None)
 
 # Helper functions (metadata, ffmpeg)
-def get_file_metadata(path): return (path.stat().st_ctime, path.stat().st_atime, path.stat().st_mtime)
+def get_file_metadata(path, st=None):
+    st = st or path.stat()
+    return (st.st_ctime, st.st_atime, st.st_mtime)
 def restore_file_metadata(path, metadata):
     ctime, atime, mtime = metadata
     os.utime(path, (atime, mtime))
@@ -417,135 +633,1680 @@ def ensure_ffmpeg(auto_download=True):
         if input(f"{C.PRIMARY}>> Download FFmpeg automatically? (Y/N): {C.RESET}").lower() != 'y': return False
     return download_ffmpeg()
 
+# Concurrent sessions per hardware encoder (consumer NVENC drivers cap sessions)
+HW_LANE_SLOTS = {"h264_nvenc": 3, "h264_qsv": 2, "h264_vaapi": 2, "h264_videotoolbox": 2}
+CODEC_LABELS = {"h264_nvenc": "NVIDIA (NVENC)", "h264_qsv": "Intel QuickSync", "h264_videotoolbox": "Apple VideoToolbox", "h264_vaapi": "VAAPI", "libx264": "CPU (x264)"}
+HW_CODECS = ["h264_nvenc", "h264_qsv", "h264_videotoolbox", "h264_vaapi"]
+
+def ffmpeg_version(ffmpeg="ffmpeg"):
+    try: return subprocess.run([ffmpeg, "-version"], capture_output=True, text=True, timeout=5).stdout.split('\n')[0].strip()
+    except: return ""
+
+def trial_encode(codec, ffmpeg="ffmpeg"):
+    # Half a second of synthetic video proves the encoder actually opens on this machine
+    cmd = [ffmpeg, "-nostdin", "-v", "error", "-f", "lavfi", "-i", "testsrc2=size=320x240:rate=30", "-t", "0.5", "-c:v", codec, "-f", "null", "-"]
+    try: return subprocess.run(cmd, capture_output=True, timeout=30).returncode == 0
+    except: return False
+
+def encoder_works(codec, ffmpeg="ffmpeg"):
+    # Trial results cached per host, binary and ffmpeg version
+    key = f"{platform.node()}|{ffmpeg}|{ffmpeg_version(ffmpeg)}"
+    try:
+        with open(ENCODER_CACHE_FILE, 'r', encoding='utf-8') as f: cache = json.load(f)
+    except: cache = {}
+    results = cache.setdefault(key, {})
+    if codec not in results:
+        results[codec] = trial_encode(codec, ffmpeg)
+        logging.info(f"Encoder trial {codec} ({ffmpeg}): {'OK' if results[codec] else 'UNUSABLE'}")
+        try:
+            ENCODER_CACHE_FILE.parent.mkdir(parents=True, exist_ok=True)
+            with open(ENCODER_CACHE_FILE, 'w', encoding='utf-8') as f: json.dump(cache, f, indent=2)
+        except: pass
+    return results[codec]
+
 def detect_gpu_codec(force_codec=None):
+    try: listed = subprocess.run(["ffmpeg", "-encoders"], capture_output=True, text=True, timeout=5).stdout
+    except: return ("libx264", "CPU (x264)")
     if force_codec and force_codec != 'auto':
-        try:
-            r = subprocess.run(["ffmpeg", "-encoders"], capture_output=True, text=True, timeout=5)
-            if force_codec in r.stdout: return (force_codec, f"{force_codec.upper()} [FORCED]")
+        if force_codec in listed and (force_codec == "libx264" or encoder_works(force_codec)):
+            return (force_codec, f"{force_codec.upper()} [FORCED]")
+    for c in HW_CODECS:
+        # Compiled in is not enough: NVENC/QSV builds often fail without the driver or device
+        if c in listed and encoder_works(c): return (c, CODEC_LABELS[c])
+    return ("libx264", "CPU (x264)")
+
+def parse_rate(rate):
+    try:
+        n, _, d = str(rate).partition('/')
+        return float(n) / float(d) if d else float(n)
+    except: return 0.0
+
+def run_ffprobe(path, timeout=30):
+    # One structured probe per file: container, streams, codecs, tags
+    cmd = ["ffprobe", "-v", "error", "-show_entries",
+           "format=duration,start_time,bit_rate,format_name:format_tags=encoder,comment:stream=index,codec_type,codec_name,width,height,avg_frame_rate,r_frame_rate,nb_frames,bit_rate,duration,channels",
+           "-of", "json", str(path)]
+    r = subprocess.run(cmd, capture_output=True, text=True, encoding='utf-8', errors='replace', timeout=timeout)
+    # A failed probe raises instead of returning an empty result, so it is never cached and can be retried
+    if r.returncode != 0: raise Exception(f"ffprobe exited with code {r.returncode}: {r.stderr.strip()[-200:]}")
+    try: data = json.loads(r.stdout or "{}")
+    except ValueError: data = {}
+    if 'format' not in data or 'streams' not in data: raise Exception("ffprobe returned no format or stream data")
+    fmt, streams = data['format'], data['streams']
+    tags = {k.lower(): v for k, v in (fmt.get('tags') or {}).items()}
+    info = {'duration': 0.0, 'start': 0.0, 'bitrate': 0, 'format': fmt.get('format_name', ''), 'encoder': tags.get('encoder', ''), 'comment': tags.get('comment', ''),
+            'vcodec': None, 'width': 0, 'height': 0, 'fps': 0.0, 'nb_frames': -1, 'vbitrate': 0,
+            'acodec': None, 'abitrate': 0, 'streams': []}
+    try: info['duration'] = float(fmt.get('duration') or 0)
+    except: pass
+    try: info['bitrate'] = int(fmt.get('bit_rate') or 0)
+    except: pass
+    try: info['start'] = float(fmt.get('start_time') or 0)
+    except: pass
+    for s in streams:
+        entry = {k: s[k] for k in ('index', 'codec_type', 'codec_name', 'width', 'height', 'avg_frame_rate', 'nb_frames', 'bit_rate', 'duration', 'channels') if k in s}
+        info['streams'].append(entry)
+        if s.get('codec_type') == 'video' and info['vcodec'] is None:
+            info['vcodec'] = s.get('codec_name')
+            info['width'], info['height'] = int(s.get('width') or 0), int(s.get('height') or 0)
+            info['fps'] = parse_rate(s.get('avg_frame_rate')) or parse_rate(s.get('r_frame_rate'))
+            try: info['nb_frames'] = int(s.get('nb_frames') or -1)
+            except: pass
+            try: info['vbitrate'] = int(s.get('bit_rate') or 0)
+            except: pass
+        elif s.get('codec_type') == 'audio' and info['acodec'] is None:
+            info['acodec'] = s.get('codec_name')
+            try: info['abitrate'] = int(s.get('bit_rate') or 0)
+            except: pass
+    if not info['duration']:
+        try: info['duration'] = max(float(s.get('duration') or 0) for s in streams)
         except: pass
+    return info
+
+class ProbeCache:
+    # Persistent ffprobe results keyed by path, validated by (size, mtime, inode)
+    def __init__(self, path=PROBE_CACHE_FILE, runner=run_ffprobe):
+        self.path = path
+        self.runner = runner # path -> probe info; the engine swaps in its simulator here
+        self.entries = None
+        self.dirty = False
+        self.lock = threading.Lock()
+    def load(self):
+        with self.lock:
+            if self.entries is not None: return
+            self.entries = {}
+            try:
+                with open(self.path, 'r', encoding='utf-8') as f: self.entries = json.load(f)
+            except: pass
+            # probe_s only describes probes run by this process; a cached entry costs this run nothing
+            for e in self.entries.values(): e.pop('probe_s', None)
+    def save(self):
+        if self.entries is None or not self.dirty: return False
+        try:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            tmp = self.path.with_suffix('.tmp')
+            with self.lock:
+                with open(tmp, 'w', encoding='utf-8') as f: json.dump(self.entries, f, separators=(',', ':'))
+                self.dirty = False
+            os.replace(tmp, self.path)
+            return True
+        except: return False
+    @staticmethod
+    def signature(st): return [st.st_size, st.st_mtime_ns, st.st_ino]
+    def get(self, path, st=None):
+        self.load()
+        st = st or os.stat(path)
+        with self.lock: entry = self.entries.get(str(path))
+        if entry and entry.get('sig') == self.signature(st) and entry.get('schema') == PROBE_SCHEMA: return entry
+        return None
+    def probe(self, path, st=None):
+        st = st or os.stat(path)
+        entry = self.get(path, st)
+        if entry: return entry
+        t0 = time.time()
+        info = self.runner(path)
+        info['probe_s'] = time.time() - t0
+        self.store(path, info, st)
+        return info
+    def store(self, path, info, st=None):
+        self.load()
+        st = st or os.stat(path)
+        info.update({'schema': PROBE_SCHEMA, 'sig': self.signature(st), 'size': st.st_size, 'mtime': st.st_mtime, 'dev': st.st_dev})
+        with self.lock:
+            self.entries[str(path)] = info
+            self.dirty = True
+        return info
+    def mark(self, path, key, value):
+        # Attach a verdict to a still-valid entry; it disappears with the entry when the file changes
+        entry = self.get(path)
+        if not entry: return
+        with self.lock:
+            entry[key] = value
+            self.dirty = True
+    def forget(self, path):
+        self.load()
+        with self.lock:
+            if self.entries.pop(str(path), None) is not None: self.dirty = True
+
+def path_filters(root, config):
+    # (wanted_file, wanted_dir) predicates taking (path, name): the video/temp name rules, exclude_dirs
+    # and the include/exclude globs, which match the path relative to root or the bare name
+    root = Path(root)
+    skip_dirs = {d.lower() for d in config.get('exclude_dirs', [])}
+    include, exclude = config.get('include', []), config.get('exclude', [])
+    def rel(path): return os.path.relpath(path, root).replace(os.sep, '/')
+    def matches(path, name, patterns):
+        r, name = rel(path).lower(), name.lower()
+        return any(fnmatch.fnmatchcase(r, p.lower()) or fnmatch.fnmatchcase(name, p.lower()) for p in patterns)
+    def wanted_dir(path, name):
+        return name.lower() not in skip_dirs and not matches(path, name, exclude)
+    def wanted_file(path, name):
+        if os.path.splitext(name)[1].lower() not in VIDEO_EXTENSIONS or name.startswith("mnemosyne_tmp_"): return False
+        if include and not matches(path, name, include): return False
+        return not (exclude and matches(path, name, exclude))
+    return wanted_file, wanted_dir
+
+def iter_videos(root, recursive=False, config=None, max_workers=8, filters=None):
+    # One scandir walk for all extensions; excluded folders are pruned before descending
+    # and each file's stat result is kept. Subfolders are scanned in parallel and
+    # (path, stat) pairs are yielded as soon as their folder is read.
+    # filters: path_filters() of an enclosing root when scanning one of its subfolders.
+    config = config or DEFAULT_CONFIG
+    root = Path(root)
+    wanted_file, wanted_dir = filters or path_filters(root, config)
+    def scan_dir(d):
+        files, subdirs = [], []
+        try:
+            with os.scandir(d) as it:
+                for e in it:
+                    try:
+                        if e.is_dir(follow_symlinks=False):
+                            if recursive and wanted_dir(e.path, e.name): subdirs.append(e.path)
+                        elif wanted_file(e.path, e.name):
+                            files.append((Path(e.path), e.stat()))
+                    except OSError: pass
+        except OSError as ex: logging.warning(f"Scan skipped {d}: {ex}")
+        return files, subdirs
+    with ThreadPoolExecutor(max_workers=max_workers) as ex:
+        pending = {ex.submit(scan_dir, str(root))}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for f in done:
+                files, subdirs = f.result()
+                pending |= {ex.submit(scan_dir, d) for d in subdirs}
+                yield from files
+
+def scan_videos(root, recursive=False, config=None, max_workers=8):
+    return dict(iter_videos(root, recursive, config, max_workers))
+
+def probe_all(eng, paths, max_workers=8, stats=None):
+    # Fill the cache in parallel; cached entries cost one stat() and no ffprobe spawn
+    stats = stats or {}
+    def safe_probe(p):
+        try: return p, eng.probes.probe(p, stats.get(p))
+        except Exception as e:
+            logging.warning(f"Probe failed for {p.name}: {e}")
+            return p, None
+    with ThreadPoolExecutor(max_workers=max_workers) as ex: results = dict(ex.map(safe_probe, paths))
+    eng.probes.save()
+    return results
+
+def parse_bitrate(value):
+    # "800k" -> 800000, "1.5M" -> 1500000
+    v = str(value).strip().lower()
+    mult = {'k': 1000, 'm': 1000000}.get(v[-1:], 1)
+    try: return int(float(v.rstrip('km')) * mult)
+    except: return 0
+
+PLAN_SLACK = 1.1 # Container overhead and VBR peaks
+
+def video_compatible(info, config):
+    # H.264 already at or below the target height, fps and bitrate: the stream can be copied
+    vbr = info.get('vbitrate') or max(0, info.get('bitrate', 0) - info.get('abitrate', 0))
+    return (info.get('vcodec') == 'h264' and 0 < info.get('height', 0) <= config['target_height']
+            and info.get('fps', 0) <= config['target_fps'] + 0.5
+            and 0 < vbr <= parse_bitrate(config['video_bitrate']) * PLAN_SLACK)
+
+def audio_compatible(info, config):
+    return (not info.get('acodec') or (info['acodec'] == 'aac'
+            and 0 < info.get('abitrate', 0) <= parse_bitrate(config['audio_bitrate']) * PLAN_SLACK))
+
+def output_path(vpath, action, config):
+    # Remuxes may rewrap allowed containers (e.g. .avi, .mkv) as .mp4, never over an existing file
+    if action == 'remux' and vpath.suffix.lower() in [e.lower() for e in config.get('container_remux', [])]:
+        dest = vpath.with_suffix('.mp4')
+        if not dest.exists(): return dest
+    return vpath
+
+GAIN_CHECK_FRACTION = 0.2 # Share of the file encoded before the output size is projected
+GAIN_CHECK_SECS = 5.0      # ...and at least this much output, so the stream headers don't skew it
+
+def gain_signature(config):
+    # A low-gain verdict only holds for the settings it was measured with
+    return [config['target_height'], config['video_bitrate'], config['target_fps'], config.get('min_savings', 0)]
+
+def keep_original(eng, wid, vpath, tmp, saved_pct, stage, renditions=()):
+    # Encode isn't worth it: drop the output, leave the source untouched and remember the verdict.
+    # Verified renditions are still placed: the ladder is wanted even when the main output isn't.
+    if tmp.exists(): tmp.unlink()
+    placed = place_renditions(renditions)
+    eng.probes.mark(vpath, 'low_gain', gain_signature(eng.config))
+    eng.journal.record(vpath, 'skipped', reason=f"saves {saved_pct:.0f}%", **({'renditions': placed} if placed else {}))
+    with eng.lock: eng.gain_aborts[stage] += 1
+    logging.info(f"[Worker {wid}] Keeping original {vpath.name}: {'projected ' if stage == 'early' else ''}savings {saved_pct:.0f}% < {eng.config['min_savings']}%")
+    eng.stats.update(wid, vpath.name, 100.0, "0", "0", f"Kept original ({saved_pct:.0f}% saving)")
+    return True
+
+def plan_video(info, config, path=None):
+    # Classify a probed file as ('skip' | 'remux' | 'encode', reason)
+    if not info: return ('encode', "probe failed")
+    if APP_NAME in (info.get('comment') or '') or APP_NAME in (info.get('encoder') or ''):
+        return ('skip', "already processed")
+    if not info.get('vcodec'): return ('skip', "no video stream")
+    if info.get('low_gain') and info['low_gain'] == gain_signature(config): return ('skip', "re-encode saves too little")
+    if not config.get('skip_compliant', True): return ('encode', "forced")
+    video_ok, audio_ok = video_compatible(info, config), audio_compatible(info, config)
+    if video_ok and audio_ok:
+        if path and output_path(path, 'remux', config) != path: return ('remux', "container only")
+        return ('skip', "within targets")
+    if video_ok: return ('remux', "video within targets")
+    return ('encode', "above targets")
+
+def build_plan(videos, probes, config):
+    plan = {v: plan_video(probes.get(v), config, v) for v in videos}
+    counts = {a: sum(1 for p in plan.values() if p[0] == a) for a in ('encode', 'remux', 'skip')}
+    work = {a: sum((probes.get(v) or {}).get('duration', 0) for v, p in plan.items() if p[0] == a) for a in ('encode', 'remux')}
+    return plan, counts, work
+
+def fmt_duration(secs):
+    h, rem = divmod(int(secs), 3600)
+    return f"{h}h {rem // 60}m" if h else f"{rem // 60}m {rem % 60}s"
+
+class JobJournal:
+    # Append-only JSONL log of job state transitions, fsync'd so it survives power loss
+    # States: queued -> encoding -> verified -> swapped -> done | failed
+    TERMINAL = ('done', 'failed', 'skipped')
+    def __init__(self, path=JOURNAL_FILE):
+        self.path = path
+        self.fh = None
+        self.lock = threading.Lock()
+    def _write(self, records, sync=True):
+        with self.lock:
+            if self.fh is None:
+                self.path.parent.mkdir(parents=True, exist_ok=True)
+                self.fh = open(self.path, 'a', encoding='utf-8')
+            for r in records: self.fh.write(json.dumps(r, ensure_ascii=False) + "\n")
+            self.fh.flush()
+            if sync:
+                try: os.fsync(self.fh.fileno())
+                except: pass
+    def record(self, path, state, **extra):
+        self._write([dict(t=time.time(), path=str(path), state=state, **extra)])
+    def begin_run(self, videos, actions=None):
+        # A new batch supersedes the previous journal; recovery has already run by now
+        with self.lock:
+            if self.fh: self.fh.close()
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self.fh = open(self.path, 'w', encoding='utf-8')
+        now = time.time()
+        recs = [dict(t=now, state='run_start', root=str(Path.cwd()), count=len(videos))]
+        recs += [dict(t=now, path=str(v), state='queued', action=(actions or {}).get(v, 'encode')) for v in videos]
+        self._write(recs)
+    def end_run(self):
+        self._write([dict(t=time.time(), state='run_end')])
+    def close(self):
+        with self.lock:
+            if self.fh: self.fh.close(); self.fh = None
+    def replay(self):
+        # Returns {path: merged job record} for an unfinished run, or None if the last run completed
+        jobs, finished = {}, True
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try: r = json.loads(line)
+                    except: continue # Torn final line from a crash
+                    if r.get('state') == 'run_start': jobs, finished = {}, False
+                    elif r.get('state') == 'run_end': finished = True
+                    elif 'path' in r: jobs.setdefault(r['path'], {}).update(r)
+        except FileNotFoundError: return None
+        return None if finished else jobs
+
+class JobMetrics:
+    # Per-job stage timings: one JSONL record per scheduled job, plus running totals served as Prometheus text
+    STAGES = ('queue', 'probe', 'encode', 'verify', 'swap')
+    BUCKETS = (0.05, 0.25, 1, 5, 15, 60, 300, 1800) # Seconds; +Inf is implied
+    ROTATE_BYTES = 50 * 1024 * 1024
+    def __init__(self, path=METRICS_FILE):
+        self.path = path
+        self.fh = None
+        self.enabled = True # Write JSONL records; counters are kept either way
+        self.lock = threading.Lock()
+        self.local = threading.local() # The record of the job running on this worker thread
+        self.counters = collections.Counter() # (metric, labels) -> value
+        self.hist = {s: [0] * (len(self.BUCKETS) + 1) + [0.0] for s in self.STAGES} # bucket counts, +Inf, sum
+        self.running = 0
+    def current(self): return getattr(self.local, 'rec', None)
+    def begin(self, job, lane, slot):
+        now = time.time()
+        jobs = job.members or [job]
+        rec = {'t0': now, 'path': str(job.path), 'files': len(job.files), 'action': job.action, 'lane': lane.name, 'slot': slot,
+               'queue_s': now - job.queued_at if job.queued_at else 0.0, 'probe_s': sum(j.probe_s for j in jobs),
+               'encode_s': 0.0, 'verify_s': 0.0, 'swap_s': 0.0, 'cpu_s': None, 'speed_sum': 0.0, 'speed_n': 0,
+               'bytes_in': job.size, 'bytes_out': 0, 'media_s': sum((j.info or {}).get('duration') or 0.0 for j in jobs)}
+        self.local.rec = rec
+        with self.lock: self.running += 1
+        return rec
+    def add(self, key, value):
+        rec = self.current()
+        if rec is not None: rec[key] += value
+    @staticmethod
+    def child_done(h):
+        # Called by the supervisor as each ffmpeg exits; segments and joins add up on the same record
+        rec = h.metrics
+        rec['encode_s'] += time.time() - h.started
+        if h.cpu is not None: rec['cpu_s'] = (rec['cpu_s'] or 0.0) + h.cpu
+        rec['speed_sum'] += h.speed_sum; rec['speed_n'] += h.speed_n
+    def end(self, rec, job, requeued=False):
+        self.local.rec = None
+        now = time.time()
+        ok = sum(1 for j in job.files if j.ok)
+        speed_sum, speed_n = rec.pop('speed_sum'), rec.pop('speed_n')
+        rec['wall_s'] = now - rec.pop('t0')
+        rec['speed'] = speed_sum / speed_n if speed_n else None
+        rec.update(t=now, ok=ok, failed=0 if requeued else rec['files'] - ok, requeued=requeued)
+        line = json.dumps({k: round(v, 3) if isinstance(v, float) else v for k, v in rec.items()}, ensure_ascii=False)
+        with self.lock:
+            self.running -= 1
+            lane = rec['lane']
+            if requeued: self.counters['files_total', ('requeued', lane)] += rec['files']
+            else:
+                self.counters['files_total', ('ok', lane)] += ok
+                self.counters['files_total', ('failed', lane)] += rec['files'] - ok
+            for key in ('bytes_in', 'bytes_out', 'media_s', 'cpu_s'): self.counters[key, ()] += rec[key] or 0
+            for stage in self.STAGES:
+                secs = rec[f'{stage}_s']
+                if secs <= 0: continue # Cached probes, verification off, nothing swapped
+                h = self.hist[stage]
+                h[bisect.bisect_left(self.BUCKETS, secs)] += 1; h[-1] += secs
+            if not self.enabled: return
+            try:
+                if self.fh is None:
+                    self.path.parent.mkdir(parents=True, exist_ok=True)
+                    if self.path.exists() and self.path.stat().st_size > self.ROTATE_BYTES: os.replace(self.path, self.path.with_name(self.path.name + '.1'))
+                    self.fh = open(self.path, 'a', encoding='utf-8')
+                self.fh.write(line + "\n"); self.fh.flush()
+            except OSError as e:
+                logging.warning(f"Metrics log disabled: {e}"); self.enabled = False
+    def stage_totals(self):
+        # {stage: (observations, seconds)} for the final report
+        with self.lock: return {s: (sum(h[:-1]), h[-1]) for s, h in self.hist.items()}
+    def render(self):
+        with self.lock:
+            counters, hist, running = dict(self.counters), {s: list(h) for s, h in self.hist.items()}, self.running
+        out = ["# HELP mnemosyne_files_total Files finished, by result and encoder lane", "# TYPE mnemosyne_files_total counter"]
+        for (name, labels), v in sorted(counters.items()):
+            if name == 'files_total': out.append(f'mnemosyne_files_total{{result="{labels[0]}",lane="{labels[1]}"}} {v}')
+        for key, name, text in (('bytes_in', 'bytes_read_total', "Source bytes of finished jobs"), ('bytes_out', 'bytes_written_total', "Output bytes swapped into place"),
+                                ('media_s', 'media_seconds_total', "Source media duration of finished jobs"), ('cpu_s', 'child_cpu_seconds_total', "CPU time of ffmpeg children")):
+            out += [f"# HELP mnemosyne_{name} {text}", f"# TYPE mnemosyne_{name} counter", f"mnemosyne_{name} {counters.get((key, ()), 0):g}"]
+        out += ["# HELP mnemosyne_jobs_running Jobs currently on a worker slot", "# TYPE mnemosyne_jobs_running gauge", f"mnemosyne_jobs_running {running}"]
+        out += ["# HELP mnemosyne_stage_seconds Time per job spent in each stage", "# TYPE mnemosyne_stage_seconds histogram"]
+        for stage, h in hist.items():
+            cum = 0
+            for le, n in zip([f"{b:g}" for b in self.BUCKETS] + ["+Inf"], h[:-1]):
+                cum += n; out.append(f'mnemosyne_stage_seconds_bucket{{stage="{stage}",le="{le}"}} {cum}')
+            out += [f'mnemosyne_stage_seconds_sum{{stage="{stage}"}} {h[-1]:.3f}', f'mnemosyne_stage_seconds_count{{stage="{stage}"}} {cum}']
+        return "\n".join(out) + "\n"
+    def serve(self, port, host="127.0.0.1"):
+        # Localhost only: the endpoint has no authentication
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+        metrics = self
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?')[0] not in ('/', '/metrics'): return self.send_error(404)
+                body = metrics.render().encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers(); self.wfile.write(body)
+            def log_message(self, *args): pass
+        server = ThreadingHTTPServer((host, port), Handler)
+        threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+        return server
+    def close(self):
+        with self.lock:
+            if self.fh: self.fh.close(); self.fh = None
+
+def swap_into_place(eng, vpath, tmp, meta, dest=None):
+    # Atomic Safety Bridge: original -> .bak, verified temp -> original (or its new container), then drop .bak
+    dest = dest or vpath
+    bak = vpath.with_suffix(vpath.suffix + '.bak')
+    if bak.exists(): bak.unlink()
+    vpath.rename(bak)
+    tmp.rename(dest)
+    eng.journal.record(vpath, 'swapped', tmp=str(tmp), bak=str(bak), dest=str(dest))
+    if meta: restore_file_metadata(dest, meta)
+    if dest.exists() and dest.stat().st_size > 10240: bak.unlink()
+    else: raise Exception("Output verification fail after swap")
+
+def recover_interrupted_jobs(eng):
+    # Roll back or finish half-done swaps from an interrupted run; returns paths still to process
+    jobs = eng.journal.replay()
+    if not jobs: return [], 0
+    remaining, fixed = [], 0
+    for p, job in jobs.items():
+        state = job.get('state')
+        if state in JobJournal.TERMINAL: continue
+        vpath = Path(p)
+        dest = Path(job.get('dest') or p)
+        tmp = Path(job['tmp']) if job.get('tmp') else None
+        bak = Path(job['bak']) if job.get('bak') else vpath.with_suffix(vpath.suffix + '.bak')
+        meta = tuple(job['meta']) if job.get('meta') else None
+        try:
+            if state == 'swapped' and dest.exists() and dest.stat().st_size > 10240:
+                # New file is in place; only metadata restore and backup removal were pending
+                if meta: restore_file_metadata(dest, meta)
+                if bak.exists(): bak.unlink()
+                eng.journal.record(vpath, 'done', recovered=True); fixed += 1
+                continue
+            if state in ('verified', 'swapped') and tmp and tmp.exists() and meta:
+                # Verified output survived: finish the swap instead of re-encoding
+                if not vpath.exists() and bak.exists(): bak.rename(vpath)
+                swap_into_place(eng, vpath, tmp, meta, dest)
+                eng.journal.record(vpath, 'done', recovered=True); fixed += 1
+                continue
+            # Anything earlier is rolled back to the original and re-queued
+            if bak.exists():
+                if vpath.exists() and vpath.stat().st_size <= 10240: vpath.unlink()
+                if not vpath.exists(): bak.rename(vpath); fixed += 1
+                else: bak.unlink()
+            if tmp and tmp.exists(): tmp.unlink()
+            if vpath.exists(): remaining.append(vpath)
+        except Exception as e:
+            logging.error(f"Recovery failed for {vpath.name}: {e}")
+    logging.info(f"Journal recovery: {fixed} swap(s) repaired, {len(remaining)} job(s) remaining")
+    return remaining, fixed
+
+# Rough per-worker throughput used to turn probe data into comparable cost estimates (seconds)
+ENCODE_PIXEL_RATE = 60e6   # Source pixels/s, ~1080p30 realtime on a medium x264 preset
+REMUX_BYTE_RATE = 100e6    # Bytes/s when the video stream is copied
+
+def estimate_cost(info, action='encode'):
+    if not info: return 0.0
+    dur = info.get('duration') or 0.0
+    if action == 'remux': return info.get('size', 0) / REMUX_BYTE_RATE + dur * 0.01
+    return dur * (info.get('width') or 640) * (info.get('height') or 480) * (info.get('fps') or 30.0) / ENCODE_PIXEL_RATE
+
+def cpu_budget(config):
+    # Cores Mnemosyne may use in total; 0 means every core on the host
+    cores = os.cpu_count() or 2
+    b = int(config.get('cpu_budget') or 0)
+    return max(1, min(b, cores) if b > 0 else cores)
+
+class ThreadBudget:
+    # Splits the CPU budget between running ffmpeg jobs instead of letting each spread over every core
+    def __init__(self, total, slots):
+        self.total, self.slots = total, slots
+        self.used = 0
+        self.lock = threading.Lock()
+    def free(self):
+        with self.lock: return self.total - self.used
+    def acquire(self, outstanding):
+        # Share is based on how many jobs can still run together, so it grows as the queue drains.
+        # The budget is a hard cap: callers only start a job while free() > 0, so with fewer cores
+        # than slots fewer jobs run at once, and a job may get less while an earlier one holds more.
+        with self.lock:
+            share = max(1, self.total // max(1, min(self.slots, outstanding)))
+            n = min(share, self.total - self.used)
+            self.used += n
+            return n
+    def release(self, n):
+        with self.lock: self.used = max(0, self.used - n)
+
+class HardwareEncodeError(Exception): pass
+
+
+class EncoderLane:
+    # One encoder with its own concurrency limit; 'ffmpeg' may point at any compatible binary
+    def __init__(self, codec, capacity, ffmpeg="ffmpeg", label=None):
+        self.codec, self.capacity, self.ffmpeg = codec, max(1, int(capacity)), ffmpeg
+        self.label = label or CODEC_LABELS.get(codec, codec.upper())
+        self.hardware = codec != "libx264"
+        self.disabled = False
+        self.active = 0
+        self.name = f"{codec}@{ffmpeg}" if ffmpeg != "ffmpeg" else codec
+
+def build_lanes(config, codec):
+    # Explicit lanes from config, else the detected hardware encoder beside a CPU lane
+    if config.get('encoder_lanes'):
+        lanes = [EncoderLane(l['codec'], l.get('slots', 1), l.get('ffmpeg', 'ffmpeg'), l.get('label')) for l in config['encoder_lanes']]
+        usable = [l for l in lanes if not l.hardware or encoder_works(l.codec, l.ffmpeg)]
+        for l in lanes:
+            if l not in usable: logging.warning(f"Encoder lane {l.label} ({l.ffmpeg}) failed its trial encode, disabled")
+        return usable or [EncoderLane("libx264", config['max_workers'])]
+    lanes = []
+    if codec != "libx264": lanes.append(EncoderLane(codec, min(HW_LANE_SLOTS.get(codec, 2), config['max_workers'])))
+    lanes.append(EncoderLane("libx264", config['max_workers']))
+    return lanes
+
+def describe_lanes(lanes):
+    return " + ".join(f"{l.label} x{l.capacity}" for l in lanes)
+
+COPY_BLOCK = 8 * 1024 * 1024 # Copy-back from scratch in large sequential blocks
+
+def lock_dir(path):
+    # Exclusive lock on a folder, held until the returned file is closed; None if another engine has it
+    path = Path(path)
+    path.mkdir(parents=True, exist_ok=True)
+    fh = open(path / "engine.lock", 'a+')
     try:
-        r = subprocess.run(["ffmpeg", "-encoders"], capture_output=True, text=True, timeout=5)
-        e = r.stdout
-        if "h264_nvenc" in e: return ("h264_nvenc", "NVIDIA (NVENC)")
-        elif "h264_qsv" in e: return ("h264_qsv", "Intel QuickSync")
-        elif "h264_videotoolbox" in e: return ("h264_videotoolbox", "Apple VideoToolbox")
-        elif "h264_vaapi" in e: return ("h264_vaapi", "VAAPI")
-        else: return ("libx264", "CPU (x264)")
-    except: return ("libx264", "CPU (x264)")
+        if IS_WINDOWS:
+            import msvcrt
+            fh.seek(0); msvcrt.locking(fh.fileno(), msvcrt.LK_NBLCK, 1)
+        else:
+            import fcntl
+            fcntl.flock(fh.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        fh.close(); return None
+    return fh
 
-worker_stats = WorkerStats()
+class ScratchSpace:
+    # Local staging folder (SSD, tmpfs) for temp outputs. Jobs reserve their expected output size
+    # at admission; when the quota is used up the scheduler holds further jobs back.
+    def __init__(self, path, config):
+        self.path = Path(path).expanduser()
+        # Startup cleanup would delete another engine's in-flight temp files, so the folder is held exclusively
+        self.owner = lock_dir(self.path)
+        if self.owner is None: raise OSError(f"{self.path} is in use by another engine")
+        cleanup_temp_files(self.path)
+        free = shutil.disk_usage(self.path).free * 0.9
+        quota = float(config.get('scratch_quota_gb') or 0) * 1024 ** 3
+        self.capacity = min(free, quota) if quota > 0 else free
+        self.used = 0
+        self.rate = (parse_bitrate(config['video_bitrate']) + parse_bitrate(config['audio_bitrate'])) / 8
+        self.seg_min = config.get('segment_min_duration', 0)
+    def need(self, job):
+        total = 0
+        for j in job.files:
+            dur = (j.info or {}).get('duration') or 0.0
+            n = j.size if j.action == 'remux' or not dur else min(j.size, self.rate * dur) if j.size else self.rate * dur
+            # Segmented encodes hold their parts and the joined file at the same time
+            if j.action == 'encode' and self.seg_min and dur >= self.seg_min: n *= 2
+            total += n * PLAN_SLACK
+        return total
+    def fits(self, job):
+        need = self.need(job)
+        return need > self.capacity or self.used + need <= self.capacity
+    def reserve(self, job):
+        need = self.need(job)
+        # Larger than the whole scratch area: encode beside the source as before
+        if need > self.capacity: job.staging, job.reserved = None, 0
+        else: job.staging, job.reserved = self.path, need
+        self.used += job.reserved
+    def release(self, job):
+        self.used = max(0, self.used - job.reserved)
+        job.reserved = 0
+    def close(self): self.owner.close()
 
-def verify_output(inp, outp):
-    if not outp.exists() or outp.stat().st_size < 10240: return False
+def open_scratch(config):
+    if not config.get('scratch_dir'): return None
     try:
-        def get_meta(p):
-            cmd = ["ffprobe", "-v", "error", "-show_entries", "format=duration:stream=nb_frames,width,height", "-of", "csv=p=0", str(p)]
-            r = subprocess.run(cmd, capture_output=True, text=True, timeout=15)
-            parts = r.stdout.strip().split(',')
-            return float(parts[0] if parts[0] else 0), int(parts[1] if len(parts) > 1 and parts[1] else -1)
-        in_d, in_f = get_meta(inp)
-        out_d, out_f = get_meta(outp)
-        dur_ok = abs(in_d - out_d) < 2.0
-        frm_ok = (in_f == -1 or out_f == -1 or abs(in_f - out_f) < 150)
-        return dur_ok and frm_ok
-    except: return False
+        scratch = ScratchSpace(config['scratch_dir'], config)
+        logging.info(f"Scratch staging: {scratch.path} ({scratch.capacity / 1024 ** 3:.1f} GB usable)")
+        return scratch
+    except OSError as e:
+        logging.warning(f"Scratch dir unusable ({e}), writing temp files beside the sources")
+        return None
+
+def copy_back(src, dst):
+    # One sequential pass scratch -> source drive, hashed on the way; the copy is read back and compared
+    h = hashlib.blake2b()
+    try:
+        with open(src, 'rb') as fi, open(dst, 'wb') as fo:
+            while chunk := fi.read(COPY_BLOCK):
+                h.update(chunk); fo.write(chunk)
+            fo.flush(); os.fsync(fo.fileno())
+            # Drop the cached pages so the read-back really comes from the target device
+            if hasattr(os, 'posix_fadvise'): os.posix_fadvise(fo.fileno(), 0, 0, os.POSIX_FADV_DONTNEED)
+        check = hashlib.blake2b()
+        with open(dst, 'rb') as f:
+            while chunk := f.read(COPY_BLOCK): check.update(chunk)
+        if check.digest() != h.digest(): raise Exception(f"Checksum mismatch copying {src.name} back from scratch")
+    except:
+        if dst.exists(): dst.unlink()
+        raise
+    src.unlink()
+    return dst
+
+class Job:
+    def __init__(self, path, action='encode', info=None):
+        self.path, self.action, self.info = path, action, info
+        self.cost = estimate_cost(info, action)
+        self.size = (info or {}).get('size', 0)
+        self.elapsed = 0.0
+        self.threads = 0
+        self.dest = path
+        self.excluded = set() # Lanes this job already failed on
+        self.lane = None
+        self.ok = None
+        self.members = None # Set on a batch of short clips run as one job
+        self.staging, self.reserved = None, 0 # Scratch folder and bytes held there while running
+        self.device = None # st_dev of the source, for per-device limits
+        self.duplicates = [] # Byte-identical sources that reuse this job's output
+        self.future = self.on_progress = None # Set for jobs queued through Engine.submit()
+        self.handles, self.cancelled = None, False # ffmpeg processes of the running job, for cancellation
+        self.probe_s = (info or {}).get('probe_s', 0.0) # ffprobe time this run, 0 when the probe was cached
+        self.queued_at = None
+    @property
+    def files(self):
+        jobs = self.members or [self]
+        return jobs + [d for j in jobs for d in j.duplicates]
+    @classmethod
+    def batch(cls, jobs):
+        b = cls(jobs[0].path, 'batch')
+        b.members = jobs
+        b.cost, b.size = sum(j.cost for j in jobs), sum(j.size for j in jobs)
+        b.device = jobs[0].device
+        return b
+
+def batchable(job, config):
+    limit = config.get('batch_max_duration', 0)
+    d = (job.info or {}).get('duration') or 0.0
+    return limit > 0 and job.action == 'encode' and 0 < d <= limit and not config.get('renditions')
+
+HASH_BLOCK = 64 * 1024
+DEDUP_POLICIES = ('off', 'copy', 'reflink', 'hardlink')
+
+def sample_hash(path, size):
+    # Head, middle and tail blocks plus the size: cheap and almost always decisive
+    h = hashlib.blake2b(str(size).encode())
+    with open(path, 'rb') as f:
+        for off in sorted({0, max(0, size // 2 - HASH_BLOCK // 2), max(0, size - HASH_BLOCK)}):
+            f.seek(off); h.update(f.read(HASH_BLOCK))
+    return h.digest()
+
+def full_hash(path):
+    h = hashlib.blake2b()
+    with open(path, 'rb') as f:
+        while chunk := f.read(COPY_BLOCK): h.update(chunk)
+    return h.digest()
+
+def find_duplicates(jobs, config, max_workers=8):
+    # size -> sampled hash -> full hash; each identical group keeps its first job, the rest ride along
+    if config.get('dedup', 'copy') not in DEDUP_POLICIES[1:]: return jobs
+    # A reused output comes without the primary's renditions, so with a ladder every copy is encoded itself
+    if config.get('renditions'): return jobs
+    def refine(groups, key_fn):
+        out = []
+        with ThreadPoolExecutor(max_workers=max_workers) as ex:
+            for group in groups:
+                keys = {}
+                for j, k in zip(group, ex.map(lambda j: _safe(key_fn, j), group)):
+                    if k is not None: keys.setdefault(k, []).append(j)
+                out.extend(g for g in keys.values() if len(g) > 1)
+        return out
+    def _safe(fn, j):
+        try: return fn(j)
+        except OSError as e: logging.warning(f"Dedup: can't read {j.path.name}: {e}"); return None
+    by_size = {}
+    for j in jobs:
+        if j.size and not j.members: by_size.setdefault((j.size, j.action), []).append(j)
+    groups = [g for g in by_size.values() if len(g) > 1]
+    # Files small enough that the samples cover them entirely need no full pass
+    groups = refine(groups, lambda j: sample_hash(j.path, j.size))
+    groups = [g for g in groups if g[0].size <= 3 * HASH_BLOCK] + refine([g for g in groups if g[0].size > 3 * HASH_BLOCK], lambda j: full_hash(j.path))
+    dropped = set()
+    for g in groups:
+        g.sort(key=jobs.index)
+        g[0].duplicates = g[1:]
+        dropped.update(id(j) for j in g[1:])
+        logging.info(f"Dedup: {g[0].path} has {len(g) - 1} identical cop{'y' if len(g) == 2 else 'ies'}")
+    return [j for j in jobs if id(j) not in dropped]
+
+def clone_file(src, dst, policy):
+    # reflink (copy-on-write clone) falls back to a plain copy where the filesystem can't do it
+    if policy == 'hardlink': return os.link(src, dst)
+    if policy == 'reflink' and SYSTEM == "Linux":
+        import fcntl
+        try:
+            with open(src, 'rb') as fi, open(dst, 'wb') as fo:
+                fcntl.ioctl(fo.fileno(), 0x40049409, fi.fileno()) # FICLONE
+            return
+        except OSError:
+            if os.path.exists(dst): os.unlink(dst)
+    shutil.copyfile(src, dst)
+
+def reuse_output(eng, wid, primary, dup):
+    # Give an identical source the primary's finished output, through the same journal and atomic swap
+    policy = eng.config.get('dedup', 'copy')
+    vpath, t0 = dup.path, time.time()
+    eng.stats.update(wid, vpath.name, 99.9, "-", "-", f"Reusing output ({policy})")
+    try:
+        st = vpath.stat()
+        meta = get_file_metadata(vpath, st)
+        tmp = vpath.parent / f"mnemosyne_tmp_{wid}_{dup.dest.name}"
+        eng.journal.record(vpath, 'encoding', tmp=str(tmp), dest=str(dup.dest), action='dedup', meta=list(meta))
+        clone_file(primary.dest, tmp, policy)
+        eng.journal.record(vpath, 'verified', tmp=str(tmp))
+        # Hard links share one inode, so per-file timestamps can't differ; the primary's are kept
+        swap_into_place(eng, vpath, tmp, None if policy == 'hardlink' else meta, dup.dest)
+        if dup.dest != vpath: eng.probes.forget(vpath)
+        out_info = eng.probes.get(primary.dest)
+        if out_info: eng.probes.store(dup.dest, {k: v for k, v in out_info.items() if k not in ('sig', 'size', 'mtime', 'dev')})
+        eng.journal.record(vpath, 'done', size=dup.dest.stat().st_size, dedup_of=str(primary.path))
+        dup.ok = True
+    except Exception as e:
+        logging.error(f"Dedup reuse failed for {vpath.name}: {e}")
+        if 'tmp' in locals() and tmp.exists(): tmp.unlink()
+        eng.journal.record(vpath, 'failed', error=f"dedup: {e}")
+        dup.ok = False
+    dup.elapsed = time.time() - t0
+
+def apply_duplicates(eng, wid, job):
+    config = eng.config
+    for j in job.files:
+        if not j.duplicates: continue
+        if not j.ok:
+            # Same bytes, same outcome: copies of a failed source are left untouched and counted as failed
+            for d in j.duplicates:
+                eng.journal.record(d.path, 'failed', error=f"duplicate of failed {j.path.name}"); d.ok = False
+            continue
+        kept = j.path.exists() and (eng.probes.get(j.path) or {}).get('low_gain') == gain_signature(config)
+        for d in j.duplicates:
+            if kept:
+                # The primary was kept as is; an identical copy would be too
+                eng.probes.mark(d.path, 'low_gain', gain_signature(config))
+                eng.journal.record(d.path, 'skipped', reason="duplicate kept original"); d.ok = True
+            else: reuse_output(eng, wid, j, d)
+
+def make_batches(jobs, config):
+    # Group short encodes into batch jobs of up to batch_size; everything else passes through unchanged.
+    # Each batch takes the place of its first member, so the order the jobs came in (the sort) is kept.
+    size = max(1, config.get('batch_size', 8))
+    small = [j for j in jobs if batchable(j, config)]
+    if size < 2 or len(small) < 2: return jobs
+    by_device, first = {}, {}
+    for j in small: by_device.setdefault(j.device, []).append(j)
+    for group in by_device.values():
+        for i in range(0, len(group), size):
+            chunk = group[i:i + size]
+            first[chunk[0]] = Job.batch(chunk) if len(chunk) > 1 else chunk[0]
+    small = set(small)
+    return [first.get(j, j) for j in jobs if j in first or j not in small]
 
-def process_video(wid, vpath, codec, config):
+DEVICE_LOOKAHEAD = 256 # Queue entries scanned for a job on an idle device
+
+def device_limits(config):
+    # {st_dev: max concurrent jobs}; the None key is the default for every other device (0 = no limit)
+    limits = {None: int(config.get('device_workers') or 0)}
+    for path, n in (config.get('device_limits') or {}).items():
+        try: limits[os.stat(path).st_dev] = int(n)
+        except OSError as e: logging.warning(f"device_limits: {path} skipped ({e})")
+    return limits
+
+def mount_point(path):
+    # Top-most folder of the path that is still on the same device
+    path = Path(path).absolute()
+    try:
+        dev = path.stat().st_dev
+        while path.parent != path and path.parent.stat().st_dev == dev: path = path.parent
+    except OSError: pass
+    return str(path)
+
+class Scheduler:
+    # Fixed pool of worker slots handed out when a job starts; jobs leave the queue in the given order
+    # and go to the first encoder lane with spare capacity that they haven't already failed on
+    def __init__(self, jobs, slots, budget=None, lanes=None, hw_failure_limit=0, closed=True, max_pending=0, lpt=False, scratch=None, device_limits=None, lock=None):
+        # closed=False keeps workers waiting for add() until close(); add() blocks beyond max_pending
+        self.closed, self.max_pending, self.lpt = closed, max_pending, lpt
+        self.scratch = scratch
+        self.dev_limits = device_limits or {}
+        self.dev_active = collections.Counter()
+        self.dev_stats = {} # st_dev -> [files, bytes, first start, last end, sample path]
+        for j in jobs: self._register(j)
+        self.added = sum(len(j.files) for j in jobs) # Counted in files, a batch counts each clip
+        self.budget = budget
+        self.lanes = lanes or [EncoderLane("libx264", slots)]
+        self.hw_failure_limit, self.hw_failures = hw_failure_limit, 0
+        self.pending = list(jobs)
+        self.pending.reverse() # pop() from the end is O(1)
+        self.slots = slots
+        self.free_slots = list(range(slots, 0, -1))
+        self.cond = threading.Condition(lock)
+        self.finished = []
+        self.completed = 0
+        self.keep_finished = True # Long-running watch mode only needs the counters
+        self.on_finish = None
+        self.running = 0
+        self.start_t = self.end_t = None
+    def _register(self, job):
+        job.queued_at = job.queued_at or time.time()
+        if job.device is None:
+            try: job.device = job.path.stat().st_dev
+            except OSError: job.device = 0
+        if job.device not in self.dev_stats: self.dev_stats[job.device] = [0, 0, None, None, job.path]
+    def _device_free(self, job):
+        limit = self.dev_limits.get(job.device, self.dev_limits.get(None, 0))
+        return not limit or self.dev_active[job.device] < limit
+    @staticmethod
+    def order_lpt(jobs):
+        # Longest Processing Time first: big files start early instead of finishing the batch alone
+        return sorted(jobs, key=lambda j: j.cost, reverse=True)
+    def _pick(self):
+        balance = len(self.dev_stats) > 1
+        for lane in self.lanes:
+            if lane.disabled or lane.active >= lane.capacity: continue
+            best = None
+            for n, i in enumerate(range(len(self.pending) - 1, -1, -1)):
+                job = self.pending[i]
+                if lane.name in job.excluded or not self._device_free(job): continue
+                # Scratch admission: a job whose output won't fit yet waits while smaller ones go ahead
+                if self.scratch and not self.scratch.fits(job): continue
+                if not balance: return i, lane
+                # Several disks: take the next job from the least busy device so every disk keeps working
+                busy = self.dev_active[job.device]
+                if best is None or busy < best[0]: best = (busy, i)
+                if busy == 0 or n >= DEVICE_LOOKAHEAD: break
+            if best: return best[1], lane
+        return None
+    def add(self, job):
+        with self.cond:
+            while self.max_pending and len(self.pending) >= self.max_pending: self.cond.wait()
+            # pending is consumed from the end: LPT keeps it sorted by ascending cost, otherwise FIFO
+            if self.lpt: bisect.insort(self.pending, job, key=lambda j: j.cost)
+            else: self.pending.insert(0, job)
+            self._register(job)
+            self.added += len(job.files)
+            self.cond.notify_all()
+    def close(self):
+        with self.cond:
+            self.closed = True
+            if not self.pending and not self.running and self.start_t: self.end_t = time.time()
+            self.cond.notify_all()
+    def next(self):
+        with self.cond:
+            while True:
+                if not self.pending and self.closed: return None
+                pick = self._pick() if self.free_slots and self.pending and (not self.budget or self.budget.free() > 0) else None
+                if pick: break
+                self.cond.wait()
+            if self.start_t is None: self.start_t = time.time()
+            i, lane = pick
+            job = self.pending.pop(i)
+            self.cond.notify_all() # Room for a blocked add()
+            # An open queue can fill every slot at any moment, so it is always shared as if full
+            if self.budget: job.threads = self.budget.acquire(len(self.pending) + self.running + 1 if self.closed else self.slots)
+            if self.scratch: self.scratch.reserve(job)
+            self.dev_active[job.device] += 1
+            ds = self.dev_stats[job.device]
+            if ds[2] is None: ds[2] = time.time()
+            job.lane = lane
+            lane.active += 1
+            self.running += 1
+            return job, self.free_slots.pop(), lane
+    def finish(self, job, slot, requeue=False):
+        with self.cond:
+            if self.budget and job.threads: self.budget.release(job.threads)
+            if self.scratch: self.scratch.release(job)
+            self.dev_active[job.device] -= 1
+            job.lane.active -= 1
+            self.running -= 1
+            # A cancelled job says nothing about the encoder either way
+            if not requeue and job.lane.hardware and not job.cancelled: self.hw_failures = 0
+            if requeue and job.lane.hardware:
+                self.hw_failures += 1
+                # Circuit breaker: after N hardware failures in a row the rest of the queue goes to the CPU
+                if self.hw_failure_limit and self.hw_failures >= self.hw_failure_limit and any(not l.hardware for l in self.lanes):
+                    for l in self.lanes:
+                        if l.hardware and not l.disabled:
+                            l.disabled = True
+                            logging.warning(f"{self.hw_failures} hardware failures in a row, disabling lane {l.label}")
+            if requeue and any(l.name not in job.excluded and not l.disabled for l in self.lanes):
+                self.pending.append(job) # Front of the queue, for the next free compatible lane
+                job.queued_at = time.time()
+            else:
+                if requeue: job.ok = False
+                # Duplicates keep their own reuse time; only the encode itself is shared out
+                members = job.members or [job]
+                work = max(0.0, job.elapsed - sum(d.elapsed for j in members for d in j.duplicates))
+                for j in job.files:
+                    if j.ok is None: j.ok = job.ok
+                    # A batch's wall time is shared out by cost so the makespan stays comparable
+                    if j is job: j.elapsed = work
+                    elif job.members and j in members: j.elapsed = work * (j.cost / job.cost if job.cost else 1 / len(members))
+                    j.info = None # Probe data is no longer needed; keeps memory flat on huge batches
+                self.completed += len(job.files)
+                ds = self.dev_stats[job.device]
+                ds[0] += len(job.files); ds[1] += job.size; ds[3] = time.time()
+                if self.keep_finished: self.finished.extend(job.files)
+                requeue = False
+            self.free_slots.append(slot)
+            if self.closed and not self.pending and not self.running: self.end_t = time.time()
+            self.cond.notify_all()
+        return not requeue
+    def worker(self, fn):
+        while True:
+            task = self.next()
+            if not task: return
+            job, slot, lane = task
+            t0 = time.time(); requeue = False
+            try: job.ok = bool(fn(slot, job, lane))
+            except HardwareEncodeError:
+                logging.warning(f"[Worker {slot}] {lane.label} failed for {job.path.name}, requeueing for another lane")
+                job.excluded.add(lane.name); requeue = True
+            except Exception as e:
+                logging.error(f"[Worker {slot}] Unhandled error for {job.path.name}: {e}"); job.ok = False
+            job.elapsed += time.time() - t0
+            if self.finish(job, slot, requeue) and self.on_finish:
+                for j in job.files:
+                    try: self.on_finish(j)
+                    except Exception as e: logging.error(f"on_finish failed for {j.path.name}: {e}")
+    def borrow(self, lane, job):
+        # Lend an idle slot to a running job (segmented encode) when nothing is waiting for it
+        with self.cond:
+            if self.pending or not self.free_slots or lane.disabled or lane.active >= lane.capacity: return None
+            if self.budget and self.budget.free() <= 0: return None
+            if not self._device_free(job): return None
+            self.dev_active[job.device] += 1
+            lane.active += 1
+            self.running += 1
+            threads = self.budget.acquire(self.running) if self.budget else 0
+            slot = self.free_slots.pop()
+        def release():
+            with self.cond:
+                if self.budget and threads: self.budget.release(threads)
+                self.dev_active[job.device] -= 1
+                lane.active -= 1
+                self.running -= 1
+                self.free_slots.append(slot)
+                self.cond.notify_all()
+        return slot, threads, release
+    def done_count(self):
+        with self.cond: return self.completed
+    def wait(self, timeout):
+        # Returns True once every job has finished; wakes early on each completion
+        with self.cond:
+            if self.pending or self.running or not self.closed: self.cond.wait(timeout)
+            return self.closed and not self.pending and not self.running
+    def device_report(self):
+        # [(mount point, files, bytes, bytes/s over the device's busy span)]
+        with self.cond: stats = list(self.dev_stats.values())
+        return [(mount_point(p), n, b, b / (end - start) if start and end and end > start else 0.0) for n, b, start, end, p in stats if n]
+    def makespan(self):
+        # Actual wall time vs. the lower bound max(total work / slots, longest job)
+        actual = ((self.end_t or time.time()) - self.start_t) if self.start_t else 0.0
+        times = [j.elapsed for j in self.finished]
+        ideal = max(sum(times) / self.slots, max(times)) if times else 0.0
+        return actual, ideal, (ideal / actual * 100) if actual > 0 else 100.0
+
+class Pipeline:
+    # scan -> bounded probe queue -> probe pool -> scheduler: encoding starts as soon as the first file is planned
+    def __init__(self, eng, source, probe_workers=4):
+        self.eng, self.source, self.sched, self.config = eng, source, eng.sched, eng.config
+        config = self.config
+        self.probe_workers = probe_workers
+        self.probe_q = queue.Queue(maxsize=config.get('pipeline_depth', 64))
+        self.counts = {'encode': 0, 'remux': 0, 'skip': 0}
+        self.live = probe_workers
+        self.small = {} # st_dev -> short clips gathering into the next batch
+        self.lock = threading.Lock()
+    def start(self):
+        threading.Thread(target=self._feed, name="scan", daemon=True).start()
+        for i in range(self.probe_workers): threading.Thread(target=self._probe, name=f"probe-{i}", daemon=True).start()
+        return self
+    def _feed(self):
+        try:
+            for item in self.source: self.probe_q.put(item) # Blocks while the probe stage is behind
+        except Exception as e: logging.error(f"Scan failed: {e}")
+        for _ in range(self.probe_workers): self.probe_q.put(None)
+    def _probe(self):
+        try:
+            while (item := self.probe_q.get()) is not None:
+                try: self._plan(*item)
+                except Exception as e: logging.error(f"Queueing failed for {item[0].name}: {e}")
+        finally:
+            # However this thread ends, the last one out must close the queue or the workers wait forever
+            with self.lock:
+                self.live -= 1
+                last = self.live == 0
+            if last:
+                try:
+                    for group in self.small.values(): self.sched.add(Job.batch(group) if len(group) > 1 else group[0])
+                    self.eng.probes.save()
+                except Exception as e: logging.error(f"Queueing failed: {e}")
+                finally: self.sched.close()
+    def _plan(self, path, st):
+        try: info = self.eng.probes.probe(path, st)
+        except Exception as e:
+            logging.warning(f"Probe failed for {path.name}: {e}"); info = None
+        action, reason = plan_video(info, self.config, path)
+        with self.lock: self.counts[action] += 1
+        if action == 'skip': return
+        job = Job(path, action, info)
+        job.dest = output_path(path, action, self.config)
+        job.device = st.st_dev
+        if not job.size: job.size = st.st_size
+        self.eng.journal.record(path, 'queued', action=action)
+        if batchable(job, self.config):
+            # Short clips wait here until a full batch from the same device has gathered
+            with self.lock:
+                group = self.small.setdefault(job.device, [])
+                group.append(job)
+                if len(group) >= max(1, self.config.get('batch_size', 8)): del self.small[job.device]
+                else: group = None
+            if group: self.sched.add(Job.batch(group) if len(group) > 1 else group[0])
+            return
+        self.sched.add(job) # Blocks while the encoders are behind
+
+VERIFY_LEVELS = ('fast', 'sampled', 'full')
+VERIFY_WINDOW = 1.0 # Seconds decoded per sample window
+
+def decode_sampled(path, duration, fps, k, start=0.0):
+    # Decode k short windows spread over the file in one ffmpeg run and check their timestamps land where asked.
+    # -copyts keeps the container's start offset (about 1.4s for MPEG-TS), so it is taken off every frame time.
+    k = max(1, min(k, int(duration // VERIFY_WINDOW) or 1))
+    starts = [max(0.0, duration * (i + 0.5) / k - VERIFY_WINDOW / 2) for i in range(k)]
+    cmd = ["ffmpeg", "-nostdin", "-v", "error", "-xerror", "-copyts"]
+    for t in starts: cmd.extend(["-ss", f"{t:.3f}", "-t", f"{VERIFY_WINDOW}", "-i", str(path)])
+    for i in range(k): cmd.extend(["-map", f"{i}:v:0"])
+    cmd.extend(["-f", "framecrc", "-"])
+    r = subprocess.run(cmd, capture_output=True, text=True, errors='replace', timeout=60 + 10 * k)
+    if r.returncode != 0 or r.stderr.strip(): return False
+    tb, frames = {}, {}
+    for line in r.stdout.splitlines():
+        if line.startswith('#tb '):
+            idx, _, rate = line[4:].partition(':')
+            tb[int(idx)] = parse_rate(rate.strip())
+        elif line and not line.startswith('#'):
+            parts = [x.strip() for x in line.split(',')]
+            frames.setdefault(int(parts[0]), []).append(int(parts[2]) * tb.get(int(parts[0]), 0) - start)
+    slack = 3.0 / (fps or 30.0)
+    for i, t in enumerate(starts):
+        ts = frames.get(i)
+        if not ts: return False
+        end = min(t + VERIFY_WINDOW, duration)
+        if ts[0] > t + slack or ts[-1] < end - VERIFY_WINDOW / 2 or ts[0] < t - slack: return False
+        if any(b <= a or b - a > slack for a, b in zip(ts, ts[1:])): return False
+    return True
+
+def decode_full(path):
+    # Decode every frame with error detection; returns the decoded video frame count or -1 on error
+    cmd = ["ffmpeg", "-nostdin", "-v", "error", "-xerror", "-i", str(path), "-map", "0:v:0", "-map", "0:a?", "-f", "null", "-", "-progress", "pipe:1"]
+    r = subprocess.run(cmd, capture_output=True, text=True, errors='replace')
+    if r.returncode != 0 or r.stderr.strip(): return -1
+    frames = [l for l in r.stdout.splitlines() if l.startswith('frame=')]
+    try: return int(frames[-1].split('=')[1])
+    except: return -1
+
+def verify_output(eng, inp, outp, in_info=None, level='fast', samples=5):
+    # fast: headers and duration | sampled: + decode K windows | full: + decode everything
+    if not outp.exists() or outp.stat().st_size < 10240: return None
+    t0 = time.time()
+    try:
+        in_info = in_info or eng.probes.probe(inp)
+        out_info = eng.ffprobe(outp, timeout=15)
+        if not out_info.get('vcodec') or not out_info.get('height'): return None
+        in_d, out_d = in_info['duration'], out_info['duration']
+        if abs(in_d - out_d) >= 2.0: return None
+        out_fps = out_info.get('fps') or in_info.get('fps') or 30.0
+        out_f = out_info['nb_frames']
+        # Short files: one full decode is cheaper than seeking into k windows
+        if level == 'sampled' and out_d < 4 * samples * VERIFY_WINDOW: level = 'full'
+        if level == 'sampled' and not decode_sampled(outp, out_d, out_fps, samples, out_info.get('start', 0.0)): return None
+        if level == 'full':
+            out_f = decode_full(outp)
+            if out_f < 0: return None
+        # Compare against the frames the input duration implies at the output rate (nb_frames is often absent)
+        if out_f > 0 and in_d > 0 and abs(in_d * out_fps - out_f) > max(2.0 * out_fps, in_d * out_fps * 0.01): return None
+        return out_info
+    except: return None
+    finally:
+        secs = time.time() - t0
+        with eng.lock:
+            tot = eng.verify_totals.setdefault(level, [0, 0.0])
+            tot[0] += 1; tot[1] += secs
+        eng.metrics.add('verify_s', secs)
+        logging.debug(f"Verify ({level}) {outp.name}: {secs:.2f}s")
+
+def video_encode_args(codec, config, scale=True):
+    args = ["-c:v", codec]
+    # 1. NVENC (NVIDIA): Use Constant Quality (CQ) mode
+    if "nvenc" in codec:
+        args.extend(["-rc", "vbr", "-cq", "24", "-preset", "p4"])
+    # 2. CPU (libx264): Use Target Bitrate + Medium Preset
+    elif "libx264" in codec:
+        args.extend(["-b:v", config['video_bitrate'], "-preset", config.get('x264_preset', "medium")])
+    # 3. Universal Safety Mode (Intel QSV, AMD, Apple, etc.): Use Bitrate Only
+    # avoid specific presets that might crash other hardware encoders
+    else:
+        args.extend(["-b:v", config['video_bitrate']])
+    # Common parameters (FPS, Resize); a ladder does its scaling in the shared filter graph instead
+    args.extend(["-r", str(config['target_fps'])])
+    if scale: args.extend(["-vf", f"scale=-2:{config['target_height']}"])
+    return args
+
+def rendition_targets(vpath, config, wid):
+    # Extra outputs from config 'renditions': [(spec, tmp, final)], written beside the source or in spec['dir'].
+    # A target that already exists is left alone: it may be a user's file that happens to share the name.
+    out = []
+    for i, r in enumerate(config.get('renditions') or []):
+        name = r.get('name') or f"r{i}"
+        thumb = r.get('type') == 'thumbnail'
+        folder = vpath.parent / r.get('dir', '')
+        final = folder / f"{vpath.stem}{r.get('suffix', '_' + name)}{r.get('ext', '.jpg' if thumb else '.mp4')}"
+        if final.exists():
+            logging.warning(f"Rendition '{name}' skipped for {vpath.name}: {final.name} already exists")
+            continue
+        out.append((r, folder / f"mnemosyne_tmp_{wid}_{final.name}", final))
+    return out
+
+def place_renditions(renditions):
+    # Move verified rendition temps to their final names; returns the paths placed
+    placed = []
+    for r, r_tmp, final in renditions:
+        if final.exists():
+            # Appeared while encoding: never overwrite it
+            logging.warning(f"Rendition '{r.get('name', final.name)}' not placed: {final} already exists")
+            r_tmp.unlink(); continue
+        os.replace(r_tmp, final); placed.append(str(final))
+    return placed
+
+def ladder_args(renditions, config, action, dur, comment=ENCODER_TAG):
+    # One decode feeds every output: split the video once, scale each branch, map each to its own output.
+    # Renditions encode on the CPU unless they name a codec, so a hardware lane's session limit still holds.
+    branches = [] if action == 'remux' else [("main", f"scale=-2:{config['target_height']}")]
+    for i, (r, _, _) in enumerate(renditions):
+        flt = f"scale=-2:{r.get('height', config['target_height'])}"
+        if r.get('type') == 'thumbnail':
+            at = float(r.get('at', 0.1))
+            at = at * dur if at < 1 else min(at, max(0.0, dur - 1.0))
+            flt = f"select='gte(t,{at:.3f})',{flt}"
+        branches.append((f"r{i}", flt))
+    graph = f"[0:v:0]split={len(branches)}" + "".join(f"[s{j}]" for j in range(len(branches)))
+    graph += "".join(f";[s{j}]{flt}[{label}]" for j, (label, flt) in enumerate(branches))
+    outputs = []
+    for i, (r, tmp, _) in enumerate(renditions):
+        outputs.extend(["-map", f"[r{i}]"])
+        if r.get('type') == 'thumbnail':
+            outputs.extend(["-frames:v", "1", "-update", "1"])
+        else:
+            rc = {**config, 'video_bitrate': r.get('video_bitrate', config['video_bitrate']), 'target_fps': r.get('fps', config['target_fps'])}
+            outputs.extend(video_encode_args(r.get('codec', "libx264"), rc, scale=False))
+            outputs.extend(["-map", "0:a:0?", "-c:a", "aac", "-b:a", r.get('audio_bitrate', config['audio_bitrate'])])
+            outputs.extend(["-metadata", f"comment={comment}"])
+        outputs.append(str(tmp))
+    main_map = ["-filter_complex", graph, "-map", "0:v:0" if action == 'remux' else "[main]", "-map", "0:a:0?"]
+    return main_map, outputs
+
+def keyframe_cuts(path, duration, seg_len):
+    # Segment start offsets (seconds from file start) snapped to the keyframe at or before each target time
+    targets = [seg_len * i for i in range(1, int(duration // seg_len) + 1) if seg_len * i < duration - seg_len / 4]
+    if not targets: return [0.0]
+    cmd = ["ffprobe", "-v", "error", "-select_streams", "v:0", "-read_intervals", ",".join(f"{t:.3f}%+#1" for t in targets),
+           "-show_entries", "packet=pts_time,flags:format=start_time", "-of", "json", str(path)]
+    try: data = json.loads(subprocess.run(cmd, capture_output=True, text=True, errors='replace', timeout=60).stdout or '{}')
+    except (subprocess.SubprocessError, ValueError): return [0.0] # Unseekable source: one part, same as a plain encode
+    start = float(data.get('format', {}).get('start_time') or 0.0)
+    cuts = {0.0}
+    for pkt in data.get('packets', []):
+        if 'K' in pkt.get('flags', '') and pkt.get('pts_time') not in (None, 'N/A'):
+            t = float(pkt['pts_time']) - start
+            if 1.0 < t < duration - 1.0: cuts.add(round(t, 6))
+    return sorted(cuts)
+
+def encode_segmented(eng, wid, vpath, tmp, codec, info, threads, ffmpeg, borrow, audio_args, on_progress):
+    # Video is encoded in keyframe-aligned pieces (each decode starts on a keyframe, nothing is wasted),
+    # joined with the concat demuxer and muxed once with the untouched source audio, so A/V sync is kept.
+    # The concat list pins each piece to its exact source length so rounding can't accumulate.
+    config = eng.config
+    fn, dur = vpath.name, info['duration']
+    cuts = keyframe_cuts(vpath, dur, max(10, config.get('segment_seconds', 300)))
+    bounds = list(zip(cuts, cuts[1:] + [None]))
+    parts = [tmp.parent / f"mnemosyne_tmp_{wid}_seg{k:04d}_{vpath.stem}.mkv" for k in range(len(bounds))]
+    listing = tmp.parent / f"mnemosyne_tmp_{wid}_{vpath.stem}.concat.txt"
+    queue, running, done_secs, live = list(range(len(bounds))), {}, 0.0, {}
+    failed = None
+    logging.info(f"[Worker {wid}] Segmented encode: {fn} in {len(bounds)} parts")
+    def report():
+        on_progress({'out_time_us': str(int((done_secs + sum(live.values())) * 0.95e6)), 'fps': '-', 'speed': f"{len(running)} seg"})
+    def spawn(k, slot, n):
+        a, b = bounds[k]
+        cmd = [ffmpeg, "-nostdin", "-y", "-loglevel", "error"]
+        if n: cmd.extend(["-filter_threads", str(n), "-threads", str(n)])
+        if a: cmd.extend(["-ss", f"{a:.6f}"])
+        if b is not None: cmd.extend(["-t", f"{b - a:.6f}"])
+        cmd.extend(["-i", str(vpath), "-map", "0:v:0", "-an", "-sn", "-dn"])
+        if n: cmd.extend(["-threads", str(n)])
+        cmd.extend(video_encode_args(codec, config))
+        cmd.extend(["-progress", "pipe:1", "-nostats", str(parts[k])])
+        def seg_progress(p):
+            try: live[k] = max(0.0, min((b or dur) - a, int(p.get('out_time_us', '')) / 1e6))
+            except ValueError: pass
+            if slot != wid: eng.stats.update(slot, f"{fn} [{k + 1}/{len(bounds)}]", live.get(k, 0) / max(0.001, (b or dur) - a) * 100, p.get('fps', '-'), p.get('speed', '-').strip())
+            report()
+        return eng.procs.spawn(cmd, seg_progress, config.get('stall_timeout'))
+    try:
+        while (queue and not failed) or running:
+            # The job's own slot runs one part; idle slots are borrowed for the rest while the queue is empty
+            while queue and not failed:
+                if not any(slot == wid for slot, _, _ in running.values()): lease = (wid, threads, None)
+                else: lease = borrow()
+                if not lease: break
+                k = queue.pop(0)
+                running[spawn(k, lease[0], lease[1])] = (lease[0], lease[2], k)
+            h = next((h for h in running if h.done.is_set()), None)
+            if h is None:
+                next(iter(running)).wait(0.5); continue
+            slot, release, k = running.pop(h)
+            if release:
+                eng.stats.update(slot, f"{fn} [{k + 1}/{len(bounds)}]", 100.0, "0", "0", "segment done")
+                release()
+            live.pop(k, None)
+            if h.returncode != 0: failed = (h.returncode, h.error_text()); continue
+            a, b = bounds[k]
+            done_secs += (b or dur) - a
+            report()
+        if failed: return failed
+        with open(listing, 'w', encoding='utf-8') as f:
+            f.write("ffconcat version 1.0\n")
+            for part, (a, b) in zip(parts, bounds):
+                f.write("file '" + part.name.replace("'", "'\\''") + "'\n")
+                if b is not None: f.write(f"duration {b - a:.6f}\n")
+        cmd = [ffmpeg, "-nostdin", "-y", "-loglevel", "error", "-f", "concat", "-safe", "0", "-i", str(listing), "-i", str(vpath),
+               "-map", "0:v:0", "-map", "1:a?", "-map_metadata", "1", "-c:v", "copy"] + audio_args
+        def join_progress(p):
+            try: on_progress({'out_time_us': str(int(dur * 0.95e6 + max(0, int(p.get('out_time_us', ''))) * 0.05)), 'fps': '-', 'speed': 'join'})
+            except ValueError: pass
+        proc = eng.procs.spawn(cmd, join_progress, config.get('stall_timeout'))
+        return proc.wait(), proc.error_text()
+    finally:
+        for h, (slot, release, k) in running.items():
+            eng.procs.cancel(h); h.wait()
+            if release: release()
+        for f in parts + [listing]:
+            try: f.unlink()
+            except OSError: pass
+
+def finalize_output(eng, wid, vpath, tmp, dest, meta, start_size, info, renditions=(), check_gain=False):
+    # Verify a finished temp output, then swap it into place; raises if verification fails
+    config = eng.config
+    saved_pct = None
+    if check_gain and config.get('min_savings', 0) and start_size:
+        saved_pct = (1 - tmp.stat().st_size / start_size) * 100
+        if saved_pct >= config['min_savings']: saved_pct = None
+        elif not renditions: return keep_original(eng, wid, vpath, tmp, saved_pct, 'final')
+    out_info = None
+    if config['verify_frames']:
+        if saved_pct is None:
+            level = config.get('verify_level', 'sampled')
+            out_info = verify_output(eng, vpath, tmp, info, level if level in VERIFY_LEVELS else 'fast', config.get('verify_samples', 5))
+            if not out_info: raise Exception("Output verification failed")
+        for r, r_tmp, _ in renditions:
+            ok = r_tmp.exists() and r_tmp.stat().st_size > 0 if r.get('type') == 'thumbnail' else verify_output(eng, vpath, r_tmp, info, 'fast')
+            if not ok: raise Exception(f"Rendition '{r.get('name', r_tmp.name)}' failed verification")
+    if saved_pct is not None: return keep_original(eng, wid, vpath, tmp, saved_pct, 'final', renditions)
+    job = getattr(eng.local, 'job', None)
+    if job is not None and job.cancelled:
+        # Cancelled after ffmpeg finished: the source is still untouched, so the cancel can still be honoured
+        for p in [tmp] + [r_tmp for _, r_tmp, _ in renditions]:
+            if p.exists(): p.unlink()
+        eng.journal.record(vpath, 'failed', error="cancelled")
+        return False
+    t0 = time.time()
+    if tmp.parent != vpath.parent:
+        eng.stats.update(wid, vpath.name, 99.9, "-", "-", "Copying back from scratch...")
+        tmp = copy_back(tmp, vpath.parent / tmp.name)
+    eng.journal.record(vpath, 'verified', tmp=str(tmp))
+
+    end_size = tmp.stat().st_size
+    size_diff = (1 - (end_size / start_size)) * 100
+    size_stats = f"{start_size/1024/1024:.1f}MB -> {end_size/1024/1024:.1f}MB ({size_diff:.0f}% saved)"
+
+    bak = vpath.with_suffix(vpath.suffix + '.bak')
+    try:
+        swap_into_place(eng, vpath, tmp, meta, dest)
+        eng.metrics.add('swap_s', time.time() - t0); eng.metrics.add('bytes_out', end_size)
+        # Cache the output's probe so the next run doesn't spawn ffprobe for it
+        if dest != vpath: eng.probes.forget(vpath)
+        if out_info: eng.probes.store(dest, out_info)
+        else: eng.probes.forget(dest)
+    except Exception as e:
+        logging.error(f"File swap error: {e}")
+        if bak.exists() and not vpath.exists(): bak.rename(vpath)
+        for _, r_tmp, _ in renditions:
+            if r_tmp.exists(): r_tmp.unlink()
+        eng.journal.record(vpath, 'failed', error=f"swap: {e}")
+        return False
+
+    placed = place_renditions(renditions)
+    eng.journal.record(vpath, 'done', size=end_size, renditions=placed)
+    eng.stats.update(wid, vpath.name, 100.0, "0", "0", size_stats)
+    return True
+
+def process_batch(eng, wid, jobs, codec, threads=0, ffmpeg="ffmpeg", scratch=None):
+    # Short clips share one ffmpeg: N inputs mapped to N outputs, so process start and encoder init
+    # are paid once. Each output is still verified and swapped on its own; returns the number that succeeded.
+    config = eng.config
+    label = f"{len(jobs)} clips ({jobs[0].path.name}...)"
+    eng.stats.update(wid, label, 0.0, "-", "0X", "")
+    logging.info(f"[Worker {wid}] Started batch of {len(jobs)}: {', '.join(j.path.name for j in jobs)}")
+    cmd = [ffmpeg, "-nostdin", "-y", "-loglevel", "error"]
+    if threads: cmd.extend(["-filter_threads", str(threads), "-threads", str(threads)])
+    items = []
+    for j in jobs:
+        try:
+            st = j.path.stat()
+            info = eng.probes.probe(j.path, st)
+        except Exception as e:
+            logging.error(f"Process error for {j.path.name}: {e}"); j.ok = False
+            continue
+        tmp = (scratch or j.path.parent) / f"mnemosyne_tmp_{wid}_{j.dest.name}"
+        items.append((j, tmp, get_file_metadata(j.path, st), st.st_size, info))
+        cmd.extend(["-i", str(j.path)])
+    if not items: return 0
+    for i, (j, tmp, meta, _, info) in enumerate(items):
+        cmd.extend(["-map", f"{i}:v:0", "-map", f"{i}:a:0?"])
+        if threads: cmd.extend(["-threads", str(threads)])
+        cmd.extend(video_encode_args(codec, config))
+        if info.get('acodec') and audio_compatible(info, config): cmd.extend(["-c:a", "copy"])
+        else: cmd.extend(["-c:a", "aac", "-b:a", config['audio_bitrate']])
+        cmd.extend(["-metadata", f"encoder={ENCODER_TAG}", "-metadata", f"comment={marker_comment(info)}", str(tmp)])
+        eng.journal.record(j.path, 'encoding', tmp=str(tmp), dest=str(j.dest), codec=codec, action=j.action, meta=list(meta))
+    cmd[-1:-1] = ["-progress", "pipe:1", "-nostats"]
+    longest = max(info['duration'] for *_, info in items) or 1.0
+    def on_progress(p):
+        try: pct = max(0.0, min(99.9, int(p.get('out_time_us', '')) / 1e6 / longest * 100))
+        except ValueError: return
+        eng.stats.update(wid, label, pct, p.get('fps', '-'), p.get('speed', '-').strip())
+    proc = eng.procs.spawn(cmd, on_progress, config.get('stall_timeout'))
+    if proc.wait() != 0:
+        for _, tmp, *_ in items:
+            if tmp.exists(): tmp.unlink()
+        if codec != "libx264":
+            for j, *_ in items: eng.journal.record(j.path, 'queued', retry=codec)
+            raise HardwareEncodeError(f"{codec} exited with code {proc.returncode}")
+        # One bad input fails the shared process: fall back to one ffmpeg per clip to keep per-file results
+        logging.warning(f"[Worker {wid}] Batch failed ({proc.error_text()}), processing clips one by one")
+        for j, *_ in items: j.ok = process_video(eng, wid, j.path, codec, j.action, threads, ffmpeg, fallback=False, dest=j.dest, scratch=scratch)
+        return sum(1 for j in jobs if j.ok)
+    for j, tmp, meta, start_size, info in items:
+        try: j.ok = finalize_output(eng, wid, j.path, tmp, j.dest, meta, start_size, info, check_gain=True)
+        except Exception as e:
+            logging.error(f"Process error for {j.path.name}: {e}")
+            if tmp.exists(): tmp.unlink()
+            eng.journal.record(j.path, 'failed', error=str(e)); j.ok = False
+    done = sum(1 for j in jobs if j.ok)
+    eng.stats.update(wid, label, 100.0, "0", "0", f"{done}/{len(jobs)} clips done")
+    return done
+
+def process_video(eng, wid, vpath, codec, action='encode', threads=0, ffmpeg="ffmpeg", fallback=True, dest=None, borrow=None, scratch=None):
+    config = eng.config
     fn = vpath.name
     s_fps, s_speed, pct = "-", "0X", 0.0
-    worker_stats.update(wid, fn, 0.0, s_fps, s_speed, "")
+    eng.stats.update(wid, fn, 0.0, s_fps, s_speed, "")
     logging.info(f"[Worker {wid}] Started processing: {fn}")
     try:
-        meta = get_file_metadata(vpath)
-        start_size = vpath.stat().st_size
-        tmp = vpath.parent / f"mnemosyne_tmp_{wid}_{fn}"
-        try:
-            dur = float(subprocess.run(["ffprobe", "-v", "error", "-show_entries", "format=duration", "-of", "csv=p=0", str(vpath)], capture_output=True, text=True).stdout.strip() or 1.0)
-        except: dur = 1.0
+        st = vpath.stat()
+        meta = get_file_metadata(vpath, st)
+        start_size = st.st_size
+        dest = dest or output_path(vpath, action, config)
+        # Encode and verify on the scratch drive when staging; finalize_output copies the result back
+        tmp = (scratch or vpath.parent) / f"mnemosyne_tmp_{wid}_{dest.name}"
+        try: info = eng.probes.probe(vpath, st)
+        except: info = {'duration': 0.0, 'nb_frames': -1}
+        dur = info['duration'] or 1.0
+        # Per-stream decisions: compatible streams are copied instead of re-encoded
+        copy_audio = bool(info.get('acodec')) and audio_compatible(info, config)
+        eng.journal.record(vpath, 'encoding', tmp=str(tmp), dest=str(dest), codec=codec, action=action, meta=list(meta))
         # Build command with Conditional Logic for Hardware vs Software Encoders
-        cmd = ["ffmpeg", "-nostdin", "-y", "-i", str(vpath), "-c:v", codec]
+        cmd = [ffmpeg, "-nostdin", "-y", "-loglevel", "error"]
+        # Thread budget: cap decoder, filter graph and encoder threads to this job's share of the CPU
+        if threads: cmd.extend(["-filter_threads", str(threads), "-threads", str(threads)])
+        cmd.extend(["-i", str(vpath)])
+        if threads: cmd.extend(["-threads", str(threads)])
         
-        # 1. NVENC (NVIDIA): Use Constant Quality (CQ) mode
-        if "nvenc" in codec:
-            cmd.extend(["-rc", "vbr", "-cq", "24", "-preset", "p4"])
-        # 2. CPU (libx264): Use Target Bitrate + Medium Preset
-        elif "libx264" in codec:
-            cmd.extend(["-b:v", config['video_bitrate'], "-preset", "medium"])
-        # 3. Universal Safety Mode (Intel QSV, AMD, Apple, etc.): Use Bitrate Only
-        # avoid specific presets that might crash other hardware encoders
+        # Ladder: extra renditions are cut from the same decode via a split filter graph
+        renditions = rendition_targets(vpath, config, wid)
+        extra_outputs = []
+        if renditions:
+            main_map, extra_outputs = ladder_args(renditions, config, action, info['duration'], marker_comment(info))
+            cmd.extend(main_map)
+            for _, r_tmp, _ in renditions: r_tmp.parent.mkdir(parents=True, exist_ok=True)
+        
+        # 0. Remux: video already within targets, stream-copied into the (new) container
+        if action == 'remux':
+            cmd.extend(["-c:v", "copy"])
         else:
-            cmd.extend(["-b:v", config['video_bitrate']])
+            cmd.extend(video_encode_args(codec, config, scale=not renditions))
 
-        # Common parameters (FPS, Audio, Resize, Metadata)
+        # Common parameters (Audio, Metadata)
+        if copy_audio: cmd.extend(["-c:a", "copy"])
+        else: cmd.extend(["-c:a", "aac", "-b:a", config['audio_bitrate']])
         cmd.extend([
-            "-r", str(config['target_fps']),
-            "-vf", f"scale=-2:{config['target_height']}",
-            "-c:a", "aac", "-b:a", config['audio_bitrate'],
-            "-metadata", f"encoder={APP_NAME} v{VERSION}",
-            "-progress", "-", "-nostats", str(tmp)
-        ])
+            "-metadata", f"encoder={ENCODER_TAG}", "-metadata", f"comment={marker_comment(info)}",
+            "-progress", "pipe:1", "-nostats", str(tmp)
+        ] + extra_outputs)
         
-        if IS_WINDOWS:
-            # CREATE_NEW_PROCESS_GROUP = 0x00000200
-            proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True, encoding='utf-8', errors='replace', creationflags=0x00000200)
+        # Savings gate: project the final size from total_size / share encoded and stop early if it's not worth it.
+        # A ladder can't stop early (its renditions are wanted regardless); its main output is still gated at the end.
+        check_gain = action == 'encode' and bool(config.get('min_savings', 0))
+        proc, projected = None, None
+        def on_progress(p):
+            nonlocal pct, s_fps, s_speed, projected
+            try: pct = max(0.0, min(99.9, int(p.get('out_time_us', '')) / 1e6 / dur * 100))
+            except ValueError: pass
+            s_fps, s_speed = p.get('fps', s_fps), p.get('speed', s_speed).strip()
+            eng.stats.update(wid, fn, pct, s_fps, s_speed)
+            if check_gain and not renditions and proc and projected is None and pct >= GAIN_CHECK_FRACTION * 100 and pct * dur / 100 >= GAIN_CHECK_SECS:
+                try: size = int(p.get('total_size', ''))
+                except ValueError: return
+                est = size / (pct / 100)
+                if (1 - est / start_size) * 100 < config['min_savings']:
+                    projected = est
+                    eng.procs.cancel(proc)
+        seg_min = config.get('segment_min_duration', 0)
+        if action == 'encode' and borrow and seg_min and info['duration'] >= seg_min and not renditions:
+            # Long file: encode keyframe-aligned segments on this slot plus any idle ones, then join
+            rc, err = encode_segmented(eng, wid, vpath, tmp, codec, info, threads, ffmpeg, borrow, cmd[cmd.index("-c:a"):], on_progress)
         else:
-            proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True, encoding='utf-8', errors='replace')
-        PROCESS_MGR.register(proc)
-        while True:
-            line = proc.stdout.readline()
-            if not line and proc.poll() is not None: break
-            if "out_time=" in line:
-                try:
-                    ts = line.split("out_time=")[1].split()[0]
-                    h, m, s = map(float, ts.split(':'))
-                    new_pct = min(99.9, ((h*3600 + m*60 + s) / dur) * 100); pct = new_pct
-                    worker_stats.update(wid, fn, pct, s_fps, s_speed)
-                except: pass
-            elif "fps=" in line:
-                try:
-                    s_fps = line.split("fps=")[1].split()[0]
-                    s_speed = line.split("speed=")[1].split()[0]
-                    worker_stats.update(wid, fn, pct, s_fps, s_speed)
-                except: pass
-        PROCESS_MGR.unregister(proc)
-        if proc.returncode != 0:
+            proc = eng.procs.spawn(cmd, on_progress, config.get('stall_timeout'))
+            rc = proc.wait()
+            err = proc.error_text()
+            if projected is not None:
+                return keep_original(eng, wid, vpath, tmp, (1 - projected / start_size) * 100, 'early')
+        if rc != 0:
             if codec != "libx264":
+                if tmp.exists(): tmp.unlink()
+                for _, r_tmp, _ in renditions:
+                    if r_tmp.exists(): r_tmp.unlink()
+                # Under the scheduler the job moves to a CPU lane instead of re-encoding on this worker
+                if not fallback: raise HardwareEncodeError(f"{codec} exited with code {rc}")
                 logging.warning(f"Hardware encoding failed for {fn}, falling back to CPU")
-                worker_stats.update(wid, fn, 0.0, "-", "0X", "Retrying with CPU...")
-                return process_video(wid, vpath, "libx264", config)
-            return False
+                eng.stats.update(wid, fn, 0.0, "-", "0X", "Retrying with CPU...")
+                return process_video(eng, wid, vpath, "libx264", action, threads, dest=dest, borrow=borrow, scratch=scratch)
+            raise Exception(f"ffmpeg exited with code {rc}: {err}")
 
-        if config['verify_frames'] and not verify_output(vpath, tmp): return False
-        
-        end_size = tmp.stat().st_size
-        size_diff = (1 - (end_size / start_size)) * 100
-        size_stats = f"{start_size/1024/1024:.1f}MB -> {end_size/1024/1024:.1f}MB ({size_diff:.0f}% saved)"
-        
-        bak = vpath.with_suffix(vpath.suffix + '.bak')
-        if bak.exists(): bak.unlink()
-        try:
-            vpath.rename(bak)
-            tmp.rename(vpath)
-            restore_file_metadata(vpath, meta)
-            if vpath.exists() and vpath.stat().st_size > 10240: bak.unlink()
-            else: raise Exception("Output verification fail after swap")
-        except Exception as e:
-            logging.error(f"File swap error: {e}")
-            if bak.exists() and not vpath.exists(): bak.rename(vpath)
-            return False
-            
-        worker_stats.update(wid, fn, 100.0, "0", "0", size_stats)
-        return True
+        return finalize_output(eng, wid, vpath, tmp, dest, meta, start_size, info, renditions, check_gain)
+    except HardwareEncodeError:
+        eng.journal.record(vpath, 'queued', retry=codec)
+        raise
     except Exception as e:
         logging.error(f"Process error for {fn}: {e}")
         if 'tmp' in locals() and tmp.exists(): tmp.unlink()
+        for _, r_tmp, _ in locals().get('renditions', []):
+            if r_tmp.exists(): r_tmp.unlink()
+        eng.journal.record(vpath, 'failed', error=str(e))
         return False
 
-def update_display(total, codec_name, config):
-    header = draw_header(config, codec_name)
+def make_runner(eng):
+    # The function Scheduler.worker calls for each job: batch, single file, then any identical copies
+    sched = eng.sched
+    def run_job(slot, job, lane):
+        fut = job.future
+        if fut and not fut.running() and not fut.set_running_or_notify_cancel():
+            eng.journal.record(job.path, 'skipped', reason="cancelled")
+            return False
+        eng.local.job, eng.slot_jobs[slot] = job, job
+        rec, requeued = eng.metrics.begin(job, lane, slot), False
+        try:
+            if job.members: ok = process_batch(eng, slot, job.members, lane.codec, job.threads, lane.ffmpeg, job.staging)
+            else: ok = job.ok = process_video(eng, slot, job.path, lane.codec, job.action, job.threads, lane.ffmpeg, fallback=False, dest=job.dest, borrow=lambda: sched.borrow(lane, job), scratch=job.staging)
+            apply_duplicates(eng, slot, job)
+            return ok
+        except HardwareEncodeError:
+            if job.cancelled:
+                # Killed on request, not a hardware fault: no retry on another lane, no strike against the GPU
+                for j in job.files: eng.journal.record(j.path, 'failed', error="cancelled")
+                return False
+            requeued = True; raise
+        finally:
+            eng.metrics.end(rec, job, requeued)
+            eng.local.job = job.handles = None
+            eng.slot_jobs.pop(slot, None)
+    return run_job
+
+class Engine:
+    # One self-contained encoder: its own ffmpeg supervisor, progress table, probe cache, journal and metrics.
+    # Engines share nothing, so several can run in one process with different configs and data folders.
+    # A data folder (and a scratch_dir) belongs to one engine at a time; a second engine on it fails fast.
+    live = weakref.WeakSet() # For the CLI's emergency stop only
+    def __init__(self, config=None, data_dir=APP_DATA, on_progress=None):
+        self.config = dict(DEFAULT_CONFIG, **(config or {}))
+        self.data_dir = Path(data_dir)
+        self.owner = lock_dir(self.data_dir)
+        if self.owner is None: raise RuntimeError(f"{self.data_dir} is in use by another engine; give each engine its own data_dir")
+        self.metrics = JobMetrics(self.data_dir / "metrics.jsonl")
+        self.metrics.enabled = self.config.get('metrics_log', True)
+        self.procs = ProcessManager(self.metrics)
+        self.procs.on_spawn = self._track
+        self.stats = WorkerStats(self._progress)
+        self.probes = ProbeCache(self.data_dir / "probe_cache.json", self.ffprobe)
+        self.journal = JobJournal(self.data_dir / "journal.jsonl")
+        self.on_progress = on_progress # (slot, snapshot) for every progress update
+        self.lock = threading.Lock() # Guards the run counters below
+        self.verify_totals = {} # level -> [files, seconds]
+        self.gain_aborts = {'early': 0, 'final': 0}
+        self.sim = None # FakeFFmpeg answering probes instead of ffprobe (--simulate)
+        self.local = threading.local() # The job running on this worker thread
+        self.slot_jobs = {} # slot -> running job, to route progress to per-job callbacks
+        self.sched = self.pool = self.lanes = None
+        self.sched_lock = None # Lock behind the scheduler's condition; --simulate swaps in a ContentionLock
+        self.on_finish = None
+        Engine.live.add(self)
+    def ffprobe(self, path, timeout=30):
+        return self.sim.probe(path) if self.sim else run_ffprobe(path, timeout)
+    def _progress(self, slot, snapshot):
+        if self.on_progress: self.on_progress(slot, snapshot)
+        job = self.slot_jobs.get(slot)
+        if job and job.on_progress:
+            try: job.on_progress(snapshot)
+            except Exception as e: logging.debug(f"Progress callback failed for {job.path.name}: {e}")
+    def _track(self, h):
+        # Runs on the worker thread that spawned h, so the thread's current job owns it
+        job = getattr(self.local, 'job', None)
+        if job is None: return
+        job.handles = (job.handles or []) + [h]
+        if job.cancelled: self.procs.cancel(h)
+    def _finished(self, job):
+        if job.future and not job.future.done():
+            # A cancel that lands after the swap committed came too late: report what actually happened
+            if job.cancelled and not job.ok: job.future.set_exception(CancelledError())
+            else: job.future.set_result(bool(job.ok))
+        if self.on_finish: self.on_finish(job)
+    def recover(self):
+        # (paths left to encode, swaps repaired) from an interrupted run of this engine's journal
+        return recover_interrupted_jobs(self)
+    def serve_metrics(self, port=None):
+        port = port or self.config.get('metrics_port', 0)
+        if not port: return None
+        try:
+            server = self.metrics.serve(port)
+            logging.info(f"Metrics endpoint: http://127.0.0.1:{port}/metrics")
+            return server
+        except OSError as e: logging.warning(f"Metrics endpoint on port {port} unavailable: {e}")
+    def start(self, jobs=None, lanes=None, codec=None, on_finish=None, max_pending=None):
+        # Start the workers. A job list runs as one fixed batch; without one the queue stays open for submit()
+        # until close(), holding at most max_pending (default pipeline_depth) waiting jobs. Without lanes,
+        # codec picks the hardware lane beside the CPU one; None detects it like --codec auto.
+        config = self.config
+        self.lanes = lanes or build_lanes(config, codec or detect_gpu_codec()[0])
+        slots = 1 if config['max_workers'] == 1 else sum(l.capacity for l in self.lanes)
+        closed = jobs is not None
+        self.sched = Scheduler(make_batches(jobs, config) if closed else [], slots, ThreadBudget(cpu_budget(config), slots), self.lanes,
+                               config.get('hw_failure_limit', 3), closed=closed,
+                               max_pending=0 if closed else config.get('pipeline_depth', 64) if max_pending is None else max_pending,
+                               lpt=config['sort'] == 'cost_desc', scratch=open_scratch(config), device_limits=device_limits(config), lock=self.sched_lock)
+        self.sched.on_finish, self.on_finish = self._finished, on_finish
+        everything = [f for j in jobs for f in j.files] if closed else []
+        self.journal.begin_run([f.path for f in everything], {f.path: f.action for f in everything})
+        self.pool = ThreadPoolExecutor(max_workers=slots, thread_name_prefix="worker")
+        run_job = make_runner(self)
+        for _ in range(slots): self.pool.submit(self.sched.worker, run_job)
+        return self.sched
+    def submit(self, path, on_progress=None):
+        # Probe, plan and queue one file, starting the workers with detected lanes on first use. The future
+        # resolves to True/False once it is done, None when the file needs no work; future.cancel() drops it
+        # while queued, cancel(future) also stops a running encode
+        if self.sched is None: self.start()
+        path, fut = Path(path), Future()
+        st = path.stat()
+        try: info = self.probes.probe(path, st)
+        except Exception as e:
+            logging.warning(f"Probe failed for {path.name}: {e}"); info = None
+        action, reason = plan_video(info, self.config, path)
+        if action == 'skip':
+            fut.set_result(None); return fut
+        job = Job(path, action, info)
+        job.dest, job.device, job.size = output_path(path, action, self.config), st.st_dev, job.size or st.st_size
+        job.future, job.on_progress, fut.job = fut, on_progress, job
+        self.journal.record(path, 'queued', action=action)
+        logging.info(f"Queued {path} ({action}: {reason})")
+        self.sched.add(job) # Blocks while pipeline_depth jobs are already waiting
+        return fut
+    def cancel(self, fut):
+        # Queued jobs never start; a running one has its ffmpeg processes terminated and fails.
+        # Once its output has replaced the source it is too late, and the future still resolves to True.
+        if fut.cancel(): return True
+        job = getattr(fut, 'job', None)
+        if job is None or fut.done(): return False
+        job.cancelled = True
+        for h in job.handles or []: self.procs.cancel(h)
+        return True
+    def wait(self, timeout=None):
+        # True once every queued job has finished (only after close() for an open queue); None blocks until then
+        end = None if timeout is None else time.time() + timeout
+        while not self.sched.wait(1.0 if end is None else max(0.0, min(1.0, end - time.time()))):
+            if end is not None and time.time() >= end: return False
+        return True
+    def close(self, wait=True):
+        # No more submissions; finish what is queued (wait=True) and write out the caches.
+        # Without waiting the run stays open in the journal, so the next start recovers it.
+        if self.sched:
+            self.sched.close()
+            self.pool.shutdown(wait=wait)
+            if wait: self.journal.end_run()
+        self.probes.save()
+        self.journal.close(); self.metrics.close()
+        if wait or not self.sched:
+            # Workers left running keep the folders until the process exits
+            if self.sched and self.sched.scratch: self.sched.scratch.close()
+            self.owner.close()
+    def kill(self): self.procs.kill_all()
+    @classmethod
+    def kill_all(cls):
+        for eng in list(cls.live): eng.kill()
+
+header_cache = {}
+def update_display(eng, total, codec_name, completed=None):
+    # The header only changes with the ticker, so it is built once per message
+    config = eng.config
+    key = (get_ticker_msg(), codec_name, config['target_height'], config['target_fps'], config['video_bitrate'], config['max_workers'], cpu_budget(config))
+    header = header_cache.get(key)
+    if header is None:
+        header_cache.clear(); header = header_cache[key] = draw_header(config, codec_name)
     buffer = [""] # Leading newline to separate from logo
-    stats = worker_stats.get_all()
-    completed = sum(1 for s in stats.values() if s['pct'] >= 100)
+    stats = eng.stats.get_all()
+    if completed is None: completed = sum(1 for s in stats.values() if s['pct'] >= 100)
     in_progress = len([s for s in stats.values() if 0 < s['pct'] < 100])
     
     for wid in sorted(stats.keys()):
@@ -564,9 +2325,568 @@ def update_display(total, codec_name, config):
     o_pct = (completed / total * 100) if total > 0 else 0
     buffer.append(f" {C.WHITE}Total: {total} | {C.SUCCESS}Done: {completed} | {C.INFO}Active: {in_progress} | {o_pct:.1f}%{C.RESET}")
     
-    # Send as one atomic write to terminal
-    sys.stdout.write("\033[H" + header + "\n".join(buffer) + "\033[J")
-    sys.stdout.flush()
+    # Only changed lines are written, as one write to the terminal
+    screen.draw(header + "\n".join(buffer))
+
+class InotifyWatcher:
+    # Minimal inotify binding via ctypes (Linux only); yields paths of files that finished writing or moved in
+    IN_CLOSE_WRITE, IN_MOVED_TO, IN_CREATE, IN_Q_OVERFLOW, IN_ISDIR = 0x8, 0x80, 0x100, 0x4000, 0x40000000
+    def __init__(self):
+        import ctypes, struct
+        self.struct = struct
+        self.libc = ctypes.CDLL(None, use_errno=True)
+        self.fd = self.libc.inotify_init1(os.O_NONBLOCK | getattr(os, 'O_CLOEXEC', 0))
+        if self.fd < 0: raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self.wds = {}
+        self.overflowed = False
+    def add(self, path):
+        mask = self.IN_CLOSE_WRITE | self.IN_MOVED_TO | self.IN_CREATE
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(str(path)), mask)
+        if wd < 0: raise OSError(f"inotify_add_watch failed for {path} (max_user_watches?)")
+        self.wds[wd] = Path(path)
+    def read(self, timeout):
+        import select
+        if not select.select([self.fd], [], [], timeout)[0]: return []
+        try: buf = os.read(self.fd, 65536)
+        except BlockingIOError: return []
+        events, off = [], 0
+        while off + 16 <= len(buf):
+            wd, mask, _, n = self.struct.unpack_from('iIII', buf, off)
+            name = buf[off + 16:off + 16 + n].rstrip(b'\0').decode('utf-8', 'surrogateescape')
+            off += 16 + n
+            if mask & self.IN_Q_OVERFLOW: self.overflowed = True
+            elif wd in self.wds and name: events.append((self.wds[wd] / name, bool(mask & self.IN_ISDIR)))
+        return events
+    def close(self): os.close(self.fd)
+
+class WatchState:
+    # Signatures of files already handled, persisted so a restart doesn't re-probe the whole tree
+    def __init__(self, path=WATCH_STATE_FILE):
+        self.path = path
+        try:
+            with open(path, 'r', encoding='utf-8') as f: self.seen = json.load(f)
+        except: self.seen = {}
+        self.dirty, self.saved_at = False, time.time()
+    def handled(self, path, st): return self.seen.get(str(path)) == [st.st_size, st.st_mtime_ns]
+    def mark(self, path, st=None):
+        try: st = st or os.stat(path)
+        except OSError: self.seen.pop(str(path), None); return
+        self.seen[str(path)] = [st.st_size, st.st_mtime_ns]; self.dirty = True
+    def save(self, force=False):
+        if not self.dirty or (not force and time.time() - self.saved_at < 30): return
+        try:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            tmp = self.path.with_suffix('.tmp')
+            with open(tmp, 'w', encoding='utf-8') as f: json.dump(self.seen, f, separators=(',', ':'))
+            os.replace(tmp, self.path)
+            self.dirty, self.saved_at = False, time.time()
+        except Exception as e: logging.warning(f"Watch state not saved: {e}")
+
+def watch_folder(eng, root, lanes):
+    # Headless daemon: queue new or changed videos once their size has settled, forever
+    root, config = Path(root), eng.config
+    state = WatchState(eng.data_dir / "watch_state.json")
+    settle, interval = config.get('watch_settle', 10), config.get('watch_interval', 30)
+    candidates, inflight, lock = {}, set(), threading.Lock() # path -> (size, mtime_ns, first_seen)
+    failures = {} # path -> failed attempts in a row
+    def retry_later(path):
+        # Failures are often transient (NAS blip, stalled ffmpeg): come back later instead of marking the file
+        # handled. Backdating first_seen into the future holds the candidate back for the delay.
+        n = failures[path] = failures.get(path, 0) + 1
+        delay = min(3600, settle * 2 ** n)
+        try: st = path.stat()
+        except OSError: return 0
+        candidates[path] = (st.st_size, st.st_mtime_ns, time.time() + delay)
+        return delay
+    def on_finish(job):
+        with lock:
+            inflight.discard(job.path)
+            if job.ok:
+                failures.pop(job.path, None)
+                state.mark(job.dest if job.dest.exists() else job.path)
+            else: delay = retry_later(job.path)
+        if job.ok: print(f" {C.SUCCESS}[WATCH] OK: {job.path}{C.RESET}", flush=True)
+        else: print(f" {C.ERROR}[WATCH] FAILED: {job.path} (retry in {delay}s){C.RESET}", flush=True)
+    # Unbounded queue: the event loop must never block on a busy encoder
+    sched = eng.start(lanes=lanes, on_finish=on_finish, max_pending=0)
+    sched.keep_finished = False
+
+    # Events go through the same name and pattern rules as a scan of root
+    filters = wanted_file, wanted_dir = path_filters(root, config)
+    def consider(path, st=None):
+        if not wanted_file(path, path.name): return
+        try: st = st or path.stat()
+        except OSError: return
+        with lock:
+            if path in inflight or state.handled(path, st): return
+            prev = candidates.get(path)
+            if not prev or prev[:2] != (st.st_size, st.st_mtime_ns): candidates[path] = (st.st_size, st.st_mtime_ns, time.time())
+    def full_scan():
+        for path, st in iter_videos(root, config['recursive'], config): consider(path, st)
+
+    watcher = None
+    if config.get('watch_inotify', True) and SYSTEM == "Linux":
+        try:
+            watcher = InotifyWatcher()
+            watcher.add(root)
+            if config['recursive']:
+                for d, subdirs, _ in os.walk(root):
+                    subdirs[:] = [x for x in subdirs if wanted_dir(os.path.join(d, x), x)]
+                    for x in subdirs: watcher.add(Path(d) / x)
+            logging.info(f"Watch: inotify on {len(watcher.wds)} folder(s)")
+        except Exception as e:
+            logging.warning(f"Watch: inotify unavailable ({e}), polling every {interval}s")
+            if watcher: watcher.close()
+            watcher = None
+    print(f" {C.INFO}[WATCH] Watching {root} ({'inotify' if watcher else f'polling every {interval}s'}), settle {settle}s. CTRL+C to stop.{C.RESET}", flush=True)
+    full_scan(); last_scan = time.time()
+    try:
+        while True:
+            if watcher:
+                for path, is_dir in watcher.read(1.0):
+                    if is_dir:
+                        if config['recursive'] and wanted_dir(path, path.name):
+                            try: watcher.add(path)
+                            except OSError as e: logging.warning(f"Watch: {e}")
+                            for p, st in iter_videos(path, True, config, filters=filters): consider(p, st)
+                    else: consider(path)
+                if watcher.overflowed:
+                    watcher.overflowed = False; full_scan(); last_scan = time.time()
+            else:
+                time.sleep(1.0)
+                if time.time() - last_scan >= interval: full_scan(); last_scan = time.time()
+            # Re-stat candidates: only files unchanged for 'settle' seconds are queued
+            now = time.time()
+            with lock: pending = list(candidates.items())
+            for path, (size, mtime_ns, since) in pending:
+                try: st = path.stat()
+                except OSError:
+                    with lock: candidates.pop(path, None)
+                    continue
+                if (st.st_size, st.st_mtime_ns) != (size, mtime_ns):
+                    with lock: candidates[path] = (st.st_size, st.st_mtime_ns, now)
+                    continue
+                if now - since < settle or now - st.st_mtime < settle: continue
+                with lock: candidates.pop(path, None)
+                try: info = eng.probes.probe(path, st)
+                except Exception as e:
+                    logging.warning(f"Probe failed for {path.name}: {e}"); info = None
+                if not info:
+                    with lock: retry_later(path)
+                    continue
+                action, reason = plan_video(info, config, path)
+                if action == 'skip':
+                    with lock: state.mark(path, st)
+                    continue
+                job = Job(path, action, info); job.dest = output_path(path, action, config); job.device = st.st_dev
+                with lock: inflight.add(path)
+                eng.journal.record(path, 'queued', action=action)
+                logging.info(f"[WATCH] Queued {path} ({action}: {reason})")
+                sched.add(job)
+            with lock: state.save()
+            eng.probes.save()
+    finally:
+        sched.close()
+        with lock: state.save(force=True)
+        eng.probes.save()
+        if watcher: watcher.close()
+
+class ProgressStream:
+    # --batch progress: one JSON object per line, and a slot is only reported when its values changed
+    def __init__(self, target='-'):
+        self.fh = sys.stdout if target in (None, '-') else open(target, 'a', encoding='utf-8')
+        self.last = {}
+        self.lock = threading.Lock()
+    def emit(self, event, **fields):
+        line = json.dumps(dict(t=round(time.time(), 3), event=event, **fields), ensure_ascii=False)
+        with self.lock:
+            self.fh.write(line + "\n"); self.fh.flush()
+    def poll(self, eng):
+        sched = eng.sched
+        for wid, s in sorted(eng.stats.get_all().items()):
+            cur = (s['fn'], round(s['pct'], 1), s['fps'], s['speed'], s['size'])
+            if self.last.get(wid) == cur: continue
+            self.last[wid] = cur
+            self.emit('progress', slot=wid, file=cur[0], pct=cur[1], fps=cur[2], speed=cur[3], note=cur[4])
+        totals = (sched.done_count(), sched.added)
+        if self.last.get('totals') != totals:
+            self.last['totals'] = totals
+            self.emit('totals', done=totals[0], total=totals[1])
+    def close(self):
+        if self.fh is not sys.stdout: self.fh.close()
+
+def queue_jobs(stats, probes, config):
+    # Plan, order and dedupe scanned files into scheduler jobs; returns (jobs, counts, work, files queued)
+    videos = list(stats)
+    plan, counts, work = build_plan(videos, probes, config)
+    videos = [v for v in videos if plan[v][0] != 'skip']
+    if config['sort'] == 'name_az': videos.sort()
+    elif config['sort'] == 'name_za': videos.sort(reverse=True)
+    elif config['sort'] == 'size_desc': videos.sort(key=lambda x: stats[x].st_size, reverse=True)
+    elif config['sort'] == 'size_asc': videos.sort(key=lambda x: stats[x].st_size)
+    jobs = [Job(v, plan[v][0], probes.get(v)) for v in videos]
+    for j in jobs: j.dest, j.device = output_path(j.path, j.action, config), stats[j.path].st_dev
+    if config['sort'] == 'cost_desc': jobs = Scheduler.order_lpt(jobs)
+    return find_duplicates(jobs, config, max(4, config['max_workers'] * 2)), counts, work, len(jobs)
+
+def run_batch(eng, lanes, progress='-'):
+    # Headless one-shot run for cron and wrappers: no prompts, no terminal UI, JSON-lines progress
+    config = eng.config
+    out = ProgressStream(progress)
+    cwd = Path.cwd()
+    resume, repaired = eng.recover()
+    cleaned = cleanup_temp_files(cwd, config['recursive'])
+    baks = len(list(cwd.rglob("*.bak") if config['recursive'] else cwd.glob("*.bak")))
+    # Orphaned backups need a human decision (restore or purge), so batch mode only reports them
+    if baks: logging.warning(f"{baks} orphaned .bak file(s) left untouched; run interactively to restore or purge")
+    out.emit('start', version=VERSION, root=str(cwd), lanes=describe_lanes(lanes), repaired=repaired, resumed=len(resume), temp_cleaned=cleaned, orphaned_backups=baks)
+    on_finish = lambda j: out.emit('file', path=str(j.path), dest=str(j.dest), action=j.action, ok=bool(j.ok), elapsed=round(j.elapsed, 3))
+    pipeline = None
+    start_t = time.time()
+    try:
+        if not config.get('prescan', True) and not resume:
+            sched = eng.start(lanes=lanes, on_finish=on_finish)
+            pipeline = Pipeline(eng, iter_videos(cwd, config['recursive'], config), max(2, config['max_workers'])).start()
+        else:
+            stats = {v: v.stat() for v in resume if v.exists()} if resume else scan_videos(cwd, config['recursive'], config)
+            probes = probe_all(eng, list(stats), max(4, config['max_workers'] * 2), stats)
+            jobs, counts, work, queued = queue_jobs(stats, probes, config)
+            out.emit('plan', files=len(stats), **counts, encode_s=round(work['encode'], 1), remux_s=round(work['remux'], 1), duplicates=queued - len(jobs))
+            sched = eng.start(jobs, lanes, on_finish=on_finish)
+        logging.info(f"Batch mode: {cwd} | lanes {describe_lanes(lanes)} | {sched.slots} slot(s)")
+        while not eng.wait(0.5): out.poll(eng)
+        out.poll(eng)
+    finally:
+        eng.close()
+    success = sum(1 for j in sched.finished if j.ok)
+    span, ideal, eff = sched.makespan()
+    summary = dict(success=success, failed=len(sched.finished) - success, elapsed=round(time.time() - start_t, 3),
+                   makespan=round(span, 3), efficiency=round(eff, 1), bytes_in=sum(j.size for j in sched.finished),
+                   bytes_out=sum(j.dest.stat().st_size if j.dest.exists() else (j.path.stat().st_size if j.path.exists() else 0) for j in sched.finished),
+                   kept_originals=sum(eng.gain_aborts.values()))
+    if pipeline: summary.update(pipeline.counts)
+    out.emit('end', **summary)
+    logging.info(f"Batch finished: {summary}")
+    out.close()
+    return 2 if summary['failed'] else 0
+
+BENCH_DIR = APP_DATA / "bench"
+# Synthetic corpus: (name, width, height, fps, seconds, container); testsrc2 + sine are deterministic
+BENCH_CORPUS = [
+    ("hd720_30", 1280, 720, 30, 10, ".mp4"),
+    ("hd1080_30", 1920, 1080, 30, 6, ".mkv"),
+    ("sd480_25", 640, 480, 25, 8, ".avi"),
+    ("wide480_60", 854, 480, 60, 5, ".mov"),
+    ("clip720_24", 1280, 720, 24, 3, ".mp4"),
+    ("qhd_30", 2560, 1440, 30, 3, ".mp4"),
+]
+
+def build_bench_corpus(folder):
+    # Generated once and reused, so every benchmark run encodes the same bytes
+    folder.mkdir(parents=True, exist_ok=True)
+    for name, w, h, fps, secs, ext in BENCH_CORPUS:
+        out = folder / f"{name}{ext}"
+        if out.exists(): continue
+        print(f" {C.INFO}[BENCH] Generating {out.name}...{C.RESET}")
+        tmp = folder / f"mnemosyne_tmp_{out.name}"
+        cmd = ["ffmpeg", "-nostdin", "-y", "-v", "error", "-f", "lavfi", "-i", f"testsrc2=size={w}x{h}:rate={fps}",
+               "-f", "lavfi", "-i", "sine=frequency=440:sample_rate=48000", "-t", str(secs), "-map", "0:v", "-map", "1:a",
+               "-c:v", "libx264", "-preset", "ultrafast", "-crf", "18", "-pix_fmt", "yuv420p", "-c:a", "aac", "-b:a", "192k", str(tmp)]
+        subprocess.run(cmd, check=True, timeout=300)
+        tmp.rename(out)
+
+def bench_matrix(config):
+    b = config.get('benchmark') or {}
+    workers = b.get('workers') or sorted({1, config['max_workers']})
+    cells = []
+    for w in workers:
+        for budget in b.get('cpu_budget') or [0]:
+            for preset in b.get('presets') or [config.get('x264_preset', 'medium')]:
+                for verify in b.get('verify') or [config['verify_frames']]:
+                    cells.append((f"w{w}_cpu{budget}_{preset}_{'verify' if verify else 'noverify'}",
+                                  dict(config, max_workers=w, cpu_budget=budget, x264_preset=preset, verify_frames=verify)))
+    return cells
+
+def cpu_times():
+    # (self + children) CPU seconds; children are only counted once reaped, which process_video always does
+    try: import resource
+    except ImportError: return None
+    own, kids = resource.getrusage(resource.RUSAGE_SELF), resource.getrusage(resource.RUSAGE_CHILDREN)
+    return own.ru_utime + own.ru_stime + kids.ru_utime + kids.ru_stime
+
+def reset_peak_rss():
+    # Linux resets this process's high-water mark (VmHWM) on request; ru_maxrss elsewhere only ever grows
+    try:
+        with open("/proc/self/clear_refs", 'w') as f: f.write("5")
+        return True
+    except OSError: return False
+
+def peak_rss():
+    # Bytes: VmHWM since the last reset_peak_rss()
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"): return int(line.split()[1]) * 1024
+    except OSError: pass
+    return 0
+
+def bench_run(corpus, cfg):
+    # One matrix cell through the real path: scan, probe, plan, schedule, process_video, verify, swap
+    work = BENCH_DIR / "run"
+    shutil.rmtree(work, ignore_errors=True)
+    shutil.copytree(corpus, work)
+    # A fresh engine per cell: cold probe cache and zeroed counters, with its state kept under BENCH_DIR
+    eng = Engine(cfg, BENCH_DIR)
+    eng.probes.entries = {}
+    # Without a per-cell reset only ffmpeg's peak is comparable between cells
+    own_peak = reset_peak_rss()
+    cpu0, t0 = cpu_times(), time.time()
+    stats = scan_videos(work, False, cfg)
+    probes = probe_all(eng, list(stats), max(4, cfg['max_workers'] * 2), stats)
+    plan, _, _ = build_plan(list(stats), probes, cfg)
+    jobs = [Job(v, plan[v][0], probes.get(v)) for v in stats if plan[v][0] != 'skip']
+    for j in jobs: j.dest, j.device = output_path(j.path, j.action, cfg), stats[j.path].st_dev
+    slots = cfg['max_workers']
+    sched = eng.start(Scheduler.order_lpt(jobs), [EncoderLane("libx264", slots)])
+    eng.wait()
+    wall = time.time() - t0
+    cpu = cpu_times() - cpu0 if cpu0 is not None else None
+    eng.close()
+    done = [j for j in sched.finished if j.ok]
+    src_secs = sum((probes.get(j.path) or {}).get('duration', 0) for j in done)
+    own_rss = peak_rss() if own_peak else 0
+    shutil.rmtree(work, ignore_errors=True)
+    return {
+        'files': len(sched.finished), 'failed': len(sched.finished) - len(done), 'wall_s': round(wall, 3),
+        'files_per_s': round(len(done) / wall, 4) if wall else 0.0,
+        'source_s_per_wall_s': round(src_secs / wall, 4) if wall else 0.0,
+        'cpu_s_per_output_min': round(cpu / (src_secs / 60), 3) if cpu is not None and src_secs else None,
+        'peak_rss_mb': round(max(eng.procs.peak_rss, own_rss) / 1024 / 1024, 1) or None,
+    }
+
+def bench_compare(results, baseline, tolerance):
+    # Higher is better for throughput, lower is better for CPU and memory
+    regressions = []
+    for cell, cur in results['runs'].items():
+        base = baseline.get('runs', {}).get(cell)
+        if not base: continue
+        for key, better in (('files_per_s', 1), ('source_s_per_wall_s', 1), ('cpu_s_per_output_min', -1), ('peak_rss_mb', -1)):
+            a, b = base.get(key), cur.get(key)
+            if not a or b is None: continue
+            change = (b - a) / a * 100
+            if change * better < -tolerance: regressions.append((cell, key, a, b, change))
+    return regressions
+
+def run_benchmark(config, save_baseline=False):
+    # Each cell runs its own Engine in BENCH_DIR, so the user's probe cache and journal are left alone
+    corpus = BENCH_DIR / "corpus"
+    build_bench_corpus(corpus)
+    # Every corpus clip is short enough to batch; batching off keeps each file on its own process_video
+    # run so the worker axis has something to spread
+    config = dict(config, dedup='off', batch_max_duration=0, scratch_dir=config.get('scratch_dir', ''))
+    results = {'version': VERSION, 'time': datetime.datetime.now().isoformat(timespec='seconds'),
+               'host': {'system': SYSTEM, 'cpus': os.cpu_count(), 'ffmpeg': ffmpeg_version()}, 'runs': {}}
+    for name, cfg in bench_matrix(config):
+        print(f" {C.INFO}[BENCH] {name}...{C.RESET}", end=" ", flush=True)
+        r = results['runs'][name] = bench_run(corpus, cfg)
+        print(f"{r['files_per_s']:.2f} files/s | {r['source_s_per_wall_s']:.2f}x realtime | "
+              f"{r['cpu_s_per_output_min'] or '-'} cpu-s/min | {r['peak_rss_mb'] or '-'} MB{' | FAILED ' + str(r['failed']) if r['failed'] else ''}")
+        logging.info(f"Benchmark {name}: {r}")
+    out = BENCH_DIR / f"results-{time.strftime('%Y%m%d-%H%M%S')}.json"
+    with open(out, 'w', encoding='utf-8') as f: json.dump(results, f, indent=2)
+    print(f" {C.SUCCESS}[+] Results: {out}{C.RESET}")
+    base_file = BENCH_DIR / "baseline.json"
+    status = 0
+    if base_file.exists():
+        with open(base_file, 'r', encoding='utf-8') as f: baseline = json.load(f)
+        if baseline.get('host') != results['host']: print(f" {C.WARNING}[!] Baseline was recorded on a different host or ffmpeg build.{C.RESET}")
+        tol = (config.get('benchmark') or {}).get('tolerance', 10)
+        regressions = bench_compare(results, baseline, tol)
+        for cell, key, a, b, change in regressions:
+            print(f" {C.ERROR}[REGRESSION] {cell}: {key} {a} -> {b} ({change:+.0f}%){C.RESET}")
+        if not regressions: print(f" {C.SUCCESS}[+] No regressions beyond {tol}% against {base_file.name}.{C.RESET}")
+        status = 2 if regressions else 0
+    if save_baseline or not base_file.exists():
+        shutil.copyfile(out, base_file)
+        print(f" {C.SUCCESS}[+] Saved as baseline.{C.RESET}")
+    return status
+
+SIM_DIR = APP_DATA / "sim"
+
+class ContentionLock:
+    # Drop-in Lock that counts acquisitions and the time spent waiting on contended ones
+    def __init__(self, name):
+        self.name, self.lock = name, threading.Lock()
+        self.acquired = self.contended = 0
+        self.wait_s = 0.0
+    def acquire(self, blocking=True, timeout=-1):
+        if self.lock.acquire(False):
+            self.acquired += 1; return True
+        if not blocking: return False
+        t0 = time.perf_counter()
+        ok = self.lock.acquire(True, timeout)
+        if ok:
+            self.acquired += 1; self.contended += 1
+            self.wait_s += time.perf_counter() - t0
+        return ok
+    def release(self): self.lock.release()
+    def locked(self): return self.lock.locked()
+    __enter__ = acquire
+    def __exit__(self, *exc): self.release()
+
+class SimProcess:
+    # Enough of Popen for the supervisor: a pid, terminate/kill and poll
+    def __init__(self, pid):
+        self.pid, self.killed, self.rc = pid, False, None
+        self.stdout, self.stderr = object(), object() # Only compared by identity in _on_data
+    def terminate(self): self.killed = True
+    kill = terminate
+    def poll(self): return self.rc
+    def wait(self, timeout=None): return self.rc
+
+class FakeFFmpeg(ProcessManager):
+    # In-process stand-in for ffmpeg/ffprobe: jobs "encode" at 'speed' x realtime, emit real -progress
+    # text every 'period' seconds through the normal parser, and fail at 'fail_rate'. Outputs are sparse
+    # files, so renames, verification and swaps run for real without using disk space.
+    def __init__(self, config, speed=2000.0, fail_rate=0.0, period=0.5, seed=1, metrics=None):
+        super().__init__(metrics)
+        self.config, self.speed, self.fail_rate, self.period = config, speed, fail_rate, period
+        self.rng = random.Random(seed)
+        self.events, self.seq = [], 0
+        self.outputs = {} # output path -> probe info it will report
+        self.busy_s = 0.0 # Simulated encoder wall time handed out
+        self.cv = threading.Condition()
+        threading.Thread(target=self._run, name="fake-ffmpeg", daemon=True).start()
+    def _sample_rss(self, h): pass # No child process; the orchestrator's own RSS is what gets reported
+    def source_info(self, path):
+        # Deterministic per name: mostly 1080p sources to encode, some already compliant
+        r = random.Random(zlib.crc32(path.name.encode()))
+        dur = round(r.uniform(2, 120), 3)
+        small = r.random() < 0.1
+        h, vbr = (480, 700000) if small else (1080, 6000000)
+        return {'duration': dur, 'bitrate': vbr + 128000, 'format': 'mov,mp4,m4a,3gp,3g2,mj2', 'encoder': '', 'comment': '',
+                'vcodec': 'h264', 'width': h * 16 // 9, 'height': h, 'fps': 30.0, 'nb_frames': int(dur * 30), 'vbitrate': vbr,
+                'acodec': 'aac', 'abitrate': 128000, 'streams': []}
+    def probe(self, path):
+        path = Path(path)
+        return dict(self.outputs.get(str(path)) or self.source_info(path))
+    def spawn(self, cmd, on_progress=None, stall_timeout=None):
+        inputs = [Path(cmd[i + 1]) for i, a in enumerate(cmd) if a == '-i']
+        outs = [Path(a) for i, a in enumerate(cmd) if Path(a).name.startswith("mnemosyne_tmp_") and cmd[i - 1] != '-i']
+        durs = [self.source_info(p)['duration'] for p in inputs] or [1.0]
+        dur = max(durs)
+        # A batch maps input k to output k, so each output reports its own source's duration
+        outs = list(zip(outs, durs if len(durs) == len(outs) else [dur] * len(outs)))
+        with self.cv:
+            self.seq += 1
+            h = self._handle(SimProcess(self.seq), on_progress, stall_timeout)
+            h.sim = {'dur': dur, 'outs': outs, 'start': time.time(), 'fail': self.rng.random() < self.fail_rate}
+            self.busy_s += dur / self.speed
+            heapq.heappush(self.events, (time.time(), self.seq, h))
+            self.cv.notify()
+        return h
+    def _block(self, h, t, dur, end):
+        rate = parse_bitrate(self.config['video_bitrate']) + parse_bitrate(self.config['audio_bitrate'])
+        frame = int(t * self.config['target_fps'])
+        return (f"frame={frame}\nfps={self.config['target_fps'] * self.speed:.0f}\nbitrate={rate / 1000:.1f}kbits/s\n"
+                f"total_size={int(rate / 8 * t)}\nout_time_us={int(t * 1e6)}\nspeed={self.speed:.0f}x\n"
+                f"progress={'end' if end else 'continue'}\n").encode()
+    def _run(self):
+        while True:
+            with self.cv:
+                while not self.events or self.events[0][0] > time.time():
+                    self.cv.wait(self.events[0][0] - time.time() if self.events else None)
+                _, _, h = heapq.heappop(self.events)
+            sim, now = h.sim, time.time()
+            t = min(sim['dur'], (now - sim['start']) * self.speed)
+            end = t >= sim['dur'] or h.proc.killed or (sim['fail'] and t >= sim['dur'] / 2)
+            self._on_data(h, h.proc.stdout, self._block(h, t, sim['dur'], end))
+            if not end:
+                with self.cv:
+                    heapq.heappush(self.events, (min(now + self.period, sim['start'] + sim['dur'] / self.speed), h.proc.pid, h))
+                continue
+            rc = 255 if h.proc.killed else 1 if sim['fail'] else 0
+            if rc == 1: self._on_data(h, h.proc.stderr, b"Error while decoding stream #0:0: Invalid data found (simulated)\n")
+            elif rc == 0:
+                for out, dur in sim['outs']:
+                    with open(out, 'wb') as f: f.truncate(max(20480, int(parse_bitrate(self.config['video_bitrate']) / 8 * dur)))
+                    info = self.source_info(out)
+                    info.update(duration=dur, height=self.config['target_height'], width=self.config['target_height'] * 16 // 9,
+                                fps=float(self.config['target_fps']), nb_frames=int(dur * self.config['target_fps']), comment=ENCODER_TAG)
+                    self.outputs[str(out)] = info
+            h.proc.rc = rc
+            self._finish(h, rc)
+
+def run_simulation(config, count, speed=2000.0, fail_rate=0.01):
+    # Orchestrator-only load test: the real scan/probe/plan/scheduler/verify/swap path, ffmpeg faked in-process
+    try: import resource
+    except ImportError: resource = None
+    root = SIM_DIR / "run"
+    shutil.rmtree(root, ignore_errors=True)
+    # Keep to the stages that only need ffprobe; decode checks and keyframe probes are ffmpeg work, not orchestration
+    config = dict(config, verify_level='fast', segment_min_duration=0, renditions=[], dedup='off', scratch_dir='', min_savings=0)
+    phases = {}
+    t0 = time.time()
+    for i in range(count):
+        d = root / f"d{i // 1000:04d}"
+        if i % 1000 == 0: d.mkdir(parents=True, exist_ok=True)
+        p = d / f"sim_{i:07d}.mp4"
+        with open(p, 'wb') as f: f.truncate(max(20480, int(random.Random(i).uniform(2, 120) * 6128000 / 8)))
+    phases['generate'] = time.time() - t0
+    # A throwaway engine in SIM_DIR whose process manager is the fake ffmpeg
+    eng = Engine(config, SIM_DIR)
+    eng.probes.entries = {}
+    eng.sim = eng.procs = sim = FakeFFmpeg(eng.config, speed, fail_rate, metrics=eng.metrics)
+    sim.on_spawn = eng._track
+    locks = [ContentionLock(n) for n in ('scheduler', 'journal', 'probe_cache', 'metrics', 'stats')]
+    eng.sched_lock, (eng.journal.lock, eng.probes.lock, eng.metrics.lock, eng.lock) = locks[0], locks[1:]
+    cpu0 = resource.getrusage(resource.RUSAGE_SELF) if resource else None
+    t0 = time.time()
+    stats = scan_videos(root, True, config)
+    phases['scan'] = time.time() - t0; t0 = time.time()
+    probes = probe_all(eng, list(stats), max(4, config['max_workers'] * 2), stats)
+    plan, counts, _ = build_plan(list(stats), probes, config)
+    jobs = [Job(v, plan[v][0], probes.get(v)) for v in stats if plan[v][0] != 'skip']
+    for j in jobs: j.dest, j.device = output_path(j.path, j.action, config), stats[j.path].st_dev
+    jobs = Scheduler.order_lpt(jobs)
+    phases['probe_plan'] = time.time() - t0; t0 = time.time()
+    slots = config['max_workers']
+    display_s, display_n = 0.0, 0
+    real_stdout, sys.stdout = sys.stdout, open(os.devnull, 'w', encoding='utf-8')
+    try:
+        sched = eng.start(jobs, [EncoderLane("libx264", slots)])
+        while not eng.wait(0.5):
+            d0 = time.perf_counter()
+            update_display(eng, sched.added, "SIMULATED", sched.done_count())
+            display_s += time.perf_counter() - d0; display_n += 1
+        phases['run'] = run_wall = time.time() - t0
+    finally:
+        sys.stdout.close(); sys.stdout = real_stdout
+        eng.close()
+    cpu1 = resource.getrusage(resource.RUSAGE_SELF) if resource else None
+    n = len(sched.finished)
+    report = {
+        'files': count, 'jobs': n, 'skipped': counts['skip'], 'failed': sum(1 for j in sched.finished if not j.ok),
+        'slots': slots, 'speed': speed, 'fail_rate': fail_rate, 'phases_s': {k: round(v, 3) for k, v in phases.items()},
+        'jobs_per_s': round(n / run_wall, 1) if run_wall else 0.0,
+        'overhead_ms_per_job': round((run_wall * slots - sim.busy_s) / n * 1000, 3) if n else 0.0,
+        'cpu_s': round(cpu1.ru_utime + cpu1.ru_stime - cpu0.ru_utime - cpu0.ru_stime, 2) if cpu0 else None,
+        'peak_rss_mb': round(cpu1.ru_maxrss / (1024 * 1024 if SYSTEM == "Darwin" else 1024), 1) if cpu1 else None,
+        'display': {'calls': display_n, 'avg_ms': round(display_s / display_n * 1000, 3) if display_n else 0.0},
+        'locks': {l.name: {'acquired': l.acquired, 'contended': l.contended, 'wait_ms': round(l.wait_s * 1000, 1)}
+                  for l in locks},
+    }
+    if report['cpu_s'] is not None: report['cpu_ms_per_job'] = round(report['cpu_s'] / max(1, n) * 1000, 3)
+    t0 = time.time()
+    shutil.rmtree(root, ignore_errors=True)
+    for f in (eng.journal.path, eng.probes.path, eng.metrics.path):
+        if f.exists(): f.unlink()
+    report['phases_s']['cleanup'] = round(time.time() - t0, 3)
+    out = SIM_DIR / f"sim-{time.strftime('%Y%m%d-%H%M%S')}.json"
+    with open(out, 'w', encoding='utf-8') as f: json.dump(report, f, indent=2)
+    print(json.dumps(report, indent=2))
+    print(f" {C.SUCCESS}[+] Report: {out}{C.RESET}")
+    return 0
 
 def show_security_notice(log_msg, drive_type=None):
     clear_screen(); w = 70
@@ -591,12 +2911,13 @@ def main():
     # Signal Handling for Ctrl+C
     import signal
     def signal_handler(sig, frame):
-        PROCESS_MGR.kill_all()
+        Engine.kill_all()
         show_cursor()
         print(f"\n\n {C.WARNING}[!] EMERGENCY STOP: Interrupted by user (Signal {sig}).{C.RESET}")
         print(f" {C.SUCCESS}[+] Cleanup complete. You may now exit.{C.RESET}")
-        cleanup_temp_files(); sys.exit(130)
+        cleanup_temp_files(recursive=config.get('recursive', False)); sys.exit(130)
     signal.signal(signal.SIGINT, signal_handler)
+    config = {}
 
     parser = argparse.ArgumentParser(description=f"{APP_NAME} v{VERSION}", formatter_class=argparse.RawDescriptionHelpFormatter)
     parser.add_argument('-r', '--recursive', action='store_true', help='Search subfolders')
@@ -604,12 +2925,67 @@ def main():
     parser.add_argument('--height', type=int, help='Target height')
     parser.add_argument('--desktop-log', action='store_true', help='Log to Desktop')
     parser.add_argument('--codec', choices=['auto', 'h264_nvenc', 'h264_qsv', 'h264_vaapi', 'libx264'], default='auto')
+    parser.add_argument('--cpu-budget', type=int, help='Cores to use in total (leave the rest free)')
+    parser.add_argument('--stream', action='store_true', help='Start encoding while the scan is still running')
+    parser.add_argument('--watch', action='store_true', help='Headless daemon: keep watching the folder and process new files')
+    parser.add_argument('--benchmark', action='store_true', help='Encode a synthetic corpus across a config matrix and compare with the baseline')
+    parser.add_argument('--save-baseline', action='store_true', help='With --benchmark: store this run as the new baseline')
+    parser.add_argument('--batch', action='store_true', help='Headless one-shot run: no prompts, settings from flags and config.json')
+    parser.add_argument('--progress', default='-', metavar='FILE', help="With --batch: write JSON-lines progress to FILE instead of stdout ('-')")
+    parser.add_argument('--metrics-port', type=int, help='Serve Prometheus metrics on 127.0.0.1:PORT/metrics')
+    parser.add_argument('--simulate', type=int, metavar='N', help='Load-test the orchestrator on N synthetic files with an in-process fake ffmpeg')
+    parser.add_argument('--sim-speed', type=float, default=2000.0, help='With --simulate: media seconds encoded per wall second')
+    parser.add_argument('--sim-fail', type=float, default=0.01, help='With --simulate: share of encodes that fail')
     args = parser.parse_args()
 
     config = load_config()
     if args.recursive: config['recursive'] = True
     if args.workers: config['max_workers'] = args.workers
     if args.height: config['target_height'] = args.height
+    if args.cpu_budget: config['cpu_budget'] = args.cpu_budget
+    if args.stream: config['prescan'] = False
+    if args.metrics_port: config['metrics_port'] = args.metrics_port
+    def open_engine():
+        # One run per data folder: a second instance would overwrite the first one's journal
+        try: return Engine(config)
+        except RuntimeError as e:
+            logging.error(str(e))
+            print(f" {C.ERROR}[X] Another {APP_NAME} run is using {APP_DATA}. Wait for it to finish.{C.RESET}", file=sys.stderr)
+
+    if args.benchmark:
+        setup_logging(desktop_mode=args.desktop_log)
+        if not check_ffmpeg() and not (config['auto_download_ffmpeg'] and download_ffmpeg()): return 1
+        return run_benchmark(config, args.save_baseline)
+    if args.simulate:
+        setup_logging(desktop_mode=args.desktop_log)
+        return run_simulation(config, args.simulate, args.sim_speed, args.sim_fail)
+    if args.batch:
+        signal.signal(signal.SIGTERM, signal_handler)
+        setup_logging(desktop_mode=args.desktop_log)
+        # stdout may be the progress stream; keep download chatter off it
+        with contextlib.redirect_stdout(sys.stderr):
+            if not check_ffmpeg() and not (config['auto_download_ffmpeg'] and download_ffmpeg()): return 1
+        codec, _ = detect_gpu_codec(args.codec)
+        eng = open_engine()
+        if not eng: return 1
+        eng.serve_metrics()
+        return run_batch(eng, build_lanes(config, codec), args.progress)
+
+    if args.watch:
+        signal.signal(signal.SIGTERM, signal_handler)
+        setup_logging(desktop_mode=args.desktop_log)
+        eng = open_engine()
+        if not eng: return 1
+        eng.recover() # Remaining jobs are picked up again by the initial scan
+        if not check_ffmpeg() and not (config['auto_download_ffmpeg'] and download_ffmpeg()): return 1
+        codec, _ = detect_gpu_codec(args.codec)
+        lanes = build_lanes(config, codec)
+        logging.info(f"Watch mode: {Path.cwd()} | lanes {describe_lanes(lanes)}")
+        eng.serve_metrics()
+        # Jobs cut short by a stop stay open in the journal and are recovered on the next start
+        try: watch_folder(eng, Path.cwd(), lanes)
+        finally: eng.close(wait=False)
+        return 0
     
     desktop_log_mode = args.desktop_log
     if not args.desktop_log:
@@ -627,7 +3003,16 @@ def main():
     
     drive_type = get_drive_type(str(Path.cwd()))
     show_security_notice(log_msg, drive_type)
-    audit_orphaned_backups()
+    # The menus below edit the engine's own config
+    eng = open_engine()
+    if not eng: return 1
+    config = eng.config
+    resume, repaired = eng.recover()
+    if repaired: print(f" {C.SUCCESS}[+] JOURNAL: Repaired {repaired} interrupted file swap(s).{C.RESET}")
+    if resume:
+        ans = input(f" {C.PRIMARY}>> Resume interrupted batch ({len(resume)} remaining)? (Y/N): {C.RESET}").lower().strip()
+        if ans == 'n': resume = []; eng.journal.end_run()
+    audit_orphaned_backups(config['recursive'])
     
     if not ensure_ffmpeg(config['auto_download_ffmpeg']): return 1
     codec, codec_name = detect_gpu_codec(args.codec)
@@ -653,17 +3038,19 @@ def main():
         
         # 2. Priority
         print(f"\n {C.PRIMARY}[BOOT] Priority:{C.RESET}")
-        print(f"    [1] Name A-Z  [2] Name Z-A  [3] Largest  [4] Smallest")
-        curr_sort = '1'
-        if config['sort'] == 'name_za': curr_sort = '2'
+        print(f"    [1] Name A-Z  [2] Name Z-A  [3] Largest  [4] Smallest  [5] Heaviest Encode")
+        curr_sort = '5'
+        if config['sort'] == 'name_az': curr_sort = '1'
+        elif config['sort'] == 'name_za': curr_sort = '2'
         elif config['sort'] == 'size_desc': curr_sort = '3'
         elif config['sort'] == 'size_asc': curr_sort = '4'
         
-        sort_opt = get_input("Choice", curr_sort, ['1', '2', '3', '4'])
-        if sort_opt == '2': config['sort'] = 'name_za'
+        sort_opt = get_input("Choice", curr_sort, ['1', '2', '3', '4', '5'])
+        if sort_opt == '1': config['sort'] = 'name_az'
+        elif sort_opt == '2': config['sort'] = 'name_za'
         elif sort_opt == '3': config['sort'] = 'size_desc'
         elif sort_opt == '4': config['sort'] = 'size_asc'
-        else: config['sort'] = 'name_az'
+        else: config['sort'] = 'cost_desc'
 
         # 3. Engine Mode
         print(f"\n {C.PRIMARY}[BOOT] Engine Mode:{C.RESET}")
@@ -683,54 +3070,96 @@ def main():
              if config['max_workers'] == 1:
                  config['max_workers'] = DEFAULT_CONFIG['max_workers']
 
-        print(f"\n {C.INFO}[SCAN] Scanning for videos...{C.RESET}")
-        videos = []; cwd = Path.cwd()
-        pattern = cwd.rglob if config['recursive'] else cwd.glob
-        for ext in VIDEO_EXTENSIONS: videos.extend(list(pattern(f"*{ext}")))
-        videos = [v for v in videos if not any(x in v.parts for x in ["bin", "logs"])]
-        if not videos:
-            input(f" {C.WARNING}No videos found. Press ENTER to retry...{C.RESET}"); continue
-        
-        if config['sort'] == 'name_az': videos.sort()
-        elif config['sort'] == 'name_za': videos.sort(reverse=True)
-        elif config['sort'] == 'size_desc': videos.sort(key=lambda x: x.stat().st_size, reverse=True)
-        elif config['sort'] == 'size_asc': videos.sort(key=lambda x: x.stat().st_size)
-
-        clear_screen(); print(draw_header(config, codec_name)); w = 70
-        total_in = sum(v.stat().st_size for v in videos)
-        draw_separator(w, 'top'); draw_box_line("MISSION BRIEFING", w, C.BOLD + C.PRIMARY); draw_separator(w, 'mid')
-        draw_box_line(f"Queue: {len(videos)} videos | Size: {total_in/1024/1024:.1f} MB", w)
+        cwd = Path.cwd(); w = 70
+        lanes = build_lanes(config, codec); codec_name = describe_lanes(lanes)
+        streaming = not config.get('prescan', True) and not resume
+        if streaming:
+            # Nothing is scanned up front: the pipeline feeds the encoders as files are found
+            clear_screen(); print(draw_header(config, codec_name))
+            draw_separator(w, 'top'); draw_box_line("MISSION BRIEFING", w, C.BOLD + C.PRIMARY); draw_separator(w, 'mid')
+            draw_box_line(f"Queue: streaming from {cwd.name or cwd} ({'recursive' if config['recursive'] else 'top level'})", w)
+            draw_box_line("Plan: decided per file while scanning, probing and encoding overlap", w, C.INFO)
+        else:
+            if resume:
+                print(f"\n {C.INFO}[RESUME] Continuing {len(resume)} videos from the interrupted batch...{C.RESET}")
+                stats = {v: v.stat() for v in resume if v.exists()}
+            else:
+                print(f"\n {C.INFO}[SCAN] Scanning for videos...{C.RESET}")
+                stats = scan_videos(cwd, config['recursive'], config)
+            videos = list(stats)
+            if not videos:
+                input(f" {C.WARNING}No videos found. Press ENTER to retry...{C.RESET}"); continue
+            print(f" {C.INFO}[PROBE] Reading metadata for {len(videos)} videos...{C.RESET}")
+            probes = probe_all(eng, videos, max(4, config['max_workers'] * 2), stats)
+            jobs, counts, work, queued = queue_jobs(stats, probes, config)
+            if not jobs:
+                input(f" {C.SUCCESS}All {counts['skip']} videos already meet the targets. Press ENTER to rescan...{C.RESET}"); continue
+
+            clear_screen(); print(draw_header(config, codec_name))
+            total_in = sum(f.size for j in jobs for f in j.files)
+            draw_separator(w, 'top'); draw_box_line("MISSION BRIEFING", w, C.BOLD + C.PRIMARY); draw_separator(w, 'mid')
+            draw_box_line(f"Queue: {queued} videos | Size: {total_in/1024/1024:.1f} MB", w)
+            draw_box_line(f"Plan: {counts['encode']} encode | {counts['remux']} remux | {counts['skip']} skip", w, C.INFO)
+            draw_box_line(f"Work: {fmt_duration(work['encode'])} to encode | {fmt_duration(work['remux'])} to remux", w, C.INFO)
+            if len(jobs) < queued: draw_box_line(f"Dedup: {queued - len(jobs)} identical copies reuse another file's output ({config['dedup']})", w, C.INFO)
         if drive_type == 2: draw_box_line("Drive: REMOVABLE MEDIA (Caution)", w, C.WARNING)
-        draw_box_line(f"Codec: {codec_name} | Mode: {'Parallel' if config['max_workers']>1 else 'Sequential'}", w)
+        draw_box_line(f"Codec: {codec_name} | Mode: {'Parallel' if config['max_workers']>1 else 'Sequential'} | CPU Budget: {cpu_budget(config)} cores", w)
         draw_separator(w, 'bot')
         
         ans = input(f"\n {C.SUCCESS}READY TO ENGAGE.{C.RESET} Press ENTER to start, 'N' to re-config, 'S' to save: ").lower().strip()
-        if ans == 'n': continue
+        if ans == 'n': resume = []; continue
         if ans == 's': save_config(config); print(f" {C.SUCCESS}[+] Settings saved.{C.RESET}"); time.sleep(1); continue
         if ans == 'q': return 0
         break
 
-    start_t = time.time(); success = 0; failed = 0
+    start_t = time.time()
+    eng.serve_metrics()
+    if streaming:
+        sched = eng.start(lanes=lanes)
+        pipeline = Pipeline(eng, iter_videos(cwd, config['recursive'], config), max(2, config['max_workers'])).start()
+    else:
+        sched = eng.start(jobs, lanes)
     clear_screen(); hide_cursor()
+    logging.info(f"Encoder lanes: {describe_lanes(lanes)} | {sched.slots} slot(s)")
     try:
-        with ThreadPoolExecutor(max_workers=config['max_workers']) as executor:
-            futures = {executor.submit(process_video, (i % config['max_workers']) + 1, v, codec, config): v for i, v in enumerate(videos)}
-            while any(not f.done() for f in futures):
-                update_display(len(videos), codec_name, config); time.sleep(0.5)
-            for f in futures:
-                if f.result(): success += 1
-                else: failed += 1
+        while not eng.wait(0.5):
+            update_display(eng, sched.added, codec_name, sched.done_count())
+        success = sum(1 for j in sched.finished if j.ok)
+        failed = len(sched.finished) - success
     finally:
         show_cursor()
+        eng.probes.save()
+    eng.close()
 
     end_t = time.time(); total_t = end_t - start_t
-    total_out = sum(v.stat().st_size for v in videos if v.exists())
+    total_in = sum(j.size for j in sched.finished)
+    total_out = sum(j.dest.stat().st_size if j.dest.exists() else (j.path.stat().st_size if j.path.exists() else 0) for j in sched.finished)
     saved = total_in - total_out
+    span, ideal, eff = sched.makespan()
+    logging.info(f"Makespan {span:.1f}s vs ideal {ideal:.1f}s ({eff:.0f}% efficiency) over {sched.slots} slot(s), {len(sched.finished) / span if span > 0 else 0:.2f} files/s")
     
     clear_screen(); print(draw_header(config, codec_name)); w = 70
     draw_separator(w, 'top'); draw_box_line("FINAL MISSION REPORT", w, C.BOLD + C.SUCCESS); draw_separator(w, 'mid')
     draw_box_line(f"Status: {success} Success | {failed} Failed", w)
+    if streaming:
+        c = pipeline.counts
+        draw_box_line(f"Plan: {c['encode']} encode | {c['remux']} remux | {c['skip']} skip", w, C.INFO)
     draw_box_line(f"Time: {int(total_t//60)}m {int(total_t%60)}s | Space Saved: {saved/1024/1024:.1f} MB", w)
+    draw_box_line(f"Makespan: {fmt_duration(span)} | Ideal: {fmt_duration(ideal)} | Efficiency: {eff:.0f}%", w)
+    draw_box_line(f"Throughput: {len(sched.finished) / span if span > 0 else 0:.2f} files/s", w, C.MUTED)
+    devices = sched.device_report()
+    if len(devices) > 1:
+        for mount, n, b, rate in devices:
+            draw_box_line(f"Disk {mount[-24:]}: {n} file(s) | {b/1024/1024:.0f} MB | {rate/1024/1024:.1f} MB/s", w, C.MUTED)
+    for mount, n, b, rate in devices: logging.info(f"Device {mount}: {n} file(s), {b/1024/1024:.1f} MB in, {rate/1024/1024:.2f} MB/s")
+    if sum(eng.gain_aborts.values()):
+        draw_box_line(f"Kept originals: {sum(eng.gain_aborts.values())} (< {config['min_savings']}% saving, {eng.gain_aborts['early']} stopped early)", w, C.MUTED)
+    for level, (n, secs) in eng.verify_totals.items():
+        draw_box_line(f"Verify ({level}): {n} file(s) | avg {secs / n:.2f}s | total {fmt_duration(secs)}", w, C.MUTED)
+    stages = eng.metrics.stage_totals()
+    if any(n for n, _ in stages.values()):
+        draw_box_line("Avg: " + " | ".join(f"{s} {secs / n:.1f}s" for s, (n, secs) in stages.items() if n), w, C.MUTED)
+        logging.info("Stage totals: " + ", ".join(f"{s} {n} job(s) {secs:.1f}s" for s, (n, secs) in stages.items()))
     draw_separator(w, 'bot')
     cleanup_temp_files()
     print(f"\n {C.SUCCESS}All operations completed successfully.{C.RESET}")
@@ -739,7 +3168,7 @@ def main():
 if __name__ == "__main__":
     try: sys.exit(main())
     except KeyboardInterrupt:
-        PROCESS_MGR.kill_all()
+        Engine.kill_all()
         show_cursor()
         print(f"\n\n {C.WARNING}[!] EMERGENCY STOP: Interrupted by user.{C.RESET}")
         print(f" {C.SUCCESS}[+] Operations terminated. Original videos are safe, you may now exit.{C.RESET}")
@@ -748,4 +3177,5 @@ if __name__ == "__main__":
         logging.critical(f"FATAL: {e}"); logging.debug(traceback.format_exc())
         print(f"\n\n {C.ERROR}[X] Fatal error. Check logs.{C.RESET}"); sys.exit(1)
 PY_EOF
+python3 "$TMP_PY" "$@"
 exit $?